@@ -0,0 +1,160 @@
+"""Cloud pass with and without empty-space skipping at several coverages.
+
+Renders views from below, inside and above the cloud layer and from orbit,
+at each cloud_coverage setting, and times the cloud pass compiled with
+CLOUD_EMPTY_SKIPPING on and off. A time is the median of glFinish-bounded
+passes over the same G-buffer. The skipping pass is also compared with the
+uniform march; it differs only where a coarse step passes over a cloud
+that both coarse samples around it miss.
+
+    python -m benchmarks.cloud_skipping [--size 1280x720] [--runs 5]
+        [--coverage 0.3 0.7 1.05 1.5]
+
+Opens a hidden window and needs OpenGL 4.3.
+"""
+
+import argparse
+import sys
+import time
+
+import glfw
+from OpenGL.GL import *
+import numpy as np
+
+from benchmarks.gbuffer_paths import FOV_DEGREES, _parse_size
+from gl_utils.buffers import create_fullscreen_quad
+from gl_utils.program import create_program
+from gl_utils.shader import load_shader_source
+from rendering.calibration import CalibrationView
+from rendering.factory import create_renderer, view_camera
+from rendering.planet_renderer import PlanetRenderer
+from utils.time import PlanetCalendar
+
+
+# The default layer spans 0.018 to 0.032 planet radii above sea level.
+VIEWS = (
+    CalibrationView("below", 0.012, 30.0, 17),
+    CalibrationView("inside", 0.025, 0.0, 17),
+    CalibrationView("above", 0.04, -12.0, 17),
+    CalibrationView("orbit", 0.6, -90.0, 17),
+)
+COVERAGES = (0.3, 0.7, 1.05, 1.5)
+DEBUG_LEVEL = 9
+
+
+def uniform_march_program() -> int:
+    with open("shaders/planet.vert") as f:
+        vert_src = f.read()
+    return create_program(vert_src, load_shader_source("shaders/clouds.frag", {"CLOUD_EMPTY_SKIPPING": 0}))
+
+
+def _read_clouds(renderer: PlanetRenderer, width: int, height: int) -> np.ndarray:
+    glBindTexture(GL_TEXTURE_2D, renderer.graph.texture(("clouds", 0)))
+    data = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    renderer.state.reset_bindings()
+    return np.frombuffer(data, dtype=np.float32).reshape(height, width, 4).copy()
+
+
+def time_cloud_pass(renderer: PlanetRenderer, width: int, height: int, runs: int) -> float:
+    """Median milliseconds of the cloud pass for the primary body, using
+    the uniforms and targets of the last render()."""
+
+    frame = renderer._body_frame(renderer.body_views[0])
+    descriptor = renderer.passes["clouds"]
+    samples = []
+    for _ in range(runs + 1):
+        renderer.invalidate_passes()
+        glFinish()
+        start = time.perf_counter()
+        renderer._render_pass(descriptor, width, height, frame, DEBUG_LEVEL)
+        glFinish()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    # The first pass compiles and allocates lazily; leave it out.
+    return float(np.median(samples[1:]))
+
+
+def run_benchmark(renderer: PlanetRenderer, reference_program: int, width: int, height: int, runs: int, coverages):
+    """(view, coverage, uniform ms, skipping ms, largest and mean difference
+    in the cloud target) per view and coverage."""
+
+    parameters = renderer.parameters
+    radius = parameters.planet_radius
+    info = renderer.query_surface_info(np.array([0.0, 0.0, radius], dtype=np.float32))
+    ground = radius + parameters.sea_level
+    if info is not None:
+        ground = max(ground, info["surface_radius"])
+
+    descriptor = renderer.passes["clouds"]
+    programs = {False: reference_program, True: descriptor.program}
+    original_coverage = parameters.cloud_coverage
+    results = []
+    try:
+        for view in VIEWS:
+            calendar_state = PlanetCalendar().set_time(100, view.hour, 0, 0)
+            cam_pos, cam_front, cam_right, cam_up = view_camera(view, ground, radius)
+            for coverage in coverages:
+                parameters.cloud_coverage = coverage
+                timings = {}
+                images = {}
+                for skipping in (False, True):
+                    descriptor.program = programs[skipping]
+                    descriptor.bake(renderer.state)
+                    renderer.invalidate_passes()
+                    renderer.render(
+                        cam_pos, cam_front, cam_right, cam_up, FOV_DEGREES, width, height, DEBUG_LEVEL,
+                        calendar_state, noise_seed=0.0,
+                    )
+                    timings[skipping] = time_cloud_pass(renderer, width, height, runs)
+                    images[skipping] = _read_clouds(renderer, width, height)
+                difference = np.abs(images[True] - images[False])
+                results.append(
+                    (view.name, coverage, timings[False], timings[True], float(difference.max()), float(difference.mean()))
+                )
+    finally:
+        parameters.cloud_coverage = original_coverage
+        descriptor.program = programs[True]
+        descriptor.bake(renderer.state)
+        renderer.invalidate_passes()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=_parse_size, default=(1280, 720), help="render size, WIDTHxHEIGHT")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--coverage", type=float, nargs="+", default=list(COVERAGES))
+    args = parser.parse_args(argv)
+
+    if not glfw.init():
+        raise RuntimeError("Failed to initialize GLFW")
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 4)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL_TRUE)
+    glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+    window = glfw.create_window(64, 64, "Cloud benchmark", None, None)
+    if not window:
+        glfw.terminate()
+        raise RuntimeError("Failed to create window")
+    glfw.make_context_current(window)
+    try:
+        glBindVertexArray(create_fullscreen_quad())
+        renderer = create_renderer()
+        width, height = args.size
+        print(f"{glGetString(GL_RENDERER).decode(errors='replace')}, {width}x{height}")
+        print(f"{'view':8s} {'coverage':>8s} {'uniform':>10s} {'skipping':>10s} {'speedup':>8s}  max / mean diff")
+        for name, coverage, uniform_ms, skipping_ms, max_difference, mean_difference in run_benchmark(
+            renderer, uniform_march_program(), width, height, args.runs, args.coverage
+        ):
+            print(
+                f"{name:8s} {coverage:8.2f} {uniform_ms:8.2f}ms {skipping_ms:8.2f}ms "
+                f"{uniform_ms / skipping_ms:7.2f}x  {max_difference:.4f} / {mean_difference:.5f}"
+            )
+    finally:
+        glfw.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""Per-frame CPU math: time per frame and allocation budgets.
+
+Runs the camera and frame-transform calls one rendered frame makes at 60 fps
+with the simulation at 120 Hz: one mouse update, and per substep two camera
+alignments, movement and the renderer's sun and tilt update, plus the
+render-time update. The render side adds the progressive and temporal key
+updates, body culling and the renderer's per-frame camera state and body
+parameters.
+
+A second workload runs FixedTimestepSimulation itself, two substeps per
+frame, walking under gravity over a warm terrain tile cache. It reads the
+renderer only for the frame state, which a stand-in provides, so neither
+workload needs a GL context; the renderer's passes are not covered.
+
+    python -m benchmarks.frame_math [--frames N] [--check]
+
+--check exits non-zero if a frame's transient allocations exceed
+ALLOCATION_BUDGET_BYTES, or STEP_ALLOCATION_BUDGET_BYTES for the simulation,
+or memory is retained across frames.
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from gl_utils.camera import FPSCamera
+from rendering.constants import default_planet_parameters
+from rendering.planet_renderer import _CameraState, _tilt_matrices
+from rendering.progressive import ViewKey
+from rendering.scene import default_scene, visible_bodies
+from simulation.fixed_timestep import FixedTimestepSimulation, MovementInput
+from utils.time import PlanetCalendar, compute_sun_direction
+
+
+SUBSTEPS_PER_FRAME = 2
+# Largest tracemalloc high-water mark one frame may add above its starting
+# point. The float math only ever holds a few boxed floats at once; the
+# NumPy version it replaced peaked around 8 KB.
+ALLOCATION_BUDGET_BYTES = 256
+# The same for two simulation substeps. Each still builds the keys of the
+# tiles the terrain cache wants and a CalendarState.
+STEP_ALLOCATION_BUDGET_BYTES = 1536
+# Retained memory over the whole run; leaking one small object per frame
+# would exceed it many times over.
+GROWTH_BUDGET_BYTES = 1024
+# Seconds to wait for the terrain workers while warming the tile cache.
+TILE_WARMUP_TIMEOUT = 30.0
+
+
+def _frame_workload():
+    camera = FPSCamera(np.array([0.0, 0.0, 6400.0], dtype=np.float32), yaw=-90.0, pitch=0.0)
+    camera.set_reference_up(np.array([0.3, 0.9, 0.1], dtype=np.float32))
+    sun_direction = np.zeros(3, dtype=np.float32)
+    tilt = 23.5
+    scene = default_scene(default_planet_parameters())
+    moon = scene.bodies[1]
+    moon_parameters = moon.parameters.copy()
+    camera_states = (_CameraState(), _CameraState())
+    view_keys = ViewKey(15)
+    history_keys = ViewKey(4)
+    views = []
+    tan_half_fov = float(np.tan(np.deg2rad(camera.fov_degrees) * 0.5))
+
+    def frame(index: int):
+        camera.process_mouse(1.5, -0.5 if index % 2 else 0.5)
+        for _ in range(SUBSTEPS_PER_FRAME):
+            compute_sun_direction(0.4, 0.2, tilt, out=sun_direction)
+            _tilt_matrices(tilt)
+            camera.update_vectors()
+            camera.process_movement("FORWARD", 1.0 / 120.0)
+            camera.update_vectors()
+        history_keys.update(1280, 720, 9, 0)
+        view_keys.update(camera.position, camera.front, camera.up, camera.fov_degrees, index / 60.0, 1280, 720, 9, 0)
+        compute_sun_direction(0.4, 0.2, tilt, out=sun_direction)
+        planet_to_world, _ = _tilt_matrices(tilt)
+        camera_states[index % 2].load(
+            camera.position, camera.front, camera.right, camera.up, tan_half_fov, planet_to_world
+        )
+        visible_bodies(scene, camera.position, camera.front, camera.right, camera.up, tan_half_fov, 1280, 720, views)
+        moon_parameters.copy_from(moon.parameters)
+
+    return frame
+
+
+class _FrameStateRenderer:
+    """The part of PlanetRenderer the simulation reads: the per-step frame
+    state, without any GL objects."""
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.sun_direction = np.zeros(3, dtype=np.float32)
+        self.planet_to_world, self.world_to_planet = _tilt_matrices(parameters.tilt_degrees)
+
+    def prepare_frame_state(self, calendar_state):
+        self.time_seconds = calendar_state.elapsed_seconds
+        self.planet_to_world, self.world_to_planet = _tilt_matrices(self.parameters.tilt_degrees)
+        tilt = self.parameters.tilt_degrees
+        compute_sun_direction(calendar_state.day_fraction, calendar_state.year_fraction, tilt, out=self.sun_direction)
+
+
+def _simulation_workload():
+    parameters = default_planet_parameters()
+    # On the equator, walking east and west, where tiles are widest.
+    camera = FPSCamera(np.array([0.0, 0.0, parameters.planet_radius + 20.0], dtype=np.float32), yaw=0.0, pitch=-4.0)
+    camera.enable_reference_alignment(False)
+    camera.update_vectors()
+    simulation = FixedTimestepSimulation(
+        camera, PlanetCalendar(), _FrameStateRenderer(parameters), parameters, base_speed=5.0
+    )
+    simulation.toggle_gravity()
+    # Walking back and forth keeps the camera over the same tiles, so the
+    # measured frames only read the cache.
+    movements = (MovementInput(forward=True), MovementInput(backward=True))
+
+    def frame(index: int):
+        simulation.advance(1.0 / 60.0, movements[(index // 30) % 2])
+
+    # Warm until a whole back-and-forth cycle finds every tile resident.
+    tiles = simulation.terrain_tiles
+    deadline = time.perf_counter() + TILE_WARMUP_TIMEOUT
+    while time.perf_counter() < deadline:
+        built = tiles.built_count
+        for index in range(60):
+            frame(index)
+        if tiles.built_count == built and not tiles.pending:
+            break
+        # Give the workers time; the next cycle's steps collect their tiles.
+        time.sleep(0.05)
+    return frame, simulation
+
+
+def _run_frames(frame, frames: int) -> float:
+    start = time.perf_counter()
+    for index in range(frames):
+        frame(index)
+    return (time.perf_counter() - start) / frames * 1e6
+
+
+def measure_time(frames: int) -> float:
+    """Mean microseconds per frame."""
+
+    frame = _frame_workload()
+    for index in range(100):
+        frame(index)
+    return _run_frames(frame, frames)
+
+
+def measure_simulation_time(frames: int) -> float:
+    """Mean microseconds per frame of simulation substeps."""
+
+    frame, simulation = _simulation_workload()
+    try:
+        return _run_frames(frame, frames)
+    finally:
+        simulation.close()
+
+
+def _traced_peaks(frame, frames: int):
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        worst_peak = 0
+        for index in range(frames):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            frame(index)
+            _, peak = tracemalloc.get_traced_memory()
+            worst_peak = max(worst_peak, peak - before)
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return worst_peak, end - start
+
+
+def measure_allocations(frames: int):
+    """Largest per-frame transient peak and total growth, in bytes."""
+
+    frame = _frame_workload()
+    for index in range(100):
+        frame(index)
+    return _traced_peaks(frame, frames)
+
+
+def measure_simulation_allocations(frames: int):
+    """measure_allocations() for the simulation, plus the tiles it had to
+    build while measured; any would make the peaks meaningless."""
+
+    frame, simulation = _simulation_workload()
+    try:
+        built = simulation.terrain_tiles.built_count
+        peak, growth = _traced_peaks(frame, frames)
+        return peak, growth, simulation.terrain_tiles.built_count - built
+    finally:
+        simulation.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--check", action="store_true", help="fail if the allocation budget is exceeded")
+    args = parser.parse_args(argv)
+
+    microseconds = measure_time(args.frames)
+    peak, growth = measure_allocations(min(args.frames, 2000))
+    print(f"{microseconds:.2f} us per frame")
+    print(f"peak {peak} B per frame (budget {ALLOCATION_BUDGET_BYTES} B), growth {growth} B")
+    failed = peak > ALLOCATION_BUDGET_BYTES or growth > GROWTH_BUDGET_BYTES
+
+    microseconds = measure_simulation_time(min(args.frames, 2000))
+    peak, growth, built = measure_simulation_allocations(min(args.frames, 2000))
+    print(f"simulation: {microseconds:.2f} us per frame")
+    print(
+        f"simulation: peak {peak} B per frame (budget {STEP_ALLOCATION_BUDGET_BYTES} B), growth {growth} B, "
+        f"{built} tiles built"
+    )
+    failed = failed or peak > STEP_ALLOCATION_BUDGET_BYTES or growth > GROWTH_BUDGET_BYTES or built > 0
+    if args.check and failed:
+        print("allocation budget exceeded")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Fragment vs compute G-buffer pass at several camera altitudes.
+
+Each view looks straight at the horizon, so sky rays that leave the march
+at once sit next to terrain rays that use most of the step budget. A
+view's time is the median of glFinish-bounded G-buffer passes; the
+compute path's G-buffer is also compared with the fragment path's, which
+it should match exactly.
+
+    python -m benchmarks.gbuffer_paths [--size 1280x720] [--runs 5]
+
+Opens a hidden window and needs OpenGL 4.3 for the compute path.
+"""
+
+import argparse
+import math
+import sys
+import time
+
+import glfw
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.buffers import create_fullscreen_quad
+from rendering.calibration import CalibrationView
+from rendering.factory import create_renderer, view_camera
+from rendering.planet_renderer import PlanetRenderer
+from utils.time import PlanetCalendar
+
+
+# Camera altitude above the ground below it, as a fraction of the planet radius.
+ALTITUDES = (
+    ("ground", 0.0002),
+    ("low", 0.004),
+    ("high", 0.04),
+    ("orbit", 0.6),
+    ("far", 3.0),
+)
+VIEW_HOUR = 17
+FOV_DEGREES = 70.0
+DEBUG_LEVEL = 9
+
+
+def horizon_view(name: str, altitude_ratio: float) -> CalibrationView:
+    """A view pitched down by the horizon dip, putting the limb mid-screen."""
+
+    dip = math.degrees(math.acos(1.0 / (1.0 + altitude_ratio)))
+    return CalibrationView(name, altitude_ratio, -dip, VIEW_HOUR)
+
+
+def _read_gbuffer(renderer: PlanetRenderer, width: int, height: int):
+    images = []
+    for attachment in range(4):
+        glBindTexture(GL_TEXTURE_2D, renderer.graph.texture(("gbuffer", attachment)))
+        data = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+        images.append(np.frombuffer(data, dtype=np.float32).reshape(height, width, 4))
+    glBindTexture(GL_TEXTURE_2D, 0)
+    renderer.state.reset_bindings()
+    return images
+
+
+def time_gbuffer_pass(renderer: PlanetRenderer, width: int, height: int, runs: int) -> float:
+    """Median milliseconds of the G-buffer pass for the primary body, using
+    the uniforms and targets of the last render()."""
+
+    frame = renderer._body_frame(renderer.body_views[0])
+    descriptor = renderer.passes["gbuffer"]
+    samples = []
+    for _ in range(runs + 1):
+        renderer.invalidate_passes()
+        glFinish()
+        start = time.perf_counter()
+        renderer._render_pass(descriptor, width, height, frame, DEBUG_LEVEL)
+        glFinish()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    # The first pass compiles and allocates lazily; leave it out.
+    return float(np.median(samples[1:]))
+
+
+def run_benchmark(renderer: PlanetRenderer, width: int, height: int, runs: int):
+    """(name, altitude ratio, fragment ms, compute ms, largest G-buffer difference) per view."""
+
+    calendar_state = PlanetCalendar().set_time(100, VIEW_HOUR, 0, 0)
+    parameters = renderer.parameters
+    radius = parameters.planet_radius
+    info = renderer.query_surface_info(np.array([0.0, 0.0, radius], dtype=np.float32))
+    ground = radius + parameters.sea_level
+    if info is not None:
+        ground = max(ground, info["surface_radius"])
+
+    results = []
+    for name, altitude_ratio in ALTITUDES:
+        view = horizon_view(name, altitude_ratio)
+        cam_pos, cam_front, cam_right, cam_up = view_camera(view, ground, radius)
+        timings = {}
+        gbuffers = {}
+        for use_compute in (False, True):
+            renderer.use_compute_gbuffer = use_compute
+            renderer.invalidate_passes()
+            renderer.render(
+                cam_pos, cam_front, cam_right, cam_up, FOV_DEGREES, width, height, DEBUG_LEVEL, calendar_state
+            )
+            timings[use_compute] = time_gbuffer_pass(renderer, width, height, runs)
+            gbuffers[use_compute] = _read_gbuffer(renderer, width, height)
+        difference = max(
+            float(np.max(np.abs(fragment - compute))) for fragment, compute in zip(gbuffers[False], gbuffers[True])
+        )
+        results.append((name, altitude_ratio, timings[False], timings[True], difference))
+    renderer.use_compute_gbuffer = False
+    return results
+
+
+def _parse_size(text: str):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=_parse_size, default=(1280, 720), help="render size, WIDTHxHEIGHT")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if not glfw.init():
+        raise RuntimeError("Failed to initialize GLFW")
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 4)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL_TRUE)
+    glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+    window = glfw.create_window(64, 64, "G-buffer benchmark", None, None)
+    if not window:
+        glfw.terminate()
+        raise RuntimeError("Failed to create window")
+    glfw.make_context_current(window)
+    try:
+        glBindVertexArray(create_fullscreen_quad())
+        renderer = create_renderer()
+        width, height = args.size
+        print(f"{glGetString(GL_RENDERER).decode(errors='replace')}, {width}x{height}")
+        print(f"{'view':8s} {'altitude':>9s} {'fragment':>10s} {'compute':>10s} {'speedup':>8s}  max diff")
+        for name, altitude_ratio, fragment_ms, compute_ms, difference in run_benchmark(
+            renderer, width, height, args.runs
+        ):
+            print(
+                f"{name:8s} {altitude_ratio:8.4f}R {fragment_ms:8.2f}ms {compute_ms:8.2f}ms "
+                f"{fragment_ms / compute_ms:7.2f}x  {difference:g}"
+            )
+    finally:
+        glfw.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -41,46 +41,15 @@ def create_texture(width, height, attachment, internal_format=GL_RGBA16F, format
     return tex
 
 
-def create_gbuffer(width, height):
-    fbo = glGenFramebuffers(1)
-    glBindFramebuffer(GL_FRAMEBUFFER, fbo)
-
-    gPositionHeight = create_texture(width, height, GL_COLOR_ATTACHMENT0)
-    gNormalFlags = create_texture(width, height, GL_COLOR_ATTACHMENT1)
-    gMaterial = create_texture(width, height, GL_COLOR_ATTACHMENT2)
-    gViewData = create_texture(width, height, GL_COLOR_ATTACHMENT3, GL_RGBA32F)
-
-    rbo = glGenRenderbuffers(1)
-    glBindRenderbuffer(GL_RENDERBUFFER, rbo)
-    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, width, height)
-    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, rbo)
-
-    attachments = [GL_COLOR_ATTACHMENT0, GL_COLOR_ATTACHMENT1, GL_COLOR_ATTACHMENT2, GL_COLOR_ATTACHMENT3]
-    glDrawBuffers(len(attachments), attachments)
-
-    if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
-        raise RuntimeError("G-buffer framebuffer is not complete")
+def create_render_target(width, height, internal_formats):
+    """Framebuffer with one texture attachment per entry in internal_formats."""
 
-    glBindFramebuffer(GL_FRAMEBUFFER, 0)
-    return {
-        "fbo": fbo,
-        "position": gPositionHeight,
-        "normal": gNormalFlags,
-        "material": gMaterial,
-        "view_data": gViewData,
-        "rbo": rbo,
-        "width": width,
-        "height": height,
-    }
-
-
-def create_color_fbo(width, height, num_attachments=1, internal_format=GL_RGBA16F):
     fbo = glGenFramebuffers(1)
     glBindFramebuffer(GL_FRAMEBUFFER, fbo)
 
     attachments = []
     textures = []
-    for i in range(num_attachments):
+    for i, internal_format in enumerate(internal_formats):
         attachment = GL_COLOR_ATTACHMENT0 + i
         attachments.append(attachment)
         textures.append(create_texture(width, height, attachment, internal_format))
@@ -97,3 +66,29 @@ def create_color_fbo(width, height, num_attachments=1, internal_format=GL_RGBA16
         "width": width,
         "height": height,
     }
+
+
+def create_color_fbo(width, height, num_attachments=1, internal_format=GL_RGBA16F):
+    return create_render_target(width, height, [internal_format] * num_attachments)
+
+
+def delete_color_fbo(target):
+    glDeleteTextures(len(target["textures"]), target["textures"])
+    glDeleteFramebuffers(1, [target["fbo"]])
+
+
+def create_volume_texture(volume, internal_format=GL_RGBA8):
+    """Repeating, mipmapped 3D texture from a (depth, height, width, 4) uint8 array."""
+
+    depth, height, width, _ = volume.shape
+    tex = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_3D, tex)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage3D(GL_TEXTURE_3D, 0, internal_format, width, height, depth, 0, GL_RGBA, GL_UNSIGNED_BYTE, volume)
+    glGenerateMipmap(GL_TEXTURE_3D)
+    glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+    glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    for wrap in (GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_TEXTURE_WRAP_R):
+        glTexParameteri(GL_TEXTURE_3D, wrap, GL_REPEAT)
+    glBindTexture(GL_TEXTURE_3D, 0)
+    return tex
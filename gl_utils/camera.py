@@ -1,29 +1,13 @@
-import numpy as np
-
-WORLD_UP = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+import math
 
+import numpy as np
 
-def normalize(v):
-    norm = np.linalg.norm(v)
-    if norm < 1e-8:
-        return np.array(v, dtype=np.float32)
-    return (v / norm).astype(np.float32)
-
+from gl_utils.vecmath import Quat, Vec3
 
-def _rotation_matrix(axis: np.ndarray, angle_rad: float) -> np.ndarray:
-    axis = normalize(axis)
-    c = np.cos(angle_rad)
-    s = np.sin(angle_rad)
-    t = 1.0 - c
-    x, y, z = axis
-    return np.array(
-        [
-            [t * x * x + c, t * x * y - s * z, t * x * z + s * y],
-            [t * x * y + s * z, t * y * y + c, t * y * z - s * x],
-            [t * x * z - s * y, t * y * z + s * x, t * z * z + c],
-        ],
-        dtype=np.float32,
-    )
+WORLD_UP = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+WORLD_UP_VEC = Vec3(0.0, 1.0, 0.0)
+# Turning the reference up onto straight down has no unique shortest arc.
+_FLIP_AXIS = Vec3(1.0, 0.0, 0.0)
 
 
 class FPSCamera:
@@ -43,10 +27,16 @@ class FPSCamera:
         self.reference_up = WORLD_UP.copy()
         self.use_reference_up = True
         self.velocity = np.zeros(3, dtype=np.float32)
+        self._front = Vec3()
+        self._right = Vec3()
+        self._up = Vec3()
+        self._reference_up = Vec3().load(WORLD_UP)
+        self._rotation = Quat()
+        self._position = Vec3()
         self.update_vectors()
 
     def set_reference_up(self, up_vector: np.ndarray):
-        self.reference_up = normalize(up_vector)
+        self._reference_up.load(up_vector).normalize().store(self.reference_up)
 
     def enable_reference_alignment(self, enabled: bool):
         self.use_reference_up = enabled
@@ -54,51 +44,34 @@ class FPSCamera:
             self.roll = 0.0
 
     def update_vectors(self):
-        yaw_r = np.radians(self.yaw)
-        pitch_r = np.radians(self.pitch)
-
-        fx = np.cos(yaw_r) * np.cos(pitch_r)
-        fy = np.sin(pitch_r)
-        fz = np.sin(yaw_r) * np.cos(pitch_r)
-
-        base_front = normalize(np.array([fx, fy, fz], dtype=np.float32))
-        base_right = normalize(np.cross(base_front, WORLD_UP))
-        base_up = normalize(np.cross(base_right, base_front))
-
+        # Runs several times per frame; all of it is float math on the
+        # preallocated Vec3s, written into the public arrays at the end.
+        yaw_r = math.radians(self.yaw)
+        pitch_r = math.radians(self.pitch)
+        cos_pitch = math.cos(pitch_r)
+
+        front = self._front.set(math.cos(yaw_r) * cos_pitch, math.sin(pitch_r), math.sin(yaw_r) * cos_pitch)
+        front.normalize()
+        right = self._right.cross(front, WORLD_UP_VEC).normalize()
+        up = self._up.cross(right, front).normalize()
+
+        rotation = self._rotation
         if self.use_reference_up:
-            target_up = normalize(self.reference_up)
-            alignment_axis = np.cross(WORLD_UP, target_up)
-            alignment_axis_norm = np.linalg.norm(alignment_axis)
-            dot_up = float(np.clip(np.dot(WORLD_UP, target_up), -1.0, 1.0))
-
-            if alignment_axis_norm < 1e-6:
-                if dot_up < 0.0:
-                    alignment_axis = np.array([1.0, 0.0, 0.0], dtype=np.float32)
-                    angle = np.pi
-                else:
-                    self.front = base_front
-                    self.right = base_right
-                    self.up = base_up
-                    return
-            else:
-                alignment_axis = alignment_axis / alignment_axis_norm
-                angle = np.arccos(dot_up)
-
-            rotation = _rotation_matrix(alignment_axis, angle)
-            self.front = normalize(rotation @ base_front)
-            self.right = normalize(rotation @ base_right)
-            self.up = normalize(rotation @ base_up)
-            return
+            rotation.set_from_to(WORLD_UP_VEC, self._reference_up, _FLIP_AXIS)
+            rotation.rotate(front).normalize()
+        else:
+            rotation.set_axis_angle(front, math.radians(self.roll))
+        rotation.rotate(right).normalize()
+        rotation.rotate(up).normalize()
 
-        roll_rotation = _rotation_matrix(base_front, np.radians(self.roll))
-        self.front = base_front
-        self.right = normalize(roll_rotation @ base_right)
-        self.up = normalize(roll_rotation @ base_up)
+        front.store(self.front)
+        right.store(self.right)
+        up.store(self.up)
 
     def process_mouse(self, xoff, yoff):
-        roll_rad = np.radians(-self.roll)
-        cos_r = np.cos(roll_rad)
-        sin_r = np.sin(roll_rad)
+        roll_rad = math.radians(-self.roll)
+        cos_r = math.cos(roll_rad)
+        sin_r = math.sin(roll_rad)
 
         rotated_x = xoff * cos_r - yoff * sin_r
         rotated_y = xoff * sin_r + yoff * cos_r
@@ -127,19 +100,21 @@ class FPSCamera:
         if direction == "FAST":
             velocity *= 5
             return
+        position = self._position.load(self.position)
         if direction == "FORWARD":
-            self.position += self.front * velocity
+            position.add_scaled(self._front, velocity)
         if direction == "BACKWARD":
-            self.position -= self.front * velocity
+            position.add_scaled(self._front, -velocity)
         if direction == "LEFT":
-            self.position -= self.right * velocity
+            position.add_scaled(self._right, -velocity)
         if direction == "RIGHT":
-            self.position += self.right * velocity
+            position.add_scaled(self._right, velocity)
 
         if self.min_radius is not None:
-            dist = np.linalg.norm(self.position)
+            dist = position.length()
             if dist < self.min_radius:
                 if dist > 1e-6:
-                    self.position = normalize(self.position) * self.min_radius
+                    position.scale(self.min_radius / dist)
                 else:
-                    self.position = np.array([0, 0, self.min_radius], dtype=np.float32)
+                    position.set(0.0, 0.0, self.min_radius)
+        position.store(self.position)
@@ -1,4 +1,10 @@
-﻿from OpenGL.GL import *
+﻿import os
+import re
+
+from OpenGL.GL import *
+
+
+_INCLUDE = re.compile(r'^[ \t]*#include[ \t]+"([^"]+)"[ \t]*$', re.MULTILINE)
 
 
 def compile_shader(src, shader_type):
@@ -12,3 +18,27 @@ def compile_shader(src, shader_type):
         raise RuntimeError(f"Shader compilation failed:\n{log}")
 
     return shader
+
+
+def load_shader_source(path, defines=None, _including=()):
+    """Read a shader file, expanding #include "name" lines relative to it.
+
+    Each entry of defines becomes a #define right after the #version line,
+    so one source can be compiled into several variants.
+    """
+
+    path = os.path.abspath(path)
+    if path in _including:
+        raise RuntimeError(f"Shader include cycle through {path}")
+    with open(path) as f:
+        src = f.read()
+    directory = os.path.dirname(path)
+    src = _INCLUDE.sub(
+        lambda match: load_shader_source(os.path.join(directory, match.group(1)), None, _including + (path,)),
+        src,
+    )
+    if defines:
+        lines = src.split("\n", 1)
+        block = "".join(f"#define {name} {value}\n" for name, value in defines.items())
+        src = lines[0] + "\n" + block + (lines[1] if len(lines) > 1 else "")
+    return src
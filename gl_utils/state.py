@@ -0,0 +1,228 @@
+from OpenGL.GL import glGetUniformLocation
+from OpenGL.raw.GL.VERSION.GL_1_0 import glClear, glDisable, glEnable, glScissor, glViewport
+from OpenGL.raw.GL.VERSION.GL_1_1 import glBindTexture, glDrawArrays
+from OpenGL.raw.GL.VERSION.GL_1_3 import glActiveTexture
+from OpenGL.raw.GL.VERSION.GL_1_4 import glBlendFuncSeparate
+from OpenGL.raw.GL.VERSION.GL_2_0 import (
+    glUniform1f,
+    glUniform1i,
+    glUniform2f,
+    glUniform3f,
+    glUniform4i,
+    glUniformMatrix3fv,
+    glUseProgram,
+)
+from OpenGL.raw.GL.VERSION.GL_3_0 import glBindFramebuffer
+from OpenGL.GL import (
+    GL_BLEND,
+    GL_FALSE,
+    GL_FRAMEBUFFER,
+    GL_ONE,
+    GL_ONE_MINUS_SRC_ALPHA,
+    GL_SCISSOR_TEST,
+    GL_TEXTURE0,
+    GL_TEXTURE_2D,
+    GL_TRIANGLES,
+    GL_ZERO,
+)
+import numpy as np
+
+
+# Marks state that has to be re-issued because something else may have
+# changed it since the last reset_bindings().
+_UNKNOWN = object()
+
+
+class GLStateCache:
+    """Shadow copy of the GL bindings and uniform values the renderer touches.
+
+    State changes that match the shadow copy are skipped, and the rest go
+    through PyOpenGL's raw entry points, which bypass argument conversion and
+    per-call error checking. Uniform values are program state and survive
+    across frames; bindings do not, because imgui and other code change them
+    behind our back, so reset_bindings() must be called before each use.
+
+    uniform_versions counts, per program, how often any of its active
+    uniforms actually changed, which makes it a cheap signature of
+    everything a draw with that program reads besides its textures.
+    uniform_values() is the slower but content-based equivalent, for
+    callers that alternate one program between several sets of values.
+    """
+
+    def __init__(self):
+        self._locations = {}
+        self._uniform_values = {}
+        self._program_values = {}
+        self.uniform_versions = {}
+        self.issued_calls = 0
+        self.skipped_calls = 0
+        self.reset_bindings()
+
+    def reset_bindings(self):
+        self._program = None
+        self._framebuffer = None
+        self._viewport = None
+        self._scissor = _UNKNOWN
+        self._blend = None
+        self._active_unit = None
+        self._textures = {}
+
+    def reset_counters(self):
+        self.issued_calls = 0
+        self.skipped_calls = 0
+
+    def forget_program(self, program):
+        """Drop cached locations and values, e.g. after a program is relinked."""
+
+        self._locations = {key: loc for key, loc in self._locations.items() if key[0] != program}
+        self._uniform_values = {key: v for key, v in self._uniform_values.items() if key[0] != program}
+        self._program_values.pop(program, None)
+        self.uniform_versions[program] = self.uniform_versions.get(program, 0) + 1
+
+    def use_program(self, program):
+        if self._program == program:
+            self.skipped_calls += 1
+            return
+        glUseProgram(program)
+        self._program = program
+        self.issued_calls += 1
+
+    def bind_framebuffer(self, fbo):
+        if self._framebuffer == fbo:
+            self.skipped_calls += 1
+            return
+        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+        self._framebuffer = fbo
+        self.issued_calls += 1
+
+    def viewport(self, x, y, width, height):
+        viewport = (x, y, width, height)
+        if self._viewport == viewport:
+            self.skipped_calls += 1
+            return
+        glViewport(x, y, width, height)
+        self._viewport = viewport
+        self.issued_calls += 1
+
+    @property
+    def current_scissor(self):
+        return self._scissor
+
+    def scissor(self, rect):
+        """Restrict drawing to rect (x, y, width, height); None disables it."""
+
+        rect = None if rect is None else tuple(rect)
+        if self._scissor == rect:
+            self.skipped_calls += 1
+            return
+        if rect is None:
+            glDisable(GL_SCISSOR_TEST)
+        else:
+            if self._scissor is None or self._scissor is _UNKNOWN:
+                glEnable(GL_SCISSOR_TEST)
+                self.issued_calls += 1
+            glScissor(*rect)
+        self._scissor = rect
+        self.issued_calls += 1
+
+    def premultiplied_blend(self, enabled):
+        """Toggle "over" blending of premultiplied colour; destination alpha is kept."""
+
+        if self._blend == enabled:
+            self.skipped_calls += 1
+            return
+        if enabled:
+            glEnable(GL_BLEND)
+            glBlendFuncSeparate(GL_ONE, GL_ONE_MINUS_SRC_ALPHA, GL_ZERO, GL_ONE)
+            self.issued_calls += 1
+        else:
+            glDisable(GL_BLEND)
+        self._blend = enabled
+        self.issued_calls += 1
+
+    def bind_texture(self, unit, texture, target=GL_TEXTURE_2D):
+        if self._textures.get(unit) == (target, texture):
+            self.skipped_calls += 1
+            return
+        if self._active_unit != unit:
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self._active_unit = unit
+            self.issued_calls += 1
+        glBindTexture(target, texture)
+        self._textures[unit] = (target, texture)
+        self.issued_calls += 1
+
+    def clear(self, mask):
+        glClear(mask)
+        self.issued_calls += 1
+
+    def draw_fullscreen(self):
+        glDrawArrays(GL_TRIANGLES, 0, 6)
+        self.issued_calls += 1
+
+    def location(self, program, name):
+        key = (program, name)
+        loc = self._locations.get(key)
+        if loc is None:
+            loc = glGetUniformLocation(program, name)
+            self._locations[key] = loc
+        return loc
+
+    def _changed(self, program, name, value):
+        loc = self.location(program, name)
+        if loc < 0:
+            # Uniform is not used by this program; nothing to upload.
+            self.skipped_calls += 1
+            return -1
+        key = (program, loc)
+        if self._uniform_values.get(key) == value:
+            self.skipped_calls += 1
+            return -1
+        self._uniform_values[key] = value
+        self._program_values.setdefault(program, {})[loc] = value
+        self.uniform_versions[program] = self.uniform_versions.get(program, 0) + 1
+        self.issued_calls += 1
+        return loc
+
+    def uniform_values(self, program) -> tuple:
+        """Every uniform value uploaded to program so far, in a stable order."""
+
+        return tuple(self._program_values.get(program, {}).values())
+
+    # The setters below upload to the currently bound program, mirroring the
+    # helpers in rendering.uniforms.
+    def set_float(self, program, name, value):
+        value = float(value)
+        loc = self._changed(program, name, value)
+        if loc >= 0:
+            glUniform1f(loc, value)
+
+    def set_int(self, program, name, value):
+        value = int(value)
+        loc = self._changed(program, name, value)
+        if loc >= 0:
+            glUniform1i(loc, value)
+
+    def set_vec2(self, program, name, v):
+        value = (float(v[0]), float(v[1]))
+        loc = self._changed(program, name, value)
+        if loc >= 0:
+            glUniform2f(loc, *value)
+
+    def set_vec3(self, program, name, v):
+        value = (float(v[0]), float(v[1]), float(v[2]))
+        loc = self._changed(program, name, value)
+        if loc >= 0:
+            glUniform3f(loc, *value)
+
+    def set_ivec4(self, program, name, v):
+        value = (int(v[0]), int(v[1]), int(v[2]), int(v[3]))
+        loc = self._changed(program, name, value)
+        if loc >= 0:
+            glUniform4i(loc, *value)
+
+    def set_mat3(self, program, name, m):
+        matrix = np.ascontiguousarray(m, dtype=np.float32)
+        loc = self._changed(program, name, matrix.tobytes())
+        if loc >= 0:
+            glUniformMatrix3fv(loc, 1, GL_FALSE, matrix)
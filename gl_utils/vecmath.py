@@ -0,0 +1,171 @@
+import math
+
+import numpy as np
+
+
+class Vec3:
+    """A mutable 3-vector of Python floats.
+
+    NumPy spends far longer dispatching a call than computing on three
+    elements, so per-frame camera and transform math works on these and
+    updates them in place. Every operation writes into self and returns it;
+    store() copies the result into an existing NumPy array at the boundary.
+    """
+
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x: float = 0.0, y: float = 0.0, z: float = 0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __repr__(self):
+        return f"Vec3({self.x!r}, {self.y!r}, {self.z!r})"
+
+    def set(self, x: float, y: float, z: float) -> "Vec3":
+        self.x = x
+        self.y = y
+        self.z = z
+        return self
+
+    def load(self, values) -> "Vec3":
+        # tolist() yields Python floats in one call; indexing an array would
+        # box a NumPy scalar per element.
+        x, y, z = values.tolist() if isinstance(values, np.ndarray) else values
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+        return self
+
+    def store(self, out):
+        out[0] = self.x
+        out[1] = self.y
+        out[2] = self.z
+        return out
+
+    def copy_from(self, other: "Vec3") -> "Vec3":
+        self.x = other.x
+        self.y = other.y
+        self.z = other.z
+        return self
+
+    def dot(self, other: "Vec3") -> float:
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+    def length(self) -> float:
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def normalize(self) -> "Vec3":
+        """Scale to unit length; vectors shorter than 1e-8 are left as they are."""
+
+        length = self.length()
+        if length >= 1e-8:
+            inverse = 1.0 / length
+            self.x *= inverse
+            self.y *= inverse
+            self.z *= inverse
+        return self
+
+    def scale(self, factor: float) -> "Vec3":
+        self.x *= factor
+        self.y *= factor
+        self.z *= factor
+        return self
+
+    def add_scaled(self, other: "Vec3", factor: float) -> "Vec3":
+        self.x += other.x * factor
+        self.y += other.y * factor
+        self.z += other.z * factor
+        return self
+
+    def cross(self, a: "Vec3", b: "Vec3") -> "Vec3":
+        """Set to a x b; either operand may be self."""
+
+        x = a.y * b.z - a.z * b.y
+        y = a.z * b.x - a.x * b.z
+        z = a.x * b.y - a.y * b.x
+        self.x = x
+        self.y = y
+        self.z = z
+        return self
+
+    def project_out(self, normal: "Vec3") -> "Vec3":
+        """Remove the component along a unit normal."""
+
+        return self.add_scaled(normal, -self.dot(normal))
+
+    def lerp(self, a: "Vec3", b: "Vec3", t: float) -> "Vec3":
+        self.x = a.x + (b.x - a.x) * t
+        self.y = a.y + (b.y - a.y) * t
+        self.z = a.z + (b.z - a.z) * t
+        return self
+
+
+class Quat:
+    """A rotation quaternion (w, x, y, z), updated in place like Vec3."""
+
+    __slots__ = ("w", "x", "y", "z")
+
+    def __init__(self, w: float = 1.0, x: float = 0.0, y: float = 0.0, z: float = 0.0):
+        self.w = w
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __repr__(self):
+        return f"Quat({self.w!r}, {self.x!r}, {self.y!r}, {self.z!r})"
+
+    def set_identity(self) -> "Quat":
+        self.w = 1.0
+        self.x = self.y = self.z = 0.0
+        return self
+
+    def set_axis_angle(self, axis: Vec3, angle: float) -> "Quat":
+        """Right-handed rotation by angle radians about axis, which need not be unit length."""
+
+        length = axis.length()
+        if length < 1e-12:
+            return self.set_identity()
+        half = angle * 0.5
+        s = math.sin(half) / length
+        self.w = math.cos(half)
+        self.x = axis.x * s
+        self.y = axis.y * s
+        self.z = axis.z * s
+        return self
+
+    def set_from_to(self, source: Vec3, target: Vec3, fallback_axis: Vec3) -> "Quat":
+        """Shortest rotation taking unit vector source onto unit vector target.
+
+        Opposite vectors have no unique shortest arc; they turn half way
+        around fallback_axis, which should be perpendicular to source.
+        """
+
+        cx = source.y * target.z - source.z * target.y
+        cy = source.z * target.x - source.x * target.z
+        cz = source.x * target.y - source.y * target.x
+        cos_angle = max(-1.0, min(1.0, source.dot(target)))
+        sin_angle = math.sqrt(cx * cx + cy * cy + cz * cz)
+        if sin_angle < 1e-6:
+            if cos_angle >= 0.0:
+                return self.set_identity()
+            return self.set_axis_angle(fallback_axis, math.pi)
+        half = math.acos(cos_angle) * 0.5
+        s = math.sin(half) / sin_angle
+        self.w = math.cos(half)
+        self.x = cx * s
+        self.y = cy * s
+        self.z = cz * s
+        return self
+
+    def rotate(self, v: Vec3) -> Vec3:
+        """Rotate v in place: v + 2w(q x v) + 2q x (q x v)."""
+
+        qx, qy, qz, w = self.x, self.y, self.z, self.w
+        tx = 2.0 * (qy * v.z - qz * v.y)
+        ty = 2.0 * (qz * v.x - qx * v.z)
+        tz = 2.0 * (qx * v.y - qy * v.x)
+        v.x += w * tx + qy * tz - qz * ty
+        v.y += w * ty + qz * tx - qx * tz
+        v.z += w * tz + qx * ty - qy * tx
+        return v
@@ -1,73 +1,141 @@
+import argparse
+import os
+import time
+from pathlib import Path
+
+import OpenGL
+
+# PyOpenGL calls glGetError after every call unless told otherwise. Keep that
+# for debugging sessions only; it must be set before OpenGL.GL is imported.
+OpenGL.ERROR_CHECKING = os.environ.get("YAWS_GL_DEBUG", "0") == "1"
+
 import glfw
 from OpenGL.GL import *
 import imgui
 from imgui.integrations.glfw import GlfwRenderer
 import numpy as np
 
-from gl_utils.program import create_compute_program, create_program
 from gl_utils.buffers import create_fullscreen_quad
-from gl_utils.camera import FPSCamera, normalize, WORLD_UP
+from gl_utils.camera import FPSCamera
+from rendering.calibration import QUALITY_TIERS, calibrate
 from rendering.constants import PlanetParameters, default_planet_parameters, SCALAR
+from rendering.factory import create_fullscreen_program, create_renderer
 from rendering.planet_renderer import PlanetRenderer
+from rendering.poster import render_poster
+from rendering.progressive import ProgressiveRenderer, ViewKey
+from rendering.resolution import MIN_RESOLUTION_SCALE, ResolutionScaler
+from rendering.temporal import TemporalAntiAliasing
+from simulation.fixed_timestep import FixedTimestepSimulation, MovementInput
+from utils.capture import FrameCapture
+from utils.image_io import IMAGE_FORMATS
+from utils.profiler import profiler
+from utils.frame_pacing import STUTTER_FACTOR, FramePacer, FrameTimeHistory
 from utils.time import DeltaTimer, PlanetCalendar
-from utils.persistence import load_camera_bookmark, save_camera_bookmark
-
-
-def compute_adaptive_speed(position, base_speed, planet_radius):
-    distance = np.linalg.norm(position)
-    distance_ratio = distance / planet_radius
-    adaptive_factor = np.clip(0.15 + distance_ratio * 0.85, 0.15, 4.0)
-    return base_speed * adaptive_factor
-
-
-
-
-def project_to_plane(vector, normal):
-    return vector - normal * np.dot(vector, normal)
-
-
-def apply_raymarch_preset(editing_params: PlanetParameters, preset: str):
+from utils.persistence import (
+    QUALITY_PROFILE_PATH,
+    load_camera_bookmark,
+    load_quality_profile,
+    save_camera_bookmark,
+    save_quality_profile,
+)
+from utils.replay import (
+    EVENT_SET_CALENDAR,
+    EVENT_TOGGLE_GRAVITY,
+    EVENT_UPDATE_PARAMETERS,
+    FrameInput,
+    InputRecorder,
+    InputReplay,
+    SessionState,
+    poll_frame_input,
+)
+
+
+PROFILE_CAPTURE_FRAMES = 120
+# Preset entries a calibrated quality profile may override.
+CALIBRATED_SETTINGS = ("planet_max_steps", "planet_step_scale", "cloud_max_steps", "resolution_scale")
+
+
+def read_movement_input(frame_input: FrameInput) -> MovementInput:
+    return MovementInput(
+        forward=frame_input.key_down(glfw.KEY_W),
+        backward=frame_input.key_down(glfw.KEY_S),
+        left=frame_input.key_down(glfw.KEY_A),
+        right=frame_input.key_down(glfw.KEY_D),
+        roll_left=frame_input.key_down(glfw.KEY_Q),
+        roll_right=frame_input.key_down(glfw.KEY_E),
+        fast=frame_input.key_down(glfw.KEY_LEFT_SHIFT),
+        enabled=not frame_input.want_capture_keyboard,
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SDF planet demo")
+    parser.add_argument("--record", metavar="PATH", help="record input and frame timing to PATH")
+    parser.add_argument("--replay", metavar="PATH", help="replay a recording instead of live input")
+    parser.add_argument(
+        "--replay-dt",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="override the recorded frame times with a constant step during replay",
+    )
+    parser.add_argument(
+        "--calibrate",
+        action="store_true",
+        help=f"measure quality settings on this machine, write {QUALITY_PROFILE_PATH.name} and exit",
+    )
+    return parser.parse_args(argv)
+
+
+def apply_raymarch_preset(editing_params: PlanetParameters, preset: str, quality_profile: dict = None):
     presets = {
         "Low": {
             "planet_max_steps": 124,
-            "planet_step_scale": 0.2,
-            "planet_min_step_factor": 0.2,
+            "planet_step_scale": 1.8,
+            "planet_min_step_factor": 0.6,
             "cloud_max_steps": 28,
             "cloud_extinction": 0.65,
             "cloud_phase_exponent": 2.1,
             "max_ray_distance_factor": 2,
+            "resolution_scale": 1.0,
         },
         "Medium": {
             "planet_max_steps": 128,
-            "planet_step_scale": 0.2,
-            "planet_min_step_factor": 0.1,
+            "planet_step_scale": 1.6,
+            "planet_min_step_factor": 0.5,
             "cloud_max_steps": 48,
             "cloud_extinction": 0.55,
             "cloud_phase_exponent": 2.5,
             "max_ray_distance_factor": 3.0,
+            "resolution_scale": 1.0,
         },
         "High": {
             "planet_max_steps": 256,
-            "planet_step_scale": 0.1,
-            "planet_min_step_factor": 0.1,
+            "planet_step_scale": 1.3,
+            "planet_min_step_factor": 0.25,
             "cloud_max_steps": 48,
             "cloud_extinction": 0.45,
             "cloud_phase_exponent": 3.0,
             "max_ray_distance_factor": 3,
+            "resolution_scale": 1.0,
         },
     }
 
     config = presets.get(preset)
     if not config:
         return
+    if quality_profile is not None:
+        calibrated = quality_profile["tiers"].get(preset, {})
+        config = dict(config, **{name: calibrated[name] for name in CALIBRATED_SETTINGS if name in calibrated})
 
-    editing_params.planet_max_steps = config["planet_max_steps"]
+    editing_params.planet_max_steps = int(config["planet_max_steps"])
     editing_params.planet_step_scale = config["planet_step_scale"]
     editing_params.planet_min_step_factor = config["planet_min_step_factor"]
-    editing_params.cloud_max_steps = config["cloud_max_steps"]
+    editing_params.cloud_max_steps = int(config["cloud_max_steps"])
     editing_params.cloud_extinction = config["cloud_extinction"]
     editing_params.cloud_phase_exponent = config["cloud_phase_exponent"]
     editing_params.max_ray_distance = editing_params.planet_radius * config["max_ray_distance_factor"]
+    editing_params.resolution_scale = float(config["resolution_scale"])
 
 
 def draw_parameter_panel(editing_params: PlanetParameters, sun_direction: np.ndarray):
@@ -154,6 +222,20 @@ def draw_parameter_panel(editing_params: PlanetParameters, sun_direction: np.nda
     return update_clicked, reset_clicked
 
 
+def draw_profiler_overlay():
+    io = imgui.get_io()
+    imgui.set_next_window_position(12.0, io.display_size.y - 260.0, condition=imgui.FIRST_USE_EVER)
+    imgui.set_next_window_size(320.0, 0.0, condition=imgui.FIRST_USE_EVER)
+    imgui.begin("Frame profiler")
+    imgui.text("CPU ms per frame (last 60 frames)")
+    imgui.separator()
+    for name, depth, milliseconds in profiler.phase_averages():
+        imgui.text(f"{'  ' * depth}{name}")
+        imgui.same_line(220.0)
+        imgui.text(f"{milliseconds:7.3f}")
+    imgui.end()
+
+
 def draw_performance_panel(
     editing_params: PlanetParameters,
     calendar_state,
@@ -165,6 +247,13 @@ def draw_performance_panel(
     camera_fov_degrees: float,
     calendar_edit_state: dict,
     bookmark_available: bool,
+    frame_pacer: FramePacer,
+    frame_history: FrameTimeHistory,
+    renderer: PlanetRenderer,
+    frame_capture: FrameCapture,
+    poster_settings: dict,
+    progressive: ProgressiveRenderer,
+    quality_profile: dict,
 ):
     io = imgui.get_io()
     left_panel_width = max(io.display_size.x * 0.28, 340.0)
@@ -173,14 +262,123 @@ def draw_performance_panel(
     imgui.begin("Performance & Raymarching")
 
     imgui.text("Quality presets")
-    if imgui.button("Low", width=90):
-        apply_raymarch_preset(editing_params, "Low")
+    for index, tier in enumerate(QUALITY_TIERS):
+        if index:
+            imgui.same_line()
+        if imgui.button(tier, width=90):
+            apply_raymarch_preset(editing_params, tier, quality_profile)
+    if quality_profile is not None:
+        imgui.text_disabled(f"Calibrated {quality_profile.get('created', '')}")
+        for tier in QUALITY_TIERS:
+            settings = quality_profile["tiers"].get(tier)
+            if settings:
+                imgui.text_disabled(
+                    f"  {tier}: {settings.get('frame_ms', 0.0):.1f} ms, error {settings.get('error', 0.0):.4f}"
+                )
+    else:
+        imgui.text_disabled("Built-in presets (run with --calibrate to tune)")
+
+    imgui.separator()
+
+    imgui.text("Frame timing")
+    p50, p95, p99 = frame_history.percentiles() * 1000.0
+    imgui.text(f"{frame_history.average_fps():.1f} fps  p50 {p50:.2f} ms  p95 {p95:.2f} ms  p99 {p99:.2f} ms")
+    imgui.text(f"Stutters (>{STUTTER_FACTOR:.1f}x median): {frame_history.stutter_count()}")
+    imgui.plot_lines(
+        "##frame_times", frame_history.values() * 1000.0, scale_min=0.0, graph_size=(0.0, 48.0)
+    )
+    _, frame_pacer.target_fps = imgui.input_float(
+        "Frame cap (fps, 0 = off)", frame_pacer.target_fps, step=5.0, step_fast=30.0
+    )
+    frame_pacer.target_fps = max(frame_pacer.target_fps, 0.0)
+    vsync_changed, vsync = imgui.checkbox("VSync", frame_pacer.vsync)
+    if vsync_changed:
+        frame_pacer.set_vsync(vsync)
+
+    progressive_changed, progressive_enabled = imgui.checkbox("Progressive refinement", progressive.enabled)
+    if progressive_changed:
+        progressive.enabled = progressive_enabled
+        progressive.invalidate()
     imgui.same_line()
-    if imgui.button("Medium", width=90):
-        apply_raymarch_preset(editing_params, "Medium")
+    if progressive.converged:
+        imgui.text_disabled("converged")
+    else:
+        imgui.text_disabled(f"{progressive.sample_count}/{progressive.max_samples} samples")
+    samples_changed, max_samples = imgui.input_int("Max samples", progressive.max_samples, step=8)
+    if samples_changed:
+        progressive.set_max_samples(max_samples)
+        progressive.invalidate()
+    temporal = progressive.temporal
+    if temporal is not None:
+        temporal_changed, temporal_enabled = imgui.checkbox("Temporal anti-aliasing", temporal.enabled)
+        if temporal_changed:
+            temporal.enabled = temporal_enabled
+            temporal.invalidate()
+            progressive.invalidate()
+
+    profiler_changed, profiler_enabled = imgui.checkbox("CPU profiler", profiler.enabled)
+    if profiler_changed:
+        profiler.set_enabled(profiler_enabled)
     imgui.same_line()
-    if imgui.button("High", width=90):
-        apply_raymarch_preset(editing_params, "High")
+    if profiler.capturing:
+        imgui.text_disabled("Capturing...")
+    elif imgui.button("Capture trace", width=120):
+        profiler.request_capture(
+            PROFILE_CAPTURE_FRAMES, Path(f"frame_trace_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        )
+    if profiler.last_export is not None:
+        imgui.text_disabled(f"Last trace: {profiler.last_export}")
+
+    imgui.separator()
+
+    imgui.text("Capture")
+    format_index = IMAGE_FORMATS.index(frame_capture.image_format)
+    format_changed, format_index = imgui.combo("Image format", format_index, list(IMAGE_FORMATS))
+    if format_changed:
+        frame_capture.set_format(IMAGE_FORMATS[format_index])
+    if imgui.button("Screenshot (F12)", width=140):
+        frame_capture.request_screenshot()
+    imgui.same_line()
+    record_label = "Stop sequence (F10)" if frame_capture.recording else "Record sequence (F10)"
+    if imgui.button(record_label, width=170):
+        frame_capture.toggle_recording()
+    imgui.text_disabled(
+        f"Saved {frame_capture.saved_count}, in flight {frame_capture.pending}, stalls {frame_capture.stall_count}"
+    )
+    if frame_capture.last_saved is not None:
+        imgui.text_disabled(f"Last: {frame_capture.last_saved.name}")
+    if frame_capture.last_error is not None:
+        imgui.text_colored(f"Capture failed: {frame_capture.last_error}", 1.0, 0.4, 0.3)
+    _, poster_settings["width"] = imgui.input_int("Poster width (px)", poster_settings["width"], step=1024)
+    poster_settings["width"] = max(poster_settings["width"], 64)
+    _, poster_settings["samples"] = imgui.input_int("Poster samples", poster_settings["samples"], step=1)
+    poster_settings["samples"] = max(1, min(poster_settings["samples"], 64))
+    poster_clicked = imgui.button("Render poster", width=140)
+    if poster_settings.get("last_path"):
+        imgui.same_line()
+        imgui.text_disabled(str(poster_settings["last_path"].name))
+
+    imgui.separator()
+
+    imgui.text("Pass reuse (runs / skipped)")
+    for name, runs in renderer.pass_runs.items():
+        imgui.text_disabled(f"  {name}: {runs} / {renderer.pass_skips[name]}")
+    if imgui.button("Reset counters", width=140):
+        renderer.reset_pass_counters()
+    graph = renderer.graph
+    imgui.text_disabled(
+        f"  Targets: {len(graph.slots)} logical in {len(graph.slot_specs)} physical, "
+        f"{graph.physical_bytes / 2**20:.1f} of {graph.logical_bytes / 2**20:.1f} MB"
+    )
+
+    imgui.separator()
+
+    body_views = renderer.body_views
+    imgui.text(f"Scene: {len(body_views)} of {len(renderer.scene.bodies)} bodies visible")
+    for view in body_views:
+        x, y, w, h = view.scissor
+        mode = "impostor" if view.impostor else f"steps x{view.budget_scale:.2f}"
+        imgui.text_disabled(f"  {view.body.name}: {w}x{h} px, {mode}")
 
     imgui.separator()
 
@@ -239,11 +437,19 @@ def draw_performance_panel(
     editing_params.planet_max_steps = max(editing_params.planet_max_steps, 1)
 
     _, editing_params.planet_step_scale = imgui.input_float(
-        "Step scale", editing_params.planet_step_scale, step=0.01, step_fast=0.05
+        "Step relaxation", editing_params.planet_step_scale, step=0.05, step_fast=0.1
+    )
+    editing_params.planet_step_scale = min(max(editing_params.planet_step_scale, 0.1), 1.95)
+    _, editing_params.resolution_scale = imgui.slider_float(
+        "Resolution scale", editing_params.resolution_scale, MIN_RESOLUTION_SCALE, 1.0
     )
     _, editing_params.planet_min_step_factor = imgui.input_float(
         "Min step factor", editing_params.planet_min_step_factor, step=0.01, step_fast=0.05
     )
+    if renderer.compute_gbuffer is not None:
+        _, renderer.use_compute_gbuffer = imgui.checkbox("Compute G-buffer", renderer.use_compute_gbuffer)
+        imgui.same_line()
+        imgui.text_disabled("(persistent threads)")
 
     imgui.separator()
     imgui.text("Cloud raymarch")
@@ -282,10 +488,14 @@ def draw_performance_panel(
         set_clock_clicked,
         sync_clock_clicked,
         save_bookmark_clicked,
+        poster_clicked,
     )
 
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    replay = InputReplay(args.replay, args.replay_dt) if args.replay else None
+
     if not glfw.init():
         raise RuntimeError("Failed to initialize GLFW")
 
@@ -293,6 +503,8 @@ def main():
     glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 1)
     glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
     glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL_TRUE)
+    if args.calibrate:
+        glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
 
     width, height = 1366, 768
     #Get the primary monitor and its video mode
@@ -310,31 +522,15 @@ def main():
 
     quad_vao = create_fullscreen_quad()
 
-    with open("shaders/planet.vert") as f:
-        vert_src = f.read()
-    with open("shaders/gbuffer.frag") as f:
-        gbuffer_src = f.read()
-    with open("shaders/lighting.frag") as f:
-        lighting_src = f.read()
-    with open("shaders/atmosphere.frag") as f:
-        atmosphere_src = f.read()
-    with open("shaders/clouds.frag") as f:
-        cloud_src = f.read()
-    with open("shaders/composite.frag") as f:
-        composite_src = f.read()
-    with open("shaders/surface_info.comp") as f:
-        surface_info_src = f.read()
-
-    gbuffer_program = create_program(vert_src, gbuffer_src)
-    lighting_program = create_program(vert_src, lighting_src)
-    atmosphere_program = create_program(vert_src, atmosphere_src)
-    cloud_program = create_program(vert_src, cloud_src)
-    composite_program = create_program(vert_src, composite_src)
-    surface_info_program = create_compute_program(surface_info_src)
-
-    glUseProgram(gbuffer_program)
+    accumulate_program = create_fullscreen_program("accumulate.frag")
+    temporal_resolve_program = create_fullscreen_program("temporal_resolve.frag")
+
+    device = glGetString(GL_RENDERER).decode(errors="replace")
+    quality_profile = None if args.calibrate else load_quality_profile(device)
 
     parameters = default_planet_parameters()
+    if quality_profile is not None:
+        apply_raymarch_preset(parameters, quality_profile.get("default_tier", "Medium"), quality_profile)
     editing_params = parameters.copy()
 
     camera = FPSCamera(
@@ -360,18 +556,38 @@ def main():
         camera.update_vectors()
         bookmark_loaded = True
 
-    renderer = PlanetRenderer(
-        gbuffer_program,
-        lighting_program,
-        atmosphere_program,
-        cloud_program,
-        composite_program,
-        surface_info_program,
-        parameters,
-    )
+    renderer = create_renderer(parameters, motion_vectors=True)
+    if args.calibrate:
+        print(f"Calibrating quality tiers on {device} for {width}x{height}")
+        quality_profile = calibrate(
+            renderer,
+            (width, height),
+            device,
+            progress=lambda done, total: print(f"Setting {done}/{total}", end="\r"),
+        )
+        for tier in QUALITY_TIERS:
+            print(f"\n{tier}: {quality_profile['tiers'][tier]}", end="")
+        if save_quality_profile(quality_profile):
+            print(f"\nSaved quality profile to {QUALITY_PROFILE_PATH}")
+        else:
+            print(f"\nCould not write {QUALITY_PROFILE_PATH}")
+        glfw.terminate()
+        return
+
+    temporal = TemporalAntiAliasing(renderer, temporal_resolve_program)
+    progressive = ProgressiveRenderer(renderer, accumulate_program, temporal=temporal)
+    # Position, front and up, field of view, time, then the history parts.
+    view_keys = ViewKey(15)
+    history_keys = ViewKey(4)
+    resolution_scaler = ResolutionScaler()
+    parameters_version = 0
     timer = DeltaTimer()
+    frame_pacer = FramePacer()
+    frame_pacer.apply_swap_interval()
+    frame_history = FrameTimeHistory()
     calendar = PlanetCalendar()
-    calendar_state = calendar.current_state()
+    simulation = FixedTimestepSimulation(camera, calendar, renderer, parameters, base_speed)
+    calendar_state = simulation.calendar_state
     calendar_edit_state = {
         "day": calendar_state.day_index + 1,
         "hour": calendar_state.hour,
@@ -384,11 +600,53 @@ def main():
 
     camera_mode = True
     space_pressed = False
-    gravity_enabled = False
     g_pressed = False
-    gravity_acceleration = 35.0
+    f10_pressed = False
+    f12_pressed = False
+    frame_capture = FrameCapture()
+    poster_settings = {"width": 16384, "samples": 4, "last_path": None}
     min_ground_clearance = 0.0
 
+    recorder = None
+    if replay is not None:
+        session = replay.session
+        camera.position = session.camera_position.copy()
+        camera.yaw = session.yaw
+        camera.pitch = session.pitch
+        camera.roll = session.roll
+        camera.fov_degrees = session.fov_degrees
+        camera.velocity[...] = 0.0
+        camera.update_vectors()
+        parameters = session.parameters.copy()
+        editing_params = parameters.copy()
+        renderer.update_parameters(parameters)
+        min_ground_clearance = session.min_ground_clearance
+        simulation.min_ground_clearance = min_ground_clearance
+        simulation.parameters = parameters
+        calendar_state = simulation.set_elapsed_seconds(session.elapsed_seconds)
+        if session.gravity_enabled != simulation.gravity_enabled:
+            simulation.toggle_gravity()
+        debug_level = session.debug_level
+        width, height = session.framebuffer_size
+        glfw.set_window_size(window, width, height)
+    elif args.record:
+        recorder = InputRecorder(
+            args.record,
+            SessionState(
+                camera_position=camera.position.copy(),
+                yaw=camera.yaw,
+                pitch=camera.pitch,
+                roll=camera.roll,
+                fov_degrees=camera.fov_degrees,
+                elapsed_seconds=calendar.elapsed_seconds,
+                gravity_enabled=simulation.gravity_enabled,
+                debug_level=debug_level,
+                framebuffer_size=tuple(glfw.get_framebuffer_size(window)),
+                min_ground_clearance=min_ground_clearance,
+                parameters=parameters.copy(),
+            ),
+        )
+
     last_mouse_x, last_mouse_y = width / 2, height / 2
     first_mouse = True
 
@@ -397,43 +655,34 @@ def main():
     imgui.create_context()
     imgui_renderer = GlfwRenderer(window)
 
-    prev_planet_to_world = renderer.planet_to_world.copy()
-    prev_world_to_planet = renderer.world_to_planet.copy()
-
     while not glfw.window_should_close(window):
         dt = timer.get_delta()
-        calendar_state = calendar.advance(dt, editing_params.time_speed)
-        renderer.prepare_frame_state(calendar_state)
-        current_sun_direction = renderer.sun_direction
-        spin_delta = renderer.planet_to_world @ prev_world_to_planet
-        glfw.poll_events()
-        imgui_renderer.process_inputs()
+        frame_history.push(dt)
+        profiler.begin_frame()
+        with profiler.span("poll_events"):
+            glfw.poll_events()
+            imgui_renderer.process_inputs()
         imgui.new_frame()
 
         io = imgui.get_io()
 
-        surface_info = renderer.query_surface_info(camera.position, min_ground_clearance)
-        in_atmosphere = np.linalg.norm(camera.position) <= parameters.atmosphere_radius
-        if gravity_enabled and in_atmosphere:
-            camera.position = spin_delta @ camera.position
-            camera.velocity = spin_delta @ camera.velocity
-            surface_info = renderer.query_surface_info(camera.position, min_ground_clearance)
-
-        if gravity_enabled and in_atmosphere:
-            camera.enable_reference_alignment(True)
-            if surface_info is not None:
-                camera.set_reference_up(surface_info["normal"])
-            else:
-                camera.set_reference_up(WORLD_UP)
+        if replay is not None:
+            frame_input = replay.next_frame()
+            if frame_input is None:
+                print(f"Replay finished after {replay.frame_index} frames")
+                break
+            editing_params.time_speed = frame_input.time_speed
+            min_ground_clearance = frame_input.min_ground_clearance
         else:
-            camera.enable_reference_alignment(False)
-        camera.update_vectors()
+            frame_input = poll_frame_input(window, dt, io)
+            frame_input.time_speed = editing_params.time_speed
+            frame_input.min_ground_clearance = min_ground_clearance
 
-        if glfw.get_key(window, glfw.KEY_ESCAPE) == glfw.PRESS:
+        if frame_input.key_down(glfw.KEY_ESCAPE):
             glfw.set_window_should_close(window, True)
 
         # Toggle between camera and cursor interaction modes
-        space_down = glfw.get_key(window, glfw.KEY_SPACE) == glfw.PRESS
+        space_down = frame_input.key_down(glfw.KEY_SPACE)
         if space_down and not space_pressed:
             camera_mode = not camera_mode
             glfw.set_input_mode(
@@ -444,19 +693,24 @@ def main():
             first_mouse = True
         space_pressed = space_down
 
-        g_down = glfw.get_key(window, glfw.KEY_G) == glfw.PRESS
+        g_down = frame_input.key_down(glfw.KEY_G)
         if g_down and not g_pressed:
-            gravity_enabled = not gravity_enabled
-            if gravity_enabled and in_atmosphere and surface_info is not None:
-                camera.enable_reference_alignment(True)
-                camera.set_reference_up(surface_info["normal"])
-            else:
-                camera.enable_reference_alignment(False)
-            camera.update_vectors()
+            simulation.toggle_gravity()
         g_pressed = g_down
 
+        # Capture hotkeys are read live, also during replay, so a recorded
+        # session can be played back into an image sequence.
+        f12_down = glfw.get_key(window, glfw.KEY_F12) == glfw.PRESS
+        if f12_down and not f12_pressed:
+            frame_capture.request_screenshot()
+        f12_pressed = f12_down
+        f10_down = glfw.get_key(window, glfw.KEY_F10) == glfw.PRESS
+        if f10_down and not f10_pressed:
+            frame_capture.toggle_recording()
+        f10_pressed = f10_down
+
         # Mouse look when in camera mode
-        mx, my = glfw.get_cursor_pos(window)
+        mx, my = frame_input.cursor_x, frame_input.cursor_y
         if first_mouse:
             last_mouse_x, last_mouse_y = mx, my
             first_mouse = False
@@ -465,52 +719,10 @@ def main():
         yoff = last_mouse_y - my
         last_mouse_x, last_mouse_y = mx, my
 
-        if camera_mode and not io.want_capture_mouse:
+        if camera_mode and not frame_input.want_capture_mouse:
             camera.process_mouse(xoff, yoff)
 
-        # Keyboard
-        shift_pressed = glfw.get_key(window, glfw.KEY_LEFT_SHIFT) == glfw.PRESS
-        speed_multiplier = 10.0 if shift_pressed else 1.0
-        camera.speed = compute_adaptive_speed(camera.position, base_speed, parameters.planet_radius) * speed_multiplier
-
-        if not io.want_capture_keyboard:
-            if gravity_enabled and in_atmosphere and surface_info is not None:
-                surface_normal = surface_info["normal"]
-                tangent_forward = project_to_plane(camera.front, surface_normal)
-                if np.linalg.norm(tangent_forward) < 1e-5:
-                    tangent_forward = project_to_plane(camera.right, surface_normal)
-                tangent_forward = normalize(tangent_forward)
-                tangent_right = normalize(np.cross(tangent_forward, surface_normal))
-
-                move_dir = np.zeros(3, dtype=np.float32)
-                if glfw.get_key(window, glfw.KEY_W) == glfw.PRESS:
-                    move_dir += tangent_forward
-                if glfw.get_key(window, glfw.KEY_S) == glfw.PRESS:
-                    move_dir -= tangent_forward
-                if glfw.get_key(window, glfw.KEY_A) == glfw.PRESS:
-                    move_dir -= tangent_right
-                if glfw.get_key(window, glfw.KEY_D) == glfw.PRESS:
-                    move_dir += tangent_right
-
-                move_len = np.linalg.norm(move_dir)
-                if move_len > 1e-6:
-                    move_dir = move_dir / move_len
-                    camera.position += move_dir * camera.speed * dt
-            else:
-                if glfw.get_key(window, glfw.KEY_W) == glfw.PRESS:
-                    camera.process_movement("FORWARD", dt)
-                if glfw.get_key(window, glfw.KEY_S) == glfw.PRESS:
-                    camera.process_movement("BACKWARD", dt)
-                if glfw.get_key(window, glfw.KEY_A) == glfw.PRESS:
-                    camera.process_movement("LEFT", dt)
-                if glfw.get_key(window, glfw.KEY_D) == glfw.PRESS:
-                    camera.process_movement("RIGHT", dt)
-                if not gravity_enabled:
-                    if glfw.get_key(window, glfw.KEY_Q) == glfw.PRESS:
-                        camera.process_roll("LEFT", dt)
-                    if glfw.get_key(window, glfw.KEY_E) == glfw.PRESS:
-                        camera.process_roll("RIGHT", dt)
-
+        if not frame_input.want_capture_keyboard:
             for idx, key in enumerate([
                 glfw.KEY_1,
                 glfw.KEY_2,
@@ -522,78 +734,54 @@ def main():
                 glfw.KEY_8,
                 glfw.KEY_9,
             ]):
-                is_pressed = glfw.get_key(window, key) == glfw.PRESS
+                is_pressed = frame_input.key_down(key)
                 if is_pressed and not pressed_state[idx]:
                     debug_level = idx + 1
                 pressed_state[idx] = is_pressed
 
-        if gravity_enabled and in_atmosphere and surface_info is not None:
-            camera.velocity += (-surface_info["normal"] * gravity_acceleration) * dt
-            camera.position += camera.velocity * dt
-        else:
-            camera.velocity[...] = 0.0
-
-        surface_info = renderer.query_surface_info(camera.position, min_ground_clearance)
-        if surface_info is not None and surface_info["altitude"] < min_ground_clearance:
-            camera.position = surface_info["normal"] * surface_info["clamped_radius"]
-            if gravity_enabled:
-                radial_component = np.dot(camera.velocity, surface_info["normal"])
-                camera.velocity -= radial_component * surface_info["normal"]
-
-        player_height = max(surface_info["altitude"], 0.0) if surface_info is not None else 0.0
-        in_atmosphere = np.linalg.norm(camera.position) <= parameters.atmosphere_radius
-        if gravity_enabled and in_atmosphere:
-            camera.enable_reference_alignment(True)
-            if surface_info is not None:
-                camera.set_reference_up(surface_info["normal"])
-            else:
-                camera.set_reference_up(WORLD_UP)
-        else:
-            camera.enable_reference_alignment(False)
-        camera.update_vectors()
+        # Physics, spin compensation and the calendar advance in fixed steps;
+        # rendering interpolates between the last two simulated states.
+        simulation.time_speed = editing_params.time_speed
+        simulation.min_ground_clearance = min_ground_clearance
+        with profiler.span("simulation"):
+            simulation.advance(frame_input.dt, read_movement_input(frame_input))
+        frame_state = simulation.render_state()
+        calendar_state = frame_state.calendar_state
+        renderer.prepare_frame_state(calendar_state)
+        current_sun_direction = renderer.sun_direction
 
-        framebuffer_width, framebuffer_height = glfw.get_framebuffer_size(window)
+        framebuffer_width, framebuffer_height = frame_input.framebuffer_size
         width, height = framebuffer_width or width, framebuffer_height or height
 
-        (
-            gravity_clicked,
-            min_ground_clearance,
-            camera_fov,
-            set_clock_clicked,
-            sync_clock_clicked,
-            save_bookmark_clicked,
-        ) = draw_performance_panel(
-            editing_params,
-            calendar_state,
-            calendar.days_in_year,
-            calendar.hours_per_day,
-            gravity_enabled,
-            player_height,
-            min_ground_clearance,
-            camera.fov_degrees,
-            calendar_edit_state,
-            bookmark_loaded,
-        )
-        camera.fov_degrees = camera_fov
-        if sync_clock_clicked:
-            calendar_edit_state.update(
-                {
-                    "day": calendar_state.day_index + 1,
-                    "hour": calendar_state.hour,
-                    "minute": calendar_state.minute,
-                    "second": calendar_state.second,
-                }
-            )
-        if set_clock_clicked:
-            target_day = max(1, min(calendar.days_in_year, calendar_edit_state.get("day", 1)))
-            calendar_state = calendar.set_time(
-                target_day - 1,
-                int(calendar_edit_state.get("hour", 0)),
-                int(calendar_edit_state.get("minute", 0)),
-                int(calendar_edit_state.get("second", 0)),
+        with profiler.span("ui.performance_panel"):
+            (
+                gravity_clicked,
+                min_ground_clearance,
+                camera_fov,
+                set_clock_clicked,
+                sync_clock_clicked,
+                save_bookmark_clicked,
+                poster_clicked,
+            ) = draw_performance_panel(
+                editing_params,
+                calendar_state,
+                calendar.days_in_year,
+                calendar.hours_per_day,
+                simulation.gravity_enabled,
+                simulation.player_height,
+                min_ground_clearance,
+                camera.fov_degrees,
+                calendar_edit_state,
+                bookmark_loaded,
+                frame_pacer,
+                frame_history,
+                renderer,
+                frame_capture,
+                poster_settings,
+                progressive,
+                quality_profile,
             )
-            renderer.prepare_frame_state(calendar_state)
-            current_sun_direction = renderer.sun_direction
+        if sync_clock_clicked:
             calendar_edit_state.update(
                 {
                     "day": calendar_state.day_index + 1,
@@ -602,52 +790,149 @@ def main():
                     "second": calendar_state.second,
                 }
             )
-        if save_bookmark_clicked:
+        if save_bookmark_clicked and replay is None:
             bookmark_loaded = save_camera_bookmark(camera) or bookmark_loaded
-        if gravity_clicked:
-            gravity_enabled = not gravity_enabled
-            if gravity_enabled and in_atmosphere and surface_info is not None:
-                camera.enable_reference_alignment(True)
-                camera.set_reference_up(surface_info["normal"])
-            else:
-                camera.enable_reference_alignment(False)
-            camera.update_vectors()
-        update_clicked, reset_clicked = draw_parameter_panel(editing_params, current_sun_direction)
-
-        if update_clicked:
-            parameters = editing_params.copy()
-            renderer.update_parameters(parameters)
-            surface_info = renderer.query_surface_info(camera.position, min_ground_clearance)
-            if surface_info is not None and surface_info["altitude"] < min_ground_clearance:
-                camera.position = surface_info["normal"] * surface_info["clamped_radius"]
-            editing_params = parameters.copy()
-        elif reset_clicked:
-            editing_params = parameters.copy()
-
-        glViewport(0, 0, width, height)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-        glBindVertexArray(quad_vao)
-        renderer.render(
-            camera.position,
-            camera.front,
-            camera.right,
-            camera.up,
+        with profiler.span("ui.parameter_panel"):
+            update_clicked, reset_clicked = draw_parameter_panel(editing_params, current_sun_direction)
+        if profiler.enabled:
+            draw_profiler_overlay()
+
+        # State-changing UI actions become frame events so a recording can
+        # apply them at the same point of the same frame during replay.
+        if replay is not None:
+            camera.fov_degrees = frame_input.fov_degrees
+            frame_events = frame_input.events
+        else:
+            camera.fov_degrees = camera_fov
+            frame_input.fov_degrees = camera.fov_degrees
+            frame_events = frame_input.events
+            if set_clock_clicked:
+                target_day = max(1, min(calendar.days_in_year, calendar_edit_state.get("day", 1)))
+                frame_events.append(
+                    (
+                        EVENT_SET_CALENDAR,
+                        (
+                            target_day - 1,
+                            int(calendar_edit_state.get("hour", 0)),
+                            int(calendar_edit_state.get("minute", 0)),
+                            int(calendar_edit_state.get("second", 0)),
+                        ),
+                    )
+                )
+            if gravity_clicked:
+                frame_events.append((EVENT_TOGGLE_GRAVITY, None))
+            if update_clicked:
+                frame_events.append((EVENT_UPDATE_PARAMETERS, editing_params.copy()))
+            elif reset_clicked:
+                editing_params = parameters.copy()
+
+        for event_type, payload in frame_events:
+            if event_type == EVENT_SET_CALENDAR:
+                calendar_state = simulation.set_calendar_time(*payload)
+                calendar_edit_state.update(
+                    {
+                        "day": calendar_state.day_index + 1,
+                        "hour": calendar_state.hour,
+                        "minute": calendar_state.minute,
+                        "second": calendar_state.second,
+                    }
+                )
+            elif event_type == EVENT_TOGGLE_GRAVITY:
+                simulation.toggle_gravity()
+            elif event_type == EVENT_UPDATE_PARAMETERS:
+                parameters = payload.copy()
+                parameters_version += 1
+                renderer.update_parameters(parameters)
+                simulation.update_parameters(parameters)
+                editing_params = parameters.copy()
+
+        if frame_events:
+            frame_state = simulation.render_state()
+
+        # Anything that changes the image must be part of the key, otherwise
+        # progressive refinement keeps presenting a stale result. The temporal
+        # history only has to restart for what reprojection cannot follow.
+        history_key = history_keys.update(width, height, debug_level, parameters_version)
+        view_key = view_keys.update(
+            frame_state.position,
+            frame_state.front,
+            frame_state.up,
             camera.fov_degrees,
+            calendar_state.elapsed_seconds,
             width,
             height,
             debug_level,
-            calendar_state,
+            parameters_version,
         )
-
-        imgui.render()
-        imgui_renderer.render(imgui.get_draw_data())
-
-        glfw.swap_buffers(window)
-
-        prev_planet_to_world = renderer.planet_to_world.copy()
-        prev_world_to_planet = renderer.world_to_planet.copy()
-
+        glBindVertexArray(quad_vao)
+        with profiler.span("render"):
+            scene_fbo, render_width, render_height = resolution_scaler.begin(
+                width, height, parameters.resolution_scale
+            )
+            progressive.render(
+                view_key,
+                frame_state.position,
+                frame_state.front,
+                frame_state.right,
+                frame_state.up,
+                camera.fov_degrees,
+                render_width,
+                render_height,
+                debug_level,
+                calendar_state,
+                output_fbo=scene_fbo,
+                history_key=history_key,
+            )
+            resolution_scaler.present(width, height, parameters.resolution_scale)
+
+        # Read back before the UI is drawn so captures show only the scene.
+        with profiler.span("capture"):
+            frame_capture.capture(width, height)
+            frame_capture.update()
+
+        if poster_clicked:
+            # Blocks the loop until every tile is done; progress goes to stdout.
+            poster_width = poster_settings["width"]
+            poster_height = max(1, round(poster_width * height / width))
+            poster_path = frame_capture.output_dir / f"poster_{time.strftime('%Y%m%d_%H%M%S')}.png"
+            poster_path.parent.mkdir(parents=True, exist_ok=True)
+            with profiler.span("poster"):
+                poster_settings["last_path"] = render_poster(
+                    renderer,
+                    frame_state.position,
+                    frame_state.front,
+                    frame_state.right,
+                    frame_state.up,
+                    camera.fov_degrees,
+                    calendar_state,
+                    poster_width,
+                    poster_height,
+                    poster_path,
+                    samples=poster_settings["samples"],
+                    debug_level=debug_level,
+                    progress=lambda done, total: print(f"Poster tile {done}/{total}", end="\r"),
+                )
+            print(f"\nSaved poster to {poster_settings['last_path']}")
+
+        with profiler.span("imgui_render"):
+            imgui.render()
+            imgui_renderer.render(imgui.get_draw_data())
+
+        with profiler.span("swap_buffers"):
+            glfw.swap_buffers(window)
+        with profiler.span("frame_pacing"):
+            frame_pacer.wait()
+
+        if recorder is not None:
+            recorder.write_frame(frame_input)
+
+    if recorder is not None:
+        recorder.close()
+        print(f"Recorded {recorder.frame_count} frames to {recorder.path}")
+    frame_capture.close()
+    simulation.close()
+    if frame_capture.saved_count:
+        print(f"Saved {frame_capture.saved_count} captures to {frame_capture.output_dir}")
     glfw.terminate()
 
 
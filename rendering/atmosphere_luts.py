@@ -0,0 +1,218 @@
+import math
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.program import create_compute_program
+from gl_utils.shader import load_shader_source
+from rendering.cloud_noise import CACHE_DIR
+
+
+ATMOSPHERE_LUT_STAGES = ("transmittance", "multi_scattering", "sky_view")
+TRANSMITTANCE_LUT_SIZE = (256, 64)
+MULTI_SCATTERING_LUT_SIZE = (32, 32)
+SKY_VIEW_LUT_SIZE = (192, 108)
+# Bump when the medium or a table layout changes so stale cache files are
+# not picked up.
+ATMOSPHERE_LUT_VERSION = 1
+# Parameter sets whose tables stay resident; older ones are deleted.
+MAX_RESIDENT_TABLES = 8
+
+# local_size of every stage in atmosphere_luts.comp.
+_GROUP_SIZE = 8
+
+
+def atmosphere_lut_sources(path: str = "shaders/atmosphere_luts.comp") -> Dict[str, str]:
+    """Source of each lookup table stage, keyed by stage name."""
+
+    return {
+        stage: load_shader_source(path, {"ATMOSPHERE_LUT_STAGE": index})
+        for index, stage in enumerate(ATMOSPHERE_LUT_STAGES)
+    }
+
+
+def atmosphere_lut_key(parameters) -> Tuple[float, float]:
+    """The parameters the cached tables depend on.
+
+    The sun only enters through the per-frame sky view and a scale factor
+    on its radiance, so it is not part of the key.
+    """
+
+    return (float(parameters.planet_radius), float(parameters.atmosphere_thickness_percent))
+
+
+def _create_lut_texture(state, unit, size, internal_format, data=None):
+    width, height = size
+    texture = int(glGenTextures(1))
+    state.bind_texture(unit, texture)
+    glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, GL_RGBA, GL_FLOAT, data)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    return texture
+
+
+def _dispatch_lut(texture, size, internal_format):
+    width, height = size
+    glBindImageTexture(0, texture, 0, GL_FALSE, 0, GL_WRITE_ONLY, internal_format)
+    glDispatchCompute(math.ceil(width / _GROUP_SIZE), math.ceil(height / _GROUP_SIZE), 1)
+    glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT | GL_TEXTURE_UPDATE_BARRIER_BIT)
+
+
+class AtmosphereLuts:
+    """Lookup tables for the atmosphere pass (see atmosphere_common.glsl).
+
+    The transmittance and multiple-scattering tables depend only on the
+    planet and atmosphere radii. They are built by compute passes the first
+    time a parameter set is drawn and saved under cache_dir, so later runs
+    with the same parameters only upload them. The low-resolution sky-view
+    table is rebuilt whenever the camera, the sun or the tables change.
+
+    Tables are bound to texture units from a base unit chosen by the
+    caller, so the render-target samplers of the pass are left alone.
+    """
+
+    def __init__(self, programs: Optional[Dict[str, int]] = None, cache_dir: Path = CACHE_DIR):
+        if programs is None:
+            programs = {stage: create_compute_program(src) for stage, src in atmosphere_lut_sources().items()}
+        self.programs = programs
+        self.cache_dir = Path(cache_dir)
+        self.tables = {}
+        self.sky_view = None
+        self._sky_view_signature = None
+        self.builds = 0
+
+    def cache_path(self, key: Tuple[float, float]) -> Path:
+        radius, thickness_percent = key
+        return self.cache_dir / (
+            f"atmosphere_luts_v{ATMOSPHERE_LUT_VERSION}_r{radius:.9g}_t{thickness_percent:.9g}.npz"
+        )
+
+    def _load(self, path: Path):
+        try:
+            with np.load(path) as data:
+                transmittance = data["transmittance"]
+                multi_scattering = data["multi_scattering"]
+        except (OSError, KeyError, ValueError):
+            return None
+        for table, (width, height) in (
+            (transmittance, TRANSMITTANCE_LUT_SIZE),
+            (multi_scattering, MULTI_SCATTERING_LUT_SIZE),
+        ):
+            if table.shape != (height, width, 4) or table.dtype != np.float32:
+                return None
+        return transmittance, multi_scattering
+
+    def _store(self, path: Path, transmittance: np.ndarray, multi_scattering: np.ndarray):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(".tmp")
+            with open(temp_path, "wb") as f:
+                np.savez(f, transmittance=transmittance, multi_scattering=multi_scattering)
+            os.replace(temp_path, path)
+        except OSError:
+            # A read-only install still works; it just rebuilds on every start.
+            pass
+
+    def _read_texture(self, unit, texture, size) -> np.ndarray:
+        width, height = size
+        glActiveTexture(GL_TEXTURE0 + unit)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        data = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_FLOAT)
+        return np.frombuffer(data, dtype=np.float32).reshape(height, width, 4).copy()
+
+    def _set_radii(self, state, program, parameters):
+        state.set_float(program, "planetRadius", parameters.planet_radius)
+        state.set_float(program, "atmosphereRadius", parameters.atmosphere_radius)
+
+    def _build(self, state, parameters, unit):
+        transmittance = _create_lut_texture(state, unit, TRANSMITTANCE_LUT_SIZE, GL_RGBA32F)
+        multi_scattering = _create_lut_texture(state, unit + 1, MULTI_SCATTERING_LUT_SIZE, GL_RGBA32F)
+
+        program = self.programs["transmittance"]
+        state.use_program(program)
+        self._set_radii(state, program, parameters)
+        _dispatch_lut(transmittance, TRANSMITTANCE_LUT_SIZE, GL_RGBA32F)
+
+        program = self.programs["multi_scattering"]
+        state.use_program(program)
+        self._set_radii(state, program, parameters)
+        state.set_int(program, "transmittanceLut", unit)
+        state.bind_texture(unit, transmittance)
+        _dispatch_lut(multi_scattering, MULTI_SCATTERING_LUT_SIZE, GL_RGBA32F)
+        self.builds += 1
+        return transmittance, multi_scattering
+
+    def lookup_tables(self, state, parameters, unit: int) -> Tuple[int, int]:
+        """Transmittance and multiple-scattering textures for parameters,
+        from memory, the disk cache or a fresh build, in that order. May
+        change the bound program and the textures on unit and unit + 1."""
+
+        key = atmosphere_lut_key(parameters)
+        tables = self.tables.get(key)
+        if tables is not None:
+            return tables
+
+        path = self.cache_path(key)
+        cached = self._load(path)
+        if cached is not None:
+            tables = (
+                _create_lut_texture(state, unit, TRANSMITTANCE_LUT_SIZE, GL_RGBA32F, cached[0]),
+                _create_lut_texture(state, unit + 1, MULTI_SCATTERING_LUT_SIZE, GL_RGBA32F, cached[1]),
+            )
+        else:
+            tables = self._build(state, parameters, unit)
+            self._store(
+                path,
+                self._read_texture(unit, tables[0], TRANSMITTANCE_LUT_SIZE),
+                self._read_texture(unit + 1, tables[1], MULTI_SCATTERING_LUT_SIZE),
+            )
+            # The readback binds textures behind the state cache's back.
+            state.reset_bindings()
+
+        if len(self.tables) >= MAX_RESIDENT_TABLES:
+            oldest = next(iter(self.tables))
+            glDeleteTextures(2, list(self.tables.pop(oldest)))
+            self._sky_view_signature = None
+        self.tables[key] = tables
+        return tables
+
+    def update_sky_view(self, state, parameters, cam_pos, sun_direction, world_to_planet, unit: int) -> Tuple[int, int]:
+        """Rebuild the sky-view table for a camera in the planet's frame
+        unless nothing it depends on changed; returns the transmittance and
+        sky-view textures. Changes the bound program and the textures on unit
+        and unit + 1."""
+
+        transmittance, multi_scattering = self.lookup_tables(state, parameters, unit)
+        if self.sky_view is None:
+            self.sky_view = _create_lut_texture(state, unit, SKY_VIEW_LUT_SIZE, GL_RGBA16F)
+
+        program = self.programs["sky_view"]
+        state.use_program(program)
+        self._set_radii(state, program, parameters)
+        state.set_vec3(program, "camPos", cam_pos)
+        state.set_vec3(program, "sunDir", sun_direction)
+        state.set_mat3(program, "worldToPlanet", world_to_planet)
+        state.set_int(program, "transmittanceLut", unit)
+        state.set_int(program, "multiScatteringLut", unit + 1)
+
+        signature = (state.uniform_versions.get(program, 0), transmittance)
+        if signature != self._sky_view_signature:
+            state.bind_texture(unit, transmittance)
+            state.bind_texture(unit + 1, multi_scattering)
+            _dispatch_lut(self.sky_view, SKY_VIEW_LUT_SIZE, GL_RGBA16F)
+            self._sky_view_signature = signature
+        return transmittance, self.sky_view
+
+    def release(self):
+        for tables in self.tables.values():
+            glDeleteTextures(2, list(tables))
+        self.tables = {}
+        if self.sky_view is not None:
+            glDeleteTextures(1, [self.sky_view])
+        self.sky_view = None
+        self._sky_view_signature = None
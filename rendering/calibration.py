@@ -0,0 +1,248 @@
+import itertools
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.buffers import create_color_fbo, delete_color_fbo
+from rendering.constants import PlanetParameters
+from rendering.factory import view_camera
+from rendering.resolution import ResolutionScaler
+from utils.persistence import QUALITY_PROFILE_VERSION
+from utils.time import PlanetCalendar
+
+
+QUALITY_TIERS = ("Low", "Medium", "High")
+
+# Calibration renders at a fixed small size and scales the measured times by
+# pixel count to the window the profile is for; every pass is per-pixel.
+CALIBRATION_SIZE = (480, 270)
+CALIBRATION_SWEEP = {
+    "planet_max_steps": (64, 128, 192, 320),
+    "planet_step_scale": (1.3, 1.6, 1.8),
+    "cloud_max_steps": (16, 32, 48),
+    "resolution_scale": (0.5, 0.75, 1.0),
+}
+# Conservative settings whose image the sweep is scored against, averaged
+# over several march seeds so jitter noise is not baked into the reference.
+REFERENCE_SETTINGS = {
+    "planet_max_steps": 1024,
+    "planet_step_scale": 1.0,
+    "planet_min_step_factor": 0.25,
+    "cloud_max_steps": 256,
+    "resolution_scale": 1.0,
+}
+REFERENCE_SAMPLES = 8
+TIMING_RUNS = 3
+# Per-tier frame budgets for the scene passes at the target window size.
+TIER_FRAME_BUDGETS_MS = {"Low": 8.0, "Medium": 16.7, "High": 33.3}
+DEFAULT_TIER = "Medium"
+
+
+@dataclass(frozen=True)
+class CalibrationView:
+    """A fixed camera: altitude above the ground below it as a fraction of
+    the planet radius and pitch above the local horizon, at an hour of day 100."""
+
+    name: str
+    altitude_ratio: float
+    pitch_degrees: float
+    hour: int
+
+
+CALIBRATION_VIEWS = (
+    CalibrationView("orbit", 0.6, -90.0, 18),
+    CalibrationView("horizon", 0.03, -8.0, 17),
+    CalibrationView("under_clouds", 0.004, 8.0, 20),
+    CalibrationView("sunset", 0.004, -2.0, 13),
+)
+
+
+@dataclass
+class CalibrationResult:
+    settings: Dict[str, float]
+    frame_ms: float
+    error: float
+
+
+def _with_settings(parameters: PlanetParameters, settings: Dict[str, float]) -> PlanetParameters:
+    candidate = parameters.copy()
+    for name, value in settings.items():
+        setattr(candidate, name, type(getattr(candidate, name))(value))
+    return candidate
+
+
+def sweep_settings(sweep: Dict[str, Sequence] = CALIBRATION_SWEEP) -> List[Dict[str, float]]:
+    names = list(sweep)
+    return [dict(zip(names, values)) for values in itertools.product(*(sweep[name] for name in names))]
+
+
+def pareto_front(results: Sequence[CalibrationResult]) -> List[CalibrationResult]:
+    """Results no other result beats on both time and error, fastest first."""
+
+    front = []
+    for result in sorted(results, key=lambda item: (item.frame_ms, item.error)):
+        if not front or result.error < front[-1].error:
+            front.append(result)
+    return front
+
+
+def pick_tiers(
+    front: Sequence[CalibrationResult], time_scale: float, budgets: Dict[str, float] = TIER_FRAME_BUDGETS_MS
+) -> Dict[str, CalibrationResult]:
+    """Most accurate front point within each tier's budget, or the fastest
+    one if the machine cannot meet the budget at all."""
+
+    tiers = {}
+    for tier, budget in budgets.items():
+        affordable = [result for result in front if result.frame_ms * time_scale <= budget]
+        tiers[tier] = min(affordable, key=lambda item: item.error) if affordable else front[0]
+    return tiers
+
+
+class _ViewRenderer:
+    """Renders calibration views through the resolution scaler into an RGBA8
+    target of the calibration size and reads them back as floats."""
+
+    def __init__(self, renderer, size: Tuple[int, int]):
+        self.renderer = renderer
+        self.width, self.height = size
+        self.output = create_color_fbo(self.width, self.height, internal_format=GL_RGBA8)
+        self.scaler = ResolutionScaler()
+        self.calendar = PlanetCalendar()
+        self._cameras = {}
+
+    def _camera(self, view: CalibrationView, parameters: PlanetParameters):
+        # The ground query is a blocking readback, so it is made once per view.
+        if view.name not in self._cameras:
+            radius = parameters.planet_radius
+            info = self.renderer.query_surface_info(np.array([0.0, 0.0, radius], dtype=np.float32))
+            ground = radius + parameters.sea_level
+            if info is not None:
+                ground = max(ground, info["surface_radius"])
+            self._cameras[view.name] = view_camera(view, ground, radius)
+        return self._cameras[view.name]
+
+    def draw(self, view: CalibrationView, parameters: PlanetParameters, noise_seed: float):
+        renderer = self.renderer
+        calendar_state = self.calendar.set_time(100, view.hour, 0, 0)
+        renderer.prepare_frame_state(calendar_state)
+        cam_pos, cam_front, cam_right, cam_up = self._camera(view, parameters)
+        scale = parameters.resolution_scale
+        fbo, render_width, render_height = self.scaler.begin(self.width, self.height, scale, self.output["fbo"])
+        renderer.render(
+            cam_pos,
+            cam_front,
+            cam_right,
+            cam_up,
+            70.0,
+            render_width,
+            render_height,
+            9,
+            calendar_state,
+            output_fbo=fbo,
+            noise_seed=noise_seed,
+        )
+        self.scaler.present(self.width, self.height, scale, self.output["fbo"])
+
+    def read(self) -> np.ndarray:
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.output["fbo"])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        self.renderer.state.reset_bindings()
+        pixels = np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)
+        return pixels.astype(np.float32) / 255.0
+
+    def time_ms(self, view: CalibrationView, parameters: PlanetParameters, runs: int) -> float:
+        # Warm up once so shader and target (re)creation stays out of the timing.
+        self.draw(view, parameters, 1.0)
+        glFinish()
+        samples = []
+        for _ in range(runs):
+            self.renderer.invalidate_passes()
+            start = time.perf_counter()
+            self.draw(view, parameters, 1.0)
+            glFinish()
+            samples.append((time.perf_counter() - start) * 1000.0)
+        return float(np.median(samples))
+
+    def release(self):
+        delete_color_fbo(self.output)
+        self.scaler.release()
+
+
+def calibrate(
+    renderer,
+    target_size: Tuple[int, int],
+    device: str,
+    size: Tuple[int, int] = CALIBRATION_SIZE,
+    sweep: Dict[str, Sequence] = CALIBRATION_SWEEP,
+    views: Sequence[CalibrationView] = CALIBRATION_VIEWS,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> dict:
+    """Sweep the raymarch settings over the calibration views and return a
+    quality profile with a Pareto-optimal setting per tier.
+
+    Frame time is the median of glFinish-bounded renders, with pass reuse
+    defeated; error is the RMS difference in display RGB to the reference
+    image, averaged over the views. The renderer's parameters are restored
+    afterwards.
+    """
+
+    original = renderer.parameters
+    views_renderer = _ViewRenderer(renderer, size)
+    candidates = sweep_settings(sweep)
+    try:
+        references = []
+        reference_parameters = _with_settings(original, REFERENCE_SETTINGS)
+        renderer.update_parameters(reference_parameters)
+        for view in views:
+            total = np.zeros((size[1], size[0], 3), dtype=np.float32)
+            for sample in range(REFERENCE_SAMPLES):
+                views_renderer.draw(view, reference_parameters, float(101 + sample))
+                total += views_renderer.read()
+            references.append(total / REFERENCE_SAMPLES)
+
+        results = []
+        for index, settings in enumerate(candidates):
+            parameters = _with_settings(original, settings)
+            renderer.update_parameters(parameters)
+            frame_ms = 0.0
+            error = 0.0
+            for view, reference in zip(views, references):
+                frame_ms += views_renderer.time_ms(view, parameters, TIMING_RUNS)
+                difference = views_renderer.read() - reference
+                error += float(np.sqrt(np.mean(difference * difference)))
+            results.append(CalibrationResult(settings, frame_ms / len(views), error / len(views)))
+            if progress is not None:
+                progress(index + 1, len(candidates))
+    finally:
+        views_renderer.release()
+        renderer.update_parameters(original)
+        renderer.invalidate_passes()
+
+    time_scale = (target_size[0] * target_size[1]) / float(size[0] * size[1])
+    front = pareto_front(results)
+    tiers = pick_tiers(front, time_scale)
+    return {
+        "version": QUALITY_PROFILE_VERSION,
+        "device": device,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "window_size": list(target_size),
+        "default_tier": DEFAULT_TIER,
+        "tiers": {
+            tier: dict(
+                result.settings,
+                frame_ms=round(result.frame_ms * time_scale, 3),
+                error=round(result.error, 6),
+            )
+            for tier, result in tiers.items()
+        },
+        "pareto_front": [
+            dict(result.settings, frame_ms=round(result.frame_ms * time_scale, 3), error=round(result.error, 6))
+            for result in front
+        ],
+    }
@@ -0,0 +1,126 @@
+import os
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / "cache"
+CLOUD_NOISE_SIZE = 64
+# The volume tiles every CLOUD_NOISE_CELLS cells of its lowest octave;
+# clouds.frag divides its noise frequencies by the same number.
+CLOUD_NOISE_CELLS = 4
+# Bump when the bake changes so stale cache files are not picked up.
+CLOUD_NOISE_VERSION = 1
+
+# Mean and standard deviation of the value-noise fbm terms the shader used
+# before the bake, so density thresholds tuned against them still hold.
+_BASE_STATS = (0.482, 0.107)
+_BILLOW_STATS = (0.177, 0.128)
+_DETAIL_STATS = (0.483, 0.107)
+
+
+def _lattice(size: int, cells: int):
+    """Per-voxel cell index and fractional position for a lattice of ``cells`` per tile."""
+
+    coords = (np.arange(size, dtype=np.float32) + 0.5) * (cells / size)
+    grid = np.stack(np.meshgrid(coords, coords, coords, indexing="ij"), axis=-1)
+    cell = np.floor(grid).astype(np.int32)
+    return cell, grid - cell
+
+
+def _gradient_noise(size: int, cells: int, rng: np.random.Generator) -> np.ndarray:
+    """Tileable Perlin noise in roughly [-1, 1]."""
+
+    gradients = rng.normal(size=(cells, cells, cells, 3)).astype(np.float32)
+    gradients /= np.linalg.norm(gradients, axis=-1, keepdims=True)
+    cell, frac = _lattice(size, cells)
+    fade = frac * frac * frac * (frac * (frac * 6.0 - 15.0) + 10.0)
+
+    result = np.zeros(frac.shape[:3], dtype=np.float32)
+    for corner in np.ndindex(2, 2, 2):
+        offset = np.array(corner, dtype=np.int32)
+        index = (cell + offset) % cells
+        g = gradients[index[..., 0], index[..., 1], index[..., 2]]
+        weight = np.prod(np.where(offset == 1, fade, 1.0 - fade), axis=-1)
+        result += weight * np.sum(g * (frac - offset), axis=-1)
+    return result * 1.6
+
+
+def _worley(size: int, cells: int, rng: np.random.Generator) -> np.ndarray:
+    """Tileable inverted cellular noise: 1 at feature points, falling to 0 a cell away."""
+
+    points = rng.random((cells, cells, cells, 3)).astype(np.float32)
+    cell, frac = _lattice(size, cells)
+    nearest = np.full(frac.shape[:3], np.inf, dtype=np.float32)
+    for neighbour in np.ndindex(3, 3, 3):
+        offset = np.array(neighbour, dtype=np.int32) - 1
+        index = (cell + offset) % cells
+        delta = offset + points[index[..., 0], index[..., 1], index[..., 2]] - frac
+        np.minimum(nearest, np.einsum("...i,...i->...", delta, delta), out=nearest)
+    return 1.0 - np.clip(np.sqrt(nearest), 0.0, 1.0)
+
+
+def _fbm(noise: Callable, size: int, cells: int, octaves: int, rng: np.random.Generator) -> np.ndarray:
+    total = np.zeros((size, size, size), dtype=np.float32)
+    amplitude = 1.0
+    norm = 0.0
+    for octave in range(octaves):
+        total += amplitude * noise(size, cells << octave, rng)
+        norm += amplitude
+        amplitude *= 0.5
+    return total / norm
+
+
+def _match_stats(channel: np.ndarray, stats) -> np.ndarray:
+    mean, std = stats
+    return (channel - channel.mean()) / max(float(channel.std()), 1e-6) * std + mean
+
+
+def bake_cloud_noise(size: int = CLOUD_NOISE_SIZE, seed: int = 7) -> np.ndarray:
+    """Bake the RGBA8 cloud shape volume, indexed [z, y, x].
+
+    R is Perlin-Worley base shape, G billow (folded Perlin fbm) and B
+    Worley fbm detail; A is unused. Every channel tiles with the volume.
+    """
+
+    rng = np.random.default_rng(seed)
+    cells = CLOUD_NOISE_CELLS
+
+    perlin = _fbm(_gradient_noise, size, cells, 4, rng) * 0.5 + 0.5
+    worley = _fbm(_worley, size, cells * 2, 3, rng)
+    # Perlin remapped into the Worley floor: billowy cells with soft edges.
+    base = worley + perlin * (1.0 - worley)
+    billow = np.abs(_fbm(_gradient_noise, size, cells, 4, rng))
+    detail = _fbm(_worley, size, cells * 2, 3, rng)
+
+    volume = np.zeros((size, size, size, 4), dtype=np.uint8)
+    for channel, values, stats in ((0, base, _BASE_STATS), (1, billow, _BILLOW_STATS), (2, detail, _DETAIL_STATS)):
+        matched = _match_stats(values, stats)
+        volume[..., channel] = np.clip(np.rint(matched * 255.0), 0, 255).astype(np.uint8)
+    # ij-indexed meshgrid gives [x, y, z]; GL uploads expect z outermost.
+    return np.ascontiguousarray(volume.transpose(2, 1, 0, 3))
+
+
+def load_cloud_noise(size: int = CLOUD_NOISE_SIZE, cache_dir: Path = CACHE_DIR) -> np.ndarray:
+    """Load the baked volume from the cache, baking and storing it on a miss."""
+
+    path = Path(cache_dir) / f"cloud_noise_v{CLOUD_NOISE_VERSION}_{size}.npy"
+    try:
+        volume = np.load(path)
+        if volume.shape == (size, size, size, 4) and volume.dtype == np.uint8:
+            return volume
+    except (OSError, ValueError):
+        pass
+
+    volume = bake_cloud_noise(size)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "wb") as f:
+            np.save(f, volume)
+        os.replace(temp_path, path)
+    except OSError:
+        # A read-only install still works; it just bakes on every start.
+        pass
+    return volume
@@ -0,0 +1,141 @@
+import math
+from typing import Dict, Sequence, Tuple
+
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.shader import load_shader_source
+
+
+GBUFFER_COMPUTE_STAGES = ("generate", "march", "shade")
+
+# Steps every queued ray takes per march round before the survivors are
+# compacted into the next queue. Short rounds keep the workgroups full of
+# live rays; long ones spend less on queue traffic.
+MARCH_ROUND_STEPS = 16
+MARCH_GROUP_SIZE = 64
+PIXEL_GROUP_SIZE = 8
+# Most workgroups launched for a march round. They loop over the queue
+# until it is drained, so this only has to be large enough to fill the GPU;
+# rounds with fewer rays launch one group per MARCH_GROUP_SIZE of them.
+PERSISTENT_GROUPS = 256
+
+# std430 size of PlanetMarch in gbuffer_common.glsl: twelve 4-byte scalars.
+_MARCH_STATE_BYTES = 48
+# Empty queue header: no groups to dispatch (x = 0, y = z = 1), no rays.
+_EMPTY_QUEUE_HEADER = np.array([0, 1, 1, 0, 0, 0, 0, 0], dtype=np.uint32)
+_QUEUE_HEADER_BYTES = _EMPTY_QUEUE_HEADER.nbytes
+_GBUFFER_IMAGE_FORMATS = (GL_RGBA16F, GL_RGBA16F, GL_RGBA16F, GL_RGBA32F)
+
+
+def gbuffer_compute_sources(path: str = "shaders/gbuffer.comp") -> Dict[str, str]:
+    """Source of each compute G-buffer stage, keyed by stage name."""
+
+    return {
+        stage: load_shader_source(
+            path,
+            {
+                "GBUFFER_STAGE": index,
+                "MARCH_ROUND_STEPS": MARCH_ROUND_STEPS,
+                "MARCH_GROUP_SIZE": MARCH_GROUP_SIZE,
+                "PIXEL_GROUP_SIZE": PIXEL_GROUP_SIZE,
+                "PERSISTENT_GROUPS": PERSISTENT_GROUPS,
+            },
+        )
+        for index, stage in enumerate(GBUFFER_COMPUTE_STAGES)
+    }
+
+
+class ComputeGBuffer:
+    """Fills the G-buffer with compute shaders instead of a fullscreen quad.
+
+    In the fragment pass every ray runs in the warp it was rasterized into,
+    so sky pixels that finish at once idle next to horizon pixels that use
+    the whole step budget. Here the march is split into rounds: a
+    generate stage queues the rays that have terrain to cross, each round
+    advances every queued ray by MARCH_ROUND_STEPS and writes the ones still
+    running to the other queue, and a shade stage writes the results. Rounds
+    are launched as a fixed set of persistent workgroups that pull batches
+    of rays off the queue, so warps always work on live rays.
+
+    Each queue carries the dispatch size of the round that drains it, so
+    rounds are launched indirectly and nothing is read back. The number of
+    rounds follows from the step budget; those after the queue empties
+    dispatch no groups.
+    """
+
+    def __init__(self, programs: Dict[str, int]):
+        self.programs = programs
+        self.marches = None
+        self.queues = None
+        self.capacity = 0
+
+    @property
+    def program_list(self) -> Tuple[int, ...]:
+        return tuple(self.programs[stage] for stage in GBUFFER_COMPUTE_STAGES)
+
+    def _ensure_buffers(self, pixels: int):
+        if pixels <= self.capacity:
+            return
+        self.release()
+        self.marches = glGenBuffers(1)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.marches)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, pixels * _MARCH_STATE_BYTES, None, GL_DYNAMIC_COPY)
+        self.queues = [int(buffer) for buffer in glGenBuffers(2)]
+        for queue in self.queues:
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, queue)
+            glBufferData(GL_SHADER_STORAGE_BUFFER, _QUEUE_HEADER_BYTES + pixels * 4, None, GL_DYNAMIC_COPY)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+        self.capacity = pixels
+
+    def _reset_queue(self, queue: int):
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, queue)
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, _QUEUE_HEADER_BYTES, _EMPTY_QUEUE_HEADER)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+
+    def dispatch(self, state, rect: Sequence[int], max_steps: int, textures: Sequence[int]):
+        """Run all stages over rect (x, y, width, height) of the G-buffer
+        textures. Uniforms, pixelRect included, must already be set on every
+        stage program."""
+
+        _, _, width, height = rect
+        pixels = width * height
+        if pixels <= 0:
+            return
+        self._ensure_buffers(pixels)
+
+        for unit, (texture, internal_format) in enumerate(zip(textures, _GBUFFER_IMAGE_FORMATS)):
+            glBindImageTexture(unit, texture, 0, GL_FALSE, 0, GL_WRITE_ONLY, internal_format)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, self.marches)
+        pixel_groups_x = math.ceil(width / PIXEL_GROUP_SIZE)
+        pixel_groups_y = math.ceil(height / PIXEL_GROUP_SIZE)
+
+        self._reset_queue(self.queues[0])
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 2, self.queues[0])
+        state.use_program(self.programs["generate"])
+        glDispatchCompute(pixel_groups_x, pixel_groups_y, 1)
+        glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT | GL_COMMAND_BARRIER_BIT)
+
+        state.use_program(self.programs["march"])
+        for round_index in range(math.ceil(max(max_steps, 1) / MARCH_ROUND_STEPS)):
+            source = self.queues[round_index % 2]
+            target = self.queues[1 - round_index % 2]
+            self._reset_queue(target)
+            glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 1, source)
+            glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 2, target)
+            glBindBuffer(GL_DISPATCH_INDIRECT_BUFFER, source)
+            glDispatchComputeIndirect(0)
+            glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT | GL_COMMAND_BARRIER_BIT)
+        glBindBuffer(GL_DISPATCH_INDIRECT_BUFFER, 0)
+
+        state.use_program(self.programs["shade"])
+        glDispatchCompute(pixel_groups_x, pixel_groups_y, 1)
+        glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT | GL_FRAMEBUFFER_BARRIER_BIT)
+
+    def release(self):
+        if self.marches is not None:
+            glDeleteBuffers(1, [self.marches])
+            glDeleteBuffers(2, self.queues)
+        self.marches = None
+        self.queues = None
+        self.capacity = 0
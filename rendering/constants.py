@@ -1,4 +1,4 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 import numpy as np
 
 
@@ -62,10 +62,13 @@ CLOUD_LIGHT_COLOR = np.array([1.0, 0.97, 0.94], dtype=np.float32)
 
 # Raymarch controls
 PLANET_MAX_STEPS = 320
-PLANET_STEP_SCALE = 0.17
+# Over-relaxation of the Lipschitz-safe sphere-tracing step, in [1, 2).
+PLANET_STEP_SCALE = 1.6
 PLANET_MIN_STEP_FACTOR = 0.5
 
 CLOUD_MAX_STEPS = 48
+# Fraction of the window resolution the passes render at before upscaling.
+RESOLUTION_SCALE = 1.0
 CLOUD_EXTINCTION = 0.55
 CLOUD_PHASE_EXPONENT = 2.5
 CLOUD_ANIMATION_SPEED = 0.006
@@ -107,6 +110,7 @@ class PlanetParameters:
     planet_step_scale: float = PLANET_STEP_SCALE
     planet_min_step_factor: float = PLANET_MIN_STEP_FACTOR
     cloud_max_steps: int = CLOUD_MAX_STEPS
+    resolution_scale: float = RESOLUTION_SCALE
     cloud_extinction: float = CLOUD_EXTINCTION
     cloud_phase_exponent: float = CLOUD_PHASE_EXPONENT
     cloud_animation_speed: float = CLOUD_ANIMATION_SPEED
@@ -156,6 +160,7 @@ class PlanetParameters:
             planet_step_scale=self.planet_step_scale,
             planet_min_step_factor=self.planet_min_step_factor,
             cloud_max_steps=self.cloud_max_steps,
+            resolution_scale=self.resolution_scale,
             cloud_extinction=self.cloud_extinction,
             cloud_phase_exponent=self.cloud_phase_exponent,
             cloud_animation_speed=self.cloud_animation_speed,
@@ -164,6 +169,45 @@ class PlanetParameters:
             time_speed=self.time_speed,
         )
 
+    def copy_from(self, other: "PlanetParameters") -> "PlanetParameters":
+        """Take every value of other, writing vectors into this instance's
+        own arrays; unlike copy() it allocates nothing."""
+
+        for name in _FIELD_NAMES:
+            value = getattr(other, name)
+            if isinstance(value, np.ndarray):
+                getattr(self, name)[...] = value
+            else:
+                setattr(self, name, value)
+        return self
+
+    def to_dict(self) -> dict:
+        data = {}
+        for item in fields(self):
+            value = getattr(self, item.name)
+            if isinstance(value, np.ndarray):
+                value = [float(v) for v in value]
+            data[item.name] = value
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PlanetParameters":
+        params = cls()
+        for item in fields(cls):
+            if item.name not in data:
+                continue
+            default = getattr(params, item.name)
+            value = data[item.name]
+            if isinstance(default, np.ndarray):
+                value = np.array(value, dtype=np.float32)
+            else:
+                value = type(default)(value)
+            setattr(params, item.name, value)
+        return params
+
+
+_FIELD_NAMES = tuple(item.name for item in fields(PlanetParameters))
+
 
 def default_planet_parameters() -> PlanetParameters:
     params = PlanetParameters()
@@ -0,0 +1,65 @@
+import math
+
+import numpy as np
+
+from gl_utils.program import create_compute_program, create_program
+from gl_utils.shader import load_shader_source
+from rendering.atmosphere_luts import atmosphere_lut_sources
+from rendering.compute_gbuffer import gbuffer_compute_sources
+from rendering.constants import PlanetParameters, default_planet_parameters
+from rendering.horizon_maps import horizon_map_sources
+from rendering.planet_renderer import PlanetRenderer
+from rendering.scene import Scene, default_scene
+
+
+SHADER_DIR = "shaders"
+
+
+def create_fullscreen_program(fragment_name: str) -> int:
+    """Program for a fullscreen pass: planet.vert with shaders/<fragment_name>."""
+
+    return create_program(
+        load_shader_source(f"{SHADER_DIR}/planet.vert"), load_shader_source(f"{SHADER_DIR}/{fragment_name}")
+    )
+
+
+def create_renderer(
+    parameters: PlanetParameters = None, scene: Scene = None, motion_vectors: bool = False
+) -> PlanetRenderer:
+    """A PlanetRenderer with every program compiled from shaders/.
+
+    Needs a current OpenGL 4.3 context for the compute programs. With
+    motion_vectors the velocity pass is built too, for temporal resolves.
+    """
+
+    if parameters is None:
+        parameters = default_planet_parameters()
+    if scene is None:
+        scene = default_scene(parameters)
+    return PlanetRenderer(
+        create_fullscreen_program("gbuffer.frag"),
+        create_fullscreen_program("lighting.frag"),
+        create_fullscreen_program("atmosphere.frag"),
+        create_fullscreen_program("clouds.frag"),
+        create_fullscreen_program("composite.frag"),
+        create_compute_program(load_shader_source(f"{SHADER_DIR}/surface_info.comp")),
+        parameters,
+        create_fullscreen_program("impostor.frag"),
+        scene,
+        {stage: create_compute_program(src) for stage, src in gbuffer_compute_sources().items()},
+        {stage: create_compute_program(src) for stage, src in atmosphere_lut_sources().items()},
+        {stage: create_compute_program(src) for stage, src in horizon_map_sources().items()},
+        create_fullscreen_program("velocity.frag") if motion_vectors else None,
+    )
+
+
+def view_camera(view, ground_radius: float, planet_radius: float):
+    """(position, front, right, up) for a view with altitude_ratio and
+    pitch_degrees, such as a CalibrationView, above the +Z pole."""
+
+    position = np.array([0.0, 0.0, ground_radius + planet_radius * view.altitude_ratio], dtype=np.float32)
+    pitch = math.radians(view.pitch_degrees)
+    front = np.array([0.0, math.cos(pitch), math.sin(pitch)], dtype=np.float32)
+    right = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    up = np.cross(right, front).astype(np.float32)
+    return position, front, right, up
@@ -0,0 +1,125 @@
+import math
+from typing import Dict, Optional, Tuple
+
+from OpenGL.GL import *
+
+from gl_utils.program import create_compute_program
+from gl_utils.shader import load_shader_source
+
+
+HORIZON_MAP_STAGES = ("height", "horizon")
+# Texels along a cube face edge, about 20 km at the default radius.
+HORIZON_MAP_SIZE = 512
+# Parameter sets whose maps stay resident; older ones are deleted.
+MAX_RESIDENT_MAPS = 4
+
+# local_size of both stages in horizon_maps.comp.
+_GROUP_SIZE = 8
+
+
+def horizon_map_sources(path: str = "shaders/horizon_maps.comp") -> Dict[str, str]:
+    """Source of each horizon map stage, keyed by stage name."""
+
+    return {
+        stage: load_shader_source(path, {"HORIZON_MAP_STAGE": index})
+        for index, stage in enumerate(HORIZON_MAP_STAGES)
+    }
+
+
+def horizon_map_key(parameters) -> Tuple[float, float, float]:
+    """The parameters the terrain, and so its horizons, depend on."""
+
+    return (float(parameters.planet_radius), float(parameters.height_scale), float(parameters.sea_level))
+
+
+def _create_cube_texture(state, unit, size, internal_format):
+    texture = int(glGenTextures(1))
+    state.bind_texture(unit, texture, GL_TEXTURE_CUBE_MAP)
+    format_type = (GL_RED, GL_FLOAT) if internal_format == GL_R32F else (GL_RGBA, GL_FLOAT)
+    for face in range(6):
+        glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + face, 0, internal_format, size, size, 0, *format_type, None)
+    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+    for wrap in (GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_TEXTURE_WRAP_R):
+        glTexParameteri(GL_TEXTURE_CUBE_MAP, wrap, GL_CLAMP_TO_EDGE)
+    return texture
+
+
+class HorizonMaps:
+    """Horizon angles of the terrain for the lighting pass.
+
+    Every texel of a pair of cube maps holds the elevation of the terrain's
+    horizon in eight azimuths, so the lighting pass gets soft terrain shadows
+    and horizon-based ambient occlusion from two fetches per pixel. The maps
+    only depend on the terrain parameters; they are built by compute passes
+    the first time a parameter set is lit and kept for later frames.
+    """
+
+    def __init__(self, programs: Optional[Dict[str, int]] = None, size: int = HORIZON_MAP_SIZE):
+        if programs is None:
+            programs = {stage: create_compute_program(src) for stage, src in horizon_map_sources().items()}
+        self.programs = programs
+        self.size = size
+        self.maps = {}
+        self.builds = 0
+
+    def _set_terrain(self, state, program, parameters):
+        state.set_float(program, "planetRadius", parameters.planet_radius)
+        state.set_float(program, "heightScale", parameters.height_scale)
+        state.set_float(program, "seaLevel", parameters.sea_level)
+
+    def _dispatch(self):
+        groups = math.ceil(self.size / _GROUP_SIZE)
+        glDispatchCompute(groups, groups, 6)
+        glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT | GL_TEXTURE_UPDATE_BARRIER_BIT)
+
+    def _build(self, state, parameters, unit):
+        # Linear fetches across face edges read the neighbouring face.
+        glEnable(GL_TEXTURE_CUBE_MAP_SEAMLESS)
+        heights = _create_cube_texture(state, unit, self.size, GL_R32F)
+        program = self.programs["height"]
+        state.use_program(program)
+        self._set_terrain(state, program, parameters)
+        glBindImageTexture(0, heights, 0, GL_TRUE, 0, GL_WRITE_ONLY, GL_R32F)
+        self._dispatch()
+
+        maps = (
+            _create_cube_texture(state, unit + 1, self.size, GL_RGBA16F),
+            _create_cube_texture(state, unit + 2, self.size, GL_RGBA16F),
+        )
+        program = self.programs["horizon"]
+        state.use_program(program)
+        self._set_terrain(state, program, parameters)
+        state.set_int(program, "heightMap", unit)
+        state.bind_texture(unit, heights, GL_TEXTURE_CUBE_MAP)
+        for binding, texture in enumerate(maps):
+            glBindImageTexture(binding, texture, 0, GL_TRUE, 0, GL_WRITE_ONLY, GL_RGBA16F)
+        self._dispatch()
+
+        # The heights are only needed while the horizons are traced.
+        state.bind_texture(unit, 0, GL_TEXTURE_CUBE_MAP)
+        glDeleteTextures(1, [heights])
+        self.builds += 1
+        return maps
+
+    def horizon_maps(self, state, parameters, unit: int) -> Tuple[int, int]:
+        """The two horizon cube maps for parameters, built on first use.
+        A build changes the bound program and the textures on unit through
+        unit + 2."""
+
+        key = horizon_map_key(parameters)
+        maps = self.maps.get(key)
+        if maps is not None:
+            return maps
+
+        maps = self._build(state, parameters, unit)
+        if len(self.maps) >= MAX_RESIDENT_MAPS:
+            oldest = next(iter(self.maps))
+            glDeleteTextures(2, list(self.maps.pop(oldest)))
+        self.maps[key] = maps
+        return maps
+
+    def release(self):
+        for maps in self.maps.values():
+            glDeleteTextures(2, list(maps))
+        self.maps = {}
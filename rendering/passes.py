@@ -0,0 +1,59 @@
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+from OpenGL.GL import glUniform1i, glUseProgram
+
+from gl_utils.state import GLStateCache
+
+
+@dataclass
+class SamplerBinding:
+    """Binds the texture produced by ``source`` to a sampler uniform."""
+
+    uniform: str
+    source: Tuple[str, object]
+
+
+@dataclass
+class PassDescriptor:
+    """Everything about a fullscreen pass that does not change per frame.
+
+    Sampler units are assigned and uploaded to the program once when the
+    descriptor is baked; textures are re-resolved only when the render
+    targets they come from are reallocated.
+    """
+
+    name: str
+    program: int
+    target: Optional[str]
+    samplers: List[SamplerBinding] = field(default_factory=list)
+    clear_mask: int = 0
+    textures: List[Tuple[int, int]] = field(default_factory=list)
+
+    def bake(self, state: GLStateCache):
+        glUseProgram(self.program)
+        for unit, sampler in enumerate(self.samplers):
+            loc = state.location(self.program, sampler.uniform)
+            if loc >= 0:
+                glUniform1i(loc, unit)
+        glUseProgram(0)
+        state.reset_bindings()
+
+    @property
+    def inputs(self) -> Tuple[str, ...]:
+        """Render targets this pass samples, in first-use order."""
+
+        return tuple(dict.fromkeys(sampler.source[0] for sampler in self.samplers))
+
+    def resolve_textures(self, lookup: Callable[[Tuple[str, object]], int]):
+        self.textures = [(unit, lookup(sampler.source)) for unit, sampler in enumerate(self.samplers)]
+
+
+def begin_pass(state: GLStateCache, descriptor: PassDescriptor, framebuffer: int, width: int, height: int):
+    state.bind_framebuffer(framebuffer)
+    state.viewport(0, 0, width, height)
+    if descriptor.clear_mask:
+        state.clear(descriptor.clear_mask)
+    state.use_program(descriptor.program)
+    for unit, texture in descriptor.textures:
+        state.bind_texture(unit, texture)
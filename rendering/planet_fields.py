@@ -0,0 +1,85 @@
+import numpy as np
+
+from rendering.terrain import fbm
+
+
+# NumPy ports of the per-point surface fields in gbuffer_common.glsl, for
+# tools that need the planet as data rather than pixels. Like the terrain
+# port in rendering/terrain.py they use the full-detail fbm, which is what
+# the shaders evaluate for a footprint of zero.
+
+_OCEAN = np.array([0.026, 0.16, 0.32], dtype=np.float32)
+_COAST = np.array([0.82, 0.75, 0.6], dtype=np.float32)
+_LAND_LOW = np.array([0.18, 0.42, 0.2], dtype=np.float32)
+_LAND_HIGH = np.array([0.36, 0.34, 0.22], dtype=np.float32)
+_LAND_ROCK = np.array([0.38, 0.36, 0.33], dtype=np.float32)
+_MOUNTAIN = np.array([0.55, 0.56, 0.6], dtype=np.float32)
+_SNOW = np.array([0.92, 0.95, 0.98], dtype=np.float32)
+_COLOR_NOISE_OFFSET = np.array([3.7, 1.3, 6.2], dtype=np.float32)
+
+_CLOUD_OFFSETS = (
+    (3.1, np.array([1.7, -2.2, 0.5], dtype=np.float32), 0.55),
+    (7.2, np.array([-4.1, 2.6, 3.3], dtype=np.float32), 0.35),
+    (12.5, np.array([5.1, -1.9, 3.6], dtype=np.float32), 0.25),
+)
+
+
+def _smoothstep(edge0: float, edge1: float, x: np.ndarray) -> np.ndarray:
+    t = np.clip((x - np.float32(edge0)) / np.float32(edge1 - edge0), 0.0, 1.0)
+    return t * t * (np.float32(3.0) - np.float32(2.0) * t)
+
+
+def _mix(a, b, t):
+    return a + (b - a) * t
+
+
+def land_color(
+    directions: np.ndarray,
+    normals: np.ndarray,
+    heights: np.ndarray,
+    sea_level: float,
+    height_scale: float,
+    octaves=None,
+) -> np.ndarray:
+    """landColor of gbuffer_common.glsl: linear albedo of shape (..., 3) for
+    unit directions and surface normals of shape (..., 3) and terrain
+    heights of shape (...), all in the planet's frame. octaves limits the
+    colour noise like the G-buffer's footprint does; see rendering.terrain.fbm."""
+
+    normalized_height = (heights - np.float32(sea_level)) / np.float32(max(height_scale, 0.0001)) * np.float32(5.0)
+    coast_blend = _smoothstep(-0.06, 0.01, normalized_height)[..., None]
+    land_blend = _smoothstep(0.02, 0.32, normalized_height)[..., None]
+    mountain_blend = _smoothstep(0.35, 0.62, normalized_height)[..., None]
+    snow_blend = _smoothstep(0.65, 0.9, normalized_height)[..., None]
+
+    height_norm = np.clip(normalized_height, 0.0, 1.0)
+    slope = 1.0 - np.clip(np.sum(directions * normals, axis=-1), 0.0, 1.0)
+    slope_rock = _smoothstep(0.28, 0.7, slope)[..., None]
+    color_noise = fbm(directions * np.float32(12.0) + _COLOR_NOISE_OFFSET, octaves)
+    height_mix = np.clip(height_norm * np.float32(1.2) + color_noise * np.float32(0.25), 0.0, 1.0)[..., None]
+
+    varied_land = _mix(_LAND_LOW, _LAND_HIGH, height_mix)
+    varied_land = _mix(varied_land, _LAND_ROCK, slope_rock * np.float32(0.65))
+
+    color = _mix(_OCEAN, _COAST, coast_blend)
+    color = _mix(color, varied_land, land_blend)
+    color = _mix(color, _MOUNTAIN, mountain_blend)
+    color = _mix(color, _SNOW, snow_blend)
+    return color.astype(np.float32)
+
+
+def cloud_coverage(directions: np.ndarray, coverage_setting: float) -> np.ndarray:
+    """cloudCoverageField of gbuffer_common.glsl for unit directions of shape
+    (..., 3): the static coverage in [0, 1] the G-buffer shades cloud
+    shadows with and the cloud pass blends its drifting field toward."""
+
+    coverage = np.zeros(directions.shape[:-1], dtype=np.float32)
+    for frequency, offset, weight in _CLOUD_OFFSETS:
+        coverage += fbm(directions * np.float32(frequency) + offset) * np.float32(weight)
+    control = min(max(coverage_setting / 1.5, 0.0), 1.0)
+    gain = 0.85 + (1.85 - 0.85) * control
+    bias = -0.1 + (0.32 + 0.1) * control
+    adjusted = np.clip(coverage * np.float32(gain) + np.float32(bias), 0.0, 1.0)
+    start = 0.44 + (0.18 - 0.44) * control
+    end = 0.82 + (0.68 - 0.82) * control
+    return _smoothstep(start, end, adjusted)
@@ -1,10 +1,94 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Tuple
+
 from OpenGL.GL import *
 import numpy as np
 
-from gl_utils.buffers import create_color_fbo, create_gbuffer
+from gl_utils.buffers import create_volume_texture
+from gl_utils.state import GLStateCache
+from rendering.atmosphere_luts import AtmosphereLuts
+from rendering.horizon_maps import HorizonMaps
+from rendering.cloud_noise import load_cloud_noise
+from rendering.compute_gbuffer import ComputeGBuffer
 from rendering.constants import PlanetParameters
+from rendering.passes import PassDescriptor, SamplerBinding, begin_pass
+from rendering.render_graph import RenderGraph, TargetSpec
+from rendering.scene import BodyView, CelestialBody, Scene, tile_scissor, visible_bodies
+from rendering.terrain import terrain_lipschitz
 from utils.time import compute_sun_direction
-from rendering.uniforms import set_float, set_int, set_mat3, set_vec2, set_vec3
+from utils.profiler import profiler
+
+
+# Floors for the reduced step budgets of distant bodies.
+MIN_PLANET_STEPS = 32
+MIN_CLOUD_STEPS = 8
+
+
+@dataclass
+class _BodyFrame:
+    """Uniform inputs for drawing one body: the camera is moved into the
+    body's frame so every shader keeps treating its planet as the origin."""
+
+    parameters: PlanetParameters
+    cam_pos: np.ndarray
+    planet_to_world: np.ndarray
+    world_to_planet: np.ndarray
+    # Name of the body; keys its pass signatures and target contents.
+    body: str = None
+    # Only filled in while motion vectors are rendered.
+    previous_cam_pos: np.ndarray = None
+    previous_planet_to_world: np.ndarray = None
+
+
+@dataclass
+class _CameraState:
+    """What the velocity pass needs from the previous frame."""
+
+    cam_pos: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.float32))
+    forward: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.float32))
+    right: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.float32))
+    up: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.float32))
+    tan_half_fov: float = 0.0
+    planet_to_world: np.ndarray = None
+
+    def load(self, cam_pos, forward, right, up, tan_half_fov: float, planet_to_world: np.ndarray):
+        self.cam_pos[...] = cam_pos
+        self.forward[...] = forward
+        self.right[...] = right
+        self.up[...] = up
+        self.tan_half_fov = float(tan_half_fov)
+        self.planet_to_world = planet_to_world
+        return self
+
+
+@lru_cache(maxsize=16)
+def _tilt_matrices(tilt_degrees: float) -> Tuple[np.ndarray, np.ndarray]:
+    """planet_to_world and world_to_planet for a tilt.
+
+    Cached, since tilts only change from the UI, and read-only because the
+    same arrays are handed out every frame. An unchanged tilt therefore
+    yields the identical objects.
+    """
+
+    tilt_rad = np.deg2rad(tilt_degrees)
+    planet_to_world = np.array(
+        [[1.0, 0.0, 0.0], [0.0, np.cos(tilt_rad), -np.sin(tilt_rad)], [0.0, np.sin(tilt_rad), np.cos(tilt_rad)]],
+        dtype=np.float32,
+    )
+    world_to_planet = np.ascontiguousarray(planet_to_world.T)
+    planet_to_world.setflags(write=False)
+    world_to_planet.setflags(write=False)
+    return planet_to_world, world_to_planet
+
+
+def _rects_overlap(a, b) -> bool:
+    """Whether two scissor rectangles share a pixel; anything but a
+    rectangle means the whole framebuffer."""
+
+    if not isinstance(a, tuple) or not isinstance(b, tuple):
+        return True
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
 
 
 class PlanetRenderer:
@@ -17,6 +101,12 @@ class PlanetRenderer:
         composite_program,
         surface_info_program,
         parameters: PlanetParameters,
+        impostor_program=None,
+        scene: Scene = None,
+        gbuffer_compute_programs=None,
+        atmosphere_lut_programs=None,
+        horizon_map_programs=None,
+        velocity_program=None,
     ):
         self.gbuffer_program = gbuffer_program
         self.lighting_program = lighting_program
@@ -24,23 +114,130 @@ class PlanetRenderer:
         self.cloud_program = cloud_program
         self.composite_program = composite_program
         self.surface_info_program = surface_info_program
+        self.impostor_program = impostor_program
+        # Optional pass writing screen-space motion for temporal resolves;
+        # it only runs for renders that ask for motion vectors.
+        self.velocity_program = velocity_program
+        self.motion_vectors = False
+        self._previous_camera = None
+        # Two camera states, alternating between current and previous.
+        self._camera_states = (_CameraState(), _CameraState())
+        # Optional compute path for the G-buffer pass, keyed by stage name;
+        # use_compute_gbuffer switches to it.
+        self.compute_gbuffer = ComputeGBuffer(gbuffer_compute_programs) if gbuffer_compute_programs else None
+        self.use_compute_gbuffer = False
         self.parameters = parameters
-        self.gbuffer = None
-        self.lighting_buffer = None
-        self.atmosphere_buffer = None
-        self.cloud_buffer = None
+        self.scene = scene if scene is not None else Scene([CelestialBody("Planet", parameters)])
+        self.scene.primary.parameters = parameters
+        self.body_views = []
         self.surface_info_buffer = None
         self.cam_pos = None
         self.cam_forward = None
         self.cam_right = None
         self.cam_up = None
         self.tan_half_fov = np.tan(np.deg2rad(70.0) * 0.5)
+        self.output_fbo = 0
+        self.pixel_offset = (0.0, 0.0)
+        self.full_size = None
         self.spin_angle_deg = 0.0
         self.seasonal_tilt_deg = 0.0
-        self.planet_to_world = np.identity(3, dtype=np.float32)
-        self.world_to_planet = np.identity(3, dtype=np.float32)
+        self.planet_to_world, self.world_to_planet = _tilt_matrices(0.0)
         self.time_seconds = 0.0
+        self.noise_seed = 0.0
         self.sun_direction = np.array(parameters.sun_direction, dtype=np.float32)
+        # Per-body frames and stretched parameters, reused every frame.
+        self._body_frames = {}
+        self._body_parameters = {}
+        self.state = GLStateCache()
+        self.passes = self._build_passes()
+        self.cloud_noise_texture = create_volume_texture(load_cloud_noise())
+        # Compiled from shaders/atmosphere_luts.comp when not given.
+        self.atmosphere_luts = AtmosphereLuts(atmosphere_lut_programs)
+        # Compiled from shaders/horizon_maps.comp when not given.
+        self.horizon_maps = HorizonMaps(horizon_map_programs)
+        targets = [
+            TargetSpec("gbuffer", (GL_RGBA16F, GL_RGBA16F, GL_RGBA16F, GL_RGBA32F)),
+            TargetSpec("lighting", (GL_RGBA16F,)),
+            TargetSpec("atmosphere", (GL_RGBA16F,)),
+            TargetSpec("clouds", (GL_RGBA16F,)),
+        ]
+        if velocity_program is not None:
+            # Read after render() returns, so it must not be aliased.
+            targets.append(TargetSpec("velocity", (GL_RG16F,), persistent=True))
+        self.graph = RenderGraph(
+            [descriptor for name, descriptor in self.passes.items() if name != "impostor"], targets
+        )
+        self._pass_uniforms = {
+            "gbuffer": self._set_gbuffer_uniforms,
+            "lighting": self._set_lighting_uniforms,
+            "atmosphere": self._set_atmosphere_uniforms,
+            "clouds": self._set_cloud_uniforms,
+            "composite": self._set_composite_uniforms,
+            "velocity": self._set_velocity_uniforms,
+        }
+        # Dirty tracking, per body: each body's part of an offscreen target
+        # has a content version that bumps whenever one of its passes writes
+        # it, and each of its passes remembers the inputs of its last draw. A
+        # pass whose inputs match is skipped, unless another body or an
+        # aliased target has since drawn over its rectangle of the framebuffer.
+        self._target_versions = {}
+        self._slot_contents = {}
+        self._pass_signatures = {}
+        self.pass_runs = {name: 0 for name in self.passes}
+        self.pass_skips = {name: 0 for name in self.passes}
+        # Bodies are blended over space; keep the default framebuffer opaque.
+        glClearColor(0.0, 0.0, 0.0, 1.0)
+
+    def _build_passes(self):
+        position = SamplerBinding("gPositionHeight", ("gbuffer", 0))
+        normal = SamplerBinding("gNormalFlags", ("gbuffer", 1))
+        material = SamplerBinding("gMaterial", ("gbuffer", 2))
+        view_data = SamplerBinding("gViewData", ("gbuffer", 3))
+        # Every pass draws a fullscreen quad that writes all of its outputs and
+        # depth testing is off, so none of the targets need clearing.
+        passes = [
+            PassDescriptor("gbuffer", self.gbuffer_program, "gbuffer"),
+            PassDescriptor("lighting", self.lighting_program, "lighting", [position, normal, material, view_data]),
+            PassDescriptor("atmosphere", self.atmosphere_program, "atmosphere", [normal, view_data]),
+            PassDescriptor("clouds", self.cloud_program, "clouds", [position, normal, material, view_data]),
+            PassDescriptor(
+                "composite",
+                self.composite_program,
+                None,
+                [
+                    position,
+                    normal,
+                    material,
+                    view_data,
+                    SamplerBinding("lightingTex", ("lighting", 0)),
+                    SamplerBinding("atmosphereTex", ("atmosphere", 0)),
+                    SamplerBinding("cloudTex", ("clouds", 0)),
+                ],
+            ),
+        ]
+        if self.velocity_program is not None:
+            passes.append(PassDescriptor("velocity", self.velocity_program, "velocity", [normal, view_data]))
+        if self.impostor_program is not None:
+            passes.append(PassDescriptor("impostor", self.impostor_program, None))
+        for descriptor in passes:
+            descriptor.bake(self.state)
+        return {descriptor.name: descriptor for descriptor in passes}
+
+    def invalidate_passes(self):
+        """Force every pass to run on the next frame."""
+
+        self._pass_signatures.clear()
+        self._slot_contents.clear()
+
+    def reset_pass_counters(self):
+        for name in self.pass_runs:
+            self.pass_runs[name] = 0
+            self.pass_skips[name] = 0
+
+    def _resolve_pass_textures(self):
+        for descriptor in self.graph.order:
+            descriptor.resolve_textures(self.graph.texture)
+        self.invalidate_passes()
 
     def _ensure_surface_info_buffer(self):
         if self.surface_info_buffer is not None:
@@ -68,65 +265,50 @@ class PlanetRenderer:
 
     def _update_rotation_matrices(self) -> None:
         self.seasonal_tilt_deg = self.parameters.tilt_degrees
-        tilt_rad = np.deg2rad(self.seasonal_tilt_deg)
-        tilt_matrix = np.array(
-            [[1.0, 0.0, 0.0], [0.0, np.cos(tilt_rad), -np.sin(tilt_rad)], [0.0, np.sin(tilt_rad), np.cos(tilt_rad)]],
-            dtype=np.float32,
-        )
-        self.planet_to_world = tilt_matrix
-        self.world_to_planet = self.planet_to_world.T
+        self.planet_to_world, self.world_to_planet = _tilt_matrices(self.seasonal_tilt_deg)
 
     def _update_sun_direction(self, day_fraction: float, year_fraction: float) -> None:
-        self.sun_direction = compute_sun_direction(day_fraction, year_fraction, self.parameters.tilt_degrees)
-
-    def _ensure_gbuffer(self, width, height):
-        if self.gbuffer and self.gbuffer["width"] == width and self.gbuffer["height"] == height:
-            return
-
-        self.gbuffer = create_gbuffer(width, height)
-
-    def _ensure_color_targets(self, width, height):
-        needs_resize = (
-            not self.lighting_buffer
-            or self.lighting_buffer["width"] != width
-            or self.lighting_buffer["height"] != height
-        )
-        if not needs_resize:
-            return
-
-        self.lighting_buffer = create_color_fbo(width, height)
-        self.atmosphere_buffer = create_color_fbo(width, height)
-        self.cloud_buffer = create_color_fbo(width, height)
-
-    def _bind_common_uniforms(self, program, width, height):
-        set_vec3(program, "camPos", self.cam_pos)
-        set_vec3(program, "camForward", self.cam_forward)
-        set_vec3(program, "camRight", self.cam_right)
-        set_vec3(program, "camUp", self.cam_up)
-        set_vec3(program, "sunDir", self.sun_direction)
-        set_float(program, "sunPower", self.parameters.sun_power)
-        set_float(program, "planetRadius", self.parameters.planet_radius)
-        set_float(program, "atmosphereRadius", self.parameters.atmosphere_radius)
-        set_float(program, "heightScale", self.parameters.height_scale)
-        set_float(program, "maxRayDistance", self.parameters.max_ray_distance)
-        set_float(program, "seaLevel", self.parameters.sea_level)
-        set_float(program, "cloudBaseAltitude", self.parameters.cloud_base_altitude)
-        set_float(program, "cloudLayerThickness", self.parameters.cloud_layer_thickness)
-        set_float(program, "cloudCoverage", self.parameters.cloud_coverage)
-        set_float(program, "cloudDensity", self.parameters.cloud_density)
-        set_float(program, "cloudDrawDistance", self.parameters.cloud_draw_distance)
-        set_float(program, "cloudAnimationSpeed", self.parameters.cloud_animation_speed)
-        set_vec3(program, "cloudLightColor", self.parameters.cloud_light_color)
-        set_vec2(program, "resolution", (width, height))
-        set_float(program, "aspect", float(width) / float(height))
-        set_float(program, "tanHalfFov", self.tan_half_fov)
-        set_float(program, "timeSeconds", self.time_seconds)
-
-        set_vec3(program, "waterColor", self.parameters.water_color)
-        set_float(program, "waterAbsorption", self.parameters.water_absorption)
-        set_float(program, "waterScattering", self.parameters.water_scattering)
-        set_mat3(program, "planetToWorld", self.planet_to_world)
-        set_mat3(program, "worldToPlanet", self.world_to_planet)
+        compute_sun_direction(day_fraction, year_fraction, self.parameters.tilt_degrees, out=self.sun_direction)
+
+    def _ensure_targets(self, width, height):
+        if self.graph.allocate(width, height):
+            self._resolve_pass_textures()
+
+    def _bind_common_uniforms(self, program, width, height, frame: _BodyFrame):
+        state = self.state
+        parameters = frame.parameters
+        state.set_vec3(program, "camPos", frame.cam_pos)
+        state.set_vec3(program, "camForward", self.cam_forward)
+        state.set_vec3(program, "camRight", self.cam_right)
+        state.set_vec3(program, "camUp", self.cam_up)
+        state.set_vec3(program, "sunDir", self.sun_direction)
+        state.set_float(program, "sunPower", parameters.sun_power)
+        state.set_float(program, "planetRadius", parameters.planet_radius)
+        state.set_float(program, "atmosphereRadius", parameters.atmosphere_radius)
+        state.set_float(program, "heightScale", parameters.height_scale)
+        state.set_float(program, "maxRayDistance", parameters.max_ray_distance)
+        state.set_float(program, "seaLevel", parameters.sea_level)
+        state.set_float(program, "cloudBaseAltitude", parameters.cloud_base_altitude)
+        state.set_float(program, "cloudLayerThickness", parameters.cloud_layer_thickness)
+        state.set_float(program, "cloudCoverage", parameters.cloud_coverage)
+        state.set_float(program, "cloudDensity", parameters.cloud_density)
+        state.set_float(program, "cloudDrawDistance", parameters.cloud_draw_distance)
+        state.set_float(program, "cloudAnimationSpeed", parameters.cloud_animation_speed)
+        state.set_vec3(program, "cloudLightColor", parameters.cloud_light_color)
+        full_width, full_height = self.full_size
+        state.set_vec2(program, "resolution", (width, height))
+        state.set_vec2(program, "pixelOffset", self.pixel_offset)
+        state.set_vec2(program, "fullResolution", self.full_size)
+        state.set_float(program, "aspect", float(full_width) / float(full_height))
+        state.set_float(program, "tanHalfFov", self.tan_half_fov)
+        state.set_float(program, "timeSeconds", self.time_seconds)
+        state.set_float(program, "noiseSeed", self.noise_seed)
+
+        state.set_vec3(program, "waterColor", parameters.water_color)
+        state.set_float(program, "waterAbsorption", parameters.water_absorption)
+        state.set_float(program, "waterScattering", parameters.water_scattering)
+        state.set_mat3(program, "planetToWorld", frame.planet_to_world)
+        state.set_mat3(program, "worldToPlanet", frame.world_to_planet)
 
     def prepare_frame_state(self, calendar_state):
         self.time_seconds = calendar_state.elapsed_seconds
@@ -135,21 +317,31 @@ class PlanetRenderer:
 
     def update_parameters(self, parameters: PlanetParameters):
         self.parameters = parameters
+        self.scene.primary.parameters = parameters
         self.sun_direction = np.array(parameters.sun_direction, dtype=np.float32)
 
     def query_surface_info(self, query_pos, min_altitude_offset=0.0):
+        # Each query is a dispatch plus a blocking readback, so it shows up
+        # as its own phase in the profiler.
+        with profiler.span("query_surface_info"):
+            return self._dispatch_surface_query(query_pos, min_altitude_offset)
+
+    def _dispatch_surface_query(self, query_pos, min_altitude_offset):
         if self.surface_info_program is None:
             return None
 
         self._ensure_surface_info_buffer()
 
-        glUseProgram(self.surface_info_program)
-        set_vec3(self.surface_info_program, "queryPosition", query_pos)
-        set_float(self.surface_info_program, "planetRadius", self.parameters.planet_radius)
-        set_float(self.surface_info_program, "heightScale", self.parameters.height_scale)
-        set_float(self.surface_info_program, "seaLevel", self.parameters.sea_level)
-        set_mat3(self.surface_info_program, "worldToPlanet", self.world_to_planet)
-        set_float(self.surface_info_program, "minAltitudeOffset", float(min_altitude_offset))
+        program = self.surface_info_program
+        state = self.state
+        state.reset_bindings()
+        state.use_program(program)
+        state.set_vec3(program, "queryPosition", query_pos)
+        state.set_float(program, "planetRadius", self.parameters.planet_radius)
+        state.set_float(program, "heightScale", self.parameters.height_scale)
+        state.set_float(program, "seaLevel", self.parameters.sea_level)
+        state.set_mat3(program, "worldToPlanet", self.world_to_planet)
+        state.set_float(program, "minAltitudeOffset", float(min_altitude_offset))
 
         glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, self.surface_info_buffer)
         glDispatchCompute(1, 1, 1)
@@ -174,145 +366,364 @@ class PlanetRenderer:
             "clamped_radius": clamped_radius,
         }
 
-    def render(self, cam_pos, cam_front, cam_right, cam_up, cam_fov_degrees, width, height, debug_level, calendar_state):
+    def _begin_pass(self, descriptor: PassDescriptor, width, height, frame: _BodyFrame):
+        begin_pass(self.state, descriptor, self.graph.framebuffer(descriptor, self.output_fbo), width, height)
+        self._bind_common_uniforms(descriptor.program, width, height, frame)
+        return descriptor.program
+
+    def _draw_pass(self, descriptor: PassDescriptor, width, height, frame: _BodyFrame, draw=None, programs=None):
+        """Draw a pass whose uniforms are bound, unless its output is still valid.
+
+        Signatures are kept per body and pass. One covers the values of the
+        program's uniforms, i.e. the body's frame (camera, matrices and
+        exactly the parameters the shader reads) along with time and sun,
+        the body's versions of the targets it samples, the scissor rectangle
+        and the viewport size. Values rather than uniform versions, because
+        bodies drawn one after another change the uniforms back and forth.
+        Passes into the output framebuffer always draw; it is cleared every
+        frame. A body's part of a target is only still valid if no other
+        body or aliased target was drawn over it since.
+
+        draw replaces the fullscreen draw, and programs the descriptor's
+        program in the signature, for passes that run other programs.
+        """
+
+        state = self.state
+        name = descriptor.name
+        if descriptor.target is not None:
+            target = descriptor.target
+            body = frame.body
+            target_versions = self._target_versions
+            slot = self.graph.slots[target]
+            scissor = state.current_scissor
+            signature = (
+                tuple(state.uniform_values(program) for program in programs or (descriptor.program,)),
+                tuple(target_versions.get((body, source), 0) for source in descriptor.inputs),
+                scissor,
+                width,
+                height,
+            )
+            version = target_versions.get((body, target), 0)
+            contents = self._slot_contents.get(slot, {}).get(body)
+            if (
+                self._pass_signatures.get((body, name)) == signature
+                and contents is not None
+                and contents[0] == (target, version)
+            ):
+                self.pass_skips[name] += 1
+                return
+            self._pass_signatures[(body, name)] = signature
+            target_versions[(body, target)] = version + 1
+            self._record_write(slot, body, (target, version + 1), scissor)
+        if draw is None:
+            state.draw_fullscreen()
+        else:
+            draw()
+        self.pass_runs[name] += 1
+
+    def _record_write(self, slot, body, produced, scissor):
+        """Note that body's rectangle of a framebuffer now holds produced,
+        a (target, version) pair, and that no other body's part it covers
+        is still there."""
+
+        contents = self._slot_contents.setdefault(slot, {})
+        for other, (_, rect) in list(contents.items()):
+            if other != body and _rects_overlap(rect, scissor):
+                del contents[other]
+        contents[body] = (produced, scissor)
+
+    def _stretched_parameters(self, body: CelestialBody) -> PlanetParameters:
+        """This frame's copy of a body's parameters, which may be changed."""
+
+        parameters = self._body_parameters.get(body.name)
+        if parameters is None:
+            parameters = self._body_parameters[body.name] = body.parameters.copy()
+            return parameters
+        return parameters.copy_from(body.parameters)
+
+    def _body_frame(self, view: BodyView) -> _BodyFrame:
+        """The body's frame for this render; the same object every frame."""
+
+        body = view.body
+        if body is self.scene.primary:
+            parameters = body.parameters
+            planet_to_world = self.planet_to_world
+            world_to_planet = self.world_to_planet
+        else:
+            # Other bodies are drawn from farther away than their own ray and
+            # cloud distances were tuned for, so stretch both to reach them.
+            parameters = self._stretched_parameters(body)
+            reach = view.distance + parameters.atmosphere_radius
+            parameters.max_ray_distance = max(parameters.max_ray_distance, reach)
+            parameters.cloud_draw_distance = max(parameters.cloud_draw_distance, reach)
+            planet_to_world, world_to_planet = _tilt_matrices(parameters.tilt_degrees)
+
+        if view.budget_scale < 1.0:
+            if parameters is body.parameters:
+                parameters = self._stretched_parameters(body)
+            parameters.planet_max_steps = max(
+                MIN_PLANET_STEPS, int(parameters.planet_max_steps * view.budget_scale)
+            )
+            parameters.cloud_max_steps = max(MIN_CLOUD_STEPS, int(parameters.cloud_max_steps * view.budget_scale))
+
+        frame = self._body_frames.get(body.name)
+        if frame is None:
+            frame = self._body_frames[body.name] = _BodyFrame(
+                parameters,
+                np.zeros(3, dtype=np.float32),
+                planet_to_world,
+                world_to_planet,
+                body.name,
+                previous_cam_pos=np.zeros(3, dtype=np.float32),
+            )
+        frame.parameters = parameters
+        frame.planet_to_world = planet_to_world
+        frame.world_to_planet = world_to_planet
+        np.subtract(self.cam_pos, body.position, out=frame.cam_pos, casting="unsafe")
+        if self.motion_vectors:
+            previous = self._previous_camera
+            np.subtract(previous.cam_pos, body.position, out=frame.previous_cam_pos, casting="unsafe")
+            # Only the primary body's orientation follows the simulation.
+            frame.previous_planet_to_world = previous.planet_to_world if body is self.scene.primary else planet_to_world
+        return frame
+
+    def reset_motion(self):
+        """Forget the previous camera, so the next velocities are all zero."""
+
+        self._previous_camera = None
+
+    def render(
+        self,
+        cam_pos,
+        cam_front,
+        cam_right,
+        cam_up,
+        cam_fov_degrees,
+        width,
+        height,
+        debug_level,
+        calendar_state,
+        output_fbo=0,
+        pixel_offset=(0.0, 0.0),
+        full_size=None,
+        noise_seed=None,
+        motion_vectors=False,
+    ):
+        """Render the scene into output_fbo.
+
+        For tiled rendering the viewport is a width x height window of a
+        full_size image whose bottom-left corner sits at pixel_offset; the
+        offset may carry a sub-pixel jitter. noise_seed overrides the march
+        jitter seed, which otherwise follows the simulation time.
+
+        With motion_vectors the velocity target is filled as well, relative
+        to the camera of the last render that also asked for them.
+        """
+
+        self.output_fbo = output_fbo
+        self.pixel_offset = (float(pixel_offset[0]), float(pixel_offset[1]))
+        self.full_size = (width, height) if full_size is None else tuple(full_size)
+        full_width, full_height = self.full_size
         self.cam_pos = cam_pos
         self.cam_forward = cam_front
         self.cam_right = cam_right
         self.cam_up = cam_up
         self.tan_half_fov = np.tan(np.deg2rad(cam_fov_degrees) * 0.5)
         self.time_seconds = calendar_state.elapsed_seconds
+        self.noise_seed = self.time_seconds if noise_seed is None else float(noise_seed)
         self._update_rotation_matrices()
         self._update_sun_direction(calendar_state.day_fraction, calendar_state.year_fraction)
-        self._ensure_gbuffer(width, height)
-        self._ensure_color_targets(width, height)
-
-        # Pass 1: populate G-buffer
-        glBindFramebuffer(GL_FRAMEBUFFER, self.gbuffer["fbo"])
-        glViewport(0, 0, width, height)
-        glClearColor(0.0, 0.0, 0.0, 1.0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-        glUseProgram(self.gbuffer_program)
-        self._bind_common_uniforms(self.gbuffer_program, width, height)
-        set_int(self.gbuffer_program, "planetMaxSteps", self.parameters.planet_max_steps)
-        set_float(self.gbuffer_program, "planetStepScale", self.parameters.planet_step_scale)
-        set_float(self.gbuffer_program, "planetMinStepFactor", self.parameters.planet_min_step_factor)
-
-        glDrawArrays(GL_TRIANGLES, 0, 6)
-
-        # Pass 2: lighting
-        glBindFramebuffer(GL_FRAMEBUFFER, self.lighting_buffer["fbo"])
-        glViewport(0, 0, width, height)
-        glClear(GL_COLOR_BUFFER_BIT)
-
-        glUseProgram(self.lighting_program)
-        self._bind_common_uniforms(self.lighting_program, width, height)
-
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["position"])
-        set_int(self.lighting_program, "gPositionHeight", 0)
-
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["normal"])
-        set_int(self.lighting_program, "gNormalFlags", 1)
-
-        glActiveTexture(GL_TEXTURE2)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["material"])
-        set_int(self.lighting_program, "gMaterial", 2)
-
-        glActiveTexture(GL_TEXTURE3)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["view_data"])
-        set_int(self.lighting_program, "gViewData", 3)
-
-        glDrawArrays(GL_TRIANGLES, 0, 6)
-
-        # Pass 3: atmosphere
-        glBindFramebuffer(GL_FRAMEBUFFER, self.atmosphere_buffer["fbo"])
-        glViewport(0, 0, width, height)
-        glClear(GL_COLOR_BUFFER_BIT)
-
-        glUseProgram(self.atmosphere_program)
-        self._bind_common_uniforms(self.atmosphere_program, width, height)
-
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["position"])
-        set_int(self.atmosphere_program, "gPositionHeight", 0)
-
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["normal"])
-        set_int(self.atmosphere_program, "gNormalFlags", 1)
-
-        glActiveTexture(GL_TEXTURE2)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["view_data"])
-        set_int(self.atmosphere_program, "gViewData", 2)
-
-        glDrawArrays(GL_TRIANGLES, 0, 6)
-
-        # Pass 4: volumetric clouds
-        glBindFramebuffer(GL_FRAMEBUFFER, self.cloud_buffer["fbo"])
-        glViewport(0, 0, width, height)
-        glClear(GL_COLOR_BUFFER_BIT)
-
-        glUseProgram(self.cloud_program)
-        self._bind_common_uniforms(self.cloud_program, width, height)
-        set_int(self.cloud_program, "cloudMaxSteps", self.parameters.cloud_max_steps)
-        set_float(self.cloud_program, "cloudExtinction", self.parameters.cloud_extinction)
-        set_float(self.cloud_program, "cloudPhaseExponent", self.parameters.cloud_phase_exponent)
-
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["position"])
-        set_int(self.cloud_program, "gPositionHeight", 0)
-
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["normal"])
-        set_int(self.cloud_program, "gNormalFlags", 1)
-
-        glActiveTexture(GL_TEXTURE2)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["material"])
-        set_int(self.cloud_program, "gMaterial", 2)
-
-        glActiveTexture(GL_TEXTURE3)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["view_data"])
-        set_int(self.cloud_program, "gViewData", 3)
-
-        glDrawArrays(GL_TRIANGLES, 0, 6)
-
-        # Pass 5: composite and debug layers
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
-        glViewport(0, 0, width, height)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-
-        glUseProgram(self.composite_program)
-        self._bind_common_uniforms(self.composite_program, width, height)
-
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["position"])
-        set_int(self.composite_program, "gPositionHeight", 0)
-
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["normal"])
-        set_int(self.composite_program, "gNormalFlags", 1)
-
-        glActiveTexture(GL_TEXTURE2)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["material"])
-        set_int(self.composite_program, "gMaterial", 2)
-
-        glActiveTexture(GL_TEXTURE3)
-        glBindTexture(GL_TEXTURE_2D, self.lighting_buffer["textures"][0])
-        set_int(self.composite_program, "lightingTex", 3)
-
-        glActiveTexture(GL_TEXTURE4)
-        glBindTexture(GL_TEXTURE_2D, self.atmosphere_buffer["textures"][0])
-        set_int(self.composite_program, "atmosphereTex", 4)
-
-        glActiveTexture(GL_TEXTURE5)
-        glBindTexture(GL_TEXTURE_2D, self.cloud_buffer["textures"][0])
-        set_int(self.composite_program, "cloudTex", 5)
-
-        glActiveTexture(GL_TEXTURE6)
-        glBindTexture(GL_TEXTURE_2D, self.gbuffer["view_data"])
-        set_int(self.composite_program, "gViewData", 6)
+        self._ensure_targets(width, height)
+        self.motion_vectors = motion_vectors and self.velocity_program is not None
+        if self.motion_vectors:
+            first, second = self._camera_states
+            camera = second if self._previous_camera is first else first
+            camera.load(cam_pos, cam_front, cam_right, cam_up, self.tan_half_fov, self.planet_to_world)
+            if self._previous_camera is None:
+                self._previous_camera = camera
+
+        state = self.state
+        state.reset_bindings()
+
+        with profiler.span("scene.cull"):
+            self.body_views = visible_bodies(
+                self.scene,
+                cam_pos,
+                cam_front,
+                cam_right,
+                cam_up,
+                self.tan_half_fov,
+                full_width,
+                full_height,
+                out=self.body_views,
+            )
+
+        # Bodies are composited far to near over empty space, each limited to
+        # the screen rectangle its bounding sphere covers.
+        state.bind_framebuffer(output_fbo)
+        state.viewport(0, 0, width, height)
+        state.scissor(None)
+        state.clear(GL_COLOR_BUFFER_BIT)
+        if self.motion_vectors:
+            self._render_sky_velocity(width, height)
+        tiled = self.full_size != (width, height) or self.pixel_offset != (0.0, 0.0)
+        for view in self.body_views:
+            scissor = tile_scissor(view.scissor, self.pixel_offset, width, height) if tiled else view.scissor
+            if scissor is None:
+                continue
+            frame = self._body_frame(view)
+            state.scissor(scissor)
+            with profiler.span(f"body.{view.body.name}"):
+                if view.impostor and self.impostor_program is not None:
+                    self._render_impostor(frame, width, height)
+                else:
+                    self._render_body(frame, width, height, debug_level)
+        state.scissor(None)
+        state.premultiplied_blend(False)
+        if self.motion_vectors:
+            self._previous_camera = camera
+            self.motion_vectors = False
+
+    def _render_impostor(self, frame: _BodyFrame, width, height):
+        state = self.state
+        parameters = frame.parameters
+        state.premultiplied_blend(True)
+        program = self._begin_pass(self.passes["impostor"], width, height, frame)
+        height_scale = max(abs(parameters.height_scale), 1e-3)
+        state.set_float(program, "oceanFraction", np.clip(0.5 + parameters.sea_level / height_scale, 0.0, 1.0))
+        self._draw_pass(self.passes["impostor"], width, height, frame)
+
+    def _set_gbuffer_uniforms(self, program, frame: _BodyFrame, debug_level):
+        parameters = frame.parameters
+        self.state.set_int(program, "planetMaxSteps", parameters.planet_max_steps)
+        self.state.set_float(program, "planetStepScale", parameters.planet_step_scale)
+        self.state.set_float(program, "planetMinStepFactor", parameters.planet_min_step_factor)
+        self.state.set_float(
+            program, "terrainLipschitz", terrain_lipschitz(parameters.planet_radius, parameters.height_scale)
+        )
 
-        set_int(self.composite_program, "debugLevel", debug_level)
+    def _set_lighting_uniforms(self, program, frame: _BodyFrame, debug_level):
+        # The horizon maps take the units after the pass's render-target
+        # samplers. Building them runs compute programs, so the pass program
+        # is bound again afterwards. They follow the terrain parameters, which
+        # the G-buffer pass reads, so the G-buffer input of this pass changes
+        # whenever the maps do and dirty skipping stays correct.
+        state = self.state
+        unit = len(self.passes["lighting"].samplers)
+        first, second = self.horizon_maps.horizon_maps(state, frame.parameters, unit)
+        state.use_program(program)
+        state.set_int(program, "horizonMapA", unit)
+        state.set_int(program, "horizonMapB", unit + 1)
+        state.bind_texture(unit, first, GL_TEXTURE_CUBE_MAP)
+        state.bind_texture(unit + 1, second, GL_TEXTURE_CUBE_MAP)
+
+    def _set_cloud_uniforms(self, program, frame: _BodyFrame, debug_level):
+        parameters = frame.parameters
+        self.state.set_int(program, "cloudMaxSteps", parameters.cloud_max_steps)
+        self.state.set_float(program, "cloudExtinction", parameters.cloud_extinction)
+        self.state.set_float(program, "cloudPhaseExponent", parameters.cloud_phase_exponent)
+        # The noise volume takes the unit after the pass's render-target samplers.
+        unit = len(self.passes["clouds"].samplers)
+        self.state.set_int(program, "cloudNoise", unit)
+        self.state.bind_texture(unit, self.cloud_noise_texture, GL_TEXTURE_3D)
+
+    def _set_atmosphere_uniforms(self, program, frame: _BodyFrame, debug_level):
+        # The lookup tables take the units after the pass's render-target
+        # samplers. Refreshing the sky view runs a compute program, so the
+        # pass program is bound again afterwards; everything the sky view
+        # reads is also a uniform of the pass, which keeps dirty skipping
+        # correct.
+        state = self.state
+        unit = len(self.passes["atmosphere"].samplers)
+        transmittance, sky_view = self.atmosphere_luts.update_sky_view(
+            state, frame.parameters, frame.cam_pos, self.sun_direction, frame.world_to_planet, unit
+        )
+        state.use_program(program)
+        state.set_int(program, "transmittanceLut", unit)
+        state.set_int(program, "skyViewLut", unit + 1)
+        state.bind_texture(unit, transmittance)
+        state.bind_texture(unit + 1, sky_view)
+
+    def _set_composite_uniforms(self, program, frame: _BodyFrame, debug_level):
+        self.state.set_int(program, "debugLevel", debug_level)
+
+    def _set_previous_camera_uniforms(self, program):
+        state = self.state
+        previous = self._previous_camera
+        state.set_vec3(program, "previousCamForward", previous.forward)
+        state.set_vec3(program, "previousCamRight", previous.right)
+        state.set_vec3(program, "previousCamUp", previous.up)
+        state.set_float(program, "previousTanHalfFov", previous.tan_half_fov)
+
+    def _set_velocity_uniforms(self, program, frame: _BodyFrame, debug_level):
+        state = self.state
+        self._set_previous_camera_uniforms(program)
+        state.set_vec3(program, "previousCamPos", frame.previous_cam_pos)
+        state.set_mat3(program, "previousPlanetToWorld", frame.previous_planet_to_world)
+        state.set_int(program, "skyOnly", 0)
+
+    def _render_sky_velocity(self, width, height):
+        """Velocities of directions at infinity over the whole target.
+
+        Bodies overwrite their own rectangles afterwards; this covers the
+        space between them, which no body pass touches.
+        """
+
+        state = self.state
+        descriptor = self.passes["velocity"]
+        program = descriptor.program
+        state.premultiplied_blend(False)
+        begin_pass(state, descriptor, self.graph.framebuffer(descriptor, self.output_fbo), width, height)
+        state.set_vec3(program, "camForward", self.cam_forward)
+        state.set_vec3(program, "camRight", self.cam_right)
+        state.set_vec3(program, "camUp", self.cam_up)
+        state.set_vec2(program, "pixelOffset", self.pixel_offset)
+        state.set_vec2(program, "fullResolution", self.full_size)
+        state.set_float(program, "aspect", float(self.full_size[0]) / float(self.full_size[1]))
+        state.set_float(program, "tanHalfFov", self.tan_half_fov)
+        self._set_previous_camera_uniforms(program)
+        state.set_int(program, "skyOnly", 1)
+        state.draw_fullscreen()
+        # The body passes must draw over this even if their inputs are unchanged.
+        self._record_write(self.graph.slots["velocity"], None, ("velocity", None), None)
+
+    def _render_compute_gbuffer(self, descriptor: PassDescriptor, width, height, frame: _BodyFrame, debug_level):
+        compute = self.compute_gbuffer
+        state = self.state
+        rect = state.current_scissor
+        if not isinstance(rect, tuple):
+            rect = (0, 0, width, height)
+        for program in compute.program_list:
+            state.use_program(program)
+            self._bind_common_uniforms(program, width, height, frame)
+            self._set_gbuffer_uniforms(program, frame, debug_level)
+            state.set_ivec4(program, "pixelRect", rect)
+        textures = self.graph.target(descriptor.target)["textures"]
+        self._draw_pass(
+            descriptor,
+            width,
+            height,
+            frame,
+            draw=lambda: compute.dispatch(state, rect, frame.parameters.planet_max_steps, textures),
+            programs=compute.program_list,
+        )
 
-        glDrawArrays(GL_TRIANGLES, 0, 6)
+    def _render_pass(self, descriptor: PassDescriptor, width, height, frame: _BodyFrame, debug_level):
+        if descriptor.name == "gbuffer" and self.use_compute_gbuffer and self.compute_gbuffer is not None:
+            self._render_compute_gbuffer(descriptor, width, height, frame, debug_level)
+            return
+        self.state.premultiplied_blend(descriptor.target is None)
+        program = self._begin_pass(descriptor, width, height, frame)
+        set_uniforms = self._pass_uniforms.get(descriptor.name)
+        if set_uniforms is not None:
+            set_uniforms(program, frame, debug_level)
+        self._draw_pass(descriptor, width, height, frame)
+
+    def _render_body(self, frame: _BodyFrame, width, height, debug_level):
+        # Offscreen passes overwrite their targets; the pass into the output
+        # framebuffer is blended over farther bodies.
+        for descriptor in self.graph.order:
+            if descriptor.name == "velocity" and not self.motion_vectors:
+                continue
+            with profiler.span(f"pass.{descriptor.name}"):
+                self._render_pass(descriptor, width, height, frame, debug_level)
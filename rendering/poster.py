@@ -0,0 +1,109 @@
+import math
+from pathlib import Path
+from typing import Callable, Optional
+
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.buffers import create_color_fbo, delete_color_fbo
+from utils.image_io import PngStreamWriter
+
+
+POSTER_TILE_SIZE = 1024
+
+
+def _radical_inverse(index: int, base: int) -> float:
+    result = 0.0
+    fraction = 1.0 / base
+    while index > 0:
+        result += (index % base) * fraction
+        index //= base
+        fraction /= base
+    return result
+
+
+def subpixel_offsets(samples: int) -> np.ndarray:
+    """Halton (2, 3) points in [-0.5, 0.5)^2; a single sample is the pixel centre."""
+
+    if samples <= 1:
+        return np.zeros((1, 2), dtype=np.float32)
+    return np.array(
+        [(_radical_inverse(i, 2) - 0.5, _radical_inverse(i, 3) - 0.5) for i in range(1, samples + 1)],
+        dtype=np.float32,
+    )
+
+
+def render_poster(
+    renderer,
+    cam_pos,
+    cam_front,
+    cam_right,
+    cam_up,
+    cam_fov_degrees,
+    calendar_state,
+    width: int,
+    height: int,
+    path: Path,
+    samples: int = 4,
+    tile_size: int = POSTER_TILE_SIZE,
+    debug_level: int = 9,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Path:
+    """Render a width x height still in tiles and stream it to a PNG.
+
+    Every tile is rendered at tile_size x tile_size through the renderer's
+    normal passes with a sub-frustum pixel offset, so GPU memory is the same
+    as for a tile_size window. Each pixel averages ``samples`` jittered
+    renders. Only one 8-bit band of tiles is held on the CPU before it is
+    compressed and written; bands are emitted top to bottom as PNG requires.
+    """
+
+    path = Path(path)
+    offsets = subpixel_offsets(samples)
+    target = create_color_fbo(tile_size, tile_size)
+    columns = math.ceil(width / tile_size)
+    rows = math.ceil(height / tile_size)
+    tile_pixels = np.empty((tile_size, tile_size, 4), dtype=np.float32)
+    accumulated = np.empty((tile_size, tile_size, 4), dtype=np.float32)
+    writer = PngStreamWriter(path, width, height)
+    try:
+        for row in range(rows):
+            # PNG rows run top-down while GL's origin is bottom-left.
+            band_top = row * tile_size
+            band_height = min(tile_size, height - band_top)
+            band_y = height - band_top - band_height
+            band = np.empty((band_height, width, 4), dtype=np.uint8)
+            for column in range(columns):
+                tile_x = column * tile_size
+                tile_width = min(tile_size, width - tile_x)
+                accumulated.fill(0.0)
+                for jitter in offsets:
+                    renderer.render(
+                        cam_pos,
+                        cam_front,
+                        cam_right,
+                        cam_up,
+                        cam_fov_degrees,
+                        tile_size,
+                        tile_size,
+                        debug_level,
+                        calendar_state,
+                        output_fbo=target["fbo"],
+                        pixel_offset=(tile_x + jitter[0], band_y + jitter[1]),
+                        full_size=(width, height),
+                    )
+                    glBindFramebuffer(GL_READ_FRAMEBUFFER, target["fbo"])
+                    glReadPixels(0, 0, tile_size, tile_size, GL_RGBA, GL_FLOAT, tile_pixels)
+                    # Clamp per sample, as the window's 8-bit framebuffer would.
+                    accumulated += np.clip(tile_pixels, 0.0, 1.0)
+                accumulated *= 255.0 / len(offsets)
+                band[:, tile_x:tile_x + tile_width] = np.rint(accumulated[:band_height, :tile_width])
+                if progress is not None:
+                    progress(row * columns + column + 1, rows * columns)
+            writer.write_rows(band[::-1])
+        writer.close()
+    finally:
+        writer.abort()
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        delete_color_fbo(target)
+    return path
@@ -0,0 +1,202 @@
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.buffers import create_color_fbo, delete_color_fbo
+from rendering.poster import subpixel_offsets
+
+
+PROGRESSIVE_MAX_SAMPLES = 64
+
+
+class ViewKey:
+    """A view or history key kept up to date in place.
+
+    update() takes the frame's values, arrays or numbers, and returns a
+    version that changes exactly when one of them does. Unlike a tuple built
+    every frame it allocates nothing that outlives the call.
+    """
+
+    def __init__(self, size: int):
+        self._values = [None] * size
+        self.version = 0
+
+    def update(self, *parts) -> int:
+        values = self._values
+        changed = False
+        index = 0
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                for value in part.tolist():
+                    if values[index] != value:
+                        values[index] = value
+                        changed = True
+                    index += 1
+            else:
+                if values[index] != part:
+                    values[index] = part
+                    changed = True
+                index += 1
+        if changed:
+            self.version += 1
+        return self.version
+
+
+class ProgressiveRenderer:
+    """Accumulates jittered frames while the view stays the same.
+
+    The first frame after any change is rendered straight to the window as
+    usual, or through temporal anti-aliasing when that is given and enabled,
+    whose history then stands in for the first few samples. Every following
+    frame with the same view key renders one more sample, with a new
+    sub-pixel offset and march noise seed, into a scratch target and blends
+    it into an RGBA32F history. Once max_samples are in,
+    no passes are issued at all and the history is only blitted to the
+    window.
+    """
+
+    def __init__(self, renderer, accumulate_program, max_samples: int = PROGRESSIVE_MAX_SAMPLES, temporal=None):
+        self.renderer = renderer
+        self.temporal = temporal
+        self.accumulate_program = accumulate_program
+        self.max_samples = max_samples
+        self.enabled = True
+        self.sample_count = 0
+        self._offsets = subpixel_offsets(max_samples)
+        self._view_key = None
+        self._history = None
+        self._frame = None
+        self._temporal_frame = False
+        self._frame_tex_loc = glGetUniformLocation(accumulate_program, "frameTex")
+
+    @property
+    def converged(self) -> bool:
+        return self.sample_count >= self.max_samples
+
+    def invalidate(self):
+        self._view_key = None
+        self.sample_count = 0
+
+    def set_max_samples(self, max_samples: int):
+        self.max_samples = max(1, max_samples)
+        self._offsets = subpixel_offsets(self.max_samples)
+
+    def _ensure_targets(self, width, height):
+        if self._history and self._history["width"] == width and self._history["height"] == height:
+            return
+        if self._history:
+            delete_color_fbo(self._history)
+            delete_color_fbo(self._frame)
+        self._history = create_color_fbo(width, height, internal_format=GL_RGBA32F)
+        self._frame = create_color_fbo(width, height)
+
+    def render(
+        self,
+        view_key,
+        cam_pos,
+        cam_front,
+        cam_right,
+        cam_up,
+        cam_fov_degrees,
+        width,
+        height,
+        debug_level,
+        calendar_state,
+        output_fbo=0,
+        history_key=None,
+    ):
+        """Render one frame to output_fbo, the default framebuffer unless given.
+
+        view_key must change whenever anything that affects the image does.
+        history_key is passed on to temporal anti-aliasing.
+        """
+
+        renderer = self.renderer
+        static = self.enabled and view_key == self._view_key
+        self._view_key = view_key
+        if not static:
+            self.sample_count = 0
+            temporal = self.temporal
+            self._temporal_frame = temporal is not None and temporal.enabled
+            if self._temporal_frame:
+                temporal.render(
+                    history_key,
+                    cam_pos,
+                    cam_front,
+                    cam_right,
+                    cam_up,
+                    cam_fov_degrees,
+                    width,
+                    height,
+                    debug_level,
+                    calendar_state,
+                    output_fbo=output_fbo,
+                )
+                return
+            renderer.render(
+                cam_pos,
+                cam_front,
+                cam_right,
+                cam_up,
+                cam_fov_degrees,
+                width,
+                height,
+                debug_level,
+                calendar_state,
+                output_fbo=output_fbo,
+            )
+            return
+
+        self._ensure_targets(width, height)
+        if self._temporal_frame:
+            self._temporal_frame = False
+            self._seed_from_temporal(width, height)
+        if not self.converged:
+            jitter = self._offsets[self.sample_count]
+            renderer.render(
+                cam_pos,
+                cam_front,
+                cam_right,
+                cam_up,
+                cam_fov_degrees,
+                width,
+                height,
+                debug_level,
+                calendar_state,
+                output_fbo=self._frame["fbo"],
+                pixel_offset=(float(jitter[0]), float(jitter[1])),
+                full_size=(width, height),
+                noise_seed=float(self.sample_count * 7 + 1),
+            )
+            self._accumulate(width, height)
+            self.sample_count += 1
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self._history["fbo"])
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, output_fbo)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def _seed_from_temporal(self, width, height):
+        samples = min(self.temporal.equivalent_samples, self.max_samples - 1)
+        if samples < 1:
+            return
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.temporal.output["fbo"])
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self._history["fbo"])
+        glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        self.sample_count = samples
+
+    def _accumulate(self, width, height):
+        glBindFramebuffer(GL_FRAMEBUFFER, self._history["fbo"])
+        glViewport(0, 0, width, height)
+        glUseProgram(self.accumulate_program)
+        glUniform1i(self._frame_tex_loc, 0)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self._frame["textures"][0])
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_CONSTANT_ALPHA, GL_ONE_MINUS_CONSTANT_ALPHA)
+        glBlendColor(0.0, 0.0, 0.0, 1.0 / (self.sample_count + 1))
+        glDrawArrays(GL_TRIANGLES, 0, 6)
+        glDisable(GL_BLEND)
+        glUseProgram(0)
+        # Bindings changed behind the renderer's state cache.
+        self.renderer.state.reset_bindings()
@@ -0,0 +1,418 @@
+import math
+
+import numpy as np
+
+
+# NumPy port of atmosphere_common.glsl, the table stages of
+# atmosphere_luts.comp and atmosphere.frag, for the reference renderer in
+# rendering/reference_renderer.py. Tables have the layout and sizes of
+# rendering/atmosphere_luts.py, indexed [row, column] with v along the rows,
+# and are sampled with the same texel-centre bilinear filter.
+
+TRANSMITTANCE_LUT_SIZE = (256, 64)
+MULTI_SCATTERING_LUT_SIZE = (32, 32)
+SKY_VIEW_LUT_SIZE = (192, 108)
+
+TRANSMITTANCE_STEPS = 40
+MULTI_SCATTERING_STEPS = 20
+MULTI_SCATTERING_DIRECTIONS = 8
+SKY_VIEW_STEPS = 32
+
+EARTH_ATMOSPHERE_THICKNESS = 60.0
+RAYLEIGH_SCATTERING = np.array([5.802e-3, 13.558e-3, 33.1e-3])
+RAYLEIGH_SCALE_HEIGHT = 8.0 / EARTH_ATMOSPHERE_THICKNESS
+MIE_SCATTERING = 3.996e-3
+MIE_EXTINCTION = 4.440e-3
+MIE_SCALE_HEIGHT = 1.2 / EARTH_ATMOSPHERE_THICKNESS
+MIE_ASYMMETRY = 0.8
+OZONE_ABSORPTION = np.array([0.650e-3, 1.881e-3, 0.085e-3])
+OZONE_CENTER = 25.0 / EARTH_ATMOSPHERE_THICKNESS
+OZONE_HALF_WIDTH = 15.0 / EARTH_ATMOSPHERE_THICKNESS
+GROUND_ALBEDO = 0.3
+SUN_ANGULAR_RADIUS = 0.004675
+
+
+def _smoothstep(edge0, edge1, x):
+    t = np.clip((x - edge0) / (edge1 - edge0), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+
+def _dot(a, b):
+    return np.einsum("...i,...i->...", a, b)
+
+
+def _unit_to_texel(x, n):
+    return 0.5 / n + x * (1.0 - 1.0 / n)
+
+
+def _texel_to_unit(u, n):
+    return (u - 0.5 / n) / (1.0 - 1.0 / n)
+
+
+def _texel_centres(size):
+    """u and v of every texel centre of a table, each of shape (height, width)."""
+
+    width, height = size
+    u = (np.arange(width) + 0.5) / width
+    v = (np.arange(height) + 0.5) / height
+    return np.meshgrid(u, v)
+
+
+def sample_bilinear(table: np.ndarray, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """Linear, clamp-to-edge lookup of a (height, width, channels) table at
+    texture coordinates u and v, as GL samples a 2D texture."""
+
+    height, width = table.shape[:2]
+    x = np.asarray(u) * width - 0.5
+    y = np.asarray(v) * height - 0.5
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = (x - x0)[..., None]
+    fy = (y - y0)[..., None]
+    x0 = x0.astype(np.int64)
+    y0 = y0.astype(np.int64)
+    xa = np.clip(x0, 0, width - 1)
+    xb = np.clip(x0 + 1, 0, width - 1)
+    ya = np.clip(y0, 0, height - 1)
+    yb = np.clip(y0 + 1, 0, height - 1)
+    top = table[ya, xa] * (1.0 - fx) + table[ya, xb] * fx
+    bottom = table[yb, xa] * (1.0 - fx) + table[yb, xb] * fx
+    return top * (1.0 - fy) + bottom * fy
+
+
+def rayleigh_phase(cos_theta):
+    return 3.0 / (16.0 * math.pi) * (1.0 + cos_theta * cos_theta)
+
+
+def mie_phase(cos_theta):
+    g = MIE_ASYMMETRY
+    g2 = g * g
+    denom = np.maximum(1.0 + g2 - 2.0 * g * cos_theta, 1e-4)
+    return 3.0 / (8.0 * math.pi) * (1.0 - g2) * (1.0 + cos_theta * cos_theta) / ((2.0 + g2) * denom * np.sqrt(denom))
+
+
+class ReferenceAtmosphere:
+    """The atmosphere of one planet and atmosphere radius.
+
+    The transmittance and multiple-scattering tables are built on
+    construction, like AtmosphereLuts does on a cache miss; sky_view builds
+    the per-frame table. Everything is computed in double precision and
+    stored at the precision of the GPU's tables.
+    """
+
+    def __init__(self, planet_radius: float, atmosphere_radius: float):
+        self.planet_radius = float(planet_radius)
+        self.atmosphere_radius = float(atmosphere_radius)
+        self.thickness = max(self.atmosphere_radius - self.planet_radius, 1e-3)
+        self.horizon = math.sqrt(
+            max((self.atmosphere_radius - self.planet_radius) * (self.atmosphere_radius + self.planet_radius), 0.0)
+        )
+        self.transmittance = self._transmittance_table()
+        self.multi_scattering = self._multi_scattering_table()
+
+    # Medium and ray geometry.
+
+    def medium(self, r):
+        """Rayleigh scattering (..., 3), Mie scattering (...) and extinction
+        (..., 3) at radius r."""
+
+        scale = EARTH_ATMOSPHERE_THICKNESS / self.thickness
+        h = np.clip((r - self.planet_radius) / self.thickness, 0.0, 1.0)
+        rayleigh = np.exp(-h / RAYLEIGH_SCALE_HEIGHT) * scale
+        mie = np.exp(-h / MIE_SCALE_HEIGHT) * scale
+        ozone = np.maximum(1.0 - np.abs(h - OZONE_CENTER) / OZONE_HALF_WIDTH, 0.0) * scale
+        rayleigh_scattering = RAYLEIGH_SCATTERING * rayleigh[..., None]
+        mie_scattering = MIE_SCATTERING * mie
+        extinction = rayleigh_scattering + (MIE_EXTINCTION * mie)[..., None] + OZONE_ABSORPTION * ozone[..., None]
+        return rayleigh_scattering, mie_scattering, extinction
+
+    def distance_to_top(self, r, mu):
+        top = self.atmosphere_radius
+        discriminant = (top - r) * (top + r) + r * r * mu * mu
+        return np.maximum(-r * mu + np.sqrt(np.maximum(discriminant, 0.0)), 0.0)
+
+    def distance_to_ground(self, r, mu):
+        radius = self.planet_radius
+        discriminant = (radius - r) * (radius + r) + r * r * mu * mu
+        return np.maximum(-r * mu - np.sqrt(np.maximum(discriminant, 0.0)), 0.0)
+
+    def hits_ground(self, r, mu):
+        radius = self.planet_radius
+        return (mu < 0.0) & ((radius - r) * (radius + r) + r * r * mu * mu >= 0.0)
+
+    def _transmittance_uv(self, r, mu):
+        width, height = TRANSMITTANCE_LUT_SIZE
+        radius = self.planet_radius
+        rho = np.sqrt(np.maximum((r - radius) * (r + radius), 0.0))
+        d = self.distance_to_top(r, mu)
+        d_min = self.atmosphere_radius - r
+        d_max = rho + self.horizon
+        x_mu = (d - d_min) / np.maximum(d_max - d_min, 1e-6)
+        x_r = rho / self.horizon
+        return _unit_to_texel(np.clip(x_mu, 0.0, 1.0), width), _unit_to_texel(np.clip(x_r, 0.0, 1.0), height)
+
+    def _multi_scattering_uv(self, r, mu_sun):
+        width, height = MULTI_SCATTERING_LUT_SIZE
+        altitude = np.clip((r - self.planet_radius) / self.thickness, 0.0, 1.0)
+        return _unit_to_texel(mu_sun * 0.5 + 0.5, width), _unit_to_texel(altitude, height)
+
+    def _sky_view_limits(self, r):
+        sin_horizon = np.clip(self.planet_radius / r, 0.0, 1.0)
+        mu_horizon = -np.sqrt(np.maximum(1.0 - sin_horizon * sin_horizon, 0.0))
+        sin_top = np.clip(self.atmosphere_radius / r, 0.0, 1.0)
+        mu_max = np.where(r > self.atmosphere_radius, -np.sqrt(np.maximum(1.0 - sin_top * sin_top, 0.0)), 1.0)
+        return mu_horizon, mu_max
+
+    def _sky_view_uv(self, r, mu, cos_azimuth):
+        width, height = SKY_VIEW_LUT_SIZE
+        mu_horizon, mu_max = self._sky_view_limits(r)
+        x = np.clip((mu + 1.0) / np.maximum(mu_horizon + 1.0, 1e-6), 0.0, 1.0)
+        y = np.clip((mu - mu_horizon) / np.maximum(mu_max - mu_horizon, 1e-6), 0.0, 1.0)
+        v = np.where(mu < mu_horizon, 0.5 - 0.5 * np.sqrt(1.0 - x), 0.5 + 0.5 * np.sqrt(y))
+        u = np.sqrt(np.clip(0.5 - 0.5 * cos_azimuth, 0.0, 1.0))
+        return _unit_to_texel(u, width), _unit_to_texel(v, height)
+
+    # Table lookups.
+
+    def transmittance_to_top(self, r, mu):
+        return sample_bilinear(self.transmittance, *self._transmittance_uv(r, mu))[..., :3]
+
+    def transmittance_along(self, r, mu, d):
+        """Transmittance over distance d from radius r along a ray with cosine mu."""
+
+        rd = np.sqrt(np.maximum(d * d + 2.0 * r * mu * d + r * r, self.planet_radius * self.planet_radius))
+        mu_d = np.clip((r * mu + d) / rd, -1.0, 1.0)
+        down = (mu < 0.0)[..., None]
+        toward = np.where(
+            down,
+            self.transmittance_to_top(rd, -mu_d) / np.maximum(self.transmittance_to_top(r, -mu), 1e-8),
+            self.transmittance_to_top(r, mu) / np.maximum(self.transmittance_to_top(rd, mu_d), 1e-8),
+        )
+        return np.minimum(toward, 1.0)
+
+    def sun_transmittance(self, r, mu_sun):
+        sin_horizon = np.clip(self.planet_radius / r, 0.0, 1.0)
+        cos_horizon = -np.sqrt(np.maximum(1.0 - sin_horizon * sin_horizon, 0.0))
+        spread = sin_horizon * SUN_ANGULAR_RADIUS
+        fade = _smoothstep(-spread, spread, mu_sun - cos_horizon)
+        return self.transmittance_to_top(r, mu_sun) * fade[..., None]
+
+    # Tables.
+
+    def _transmittance_table(self) -> np.ndarray:
+        width, height = TRANSMITTANCE_LUT_SIZE
+        u, v = _texel_centres(TRANSMITTANCE_LUT_SIZE)
+        x_mu = _texel_to_unit(u, width)
+        x_r = _texel_to_unit(v, height)
+        rho = self.horizon * x_r
+        r = np.sqrt(rho * rho + self.planet_radius * self.planet_radius)
+        d_min = self.atmosphere_radius - r
+        d_max = rho + self.horizon
+        d = d_min + x_mu * (d_max - d_min)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mu = np.where(d == 0.0, 1.0, (self.horizon ** 2 - rho * rho - d * d) / (2.0 * r * d))
+        mu = np.clip(mu, -1.0, 1.0)
+
+        dt = self.distance_to_top(r, mu) / TRANSMITTANCE_STEPS
+        depth = np.zeros(r.shape + (3,))
+        for step in range(TRANSMITTANCE_STEPS):
+            t = (step + 0.5) * dt
+            sample_radius = np.sqrt(t * t + 2.0 * r * mu * t + r * r)
+            depth += self.medium(sample_radius)[2] * dt[..., None]
+        table = np.ones(r.shape + (4,), dtype=np.float32)
+        table[..., :3] = np.exp(-depth)
+        return table
+
+    def _gather_scattering(self, pos, rd, light_dir):
+        """Isotropic single scattering toward pos along rd and the fraction
+        of light scattered on the way, as gatherScattering does."""
+
+        shape = np.broadcast(pos, rd, light_dir).shape
+        pos = np.broadcast_to(pos, shape)
+        rd = np.broadcast_to(rd, shape)
+        light_dir = np.broadcast_to(light_dir, shape)
+        r = np.linalg.norm(pos, axis=-1)
+        mu = _dot(pos, rd) / r
+        ground = self.hits_ground(r, mu)
+        t_end = np.where(ground, self.distance_to_ground(r, mu), self.distance_to_top(r, mu))
+        dt = (t_end / MULTI_SCATTERING_STEPS)[..., None]
+        isotropic_phase = 1.0 / (4.0 * math.pi)
+
+        transmittance = np.ones(r.shape + (3,))
+        scattered = np.zeros(r.shape + (3,))
+        scattering_fraction = np.zeros(r.shape + (3,))
+        for step in range(MULTI_SCATTERING_STEPS):
+            sample_pos = pos + rd * ((step + 0.5) * dt)
+            sample_radius = np.linalg.norm(sample_pos, axis=-1)
+            rayleigh, mie, extinction = self.medium(sample_radius)
+            scattering = rayleigh + mie[..., None]
+            step_transmittance = np.exp(-extinction * dt)
+            step_weight = (1.0 - step_transmittance) / np.maximum(extinction, 1e-9)
+            sun = self.sun_transmittance(sample_radius, _dot(sample_pos, light_dir) / sample_radius)
+            scattered += transmittance * scattering * isotropic_phase * sun * step_weight
+            scattering_fraction += transmittance * scattering * step_weight
+            transmittance *= step_transmittance
+
+        ground_pos = pos + rd * t_end[..., None]
+        ground_radius = np.linalg.norm(ground_pos, axis=-1)
+        mu_sun = _dot(ground_pos, light_dir) / ground_radius
+        bounce = (
+            transmittance
+            * self.sun_transmittance(ground_radius, mu_sun)
+            * np.maximum(mu_sun, 0.0)[..., None]
+            * GROUND_ALBEDO
+            / math.pi
+        )
+        scattered += np.where(ground[..., None], bounce, 0.0)
+        return scattered, scattering_fraction
+
+    def _multi_scattering_table(self) -> np.ndarray:
+        width, height = MULTI_SCATTERING_LUT_SIZE
+        u, v = _texel_centres(MULTI_SCATTERING_LUT_SIZE)
+        mu_sun = _texel_to_unit(u, width) * 2.0 - 1.0
+        altitude = _texel_to_unit(v, height)
+        r = self.planet_radius + np.maximum(altitude * self.thickness, 1e-3)
+        pos = np.stack([np.zeros_like(r), np.zeros_like(r), r], axis=-1)
+        light_dir = np.stack([np.zeros_like(r), np.sqrt(np.maximum(1.0 - mu_sun * mu_sun, 0.0)), mu_sun], axis=-1)
+
+        count = MULTI_SCATTERING_DIRECTIONS
+        phi = 2.0 * math.pi * (np.arange(count) + 0.5) / count
+        cos_theta = 1.0 - 2.0 * (np.arange(count) + 0.5) / count
+        sin_theta = np.sqrt(np.maximum(1.0 - cos_theta * cos_theta, 0.0))
+        directions = np.stack(
+            [
+                np.cos(phi)[:, None] * sin_theta[None, :],
+                np.sin(phi)[:, None] * sin_theta[None, :],
+                np.broadcast_to(cos_theta[None, :], (count, count)),
+            ],
+            axis=-1,
+        ).reshape(-1, 3)
+
+        # Equal-area directions: the sphere integrals are plain averages.
+        scattered, fraction = self._gather_scattering(
+            pos[..., None, :], directions, light_dir[..., None, :]
+        )
+        second_order = scattered.mean(axis=-2)
+        transfer = fraction.mean(axis=-2)
+        table = np.ones(r.shape + (4,), dtype=np.float32)
+        table[..., :3] = second_order / np.maximum(1.0 - transfer, 1e-4)
+        return table
+
+    def sky_view(self, cam_planet: np.ndarray, light_dir: np.ndarray) -> np.ndarray:
+        """The sky-view table for a camera and unit sun direction in the
+        planet's frame, stored at half precision like the GPU's."""
+
+        cam_planet = np.asarray(cam_planet, dtype=np.float64)
+        light_dir = np.asarray(light_dir, dtype=np.float64)
+        cam_radius = float(np.linalg.norm(cam_planet))
+        up = cam_planet / cam_radius
+        u, v = _texel_centres(SKY_VIEW_LUT_SIZE)
+        width, height = SKY_VIEW_LUT_SIZE
+
+        mu_horizon, mu_max = self._sky_view_limits(np.float64(cam_radius))
+        v = _texel_to_unit(v, height)
+        x = 1.0 - (1.0 - 2.0 * v) ** 2
+        y = (2.0 * v - 1.0) ** 2
+        mu = np.where(v < 0.5, -1.0 + x * (mu_horizon + 1.0), mu_horizon + y * (mu_max - mu_horizon))
+        cos_azimuth = 1.0 - 2.0 * _texel_to_unit(u, width) ** 2
+
+        sun_side = light_dir - up * np.dot(light_dir, up)
+        if np.dot(sun_side, sun_side) < 1e-8:
+            sun_side = np.cross(up, [1.0, 0.0, 0.0] if abs(up[0]) < 0.9 else [0.0, 1.0, 0.0])
+        sun_side /= np.linalg.norm(sun_side)
+        side = np.cross(up, sun_side)
+        sin_azimuth = np.sqrt(np.maximum(1.0 - cos_azimuth * cos_azimuth, 0.0))
+        horizontal = np.sqrt(np.maximum(1.0 - mu * mu, 0.0))[..., None]
+        rd = up * mu[..., None] + (sun_side * cos_azimuth[..., None] + side * sin_azimuth[..., None]) * horizontal
+
+        # Rays from space start where they enter the atmosphere.
+        t_start = np.zeros_like(mu)
+        outside = np.zeros(mu.shape, dtype=bool)
+        if cam_radius > self.atmosphere_radius:
+            top = self.atmosphere_radius
+            discriminant = (top - cam_radius) * (top + cam_radius) + cam_radius * cam_radius * mu * mu
+            outside = (discriminant < 0.0) | (mu >= 0.0)
+            t_start = np.where(outside, 0.0, -cam_radius * mu - np.sqrt(np.maximum(discriminant, 0.0)))
+        origin = cam_planet + rd * t_start[..., None]
+        r = np.linalg.norm(origin, axis=-1)
+        mu_origin = _dot(origin, rd) / r
+        t_end = np.where(
+            self.hits_ground(r, mu_origin), self.distance_to_ground(r, mu_origin), self.distance_to_top(r, mu_origin)
+        )
+        dt = t_end / SKY_VIEW_STEPS
+
+        cos_theta = _dot(rd, light_dir)
+        phase_r = rayleigh_phase(cos_theta)[..., None]
+        phase_m = mie_phase(cos_theta)[..., None]
+        transmittance = np.ones(mu.shape + (3,))
+        radiance = np.zeros(mu.shape + (3,))
+        for step in range(SKY_VIEW_STEPS):
+            sample_pos = origin + rd * ((step + 0.5) * dt)[..., None]
+            sample_radius = np.linalg.norm(sample_pos, axis=-1)
+            mu_sun = _dot(sample_pos, light_dir) / sample_radius
+            rayleigh, mie, extinction = self.medium(sample_radius)
+            sun = self.sun_transmittance(sample_radius, mu_sun)
+            multiple = sample_bilinear(self.multi_scattering, *self._multi_scattering_uv(sample_radius, mu_sun))[..., :3]
+            source = rayleigh * (phase_r * sun + multiple) + mie[..., None] * (phase_m * sun + multiple)
+            step_transmittance = np.exp(-extinction * dt[..., None])
+            radiance += transmittance * source * (1.0 - step_transmittance) / np.maximum(extinction, 1e-9)
+            transmittance *= step_transmittance
+
+        table = np.empty(mu.shape + (4,), dtype=np.float32)
+        table[..., :3] = radiance
+        table[..., 3] = transmittance.mean(axis=-1)
+        table[outside] = (0.0, 0.0, 0.0, 1.0)
+        return table.astype(np.float16).astype(np.float32)
+
+    def shade(self, sky_view, cam_planet, view_dirs, light_dir, hit, segments, view_distances, sun_power):
+        """atmosphere.frag for rays of shape (..., 3) from cam_planet: the
+        in-scattered light and mean transmittance up to the G-buffer hit, or
+        through the atmosphere where nothing was hit; segments holds the
+        entry and exit distances of the G-buffer's view data."""
+
+        cam_planet = np.asarray(cam_planet, dtype=np.float64)
+        view_dirs = np.asarray(view_dirs, dtype=np.float64)
+        segments = np.asarray(segments, dtype=np.float64)
+        view_distances = np.asarray(view_distances, dtype=np.float64)
+        result = np.zeros(view_dirs.shape[:-1] + (4,), dtype=np.float32)
+        result[..., 3] = 1.0
+        inside = segments[..., 1] > segments[..., 0]
+        if not inside.any():
+            return result
+
+        rd = view_dirs[inside]
+        cam_radius = float(np.linalg.norm(cam_planet))
+        up = cam_planet / cam_radius
+        view_side = rd - up * _dot(rd, up)[..., None]
+        sun_side = light_dir - up * np.dot(light_dir, up)
+        lengths2 = _dot(view_side, view_side) * np.dot(sun_side, sun_side)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cos_azimuth = np.where(
+                lengths2 < 1e-16,
+                1.0,
+                np.clip(_dot(view_side, sun_side) / np.sqrt(np.maximum(lengths2, 1e-300)), -1.0, 1.0),
+            )
+        sky = sample_bilinear(sky_view, *self._sky_view_uv(np.float64(cam_radius), _dot(up, rd), cos_azimuth))
+
+        # albedo * sunPower is the lighting pass's lit brightness, pi times
+        # the radiance of a Lambertian surface under that illuminance.
+        sun_radiance = max(sun_power, 0.0) * math.pi
+        shaded = np.empty(rd.shape[:-1] + (4,))
+        shaded[..., :3] = sky[..., :3] * sun_radiance
+        shaded[..., 3] = sky[..., 3]
+
+        surface = hit[inside]
+        if surface.any():
+            entry_distance = segments[inside][surface, 0]
+            entry = cam_planet + rd[surface] * entry_distance[..., None]
+            entry_radius = np.linalg.norm(entry, axis=-1)
+            mu = _dot(entry, rd[surface]) / entry_radius
+            distance = np.maximum(view_distances[inside][surface] - entry_distance, 0.0)
+            mean_transmittance = self.transmittance_along(entry_radius, mu, distance).mean(axis=-1)
+            share = np.clip((1.0 - mean_transmittance) / np.maximum(1.0 - sky[surface, 3], 1e-4), 0.0, 1.0)
+            shaded[surface, :3] = sky[surface, :3] * (share * sun_radiance)[..., None]
+            shaded[surface, 3] = mean_transmittance
+
+        shaded[..., 3] = np.clip(shaded[..., 3], 0.0, 1.0)
+        result[inside] = shaded
+        return result
@@ -0,0 +1,1036 @@
+"""CPU reference of the planet passes, in vectorized NumPy.
+
+Reproduces the G-buffer, lighting, atmosphere, cloud and composite passes of
+PlanetRenderer for the primary planet, without a GL driver: as a golden
+image for per-pass regression checks at small sizes, and as a preview where
+there is no GPU.
+
+    python -m rendering.reference_renderer preview.png [--size 160x90]
+        [--day 100] [--hour 12] [--debug-level 9] [--bookmark]
+"""
+
+import argparse
+import math
+import sys
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+from rendering.cloud_noise import CLOUD_NOISE_CELLS, load_cloud_noise
+from rendering.constants import PlanetParameters, default_planet_parameters
+from rendering.planet_fields import _mix, _smoothstep, cloud_coverage, land_color
+from rendering.reference_atmosphere import ReferenceAtmosphere
+from rendering.terrain import fbm, fbm_octaves, terrain_height, terrain_lipschitz, terrain_lod
+from utils.time import CalendarState, PlanetCalendar, compute_sun_direction
+
+
+# Pixels every pass handles at once; bounds the size of the temporaries.
+REFERENCE_CHUNK_SIZE = 4096
+# Texels along a cube face edge of the CPU horizon maps, a quarter of
+# HORIZON_MAP_SIZE (rendering/horizon_maps.py): about five seconds to bake
+# rather than a minute and a half, at the cost of softer terrain shadows.
+REFERENCE_HORIZON_MAP_SIZE = 128
+
+# gbuffer_common.glsl
+PLANET_REFINE_STEPS = 3
+_MARCH_LOOP_LIMIT = 1024
+_RUNNING, _CROSSED, _MISSED = 0, 1, 2
+
+# horizon_maps.comp, horizon_common.glsl and lighting.frag
+HORIZON_AZIMUTHS = 8
+HORIZON_STEPS = 32
+HORIZON_START_TEXELS = 1.5
+HORIZON_PENUMBRA = 0.035
+
+# clouds.frag. The reference takes every step of the march, which is what
+# the empty-space skipping there is measured against.
+CLOUD_SHAPE_FREQUENCIES = np.array([18.0, 9.5, 42.0], dtype=np.float32)
+CLOUD_SHAPE_THRESHOLD = 0.48
+_CLOUD_SHAPE_OFFSETS = (
+    np.array([0.61, 0.09, -0.24], dtype=np.float32),
+    np.array([-0.30, 0.22, 0.38], dtype=np.float32),
+    np.array([-0.26, -0.48, -0.14], dtype=np.float32),
+)
+_CLOUD_SHAPE_WEIGHTS = (0.45, 0.4, 0.25)
+
+
+@dataclass
+class ReferenceFrame:
+    """Every pass target of one render, each (height, width, 4) float32 with
+    rows bottom-up as glReadPixels returns them. Targets the GPU keeps at
+    half precision are rounded through float16 like it."""
+
+    position_height: np.ndarray
+    normal_flags: np.ndarray
+    material: np.ndarray
+    view_data: np.ndarray
+    lighting: np.ndarray
+    atmosphere: np.ndarray
+    clouds: np.ndarray
+    composite: np.ndarray
+
+    def image(self) -> np.ndarray:
+        """The composite over black as RGBA8, top row first."""
+
+        pixels = np.empty(self.composite.shape, dtype=np.uint8)
+        pixels[..., :3] = np.rint(np.clip(self.composite[..., :3], 0.0, 1.0) * 255.0)
+        pixels[..., 3] = 255
+        return pixels[::-1]
+
+
+@dataclass
+class _FrameInputs:
+    """The uniforms of one render, as the shaders see them."""
+
+    parameters: PlanetParameters
+    cam_pos: np.ndarray
+    cam_forward: np.ndarray
+    cam_right: np.ndarray
+    cam_up: np.ndarray
+    cam_planet: np.ndarray
+    to_planet: np.ndarray
+    to_world: np.ndarray
+    sun_dir: np.ndarray
+    light_dir: np.ndarray
+    tan_half_fov: float
+    aspect: float
+    full_size: np.ndarray
+    pixel_spread: float
+    time_seconds: float
+    noise_seed: float
+
+
+def _quantize_half(values: np.ndarray) -> np.ndarray:
+    return values.astype(np.float16).astype(np.float32)
+
+
+def _dot(a, b):
+    return np.einsum("...i,...i->...", a, b)
+
+
+def _normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def _tilt_rotation(tilt_degrees: float) -> np.ndarray:
+    """The rotation the shaders apply as worldToPlanet.
+
+    PlanetRenderer uploads its matrices untransposed, so the shaders apply
+    the transpose of each; this is that transpose of its world_to_planet.
+    """
+
+    tilt = math.radians(tilt_degrees)
+    return np.array(
+        [[1.0, 0.0, 0.0], [0.0, math.cos(tilt), -math.sin(tilt)], [0.0, math.sin(tilt), math.cos(tilt)]],
+        dtype=np.float32,
+    )
+
+
+def _interleaved_gradient_noise(pixels: np.ndarray) -> np.ndarray:
+    f = pixels[..., 0] * np.float32(0.06711056) + pixels[..., 1] * np.float32(0.00583715)
+    f = f - np.floor(f)
+    g = np.float32(52.9829189) * f
+    return g - np.floor(g)
+
+
+def _intersect_sphere(ro, rd, radius):
+    """Hit mask and entry and exit distances of rays from one origin; the
+    distances are zero for misses."""
+
+    b = _dot(rd, ro)
+    c = np.dot(ro, ro) - np.float32(radius) * np.float32(radius)
+    h = b * b - c
+    hit = h >= 0.0
+    h = np.sqrt(np.maximum(h, 0.0))
+    return hit, np.where(hit, -b - h, 0.0), np.where(hit, -b + h, 0.0)
+
+
+def _ray_directions(frame: _FrameInputs, pixels: np.ndarray) -> np.ndarray:
+    """rayDirection of the shaders for pixel centres, in the world frame."""
+
+    uv = pixels / frame.full_size * np.float32(2.0) - np.float32(1.0)
+    uv[..., 0] *= np.float32(frame.aspect)
+    uv *= np.float32(frame.tan_half_fov)
+    return _normalize(frame.cam_forward + uv[..., 0:1] * frame.cam_right + uv[..., 1:2] * frame.cam_up)
+
+
+# G-buffer pass (gbuffer_common.glsl)
+
+
+def _planet_sdf(frame: _FrameInputs, p, footprint):
+    parameters = frame.parameters
+    radius = np.float32(parameters.planet_radius)
+    heights = terrain_height(p, parameters.planet_radius, parameters.height_scale, footprint)
+    return np.linalg.norm(p, axis=-1) - (radius + heights)
+
+
+def _surface_footprint(frame: _FrameInputs, p, rd, t):
+    cosine = np.abs(_dot(rd, p)) / np.linalg.norm(p, axis=-1)
+    return np.maximum(t, 0.0) * np.float32(frame.pixel_spread) / np.sqrt(np.maximum(cosine, np.float32(0.05)))
+
+
+def _refine_crossing(frame, ro, rd, t_near, d_near, t_far, d_far):
+    for _ in range(PLANET_REFINE_STEPS):
+        span = t_far - t_near
+        t_mid = t_near + span * np.clip(d_near / np.maximum(d_near - d_far, 1e-6), 0.1, 0.9)
+        p = ro + rd * t_mid[:, None]
+        d = _planet_sdf(frame, p, _surface_footprint(frame, p, rd, t_mid))
+        above = d > 0.0
+        t_near = np.where(above, t_mid, t_near)
+        d_near = np.where(above, d, d_near)
+        t_far = np.where(above, t_far, t_mid)
+        d_far = np.where(above, d_far, d)
+    return t_near + (t_far - t_near) * np.clip(d_near / np.maximum(d_near - d_far, 1e-6), 0.0, 1.0)
+
+
+def _march_planet(frame: _FrameInputs, ro, rd, lod_factor, jitter, t_min, t_max):
+    """marchPlanet for a set of rays, each step taken by the rays still
+    running; returns the hit mask and distances."""
+
+    parameters = frame.parameters
+    max_steps = np.float32(parameters.planet_max_steps)
+    step_budget = np.maximum(_mix(max_steps, max_steps * np.float32(0.55), lod_factor).astype(np.int32), 1)
+    min_factor = np.float32(parameters.planet_min_step_factor)
+    min_step = _mix(min_factor * np.float32(0.65), min_factor * np.float32(1.5), lod_factor)
+    eps = np.float32(max(parameters.height_scale * 0.01, parameters.planet_radius * 0.0001))
+    min_step_length = eps * min_step
+    inv_lipschitz = np.float32(1.0 / max(terrain_lipschitz(parameters.planet_radius, parameters.height_scale), 1.0))
+
+    count = len(t_min)
+    omega = np.full(count, min(max(parameters.planet_step_scale, 0.1), 1.95), dtype=np.float32)
+    t = (t_min + eps * jitter).astype(np.float32)
+    d = np.zeros(count, dtype=np.float32)
+    t_prev = t.copy()
+    d_prev = np.zeros(count, dtype=np.float32)
+    prev_radius = np.zeros(count, dtype=np.float32)
+    step_length = np.zeros(count, dtype=np.float32)
+    step = np.zeros(count, dtype=np.int32)
+    status = np.full(count, _RUNNING, dtype=np.int8)
+
+    active = np.arange(count)
+    for _ in range(_MARCH_LOOP_LIMIT):
+        spent = step[active] >= step_budget[active]
+        status[active[spent]] = _MISSED
+        active = active[~spent]
+        if active.size == 0:
+            break
+        step[active] += 1
+        p = ro + rd[active] * t[active, None]
+        distance = _planet_sdf(frame, p, _surface_footprint(frame, p, rd[active], t[active]))
+        d[active] = distance
+        radius = np.abs(distance) * inv_lipschitz
+
+        # Over-relaxed steps whose bounding spheres stop overlapping go back
+        # and continue with plain sphere tracing.
+        back = (omega[active] > 1.0) & (step[active] > 1) & (radius + prev_radius[active] < step_length[active])
+        rays = active[back]
+        omega[rays] = 1.0
+        step_length[rays] = np.maximum(prev_radius[rays], min_step_length[rays])
+        t[rays] = t_prev[rays] + step_length[rays]
+
+        crossed = ~back & (distance < 0.0)
+        status[active[crossed]] = _CROSSED
+
+        advance = ~back & ~crossed
+        rays = active[advance]
+        t_prev[rays] = t[rays]
+        d_prev[rays] = distance[advance]
+        prev_radius[rays] = radius[advance]
+        step_length[rays] = np.maximum(radius[advance] * omega[rays], min_step_length[rays])
+        t[rays] += step_length[rays]
+        status[rays[t[rays] > t_max[rays]]] = _MISSED
+        active = active[status[active] == _RUNNING]
+
+    hit = status == _CROSSED
+    refine = hit & (d_prev > 0.0)
+    if refine.any():
+        t[refine] = _refine_crossing(frame, ro, rd[refine], t_prev[refine], d_prev[refine], t[refine], d[refine])
+    return hit, t
+
+
+def _gbuffer_pass(frame: _FrameInputs, pixels: np.ndarray):
+    parameters = frame.parameters
+    height_scale = np.float32(parameters.height_scale)
+    sea_level = np.float32(parameters.sea_level)
+    max_ray_distance = np.float32(parameters.max_ray_distance)
+
+    ro = frame.cam_planet
+    rd = _ray_directions(frame, pixels) @ frame.to_planet.T
+    count = len(rd)
+
+    # traceSegments
+    hits_atmosphere, t_atm0, t_atm1 = _intersect_sphere(ro, rd, parameters.atmosphere_radius)
+    hits_shell, t_planet0, t_planet1 = _intersect_sphere(ro, rd, parameters.planet_radius)
+    hit_water, t_water0, t_water1 = _intersect_sphere(ro, rd, parameters.planet_radius + parameters.sea_level)
+    hit_water &= t_water1 > 0.0
+    t_water0 = np.where(hit_water & (t_water0 < 0.0), 0.0, t_water0).astype(np.float32)
+
+    through_top = hits_atmosphere & (t_atm1 > 0.0)
+    march_start = np.where(through_top, np.maximum(t_atm0, 0.0), 0.0).astype(np.float32)
+    march_end = np.where(through_top, np.minimum(t_atm1, max_ray_distance), max_ray_distance).astype(np.float32)
+    if np.linalg.norm(ro) > parameters.atmosphere_radius:
+        march_start[~through_top] = max_ray_distance
+        march_end[~through_top] = max_ray_distance
+    shell_padding = np.float32(max(parameters.height_scale * 1.2, parameters.planet_radius * 0.001))
+    shell = hits_shell & (t_planet1 > 0.0)
+    march_start = np.where(shell, np.maximum(march_start, np.maximum(t_planet0, 0.0) - shell_padding), march_start)
+    march_start = np.where(shell, np.maximum(march_start, 0.0), march_start)
+    march_end = np.where(shell, np.minimum(march_end, t_planet1 + shell_padding), march_end)
+    march_start = np.where(hit_water, np.maximum(march_start, np.maximum(t_water0 - shell_padding, 0.0)), march_start)
+    march_end = np.where(hit_water, np.minimum(march_end, t_water1 + shell_padding), march_end)
+
+    hit = np.zeros(count, dtype=bool)
+    t = np.zeros(count, dtype=np.float32)
+    marching = np.flatnonzero(march_end > march_start)
+    if marching.size:
+        jitter = _interleaved_gradient_noise(pixels[marching] + np.float32(frame.noise_seed))
+        # computeLodFactor
+        altitude = max(float(np.linalg.norm(ro)) - parameters.planet_radius, 0.0)
+        distance_lod = np.float32(math.log2(1.0 + altitude / max(parameters.planet_radius, 0.0001)))
+        horizon_align = (1.0 - np.abs(rd[marching] @ (ro / np.linalg.norm(ro)))) ** np.float32(2.2)
+        lod_factor = np.clip(_mix(distance_lod, distance_lod + horizon_align * np.float32(0.5), 0.65), 0.0, 1.0)
+        hit[marching], t[marching] = _march_planet(
+            frame, ro, rd[marching], lod_factor.astype(np.float32), jitter, march_start[marching], march_end[marching]
+        )
+
+    # shadeGBuffer
+    pos_planet = ro + rd * t[:, None]
+    t_terrain = np.where(hit, t, np.float32(1e9))
+    height_value = np.full(count, -1.0, dtype=np.float32)
+    base_color = np.tile(np.array([0.05, 0.07, 0.1], dtype=np.float32), (count, 1))
+    water_flag = np.full(count, -1.0, dtype=np.float32)
+    normal_planet = rd.copy()
+
+    surface = np.flatnonzero(hit)
+    if surface.size:
+        p = pos_planet[surface]
+        footprint = _surface_footprint(frame, p, rd[surface], t[surface])
+        height_value[surface] = terrain_height(p, parameters.planet_radius, parameters.height_scale, footprint)
+        d0 = _planet_sdf(frame, p, footprint)
+        eps = np.float32(max(parameters.planet_radius * 0.0005, parameters.height_scale * 0.03))
+        gradient = np.stack(
+            [_planet_sdf(frame, p + offset, footprint) - d0 for offset in np.eye(3, dtype=np.float32) * eps], axis=-1
+        )
+        normals = _normalize(gradient)
+        normal_planet[surface] = normals
+        octaves = fbm_octaves(terrain_lod(footprint, parameters.planet_radius), 12.0)
+        base_color[surface] = land_color(
+            _normalize(p), normals, height_value[surface], sea_level, height_scale, octaves
+        )
+        water_flag[surface] = 0.0
+
+    water = hit_water & (t_water0 < t_terrain) & (height_value <= sea_level)
+    pos_planet = np.where(water[:, None], ro + rd * t_water0[:, None], pos_planet)
+    normal_planet = np.where(water[:, None], _normalize(pos_planet), normal_planet)
+    water_flag[water] = 1.0
+    missed = ~hit & ~water
+    pos_planet[missed] = ro + rd[missed] * march_end[missed, None]
+
+    cloud_mask = np.zeros(count, dtype=np.float32)
+    through_atmosphere = hit | through_top
+    if through_atmosphere.any():
+        exit_distance = np.minimum(max_ray_distance, np.maximum(t_atm1, 0.0))
+        sample = np.where(hit[:, None], pos_planet, ro + rd * exit_distance[:, None])[through_atmosphere]
+        cloud_mask[through_atmosphere] = cloud_coverage(_normalize(sample), parameters.cloud_coverage)
+
+    pos_world = pos_planet @ frame.to_world.T
+    normal = _normalize(normal_planet @ frame.to_world.T)
+    view_distance = np.linalg.norm(pos_world - frame.cam_pos, axis=-1)
+    water_exit = np.minimum(t_water1, view_distance)
+    water_path = np.where(hit_water & (water_exit > t_water0), water_exit - t_water0, 0.0)
+    atm_entry = np.where(through_atmosphere, np.maximum(t_atm0, 0.0), 0.0)
+    atm_exit = np.where(through_atmosphere, np.minimum(t_atm1, max_ray_distance), 0.0)
+
+    position_height = _quantize_half(np.concatenate([pos_world, height_value[:, None]], axis=-1))
+    normal_flags = _quantize_half(np.concatenate([normal, water_flag[:, None]], axis=-1))
+    material = _quantize_half(np.concatenate([base_color, cloud_mask[:, None]], axis=-1))
+    view_data = np.stack([view_distance, atm_entry, atm_exit, water_path], axis=-1).astype(np.float32)
+    return position_height, normal_flags, material, view_data
+
+
+# Horizon maps (horizon_maps.comp) and lighting pass (lighting.frag)
+
+
+def _cube_directions(size: int) -> np.ndarray:
+    """cubeDirection of horizon_maps.comp for every texel, (6, size, size, 3)
+    indexed [face, row, column]."""
+
+    st = (np.arange(size, dtype=np.float32) + 0.5) / size * 2.0 - 1.0
+    s, t = np.meshgrid(st, st)
+    one = np.ones_like(s)
+    faces = [
+        (one, -t, -s),
+        (-one, -t, s),
+        (s, one, t),
+        (s, -one, -t),
+        (s, -t, one),
+        (-s, -t, -one),
+    ]
+    return _normalize(np.stack([np.stack(face, axis=-1) for face in faces]))
+
+
+def sample_cube(table: np.ndarray, directions: np.ndarray) -> np.ndarray:
+    """Linear lookup of a (6, size, size, channels) cube map along directions
+    of shape (..., 3), with GL's face selection. Filtering is clamped at face
+    edges rather than seamless."""
+
+    x, y, z = directions[..., 0], directions[..., 1], directions[..., 2]
+    ax, ay, az = np.abs(x), np.abs(y), np.abs(z)
+    major_x = (ax >= ay) & (ax >= az)
+    major_y = ~major_x & (ay >= az)
+    face = np.where(major_x, np.where(x > 0, 0, 1), np.where(major_y, np.where(y > 0, 2, 3), np.where(z > 0, 4, 5)))
+    sc = np.select([face == 0, face == 1, face == 5], [-z, z, -x], x)
+    tc = np.select([face == 2, face == 3], [z, -z], -y)
+    ma = np.select([major_x, major_y], [ax, ay], az)
+
+    size = table.shape[1]
+    column = (sc / ma + 1.0) * 0.5 * size - 0.5
+    row = (tc / ma + 1.0) * 0.5 * size - 0.5
+    c0 = np.floor(column)
+    r0 = np.floor(row)
+    fc = (column - c0)[..., None]
+    fr = (row - r0)[..., None]
+    c0 = c0.astype(np.int64)
+    r0 = r0.astype(np.int64)
+    ca = np.clip(c0, 0, size - 1)
+    cb = np.clip(c0 + 1, 0, size - 1)
+    ra = np.clip(r0, 0, size - 1)
+    rb = np.clip(r0 + 1, 0, size - 1)
+    top = table[face, ra, ca] * (1.0 - fc) + table[face, ra, cb] * fc
+    bottom = table[face, rb, ca] * (1.0 - fc) + table[face, rb, cb] * fc
+    return top * (1.0 - fr) + bottom * fr
+
+
+def _horizon_frame(up: np.ndarray):
+    side = np.cross(np.array([0.0, 1.0, 0.0], dtype=np.float32), up)
+    length = np.linalg.norm(side, axis=-1, keepdims=True)
+    east = np.where(length > 1e-5, side / np.maximum(length, 1e-30), np.array([1.0, 0.0, 0.0], dtype=np.float32))
+    north = np.cross(up, east)
+    return east, north
+
+
+def bake_horizon_maps(parameters: PlanetParameters, size: int = REFERENCE_HORIZON_MAP_SIZE) -> np.ndarray:
+    """Horizon elevation angles of every azimuth, (6, size, size, 8), as the
+    two cube maps of HorizonMaps hold them."""
+
+    radius = parameters.planet_radius
+    up = _cube_directions(size)
+    texel_angle = 2.0 / size
+    heights = terrain_height(up * np.float32(radius), radius, parameters.height_scale, texel_angle * radius)
+    heights = np.maximum(heights, np.float32(parameters.sea_level))[..., None]
+
+    origin = up * (np.float32(radius) + heights)
+    east, north = _horizon_frame(up)
+    reach = math.sqrt(2.0 * max(parameters.height_scale, 0.0) / radius)
+    start_angle = texel_angle * HORIZON_START_TEXELS
+    end_angle = max(reach, start_angle * 2.0)
+    ratio = (end_angle / start_angle) ** (1.0 / (HORIZON_STEPS - 1))
+
+    horizon = np.empty(up.shape[:-1] + (HORIZON_AZIMUTHS,), dtype=np.float32)
+    for index in range(HORIZON_AZIMUTHS):
+        azimuth = 2.0 * math.pi * index / HORIZON_AZIMUTHS
+        tangent = east * np.float32(math.cos(azimuth)) + north * np.float32(math.sin(azimuth))
+        best = np.full(up.shape[:-1], -math.pi / 2.0, dtype=np.float32)
+        angle = start_angle
+        for _ in range(HORIZON_STEPS):
+            direction = up * np.float32(math.cos(angle)) + tangent * np.float32(math.sin(angle))
+            offset = direction * (np.float32(radius) + sample_cube(heights, direction)) - origin
+            np.maximum(best, np.arctan2(_dot(offset, up), _dot(offset, tangent)), out=best)
+            angle *= ratio
+        horizon[..., index] = best
+    return _quantize_half(horizon)
+
+
+def _sun_tint(position, light_dir):
+    """computeSunTint of lighting.frag."""
+
+    sun_height = np.clip(_dot(_normalize(position), light_dir), -1.0, 1.0)
+    day_factor = _smoothstep(-0.02, 0.08, sun_height)[..., None]
+    golden_band = (1.0 - _smoothstep(0.01, 0.25, np.abs(sun_height)))[..., None]
+    night = np.array([0.04, 0.07, 0.12], dtype=np.float32)
+    day = np.array([0.94, 0.95, 0.93], dtype=np.float32)
+    golden = np.array([1.04, 0.72, 0.46], dtype=np.float32)
+    twilight = np.array([0.48, 0.36, 0.60], dtype=np.float32)
+    warm = _mix(day, golden, golden_band * np.float32(1.35))
+    return _mix(_mix(night, warm, day_factor), twilight, golden_band * np.float32(0.15))
+
+
+def _terrain_occlusion(frame: _FrameInputs, horizon_maps, pos):
+    """computeTerrainOcclusion: soft terrain shadow and ambient visibility."""
+
+    up = _normalize(pos @ frame.to_planet.T)
+    sun = frame.light_dir
+    east, north = _horizon_frame(up)
+    horizon = sample_cube(horizon_maps, up)
+
+    s = np.sin(np.maximum(horizon, 0.0))
+    ambient_visibility = 1.0 - np.sum(s * s, axis=-1) / HORIZON_AZIMUTHS
+
+    azimuth = np.arctan2(_dot(north, sun), _dot(east, sun)) / (2.0 * math.pi) * HORIZON_AZIMUTHS
+    azimuth = np.mod(azimuth + HORIZON_AZIMUTHS, HORIZON_AZIMUTHS)
+    index = azimuth.astype(np.int64) % HORIZON_AZIMUTHS
+    rows = np.arange(len(index))
+    sun_horizon = _mix(
+        horizon[rows, index], horizon[rows, (index + 1) % HORIZON_AZIMUTHS], azimuth - np.floor(azimuth)
+    )
+    sun_elevation = np.arcsin(np.clip(up @ sun, -1.0, 1.0))
+    sun_visibility = _smoothstep(sun_horizon - HORIZON_PENUMBRA, sun_horizon + HORIZON_PENUMBRA, sun_elevation)
+    return sun_visibility.astype(np.float32), ambient_visibility.astype(np.float32)
+
+
+def _shade_water(frame, pos, normal, floor_color, depth, view_water_thickness, sun_color, shadow, ambient_light):
+    parameters = frame.parameters
+    water_color = np.asarray(parameters.water_color, dtype=np.float32)
+    light_dir = frame.sun_dir
+    view_dir = _normalize(frame.cam_pos - pos)
+
+    ndl = np.maximum(normal @ light_dir, 0.0)
+    view_facing = np.maximum(_dot(normal, view_dir), 0.0)
+    entry_cos = np.maximum(_dot(normal, -view_dir), 0.05)
+
+    path_length = depth / entry_cos + view_water_thickness
+    absorption = np.exp(-parameters.water_absorption * path_length * 0.42)[:, None]
+    forward = np.maximum(view_dir @ light_dir, 0.0) ** 4
+    scatter_amount = _mix(0.12, 0.75, parameters.water_scattering)
+    sun_facing = (ndl * 0.6 + forward)[:, None]
+    shadow = shadow[:, None]
+    in_scattering = (
+        water_color * (1.0 - absorption) * (0.25 + scatter_amount * sun_facing) * (sun_color * shadow + ambient_light)
+    )
+
+    bed_darken = _smoothstep(0.0, 80.0, depth)[:, None]
+    floor_light = sun_color * shadow + ambient_light
+    transmitted = floor_color * floor_light * absorption * _mix(1.0, 0.25, bed_darken)
+    reflected = _mix(water_color, sun_color, 0.25) * (0.35 + 0.65 * ndl[:, None] * shadow)
+    fresnel = (0.02 + (1.0 - view_facing) ** 5)[:, None]
+
+    ambient_reflection = ambient_light * (0.25 + 0.35 * (1.0 - absorption))
+    color = _mix(transmitted + in_scattering, reflected + ambient_reflection, fresnel)
+    reflect = -light_dir - 2.0 * _dot(normal, -light_dir)[:, None] * normal
+    spec = np.maximum(_dot(reflect, view_dir), 0.0) ** 48 * shadow[:, 0]
+    return color + (spec * _mix(0.08, 0.35, scatter_amount))[:, None] * sun_color
+
+
+def _lighting_pass(frame: _FrameInputs, gbuffer, horizon_maps):
+    parameters = frame.parameters
+    position_height, normal_flags, material, view_data = gbuffer
+    pos = position_height[:, :3]
+    height_value = position_height[:, 3]
+    normal = _normalize(normal_flags[:, :3])
+    water_flag = normal_flags[:, 3]
+    albedo = material[:, :3]
+    hit = water_flag > -0.5
+
+    light_dir = frame.sun_dir
+    view_dir = _normalize(frame.cam_pos - pos)
+    raw_ndl = normal @ light_dir
+    wrap_ndl = np.clip((raw_ndl + 0.65) / 1.65, 0.0, 1.0)
+    horizon_blend = _smoothstep(-0.18, 0.25, raw_ndl)
+    soft_halo = _smoothstep(-0.4, -0.05, raw_ndl) * (1.0 - horizon_blend)
+    sun_height = _normalize(pos) @ light_dir
+
+    sun_color = _sun_tint(pos, light_dir) * max(parameters.sun_power, 0.0)
+    sun_visibility = _smoothstep(-0.02, 0.04, sun_height)
+    effective_sun_color = sun_color * sun_visibility[:, None]
+    twilight = _smoothstep(-0.18, 0.04, sun_height)[:, None]
+    ambient_light = _mix(
+        np.array([0.02, 0.04, 0.06], dtype=np.float32), np.array([0.16, 0.22, 0.32], dtype=np.float32), twilight
+    )
+    ambient_strength = _mix(0.02, 0.14, twilight)
+    soft_halo *= sun_visibility
+
+    direct_light = effective_sun_color * (wrap_ndl * horizon_blend + soft_halo * 0.5)[:, None]
+    ambient = ambient_light * (ambient_strength + soft_halo[:, None] * 0.25)
+
+    sun_occlusion = np.ones(len(pos), dtype=np.float32)
+    ambient_occlusion = np.ones(len(pos), dtype=np.float32)
+    if hit.any():
+        sun_occlusion[hit], ambient_occlusion[hit] = _terrain_occlusion(frame, horizon_maps, pos[hit])
+    ambient = ambient * ambient_occlusion[:, None]
+    # computeShadow
+    ndl = normal @ light_dir
+    shadow = np.clip(ndl * 0.5 + 0.5, 0.0, 1.0) * _smoothstep(-0.2, 0.05, ndl) * sun_occlusion
+    shadow = np.where(hit, shadow, 0.0)
+
+    water_path = np.maximum(view_data[:, 3], 0.0)
+    water = water_flag > 0.5
+    water_depth = np.where(water, np.maximum(np.float32(parameters.sea_level) - height_value, 0.0), 0.0)
+
+    color = albedo * (ambient + direct_light * shadow[:, None])
+    reflect = -light_dir - 2.0 * _dot(normal, -light_dir)[:, None] * normal
+    spec = np.maximum(_dot(reflect, view_dir), 0.0) ** 24 * shadow
+    color = color + (spec * 0.08)[:, None] * effective_sun_color
+    murky = ~water & (water_path > 0.0)
+    if murky.any():
+        water_color = np.asarray(parameters.water_color, dtype=np.float32)
+        attenuation = np.exp(-parameters.water_absorption * water_path[murky] * 0.65)[:, None]
+        murk = _smoothstep(0.0, 120.0, water_path[murky])[:, None]
+        fog = _mix(water_color * 0.35, water_color * 0.6, murk) * (
+            effective_sun_color[murky] * 0.25 + ambient[murky] * 0.5
+        )
+        color[murky] = _mix(fog, color[murky], attenuation)
+    if water.any():
+        color[water] = _shade_water(
+            frame,
+            pos[water],
+            normal[water],
+            albedo[water],
+            water_depth[water],
+            water_path[water],
+            effective_sun_color[water],
+            shadow[water],
+            ambient[water],
+        )
+    return _quantize_half(np.concatenate([color, shadow[:, None]], axis=-1).astype(np.float32))
+
+
+# Cloud pass (clouds.frag)
+
+
+def _volume_pyramid(volume: np.ndarray):
+    """The mip chain glGenerateMipmap builds for the RGBA8 noise volume, as
+    floats in [0, 1]. Mesa halves each axis in turn, rounding every 2-tap
+    average half up; a plain rounded box filter comes out about 0.75 of a
+    step darker per level, which thins distant clouds noticeably."""
+
+    level = volume.astype(np.int32)
+    levels = [level / np.float32(255.0)]
+    while level.shape[0] > 1:
+        level = (level[:, :, 0::2] + level[:, :, 1::2] + 1) // 2
+        level = (level[:, 0::2] + level[:, 1::2] + 1) // 2
+        level = (level[0::2] + level[1::2] + 1) // 2
+        levels.append(level / np.float32(255.0))
+    return levels
+
+
+def _sample_volume(levels, coords: np.ndarray, lod: np.ndarray, channel: int) -> np.ndarray:
+    """textureLod on the repeating noise volume: trilinear within each mip
+    level and linear between the two nearest ones."""
+
+    lod = np.clip(lod, 0.0, len(levels) - 1)
+    low = np.floor(lod).astype(np.int64)
+    blend = lod - low
+    result = np.zeros(len(coords), dtype=np.float32)
+    for level_index in np.unique(low):
+        rows = np.flatnonzero(low == level_index)
+        value = _trilinear(levels[level_index], coords[rows], channel)
+        upper = min(level_index + 1, len(levels) - 1)
+        if upper != level_index:
+            value = _mix(value, _trilinear(levels[upper], coords[rows], channel), blend[rows])
+        result[rows] = value
+    return result
+
+
+def _trilinear(level: np.ndarray, coords: np.ndarray, channel: int) -> np.ndarray:
+    size = np.array(level.shape[2::-1][:3], dtype=np.float32)
+    position = coords * size - 0.5
+    base = np.floor(position)
+    f = position - base
+    base = base.astype(np.int64)
+    data = level[..., channel]
+    result = np.zeros(len(coords), dtype=np.float32)
+    for corner in np.ndindex(2, 2, 2):
+        index = (base + corner) % size.astype(np.int64)
+        weight = np.prod(np.where(np.array(corner) == 1, f, 1.0 - f), axis=-1)
+        result += weight * data[index[:, 2], index[:, 1], index[:, 0]]
+    return result
+
+
+def _cloud_coverage_field(frame: _FrameInputs, directions):
+    """cloudCoverageField of clouds.frag, which drifts with time."""
+
+    parameters = frame.parameters
+    cloud_time = np.float32(frame.time_seconds * parameters.cloud_animation_speed)
+    flow = np.array([cloud_time * 0.00035, 0.0, cloud_time * 0.00055], dtype=np.float32)
+    lookup = directions * np.float32(2.6) + np.array([1.25, -0.45, 0.65], dtype=np.float32) + flow
+
+    base = fbm(lookup)
+    billow = 1.0 - np.abs(fbm(lookup * np.float32(1.9) + np.array([-2.0, 3.1, 0.5], dtype=np.float32)) * 2.0 - 1.0)
+    tuft = fbm(lookup * np.float32(3.8) + np.array([2.2, 1.4, -3.1], dtype=np.float32))
+    coverage = _mix(_mix(base, billow, 0.52), tuft, 0.32)
+    control = min(max(parameters.cloud_coverage / 1.5, 0.0), 1.0)
+    adjusted = np.clip(coverage * _mix(0.85, 1.85, control) + _mix(-0.1, 0.32, control), 0.0, 1.0)
+    return _smoothstep(_mix(0.42, 0.16, control), _mix(0.82, 0.68, control), adjusted)
+
+
+def _cloud_shape_noise(frame: _FrameInputs, levels, p, footprint):
+    parameters = frame.parameters
+    radius = np.float32(parameters.planet_radius)
+    cloud_time = np.float32(frame.time_seconds * parameters.cloud_animation_speed)
+    flow = np.array([cloud_time * 0.0011, cloud_time * 0.0005, -cloud_time * 0.0008], dtype=np.float32)
+    lookup = (p / radius + flow) / np.float32(CLOUD_NOISE_CELLS)
+    texels = CLOUD_SHAPE_FREQUENCIES * np.float32(levels[0].shape[0] / (CLOUD_NOISE_CELLS * parameters.planet_radius))
+    lod = np.log2(np.maximum(footprint[:, None] * texels, 1e-6))
+    shape = np.zeros(len(p), dtype=np.float32)
+    for channel in range(3):
+        coords = lookup * CLOUD_SHAPE_FREQUENCIES[channel] + _CLOUD_SHAPE_OFFSETS[channel]
+        shape += np.float32(_CLOUD_SHAPE_WEIGHTS[channel]) * _sample_volume(levels, coords, lod[:, channel], channel)
+    return shape
+
+
+def _cloud_density(frame: _FrameInputs, levels, p, coverage_hint, footprint):
+    parameters = frame.parameters
+    base_radius = parameters.planet_radius + parameters.cloud_base_altitude
+    height_norm = np.clip(
+        (np.linalg.norm(p, axis=-1) - base_radius) / max(parameters.cloud_layer_thickness, 0.001), 0.0, 1.0
+    )
+    density = np.zeros(len(p), dtype=np.float32)
+    # Shape noise at or below the threshold leaves no density whatever the
+    # coverage, so the coverage field is only evaluated past it.
+    shape = _cloud_shape_noise(frame, levels, p, footprint)
+    dense = np.flatnonzero(shape > CLOUD_SHAPE_THRESHOLD)
+    if dense.size:
+        coverage = _mix(_cloud_coverage_field(frame, _normalize(p[dense])), coverage_hint[dense], 0.35)
+        density[dense] = np.clip((shape[dense] - CLOUD_SHAPE_THRESHOLD) * 2.1 * coverage, 0.0, 1.0)
+    return density * _smoothstep(0.04, 0.24, height_norm) * (1.0 - _smoothstep(0.6, 0.95, height_norm))
+
+
+def _cloud_sun_tint(up, light_dir):
+    """computeSunTint of clouds.frag."""
+
+    sun_height = np.clip(up @ light_dir, -1.0, 1.0)
+    day_factor = _smoothstep(-0.08, 0.12, sun_height)[:, None]
+    golden_band = (1.0 - _smoothstep(0.01, 0.20, np.abs(sun_height)))[:, None]
+    night = np.array([0.03, 0.06, 0.10], dtype=np.float32)
+    day = np.array([0.46, 0.46, 0.42], dtype=np.float32)
+    golden = np.array([1.04, 0.70, 0.44], dtype=np.float32)
+    twilight = np.array([0.44, 0.34, 0.56], dtype=np.float32)
+    warm = _mix(day, golden, golden_band * np.float32(1.2))
+    return _mix(_mix(night, warm, day_factor), twilight, golden_band * np.float32(0.18))
+
+
+def _raymarch_clouds(frame: _FrameInputs, levels, rd, max_distance, coverage_hint, distance_lod, jitter):
+    parameters = frame.parameters
+    ro = frame.cam_planet
+    count = len(rd)
+    result = np.zeros((count, 4), dtype=np.float32)
+    result[:, 3] = 1.0
+
+    base_radius = parameters.planet_radius + parameters.cloud_base_altitude
+    top_radius = base_radius + parameters.cloud_layer_thickness
+    hits_outer, t_outer0, t_outer1 = _intersect_sphere(ro, rd, top_radius)
+    hits_inner, t_inner0, t_inner1 = _intersect_sphere(ro, rd, base_radius)
+    start = np.maximum(t_outer0, 0.0)
+    # From below the cloud base, start where the ray leaves it.
+    start = np.where(hits_inner & (t_inner0 < 0.0), np.maximum(start, t_inner1), start)
+    end = np.minimum(t_outer1, max_distance)
+    rays = np.flatnonzero(hits_outer & (t_outer1 > 0.0) & (end > start))
+    if rays.size == 0:
+        return result
+
+    rd = rd[rays]
+    start = start[rays]
+    coverage_hint = coverage_hint[rays]
+    distance_lod = distance_lod[rays]
+    max_steps = parameters.cloud_max_steps
+    steps = _mix(np.float32(max_steps), np.float32(max_steps) * np.float32(0.35), distance_lod).astype(np.int32)
+    steps = np.clip(steps, 4, min(max_steps, 256))
+    step_size = (end[rays] - start) / steps
+    jitter_offset = jitter[rays] - np.float32(0.5)
+    light_dir = frame.light_dir
+
+    accum = np.zeros((len(rays), 3), dtype=np.float32)
+    transmittance = np.ones(len(rays), dtype=np.float32)
+    running = np.ones(len(rays), dtype=bool)
+    sun_intensity = max(parameters.sun_power, 0.0)
+    light_color = np.asarray(parameters.cloud_light_color, dtype=np.float32)
+    forward_scatter = np.maximum(rd @ light_dir, 0.0) ** np.float32(parameters.cloud_phase_exponent)
+    phase = _mix(0.38, 0.72, forward_scatter)
+
+    for index in range(int(steps.max())):
+        live = np.flatnonzero(running & (index < steps))
+        if live.size == 0:
+            break
+        t = start[live] + step_size[live] * (np.float32(index + 0.5) + jitter_offset[live])
+        sample_pos = ro + rd[live] * t[:, None]
+        local_normal = _normalize(sample_pos)
+        sun_height = local_normal @ light_dir
+        density = _cloud_density(frame, levels, sample_pos, coverage_hint[live], t * np.float32(frame.pixel_spread))
+        density *= np.float32(parameters.cloud_density) * _mix(1.0, 0.68, distance_lod[live])
+
+        # Grazing views through the layer are thinned.
+        view_alignment = np.abs(_dot(-rd[live], local_normal))
+        density *= _mix(0.25, 1.0, _smoothstep(0.05, 0.35, view_alignment))
+        horizon_light_dimming = _mix(0.32, 1.0, _smoothstep(0.12, 0.55, view_alignment))
+        lit = density >= 0.001
+        live = live[lit]
+        if live.size == 0:
+            continue
+        density = density[lit]
+        sun_height = sun_height[lit]
+        horizon_light_dimming = horizon_light_dimming[lit]
+
+        light_amount = _smoothstep(0.02, 0.18, sun_height)
+        sun_visibility = _smoothstep(-0.28, 0.05, sun_height)
+        low_light = _mix(0.4, 1.0, sun_visibility)
+        diffuse_dimming = _mix(0.55, 1.0, light_amount)
+        twilight_mask = _smoothstep(-0.25, 0.05, sun_height) * (1.0 - light_amount)
+        twilight_dimming = _mix(0.6, 1.0, 1.0 - twilight_mask * 0.7)
+        extinction = density * step_size[live] * np.float32(parameters.cloud_extinction)
+
+        sun_color = _cloud_sun_tint(local_normal[lit], light_dir) * sun_intensity
+        direct = (
+            light_color
+            * sun_color
+            * (light_amount * _mix(0.4, 0.82, phase[live]) * sun_visibility * low_light)[:, None]
+        )
+        direct *= (_mix(0.55, 1.0, light_amount + sun_visibility * 0.35) * horizon_light_dimming)[:, None]
+        ambient = _mix(
+            np.array([0.02, 0.025, 0.03], dtype=np.float32),
+            np.array([0.08, 0.10, 0.12], dtype=np.float32),
+            sun_visibility[:, None],
+        ) * low_light[:, None]
+        ambient *= _mix(0.5, 1.0, light_amount + sun_visibility * 0.5)[:, None]
+        warm_twilight = np.array([0.12, 0.09, 0.10], dtype=np.float32) * (
+            twilight_mask * sun_intensity * 0.18 * low_light
+        )[:, None]
+        scatter = (direct + ambient * light_color + warm_twilight) * (
+            density * step_size[live] * diffuse_dimming * twilight_dimming
+        )[:, None]
+
+        accum[live] += scatter * transmittance[live, None]
+        transmittance[live] *= np.exp(-extinction)
+        running[live[transmittance[live] < 0.01]] = False
+
+    result[rays, :3] = accum
+    result[rays, 3] = transmittance
+    return result
+
+
+def _cloud_pass(frame: _FrameInputs, levels, gbuffer, pixels):
+    parameters = frame.parameters
+    position_height, normal_flags, material, view_data = gbuffer
+    hit = normal_flags[:, 3] > -0.5
+    view_dir = np.where(
+        hit[:, None], _normalize(position_height[:, :3] - frame.cam_pos), _ray_directions(frame, pixels)
+    )
+    view_dir = _normalize(view_dir @ frame.to_planet.T)
+    surface_distance = view_data[:, 0]
+    distance_lod = np.clip(
+        np.log2(1.0 + surface_distance / max(parameters.planet_radius, 0.0001)) * np.float32(0.55), 0.0, 1.0
+    )
+    jitter = _interleaved_gradient_noise(pixels + np.float32(frame.noise_seed))
+    draw_distance = np.float32(parameters.cloud_draw_distance)
+    capped = np.minimum(surface_distance, draw_distance)
+
+    result = np.zeros((len(pixels), 4), dtype=np.float32)
+    result[:, 3] = 1.0
+    drawn = np.flatnonzero(capped > 0.0)
+    if drawn.size:
+        clouds = _raymarch_clouds(
+            frame, levels, view_dir[drawn], capped[drawn], material[drawn, 3], distance_lod[drawn], jitter[drawn]
+        )
+        fade = 1.0 - _smoothstep(draw_distance * 0.7, draw_distance, surface_distance[drawn])
+        clouds[:, :3] *= fade[:, None]
+        clouds[:, 3] = _mix(1.0, clouds[:, 3], fade)
+        result[drawn] = clouds
+    return _quantize_half(result)
+
+
+# Composite pass (composite.frag)
+
+
+def _composite_pass(frame: _FrameInputs, gbuffer, lighting, atmosphere, clouds, debug_level: int):
+    parameters = frame.parameters
+    position_height, normal_flags, material, view_data = gbuffer
+    hit = normal_flags[:, 3] > -0.5
+    level = min(max(int(debug_level), 1), 9)
+    result = np.ones((len(hit), 4), dtype=np.float32)
+
+    if level == 1:
+        result[:, :3] = np.clip(view_data[:, 0] / parameters.max_ray_distance, 0.0, 1.0)[:, None]
+        return result
+    if level == 2:
+        height_scale = parameters.height_scale
+        height_view = np.clip((position_height[:, 3] + height_scale) / (height_scale * 2.0), 0.0, 1.0)
+        result[:, :3] = height_view[:, None]
+        return result
+
+    surface = material[:, :3]
+    if level >= 4:
+        surface = surface * lighting[:, 3:4]
+    if level >= 5:
+        surface = lighting[:, :3]
+    lit_transmittance = atmosphere[:, 3:4] if level >= 6 else 1.0
+    cloud_blend = clouds[:, 3:4] if level >= 8 else np.ones((len(hit), 1), dtype=np.float32)
+
+    composite = surface * lit_transmittance * cloud_blend
+    if level >= 7:
+        composite = composite + atmosphere[:, :3] * cloud_blend
+    if level >= 9:
+        composite = composite + clouds[:, :3]
+
+    # Premultiplied: alpha is how much of what lies behind the planet is hidden.
+    behind = atmosphere[:, 3:4] if level >= 7 else 1.0
+    coverage = np.where(hit[:, None], 1.0, 1.0 - behind * cloud_blend)
+    result[:, :3] = composite
+    result[:, 3:4] = np.clip(coverage, 0.0, 1.0)
+    return result
+
+
+class ReferenceRenderer:
+    """Renders the primary planet of PlanetRenderer pass by pass on the CPU.
+
+    Bodies other than the planet are not drawn, and the planet always gets
+    its full step budgets, which PlanetRenderer also gives it whenever it
+    covers a fair part of the screen. Lookup tables and horizon maps are
+    kept per parameter set like the GPU's.
+    """
+
+    def __init__(
+        self, chunk_size: int = REFERENCE_CHUNK_SIZE, horizon_map_size: int = REFERENCE_HORIZON_MAP_SIZE
+    ):
+        self.chunk_size = chunk_size
+        self.horizon_map_size = horizon_map_size
+        self.noise_levels = _volume_pyramid(load_cloud_noise())
+        self.atmospheres = {}
+        self.horizon_maps = {}
+
+    def _atmosphere(self, parameters: PlanetParameters) -> ReferenceAtmosphere:
+        key = (float(parameters.planet_radius), float(parameters.atmosphere_radius))
+        atmosphere = self.atmospheres.get(key)
+        if atmosphere is None:
+            atmosphere = self.atmospheres[key] = ReferenceAtmosphere(*key)
+        return atmosphere
+
+    def _horizon_maps(self, parameters: PlanetParameters) -> np.ndarray:
+        key = (float(parameters.planet_radius), float(parameters.height_scale), float(parameters.sea_level))
+        maps = self.horizon_maps.get(key)
+        if maps is None:
+            maps = self.horizon_maps[key] = bake_horizon_maps(parameters, self.horizon_map_size)
+        return maps
+
+    def _frame_inputs(self, parameters, camera, calendar_state, width, height, noise_seed) -> _FrameInputs:
+        to_planet = _tilt_rotation(parameters.tilt_degrees)
+        sun_dir = compute_sun_direction(
+            calendar_state.day_fraction, calendar_state.year_fraction, parameters.tilt_degrees
+        )
+        cam_pos = np.asarray(camera.position, dtype=np.float32)
+        tan_half_fov = math.tan(math.radians(camera.fov_degrees) * 0.5)
+        time_seconds = float(calendar_state.elapsed_seconds)
+        return _FrameInputs(
+            parameters=parameters,
+            cam_pos=cam_pos,
+            cam_forward=np.asarray(camera.front, dtype=np.float32),
+            cam_right=np.asarray(camera.right, dtype=np.float32),
+            cam_up=np.asarray(camera.up, dtype=np.float32),
+            cam_planet=to_planet @ cam_pos,
+            to_planet=to_planet,
+            to_world=np.ascontiguousarray(to_planet.T),
+            sun_dir=sun_dir,
+            light_dir=_normalize(to_planet @ sun_dir),
+            tan_half_fov=tan_half_fov,
+            aspect=width / height,
+            full_size=np.array([width, height], dtype=np.float32),
+            pixel_spread=2.0 * tan_half_fov / height,
+            time_seconds=time_seconds,
+            noise_seed=time_seconds if noise_seed is None else float(noise_seed),
+        )
+
+    def render(
+        self,
+        parameters: PlanetParameters,
+        camera,
+        calendar_state: CalendarState,
+        width: int,
+        height: int,
+        debug_level: int = 9,
+        noise_seed: Optional[float] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> ReferenceFrame:
+        """Render every pass for a camera with FPSCamera's position, front,
+        right, up and fov_degrees. noise_seed overrides the march jitter
+        seed as in PlanetRenderer.render."""
+
+        frame = self._frame_inputs(parameters, camera, calendar_state, width, height, noise_seed)
+        atmosphere = self._atmosphere(parameters)
+        sky_view = atmosphere.sky_view(frame.cam_planet, frame.light_dir)
+        horizon_maps = self._horizon_maps(parameters)
+
+        pixel_count = width * height
+        targets = [np.zeros((pixel_count, 4), dtype=np.float32) for _ in range(8)]
+        chunks = math.ceil(pixel_count / self.chunk_size)
+        for chunk in range(chunks):
+            index = np.arange(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, pixel_count))
+            pixels = np.stack([index % width, index // width], axis=-1).astype(np.float32) + np.float32(0.5)
+
+            gbuffer = _gbuffer_pass(frame, pixels)
+            lighting = _lighting_pass(frame, gbuffer, horizon_maps)
+            view_dirs = _ray_directions(frame, pixels) @ frame.to_planet.T
+            sky = atmosphere.shade(
+                sky_view,
+                frame.cam_planet,
+                _normalize(view_dirs),
+                frame.light_dir,
+                gbuffer[1][:, 3] > -0.5,
+                gbuffer[3][:, 1:3],
+                gbuffer[3][:, 0],
+                parameters.sun_power,
+            )
+            sky = _quantize_half(sky)
+            clouds = _cloud_pass(frame, self.noise_levels, gbuffer, pixels)
+            composite = _composite_pass(frame, gbuffer, lighting, sky, clouds, debug_level)
+            for target, values in zip(targets, (*gbuffer, lighting, sky, clouds, composite)):
+                target[index] = values
+            if progress is not None:
+                progress(chunk + 1, chunks)
+
+        return ReferenceFrame(*(target.reshape(height, width, 4) for target in targets))
+
+
+def _parse_size(text: str):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    from gl_utils.camera import FPSCamera
+    from utils.image_io import write_image
+    from utils.persistence import load_camera_bookmark
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="image path; .png, .exr or .raw")
+    parser.add_argument("--size", type=_parse_size, default=(160, 90), help="render size, WIDTHxHEIGHT")
+    parser.add_argument("--day", type=int, default=100)
+    parser.add_argument("--hour", type=int, default=12)
+    parser.add_argument("--debug-level", type=int, default=9)
+    parser.add_argument("--bookmark", action="store_true", help="view from the saved camera bookmark")
+    args = parser.parse_args(argv)
+
+    parameters = default_planet_parameters()
+    # The window's starting view, unless a bookmark is asked for.
+    camera = FPSCamera(np.array([0.0, 0.0, parameters.planet_radius * 1.6], dtype=np.float32), yaw=-90.0, pitch=0.0)
+    camera.enable_reference_alignment(False)
+    if args.bookmark:
+        bookmark = load_camera_bookmark()
+        if bookmark is None:
+            parser.error("no camera bookmark saved")
+        camera.position = bookmark["position"]
+        camera.yaw = bookmark["yaw"]
+        camera.pitch = bookmark["pitch"]
+        camera.roll = bookmark["roll"]
+        camera.fov_degrees = bookmark["fov"]
+        camera.update_vectors()
+
+    width, height = args.size
+    calendar_state = PlanetCalendar().set_time(args.day, args.hour, 0, 0)
+    frame = ReferenceRenderer().render(
+        parameters,
+        camera,
+        calendar_state,
+        width,
+        height,
+        args.debug_level,
+        progress=lambda done, total: print(f"Chunk {done}/{total}", end="\r"),
+    )
+    print()
+    if args.output.lower().endswith(".png"):
+        write_image(args.output, frame.image())
+    else:
+        write_image(args.output, frame.composite, flip=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
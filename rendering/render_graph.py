@@ -0,0 +1,161 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from OpenGL.GL import GL_R32F, GL_RG16F, GL_RGBA8, GL_RGBA16F, GL_RGBA32F
+
+from gl_utils.buffers import create_render_target, delete_color_fbo
+from rendering.passes import PassDescriptor
+
+
+_FORMAT_BYTES = {
+    GL_RGBA8: 4,
+    GL_R32F: 4,
+    GL_RG16F: 4,
+    GL_RGBA16F: 8,
+    GL_RGBA32F: 16,
+}
+
+
+@dataclass(frozen=True)
+class TargetSpec:
+    """A logical render target: one framebuffer with an attachment per format.
+
+    Persistent targets keep their contents between frames (history buffers)
+    and are never aliased.
+    """
+
+    name: str
+    formats: Tuple[int, ...]
+    persistent: bool = False
+
+    def bytes_per_pixel(self) -> int:
+        return sum(_FORMAT_BYTES.get(internal_format, 16) for internal_format in self.formats)
+
+
+class RenderGraph:
+    """Orders passes by the targets they read and write and backs the
+    targets with as few framebuffers as their lifetimes allow.
+
+    A target lives from the pass that writes it to the last pass that samples
+    it. Transient targets with the same formats and disjoint lifetimes share
+    one physical framebuffer, so a chain of effects costs the memory of its
+    widest point rather than of every intermediate.
+    """
+
+    def __init__(self, passes: Sequence[PassDescriptor], targets: Sequence[TargetSpec]):
+        self.targets: Dict[str, TargetSpec] = {spec.name: spec for spec in targets}
+        self.order: List[PassDescriptor] = self._sort(list(passes))
+        self.slots: Dict[str, int] = {}
+        self.slot_specs: List[TargetSpec] = []
+        self._assign_slots()
+        self.physical: List[Optional[dict]] = [None] * len(self.slot_specs)
+        self.width = 0
+        self.height = 0
+
+    def _sort(self, passes: List[PassDescriptor]) -> List[PassDescriptor]:
+        writers = {}
+        for descriptor in passes:
+            target = descriptor.target
+            if target is None:
+                continue
+            if target not in self.targets:
+                raise ValueError(f"Pass '{descriptor.name}' writes undeclared target '{target}'")
+            if target in writers:
+                raise ValueError(f"Target '{target}' is written by both '{writers[target]}' and '{descriptor.name}'")
+            writers[target] = descriptor.name
+
+        dependencies = {}
+        for descriptor in passes:
+            sources = set()
+            for source in descriptor.inputs:
+                if source not in writers:
+                    raise ValueError(f"Pass '{descriptor.name}' reads '{source}', which no pass writes")
+                sources.add(writers[source])
+            dependencies[descriptor.name] = sources
+
+        # Kahn's algorithm; ties keep declaration order so the result is stable.
+        order = []
+        done = set()
+        remaining = list(passes)
+        while remaining:
+            for descriptor in remaining:
+                if dependencies[descriptor.name] <= done:
+                    break
+            else:
+                names = ", ".join(descriptor.name for descriptor in remaining)
+                raise ValueError(f"Render graph has a cycle between: {names}")
+            remaining.remove(descriptor)
+            order.append(descriptor)
+            done.add(descriptor.name)
+        return order
+
+    def _assign_slots(self):
+        first_use = {}
+        last_use = {}
+        for index, descriptor in enumerate(self.order):
+            if descriptor.target is not None:
+                first_use.setdefault(descriptor.target, index)
+                last_use[descriptor.target] = max(last_use.get(descriptor.target, index), index)
+            for source in descriptor.inputs:
+                last_use[source] = index
+
+        slot_end = []
+        for name in sorted(first_use, key=first_use.get):
+            spec = self.targets[name]
+            slot = None
+            if not spec.persistent:
+                for index, candidate in enumerate(self.slot_specs):
+                    # A pass may read one target while writing another, so the
+                    # previous occupant must be dead before this one is born.
+                    if (
+                        not candidate.persistent
+                        and candidate.formats == spec.formats
+                        and slot_end[index] < first_use[name]
+                    ):
+                        slot = index
+                        break
+            if slot is None:
+                slot = len(self.slot_specs)
+                self.slot_specs.append(spec)
+                slot_end.append(last_use[name])
+            else:
+                slot_end[slot] = last_use[name]
+            self.slots[name] = slot
+
+    def allocate(self, width: int, height: int) -> bool:
+        """(Re)create the physical targets for a new size; returns True if it did."""
+
+        if (width, height) == (self.width, self.height):
+            return False
+        self.release()
+        self.physical = [create_render_target(width, height, spec.formats) for spec in self.slot_specs]
+        self.width = width
+        self.height = height
+        return True
+
+    def release(self):
+        for target in self.physical:
+            if target is not None:
+                delete_color_fbo(target)
+        self.physical = [None] * len(self.slot_specs)
+        self.width = self.height = 0
+
+    def target(self, name: str) -> dict:
+        return self.physical[self.slots[name]]
+
+    def texture(self, source: Tuple[str, int]) -> int:
+        name, attachment = source
+        return self.target(name)["textures"][attachment]
+
+    def framebuffer(self, descriptor: PassDescriptor, output_fbo: int) -> int:
+        if descriptor.target is None:
+            return output_fbo
+        return self.target(descriptor.target)["fbo"]
+
+    @property
+    def logical_bytes(self) -> int:
+        return sum(self.targets[name].bytes_per_pixel() for name in self.slots) * self.width * self.height
+
+    @property
+    def physical_bytes(self) -> int:
+        return sum(spec.bytes_per_pixel() for spec in self.slot_specs) * self.width * self.height
@@ -0,0 +1,54 @@
+from typing import Tuple
+
+from OpenGL.GL import *
+
+from gl_utils.buffers import create_color_fbo, delete_color_fbo
+
+
+MIN_RESOLUTION_SCALE = 0.25
+
+
+def scaled_size(width: int, height: int, scale: float) -> Tuple[int, int]:
+    scale = min(max(scale, MIN_RESOLUTION_SCALE), 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class ResolutionScaler:
+    """Renders the scene below window resolution and stretches it back up.
+
+    At scale 1 the scene goes straight to the output framebuffer. Below it,
+    begin() hands out an RGBA8 target of the scaled size and present()
+    blits it to the output with linear filtering.
+    """
+
+    def __init__(self):
+        self._target = None
+
+    def begin(self, width: int, height: int, scale: float, output_fbo: int = 0) -> Tuple[int, int, int]:
+        """Framebuffer and size the scene should be rendered at this frame."""
+
+        render_width, render_height = scaled_size(width, height, scale)
+        if (render_width, render_height) == (width, height):
+            return output_fbo, width, height
+        target = self._target
+        if target is None or (target["width"], target["height"]) != (render_width, render_height):
+            if target is not None:
+                delete_color_fbo(target)
+            self._target = create_color_fbo(render_width, render_height, internal_format=GL_RGBA8)
+        return self._target["fbo"], render_width, render_height
+
+    def present(self, width: int, height: int, scale: float, output_fbo: int = 0):
+        render_width, render_height = scaled_size(width, height, scale)
+        if (render_width, render_height) == (width, height):
+            return
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self._target["fbo"])
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, output_fbo)
+        glBlitFramebuffer(
+            0, 0, render_width, render_height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_LINEAR
+        )
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def release(self):
+        if self._target is not None:
+            delete_color_fbo(self._target)
+            self._target = None
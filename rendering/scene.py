@@ -0,0 +1,241 @@
+import math
+from dataclasses import dataclass, field
+from operator import attrgetter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from rendering.constants import MAX_RAY_DISTANCE_FACTOR, PlanetParameters
+
+
+# Bodies whose bounding sphere projects to fewer pixels than this (radius) are
+# drawn as a single analytic sphere instead of running the full pass chain.
+IMPOSTOR_RADIUS_PIXELS = 24.0
+# Step budgets scale down with screen coverage until the body's radius reaches
+# this fraction of the viewport height; the scale never drops below the floor.
+FULL_DETAIL_RADIUS_FRACTION = 0.35
+MIN_STEP_BUDGET_SCALE = 0.3
+
+
+@dataclass
+class CelestialBody:
+    name: str
+    parameters: PlanetParameters
+    position: np.ndarray = field(default_factory=lambda: np.zeros(3, dtype=np.float32))
+
+    @property
+    def bounding_radius(self) -> float:
+        return max(
+            self.parameters.atmosphere_radius,
+            self.parameters.planet_radius + abs(self.parameters.height_scale),
+        )
+
+
+@dataclass
+class Scene:
+    """A primary planet at the origin plus any number of other bodies.
+
+    The primary body drives collision, gravity and the sun direction; the
+    others are only rendered.
+    """
+
+    bodies: List[CelestialBody]
+
+    @property
+    def primary(self) -> CelestialBody:
+        return self.bodies[0]
+
+
+@dataclass
+class BodyView:
+    """Per-frame visibility and level of detail for one body."""
+
+    body: CelestialBody
+    distance: float
+    scissor: Optional[Tuple[int, int, int, int]]
+    radius_pixels: float
+    budget_scale: float
+    impostor: bool
+
+
+def default_scene(parameters: PlanetParameters) -> Scene:
+    moon_radius = parameters.planet_radius * 0.27
+    moon = PlanetParameters(
+        planet_radius=moon_radius,
+        atmosphere_thickness_percent=0.6,
+        height_scale=parameters.height_scale * 0.6,
+        cloud_coverage=0.0,
+        cloud_density=0.0,
+        water_color=np.array([0.32, 0.31, 0.3], dtype=np.float32),
+        max_ray_distance=moon_radius * MAX_RAY_DISTANCE_FACTOR,
+        tilt_degrees=6.7,
+    )
+    moon.sea_level = -moon.height_scale
+    moon.scale_with_planet_radius()
+    moon_position = np.array([8.0, 2.0, -9.0], dtype=np.float32) * parameters.planet_radius
+    return Scene(
+        bodies=[
+            CelestialBody("Planet", parameters),
+            CelestialBody("Moon", moon, moon_position),
+        ]
+    )
+
+
+def _tangent_extent(lateral: float, depth: float, radius: float) -> Tuple[float, float]:
+    """Range of lateral/depth slopes covered by a circle seen from the origin."""
+
+    distance = math.hypot(lateral, depth)
+    if distance <= radius:
+        return -math.inf, math.inf
+    center_angle = math.atan2(lateral, depth)
+    half_angle = math.asin(radius / distance)
+    low = center_angle - half_angle
+    high = center_angle + half_angle
+    half_pi = math.pi * 0.5
+    low_slope = -math.inf if low <= -half_pi else math.tan(low)
+    high_slope = math.inf if high >= half_pi else math.tan(high)
+    return low_slope, high_slope
+
+
+def project_bounding_sphere(
+    center: np.ndarray,
+    radius: float,
+    cam_forward: np.ndarray,
+    cam_right: np.ndarray,
+    cam_up: np.ndarray,
+    tan_half_fov: float,
+    aspect: float,
+    width: int,
+    height: int,
+) -> Optional[Tuple[int, int, int, int]]:
+    """Pixel rectangle (x, y, w, h) covered by a sphere, or None if off-screen.
+
+    ``center`` is relative to the camera. Each screen axis is bounded by the
+    exact tangent lines of the sphere's silhouette, so the rectangle is tight
+    but never clips the body.
+    """
+
+    depth = float(np.dot(center, cam_forward))
+    x = float(np.dot(center, cam_right))
+    y = float(np.dot(center, cam_up))
+    return _project_sphere(x, y, depth, radius, tan_half_fov, aspect, width, height)
+
+
+def _project_sphere(x, y, depth, radius, tan_half_fov, aspect, width, height):
+    """project_bounding_sphere for a center given as camera-space floats."""
+
+    if depth + radius <= 0.0:
+        return None
+    x_low, x_high = _tangent_extent(x, depth, radius)
+    y_low, y_high = _tangent_extent(y, depth, radius)
+    # Slopes are converted to NDC; a sphere straddling the camera plane can
+    # cover either side entirely.
+    x_scale = 1.0 / (tan_half_fov * aspect)
+    y_scale = 1.0 / tan_half_fov
+    ndc = (
+        max(x_low * x_scale, -1.0),
+        min(x_high * x_scale, 1.0),
+        max(y_low * y_scale, -1.0),
+        min(y_high * y_scale, 1.0),
+    )
+    if ndc[0] >= ndc[1] or ndc[2] >= ndc[3]:
+        return None
+
+    x0 = int(math.floor((ndc[0] * 0.5 + 0.5) * width))
+    x1 = int(math.ceil((ndc[1] * 0.5 + 0.5) * width))
+    y0 = int(math.floor((ndc[2] * 0.5 + 0.5) * height))
+    y1 = int(math.ceil((ndc[3] * 0.5 + 0.5) * height))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def visible_bodies(
+    scene: Scene,
+    cam_pos: np.ndarray,
+    cam_forward: np.ndarray,
+    cam_right: np.ndarray,
+    cam_up: np.ndarray,
+    tan_half_fov: float,
+    width: int,
+    height: int,
+    out: Optional[List[BodyView]] = None,
+) -> List[BodyView]:
+    """Cull off-screen bodies and return the rest sorted far to near.
+
+    out, a list an earlier call returned, is refilled in place and its
+    BodyViews reused, so a frame that sees the same bodies allocates
+    nothing that outlives the call.
+    """
+
+    aspect = float(width) / float(height)
+    tan_half_fov = float(tan_half_fov)
+    views = [] if out is None else out
+    # Python floats throughout: NumPy would allocate for every product.
+    cam_x, cam_y, cam_z = cam_pos.tolist()
+    forward_x, forward_y, forward_z = cam_forward.tolist()
+    right_x, right_y, right_z = cam_right.tolist()
+    up_x, up_y, up_z = cam_up.tolist()
+    count = 0
+    for body in scene.bodies:
+        body_x, body_y, body_z = body.position.tolist()
+        dx = body_x - cam_x
+        dy = body_y - cam_y
+        dz = body_z - cam_z
+        distance = math.sqrt(dx * dx + dy * dy + dz * dz)
+        radius = body.bounding_radius
+        scissor = _project_sphere(
+            dx * right_x + dy * right_y + dz * right_z,
+            dx * up_x + dy * up_y + dz * up_z,
+            dx * forward_x + dy * forward_y + dz * forward_z,
+            radius,
+            tan_half_fov,
+            aspect,
+            width,
+            height,
+        )
+        if scissor is None:
+            continue
+
+        if distance <= radius:
+            radius_pixels = math.inf
+        else:
+            angular_radius = math.asin(radius / distance)
+            radius_pixels = math.tan(angular_radius) / tan_half_fov * height * 0.5
+        coverage = radius_pixels / (height * FULL_DETAIL_RADIUS_FRACTION)
+        budget_scale = min(max(coverage, MIN_STEP_BUDGET_SCALE), 1.0)
+        if count == len(views):
+            views.append(BodyView(body, distance, scissor, radius_pixels, budget_scale, False))
+        view = views[count]
+        view.body = body
+        view.distance = distance
+        view.scissor = scissor
+        view.radius_pixels = radius_pixels
+        view.budget_scale = budget_scale
+        view.impostor = radius_pixels < IMPOSTOR_RADIUS_PIXELS
+        count += 1
+
+    del views[count:]
+    views.sort(key=_BY_DISTANCE, reverse=True)
+    return views
+
+
+_BY_DISTANCE = attrgetter("distance")
+
+
+def tile_scissor(
+    rect: Tuple[int, int, int, int], pixel_offset: Tuple[float, float], width: int, height: int
+) -> Optional[Tuple[int, int, int, int]]:
+    """Move a full-image scissor rectangle into a tile's viewport and clip it.
+
+    The rectangle grows by a pixel on each side to cover sub-pixel jitter.
+    """
+
+    x, y, w, h = rect
+    x0 = max(x - 1 - int(math.floor(pixel_offset[0])), 0)
+    y0 = max(y - 1 - int(math.floor(pixel_offset[1])), 0)
+    x1 = min(x + w + 1 - int(math.floor(pixel_offset[0])), width)
+    y1 = min(y + h + 1 - int(math.floor(pixel_offset[1])), height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
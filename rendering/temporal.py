@@ -0,0 +1,153 @@
+from OpenGL.GL import *
+
+from gl_utils.buffers import create_color_fbo, delete_color_fbo
+from rendering.poster import subpixel_offsets
+
+
+TEMPORAL_JITTER_SAMPLES = 16
+# Weight of the new frame once the history has warmed up. Lower averages
+# more frames of jitter and march noise but trails lighting changes longer.
+TEMPORAL_BLEND = 0.1
+
+
+class TemporalAntiAliasing:
+    """Accumulates jittered frames over time while the view changes.
+
+    Every frame is rendered with the next sub-pixel offset of a Halton
+    sequence and a new march noise seed, together with the renderer's
+    velocity target. The resolve pass reprojects the history along those
+    velocities, clips it to the neighbourhood of the new frame and blends
+    the two into the other of two RGBA16F history targets, which is then
+    blitted to the window.
+    """
+
+    def __init__(self, renderer, resolve_program, blend: float = TEMPORAL_BLEND):
+        if "velocity" not in renderer.passes:
+            raise ValueError("Temporal anti-aliasing needs a renderer with a velocity program")
+        self.renderer = renderer
+        self.resolve_program = resolve_program
+        self.blend = blend
+        self.enabled = True
+        self.frame_index = 0
+        self.history_frames = 0
+        self._offsets = subpixel_offsets(TEMPORAL_JITTER_SAMPLES)
+        self._history_key = None
+        self._frame = None
+        self._history = []
+        self._current = 0
+        glUseProgram(resolve_program)
+        for unit, name in enumerate(("frameTex", "historyTex", "velocityTex")):
+            glUniform1i(glGetUniformLocation(resolve_program, name), unit)
+        glUseProgram(0)
+        self._weight_loc = glGetUniformLocation(resolve_program, "currentWeight")
+
+    @property
+    def output(self) -> dict:
+        """History target holding the last resolved frame."""
+
+        return self._history[self._current]
+
+    @property
+    def equivalent_samples(self) -> int:
+        """Roughly how many plain samples the history is worth."""
+
+        return min(self.history_frames, round(1.0 / self.blend))
+
+    def invalidate(self):
+        self.history_frames = 0
+        self.renderer.reset_motion()
+
+    def _ensure_targets(self, width, height):
+        if self._frame and self._frame["width"] == width and self._frame["height"] == height:
+            return
+        if self._frame:
+            delete_color_fbo(self._frame)
+            for target in self._history:
+                delete_color_fbo(target)
+        self._frame = create_color_fbo(width, height)
+        self._history = [create_color_fbo(width, height) for _ in range(2)]
+        self.invalidate()
+
+    def render(
+        self,
+        history_key,
+        cam_pos,
+        cam_front,
+        cam_right,
+        cam_up,
+        cam_fov_degrees,
+        width,
+        height,
+        debug_level,
+        calendar_state,
+        output_fbo=0,
+    ):
+        """Render one frame to output_fbo, the default framebuffer unless given.
+
+        history_key must change whenever the image changes in a way the
+        velocities cannot follow, such as new parameters or debug level;
+        camera motion and time of day are left to reprojection and clipping.
+        """
+
+        if history_key != self._history_key:
+            self._history_key = history_key
+            self.invalidate()
+        self._ensure_targets(width, height)
+
+        step = self.frame_index % TEMPORAL_JITTER_SAMPLES
+        jitter = self._offsets[step]
+        self.renderer.render(
+            cam_pos,
+            cam_front,
+            cam_right,
+            cam_up,
+            cam_fov_degrees,
+            width,
+            height,
+            debug_level,
+            calendar_state,
+            output_fbo=self._frame["fbo"],
+            pixel_offset=(float(jitter[0]), float(jitter[1])),
+            full_size=(width, height),
+            noise_seed=float(step * 7 + 1),
+            motion_vectors=True,
+        )
+        self._resolve(width, height)
+        self.frame_index += 1
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.output["fbo"])
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, output_fbo)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def _resolve(self, width, height):
+        history = self._history[self._current]
+        self._current = 1 - self._current
+        # A running average until the history is warm, then a fixed blend.
+        weight = max(self.blend, 1.0 / (self.history_frames + 1))
+        self.history_frames += 1
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.output["fbo"])
+        glViewport(0, 0, width, height)
+        glUseProgram(self.resolve_program)
+        glUniform1f(self._weight_loc, weight)
+        textures = (
+            self._frame["textures"][0],
+            history["textures"][0],
+            self.renderer.graph.texture(("velocity", 0)),
+        )
+        for unit, texture in enumerate(textures):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            glBindTexture(GL_TEXTURE_2D, texture)
+        glDrawArrays(GL_TRIANGLES, 0, 6)
+        glUseProgram(0)
+        # Bindings changed behind the renderer's state cache.
+        self.renderer.state.reset_bindings()
+
+    def release(self):
+        if self._frame is not None:
+            delete_color_fbo(self._frame)
+            for target in self._history:
+                delete_color_fbo(target)
+            self._frame = None
+            self._history = []
@@ -0,0 +1,171 @@
+import math
+
+import numpy as np
+
+
+# Terrain noise layout; must match terrainHeight in gbuffer_common.glsl and
+# surface_info.comp. Frequencies are per planet radius.
+TERRAIN_FREQUENCY = 8.0
+TERRAIN_DETAIL_RATIO = 2.5
+TERRAIN_BASE_WEIGHT = 0.62
+TERRAIN_DETAIL_WEIGHT = 0.38 * 0.35
+WARP_FREQUENCY = 1.15
+WARP_AMPLITUDE = 0.06
+# Fraction of height_scale the normalized fbm sum is lowered by, which puts
+# part of the surface below sea level.
+TERRAIN_HEIGHT_BIAS = 0.42
+FBM_OCTAVES = 5
+# The rendered surface along a direction solves r = R + h(dir * r), since the
+# height field is evaluated at the point itself; each iteration of r <- R + h
+# shrinks the error about tenfold over most of the planet.
+SURFACE_ITERATIONS = 4
+
+_WARP_OFFSETS = np.array([[11.7, 11.7, 11.7], [3.9, 17.2, 5.1], [-7.5, -7.5, -7.5]], dtype=np.float32)
+# Lattice corners of a noise cell, in the order the shaders' mix() tree
+# consumes them: x fastest, then y, then z.
+_CELL_CORNERS = np.array(
+    [[x, y, z] for z in (0.0, 1.0) for y in (0.0, 1.0) for x in (0.0, 1.0)], dtype=np.float32
+)
+
+# Largest gradient magnitude of the shaders' 5-octave value-noise fbm at unit
+# frequency. The worst case from the smoothstep weights alone is about 6.5,
+# but that needs every lattice difference to be maximal at once; four
+# million random samples never exceeded 2.17, so this keeps a 10% margin.
+FBM_GRADIENT_BOUND = 2.4
+
+
+def terrain_gradient_bound() -> float:
+    """Upper bound of |grad h| per unit of p / planet_radius, with h in units of height_scale.
+
+    Follows the chain rule through terrainHeight: the warp offsets the
+    lookup by at most 2 * WARP_AMPLITUDE times the warp fbm's Jacobian.
+    """
+
+    warp_jacobian = 2.0 * WARP_AMPLITUDE * math.sqrt(3.0) * WARP_FREQUENCY * FBM_GRADIENT_BOUND
+    lookup_scale = TERRAIN_FREQUENCY + warp_jacobian
+    height_gradient = FBM_GRADIENT_BOUND * (TERRAIN_BASE_WEIGHT + TERRAIN_DETAIL_WEIGHT * TERRAIN_DETAIL_RATIO)
+    return height_gradient * lookup_scale
+
+
+def terrain_lipschitz(planet_radius: float, height_scale: float) -> float:
+    """Lipschitz constant of planetSDF, length(p) - (R + h(p)).
+
+    Dividing the SDF by it gives a distance that never oversteps the
+    surface, which is what the sphere tracer in gbuffer_common.glsl relies on.
+    """
+
+    return 1.0 + terrain_gradient_bound() * abs(height_scale) / max(planet_radius, 1e-6)
+
+
+# NumPy port of the shaders' value noise. Everything stays in float32 and
+# follows the GLSL operation order, since the hash takes the fraction of a
+# product in the hundreds of thousands and amplifies any rounding change.
+
+
+def _fract(x):
+    return x - np.floor(x)
+
+
+def _hash(p: np.ndarray) -> np.ndarray:
+    p = _fract(p * np.float32(0.3183099) + np.float32(0.1))
+    p *= np.float32(17.0)
+    x, y, z = p[..., 0], p[..., 1], p[..., 2]
+    return _fract(x * y * z * (x + y + z))
+
+
+def _mix(a, b, t):
+    return a + (b - a) * t
+
+
+def _noise(p: np.ndarray) -> np.ndarray:
+    cell = np.floor(p)
+    f = p - cell
+    n = _hash(cell[..., None, :] + _CELL_CORNERS)
+    u = f * f * (np.float32(3.0) - np.float32(2.0) * f)
+    ux, uy, uz = u[..., 0:1], u[..., 1:2], u[..., 2]
+    n = _mix(n[..., 0::2], n[..., 1::2], ux)
+    n = _mix(n[..., 0::2], n[..., 1::2], uy)
+    return _mix(n[..., 0], n[..., 1], uz)
+
+
+def fbm(p: np.ndarray, octaves=None) -> np.ndarray:
+    """fbm of the shaders at points of shape (..., 3).
+
+    octaves is the fractional octave count of fbm(p, octaves) in
+    gbuffer_common.glsl, a scalar or one per point; None gives every octave.
+    """
+
+    value = np.zeros(p.shape[:-1], dtype=np.float32)
+    amplitude = np.float32(0.5)
+    if octaves is None:
+        for _ in range(FBM_OCTAVES):
+            value += amplitude * _noise(p)
+            p = p * np.float32(2.0)
+            amplitude *= np.float32(0.5)
+        return value
+
+    octaves = np.broadcast_to(np.asarray(octaves, dtype=np.float32), value.shape)
+    running = np.ones(value.shape, dtype=bool)
+    for octave in range(FBM_OCTAVES):
+        weight = np.clip(octaves - np.float32(octave), 0.0, 1.0)
+        # Octaves past the count are replaced by their mean.
+        stopped = running & (weight <= 0.0)
+        value[stopped] += amplitude - np.float32(2.0 ** -(FBM_OCTAVES + 1))
+        running &= ~stopped
+        if not running.any():
+            break
+        weight = weight[running]
+        value[running] += amplitude * (np.float32(0.5) * (np.float32(1.0) - weight) + _noise(p[running]) * weight)
+        p = p * np.float32(2.0)
+        amplitude *= np.float32(0.5)
+    return value
+
+
+def terrain_lod(footprint, planet_radius: float):
+    """terrainLod of gbuffer_common.glsl: -log2 of a footprint in planet radii."""
+
+    ratio = np.asarray(footprint, dtype=np.float32) / np.float32(planet_radius)
+    return -np.log2(np.maximum(ratio, np.float32(1e-12)))
+
+
+def fbm_octaves(lod, frequency: float):
+    """fbmOctaves of gbuffer_common.glsl: the octaves an fbm of the given base
+    frequency resolves at a lod from terrain_lod."""
+
+    return np.clip(lod - np.float32(math.log2(frequency)), 1.0, float(FBM_OCTAVES)).astype(np.float32)
+
+
+def terrain_height(points: np.ndarray, planet_radius: float, height_scale: float, footprint=None) -> np.ndarray:
+    """terrainHeight of the shaders at planet-frame points of shape (..., 3);
+    one height per point. footprint, a scalar or one per point, limits the
+    octaves as the G-buffer pass does; None gives the full detail that
+    surface_info.comp evaluates."""
+
+    scaled = np.asarray(points, dtype=np.float32) / np.float32(planet_radius)
+    warp_octaves = base_octaves = detail_octaves = None
+    if footprint is not None:
+        lod = terrain_lod(footprint, planet_radius)
+        warp_octaves = fbm_octaves(lod, WARP_FREQUENCY)[..., None]
+        base_octaves = fbm_octaves(lod, TERRAIN_FREQUENCY)
+        detail_octaves = fbm_octaves(lod, TERRAIN_FREQUENCY * TERRAIN_DETAIL_RATIO)
+    warp_lookup = scaled[..., None, :] * np.float32(WARP_FREQUENCY) + _WARP_OFFSETS
+    warp = fbm(warp_lookup, warp_octaves)
+    warped = scaled * np.float32(TERRAIN_FREQUENCY) + (warp - np.float32(0.5)) * np.float32(2.0 * WARP_AMPLITUDE)
+
+    base = fbm(warped, base_octaves)
+    detail = fbm(warped * np.float32(TERRAIN_DETAIL_RATIO), detail_octaves) * np.float32(0.35)
+    normalized = base * np.float32(TERRAIN_BASE_WEIGHT) + detail * np.float32(0.38)
+    return (normalized - np.float32(TERRAIN_HEIGHT_BIAS)) * np.float32(height_scale)
+
+
+def surface_height(
+    directions: np.ndarray, planet_radius: float, height_scale: float, iterations: int = SURFACE_ITERATIONS
+) -> np.ndarray:
+    """Terrain height where the rendered surface crosses unit directions of
+    shape (..., 3), in the planet's frame."""
+
+    directions = np.asarray(directions, dtype=np.float32)
+    radius = np.full(directions.shape[:-1], planet_radius, dtype=np.float32)
+    for _ in range(iterations):
+        radius = planet_radius + terrain_height(directions * radius[..., None], planet_radius, height_scale)
+    return radius - np.float32(planet_radius)
@@ -0,0 +1,15 @@
+#version 410 core
+
+// Writes one progressive sample; the running average comes from constant
+// alpha blending with weight 1 / (sample index + 1).
+
+out vec4 FragColor;
+
+in vec2 TexCoord;
+
+uniform sampler2D frameTex;
+
+void main() {
+    // Clamp as the display would so bright outliers don't dominate the mean.
+    FragColor = vec4(clamp(texture(frameTex, TexCoord).rgb, 0.0, 1.0), 1.0);
+}
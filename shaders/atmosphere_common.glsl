@@ -0,0 +1,214 @@
+// Physically based atmosphere shared by atmosphere.frag and the lookup table
+// stages in atmosphere_luts.comp (see rendering/atmosphere_luts.py). The
+// medium is Earth's (Rayleigh, Mie and ozone) with every height expressed as
+// a fraction of its 60 km shell and every coefficient scaled the other way,
+// so vertical optical depths match Earth's whatever the shell thickness.
+//
+// Lookup tables:
+//   transmittanceLut: transmittance from radius r to the top of the
+//     atmosphere along a ray with cosine mu to the local up (Bruneton's
+//     parameterization).
+//   multiScatteringLut: isotropic multiple-scattering radiance per unit of
+//     scattering coefficient, by sun cosine and altitude (Hillaire 2020).
+//   skyViewLut: in-scattered radiance and mean transmittance of every view
+//     direction from the camera, by azimuth from the sun and cosine to the
+//     local up. Rebuilt whenever the camera or the sun moves.
+// Radiance is for a sun of unit illuminance.
+
+uniform float planetRadius;
+uniform float atmosphereRadius;
+
+const float PI = 3.14159265359;
+
+const float EARTH_ATMOSPHERE_THICKNESS = 60.0;
+const vec3 RAYLEIGH_SCATTERING = vec3(5.802e-3, 13.558e-3, 33.1e-3);
+const float RAYLEIGH_SCALE_HEIGHT = 8.0 / EARTH_ATMOSPHERE_THICKNESS;
+const float MIE_SCATTERING = 3.996e-3;
+const float MIE_EXTINCTION = 4.440e-3;
+const float MIE_SCALE_HEIGHT = 1.2 / EARTH_ATMOSPHERE_THICKNESS;
+const float MIE_ASYMMETRY = 0.8;
+const vec3 OZONE_ABSORPTION = vec3(0.650e-3, 1.881e-3, 0.085e-3);
+const float OZONE_CENTER = 25.0 / EARTH_ATMOSPHERE_THICKNESS;
+const float OZONE_HALF_WIDTH = 15.0 / EARTH_ATMOSPHERE_THICKNESS;
+const vec3 GROUND_ALBEDO = vec3(0.3);
+// Angular radius of the sun, which softens the edge of the planet's shadow.
+const float SUN_ANGULAR_RADIUS = 0.004675;
+
+struct AtmosphereMedium {
+    vec3 rayleighScattering;
+    float mieScattering;
+    vec3 extinction;
+};
+
+float atmosphereThickness() {
+    return max(atmosphereRadius - planetRadius, 1e-3);
+}
+
+AtmosphereMedium sampleMedium(float r) {
+    float thickness = atmosphereThickness();
+    float scale = EARTH_ATMOSPHERE_THICKNESS / thickness;
+    float h = clamp((r - planetRadius) / thickness, 0.0, 1.0);
+    float rayleigh = exp(-h / RAYLEIGH_SCALE_HEIGHT) * scale;
+    float mie = exp(-h / MIE_SCALE_HEIGHT) * scale;
+    float ozone = max(1.0 - abs(h - OZONE_CENTER) / OZONE_HALF_WIDTH, 0.0) * scale;
+
+    AtmosphereMedium medium;
+    medium.rayleighScattering = RAYLEIGH_SCATTERING * rayleigh;
+    medium.mieScattering = MIE_SCATTERING * mie;
+    medium.extinction = medium.rayleighScattering + vec3(MIE_EXTINCTION * mie) + OZONE_ABSORPTION * ozone;
+    return medium;
+}
+
+float rayleighPhase(float cosTheta) {
+    return 3.0 / (16.0 * PI) * (1.0 + cosTheta * cosTheta);
+}
+
+// Cornette-Shanks.
+float miePhase(float cosTheta) {
+    float g = MIE_ASYMMETRY;
+    float g2 = g * g;
+    float denom = max(1.0 + g2 - 2.0 * g * cosTheta, 1e-4);
+    return 3.0 / (8.0 * PI) * (1.0 - g2) * (1.0 + cosTheta * cosTheta) / ((2.0 + g2) * denom * sqrt(denom));
+}
+
+// Squared radii are formed as products of sums and differences: at planet
+// scale r * r loses the few kilometres the atmosphere spans.
+float distanceToAtmosphereTop(float r, float mu) {
+    float discriminant = (atmosphereRadius - r) * (atmosphereRadius + r) + r * r * mu * mu;
+    return max(-r * mu + sqrt(max(discriminant, 0.0)), 0.0);
+}
+
+float distanceToGround(float r, float mu) {
+    float discriminant = (planetRadius - r) * (planetRadius + r) + r * r * mu * mu;
+    return max(-r * mu - sqrt(max(discriminant, 0.0)), 0.0);
+}
+
+bool rayHitsGround(float r, float mu) {
+    return mu < 0.0 && (planetRadius - r) * (planetRadius + r) + r * r * mu * mu >= 0.0;
+}
+
+// Maps [0, 1] onto the texel centres of a lookup table row of n texels, so
+// both ends are sampled exactly.
+float unitToTexel(float x, float n) {
+    return 0.5 / n + x * (1.0 - 1.0 / n);
+}
+
+float texelToUnit(float u, float n) {
+    return (u - 0.5 / n) / (1.0 - 1.0 / n);
+}
+
+float horizonDistance() {
+    return sqrt(max((atmosphereRadius - planetRadius) * (atmosphereRadius + planetRadius), 0.0));
+}
+
+vec2 transmittanceUv(float r, float mu, vec2 size) {
+    float H = horizonDistance();
+    float rho = sqrt(max((r - planetRadius) * (r + planetRadius), 0.0));
+    float d = distanceToAtmosphereTop(r, mu);
+    float dMin = atmosphereRadius - r;
+    float dMax = rho + H;
+    float xMu = (d - dMin) / max(dMax - dMin, 1e-6);
+    float xR = rho / H;
+    return vec2(unitToTexel(clamp(xMu, 0.0, 1.0), size.x), unitToTexel(clamp(xR, 0.0, 1.0), size.y));
+}
+
+void transmittanceRMu(vec2 uv, vec2 size, out float r, out float mu) {
+    float xMu = texelToUnit(uv.x, size.x);
+    float xR = texelToUnit(uv.y, size.y);
+    float H = horizonDistance();
+    float rho = H * xR;
+    r = sqrt(rho * rho + planetRadius * planetRadius);
+    float dMin = atmosphereRadius - r;
+    float dMax = rho + H;
+    float d = dMin + xMu * (dMax - dMin);
+    mu = d == 0.0 ? 1.0 : (H * H - rho * rho - d * d) / (2.0 * r * d);
+    mu = clamp(mu, -1.0, 1.0);
+}
+
+vec2 multiScatteringUv(float r, float muSun, vec2 size) {
+    float altitude = clamp((r - planetRadius) / atmosphereThickness(), 0.0, 1.0);
+    return vec2(unitToTexel(muSun * 0.5 + 0.5, size.x), unitToTexel(altitude, size.y));
+}
+
+// View cosines at which a ray from radius r grazes the ground, and above
+// which it misses the atmosphere (1 from inside, where nothing is missed).
+void skyViewLimits(float r, out float muHorizon, out float muMax) {
+    float sinHorizon = clamp(planetRadius / r, 0.0, 1.0);
+    muHorizon = -sqrt(max(1.0 - sinHorizon * sinHorizon, 0.0));
+    float sinTop = clamp(atmosphereRadius / r, 0.0, 1.0);
+    muMax = r > atmosphereRadius ? -sqrt(max(1.0 - sinTop * sinTop, 0.0)) : 1.0;
+}
+
+// v puts the ground limb at 0.5, with resolution gathered toward it from
+// both sides; u is sin(azimuth / 2) for the azimuth from the sun, which
+// gathers resolution toward the sun and needs no inverse trigonometry.
+// Rays are mirrored about the plane holding the sun, like the sky.
+vec2 skyViewUv(float r, float mu, float cosAzimuth, vec2 size) {
+    float muHorizon;
+    float muMax;
+    skyViewLimits(r, muHorizon, muMax);
+    float v;
+    if (mu < muHorizon) {
+        float x = clamp((mu + 1.0) / max(muHorizon + 1.0, 1e-6), 0.0, 1.0);
+        v = 0.5 - 0.5 * sqrt(1.0 - x);
+    } else {
+        float y = clamp((mu - muHorizon) / max(muMax - muHorizon, 1e-6), 0.0, 1.0);
+        v = 0.5 + 0.5 * sqrt(y);
+    }
+    float u = sqrt(clamp(0.5 - 0.5 * cosAzimuth, 0.0, 1.0));
+    return vec2(unitToTexel(u, size.x), unitToTexel(v, size.y));
+}
+
+void skyViewCosines(vec2 uv, vec2 size, float r, out float mu, out float cosAzimuth) {
+    float muHorizon;
+    float muMax;
+    skyViewLimits(r, muHorizon, muMax);
+    float v = texelToUnit(uv.y, size.y);
+    if (v < 0.5) {
+        float x = 1.0 - (1.0 - 2.0 * v) * (1.0 - 2.0 * v);
+        mu = -1.0 + x * (muHorizon + 1.0);
+    } else {
+        float y = (2.0 * v - 1.0) * (2.0 * v - 1.0);
+        mu = muHorizon + y * (muMax - muHorizon);
+    }
+    float u = texelToUnit(uv.x, size.x);
+    cosAzimuth = 1.0 - 2.0 * u * u;
+}
+
+// Cosine of the azimuth of rd around up, measured from the sun.
+float sunCosAzimuth(vec3 up, vec3 rd, vec3 lightDir) {
+    vec3 viewSide = rd - up * dot(rd, up);
+    vec3 sunSide = lightDir - up * dot(lightDir, up);
+    float lengths2 = dot(viewSide, viewSide) * dot(sunSide, sunSide);
+    if (lengths2 < 1e-16) {
+        return 1.0;
+    }
+    return clamp(dot(viewSide, sunSide) * inversesqrt(lengths2), -1.0, 1.0);
+}
+
+uniform sampler2D transmittanceLut;
+
+vec3 transmittanceToTop(float r, float mu) {
+    return texture(transmittanceLut, transmittanceUv(r, mu, vec2(textureSize(transmittanceLut, 0)))).rgb;
+}
+
+// Transmittance over distance d from radius r along a ray with cosine mu,
+// as the ratio of two rays to the top. Downward rays are looked up in
+// reverse, since rays toward the ground are not in the table.
+vec3 transmittanceAlong(float r, float mu, float d) {
+    float rd = sqrt(max(d * d + 2.0 * r * mu * d + r * r, planetRadius * planetRadius));
+    float muD = clamp((r * mu + d) / rd, -1.0, 1.0);
+    vec3 ratio = mu < 0.0
+        ? transmittanceToTop(rd, -muD) / max(transmittanceToTop(r, -mu), vec3(1e-8))
+        : transmittanceToTop(r, mu) / max(transmittanceToTop(rd, muD), vec3(1e-8));
+    return min(ratio, vec3(1.0));
+}
+
+// Sunlight reaching radius r, faded out over the sun's disc as it sets
+// behind the planet.
+vec3 sunTransmittance(float r, float muSun) {
+    float sinHorizon = clamp(planetRadius / r, 0.0, 1.0);
+    float cosHorizon = -sqrt(max(1.0 - sinHorizon * sinHorizon, 0.0));
+    float spread = sinHorizon * SUN_ANGULAR_RADIUS;
+    return transmittanceToTop(r, muSun) * smoothstep(-spread, spread, muSun - cosHorizon);
+}
@@ -8,6 +8,30 @@ uniform sampler2D gPositionHeight;
 uniform sampler2D gNormalFlags;
 uniform sampler2D gMaterial;
 uniform sampler2D gViewData;
+uniform sampler3D cloudNoise;
+
+// The baked noise volume tiles every CLOUD_NOISE_CELLS cells of its lowest
+// octave (rendering/cloud_noise.py); R = base, G = billow, B = detail.
+const float CLOUD_NOISE_CELLS = 4.0;
+// Lookup frequency of each channel in cloudShapeNoise.
+const vec3 CLOUD_SHAPE_FREQUENCIES = vec3(18.0, 9.5, 42.0);
+// Shape noise at or below this leaves no density whatever the coverage.
+const float CLOUD_SHAPE_THRESHOLD = 0.48;
+
+// Empty-space skipping in raymarchClouds; 0 gives the uniform march that
+// benchmarks/cloud_skipping.py compares against.
+#ifndef CLOUD_EMPTY_SKIPPING
+#define CLOUD_EMPTY_SKIPPING 1
+#endif
+// Fine steps per coarse step through empty space, and the longest coarse
+// step in texels of the detail noise. A coarse sample only counts as empty
+// CLOUD_SKIP_MARGIN below the shape threshold, which keeps clouds that
+// start between two coarse samples from being stepped over; at these
+// settings benchmarks/cloud_skipping.py finds no difference from the
+// uniform march.
+const int CLOUD_SKIP_STEPS = 6;
+const float CLOUD_SKIP_DETAIL_TEXELS = 3.0;
+const float CLOUD_SKIP_MARGIN = 0.03;
 
 uniform vec3 camPos;
 uniform vec3 camForward;
@@ -24,12 +48,16 @@ uniform float cloudDrawDistance;
 uniform vec3 cloudLightColor;
 uniform float maxRayDistance;
 uniform float aspect;
+uniform float tanHalfFov;
+uniform vec2 pixelOffset;
+uniform vec2 fullResolution;
 uniform int cloudMaxSteps;
 uniform float cloudExtinction;
 uniform float cloudPhaseExponent;
 uniform float cloudAnimationSpeed;
 uniform mat3 worldToPlanet;
 uniform float timeSeconds;
+uniform float noiseSeed;
 
 vec3 computeSunTint(vec3 upDir, vec3 lightDir) {
     float sunHeight = clamp(dot(upDir, lightDir), -1.0, 1.0);
@@ -117,27 +145,37 @@ float cloudCoverageField(vec3 dir) {
     return clamp(smoothstep(start, end, adjusted), 0.0, 1.0);
 }
 
-float cloudShapeNoise(vec3 p) {
+// Ray-cone width of one pixel per unit of distance; set in main().
+float pixelSpread = 0.0;
+
+// footprint is the width a sample covers. Mip levels come from it rather
+// than from screen derivatives: neighbouring pixels march different
+// segments and, with skipping, different sample positions.
+float cloudShapeNoise(vec3 p, float footprint) {
     vec3 normalizedP = p / planetRadius;
     float cloudTime = timeSeconds * cloudAnimationSpeed;
     vec3 flowOffset = vec3(cloudTime * 0.0011, cloudTime * 0.0005, -cloudTime * 0.0008);
     vec3 warped = normalizedP + flowOffset;
 
-    float base = fbm(warped * 18.0 + vec3(6.1, 0.9, -2.4));
-    float billow = abs(fbm(warped * 9.5 + vec3(-3.0, 2.2, 3.8)) * 2.0 - 1.0);
-    float detail = fbm(warped * 42.0 - vec3(2.6, 4.8, 1.4));
+    vec3 lookup = warped / CLOUD_NOISE_CELLS;
+    vec3 texels = CLOUD_SHAPE_FREQUENCIES * (float(textureSize(cloudNoise, 0).x) / (CLOUD_NOISE_CELLS * planetRadius));
+    vec3 lod = log2(max(footprint * texels, vec3(1e-6)));
+
+    float base = textureLod(cloudNoise, lookup * CLOUD_SHAPE_FREQUENCIES.x + vec3(0.61, 0.09, -0.24), lod.x).r;
+    float billow = textureLod(cloudNoise, lookup * CLOUD_SHAPE_FREQUENCIES.y + vec3(-0.30, 0.22, 0.38), lod.y).g;
+    float detail = textureLod(cloudNoise, lookup * CLOUD_SHAPE_FREQUENCIES.z - vec3(0.26, 0.48, 0.14), lod.z).b;
     return base * 0.45 + billow * 0.4 + detail * 0.25;
 }
 
-float sampleCloudDensity(vec3 p, float coverageHint) {
+float sampleCloudDensity(vec3 p, float coverageHint, float footprint) {
     float layerBaseRadius = planetRadius + cloudBaseAltitude;
     float heightNorm = clamp((length(p) - layerBaseRadius) / max(cloudLayerThickness, 0.001), 0.0, 1.0);
 
     float coverage = cloudCoverageField(normalize(p));
     coverage = mix(coverage, coverageHint, 0.35);
 
-    float shape = cloudShapeNoise(p);
-    float density = (shape - 0.48) * 2.1;
+    float shape = cloudShapeNoise(p, footprint);
+    float density = (shape - CLOUD_SHAPE_THRESHOLD) * 2.1;
     density = clamp(density * coverage, 0.0, 1.0);
 
     float bottomFade = smoothstep(0.04, 0.24, heightNorm);
@@ -146,8 +184,8 @@ float sampleCloudDensity(vec3 p, float coverageHint) {
 }
 
 vec3 rayDirection(vec2 uv) {
-    uv = uv * 2.0 - 1.0;
     uv.x *= aspect;
+    uv *= tanHalfFov;
     return normalize(camForward + uv.x * camRight + uv.y * camUp);
 }
 
@@ -201,14 +239,45 @@ vec4 raymarchClouds(vec3 rayOrigin, vec3 rayDir, float maxDistance, float covera
     float transmittance = 1.0;
     vec3 lightDir = normalize(worldToPlanet * sunDir);
 
-    for (int i = 0; i < 256; i++) {
-        if (i >= adaptiveSteps) break;
-        float t = start + stepSize * (float(i) + 0.5 + jitterOffset);
+    // Two-level march over the fine sample positions. In coarse mode only
+    // every skipSteps-th position gets a cheap presence test; when one
+    // passes, the march backs up to the first position after the last
+    // empty test and takes full samples from there, until a coarse step's
+    // worth of them in a row comes back empty.
+    float detailTexel = planetRadius * CLOUD_NOISE_CELLS / (CLOUD_SHAPE_FREQUENCIES.z * float(textureSize(cloudNoise, 0).x));
+    int skipSteps = clamp(int(CLOUD_SKIP_DETAIL_TEXELS * detailTexel / stepSize), 1, CLOUD_SKIP_STEPS);
+    bool coarse = CLOUD_EMPTY_SKIPPING != 0 && skipSteps > 1;
+    int sampleIndex = 0;
+    int lastEmptyIndex = -1;
+    int emptyRun = 0;
+
+    // Every position is tested at most once in each mode.
+    for (int i = 0; i < 512; i++) {
+        if (sampleIndex >= adaptiveSteps) break;
+        float t = start + stepSize * (float(sampleIndex) + 0.5 + jitterOffset);
         vec3 samplePos = rayOrigin + rayDir * t;
+        float footprint = t * pixelSpread;
+
+        if (coarse) {
+            // Shape noise alone: coverage only scales it, and the coverage
+            // field is most of a full sample's cost.
+            if (cloudShapeNoise(samplePos, footprint) > CLOUD_SHAPE_THRESHOLD - CLOUD_SKIP_MARGIN) {
+                coarse = false;
+                emptyRun = 0;
+                sampleIndex = lastEmptyIndex + 1;
+            } else if (sampleIndex == adaptiveSteps - 1) {
+                break;
+            } else {
+                lastEmptyIndex = sampleIndex;
+                sampleIndex = min(sampleIndex + skipSteps, adaptiveSteps - 1);
+            }
+            continue;
+        }
+        sampleIndex++;
 
         vec3 localNormal = normalize(samplePos);
         float sunHeight = dot(localNormal, lightDir);
-        float density = sampleCloudDensity(samplePos, coverageHint) * cloudDensity;
+        float density = sampleCloudDensity(samplePos, coverageHint, footprint) * cloudDensity;
         density *= mix(1.0, 0.68, distanceLod);
 
         // Thin clouds along grazing angles so the horizon view doesn't look overly
@@ -221,8 +290,14 @@ vec4 raymarchClouds(vec3 rayOrigin, vec3 rayDir, float maxDistance, float covera
         float horizonLightDimming = mix(0.32, 1.0, smoothstep(0.12, 0.55, viewAlignment));
         density *= horizonFade;
         if (density < 0.001) {
+            emptyRun++;
+            if (CLOUD_EMPTY_SKIPPING != 0 && skipSteps > 1 && emptyRun >= skipSteps) {
+                coarse = true;
+                lastEmptyIndex = sampleIndex - 1;
+            }
             continue;
         }
+        emptyRun = 0;
 
         float lightAmount = smoothstep(0.02, 0.18, sunHeight);
         float sunVisibility = smoothstep(-0.28, 0.05, sunHeight);
@@ -266,11 +341,13 @@ void main() {
     bool hit = normalFlags.w > -0.5;
 
     vec3 camPlanet = worldToPlanet * camPos;
-    vec3 viewDirWorld = hit ? normalize(pos - camPos) : rayDirection(uv);
+    vec2 pixel = gl_FragCoord.xy + pixelOffset;
+    pixelSpread = 2.0 * tanHalfFov / fullResolution.y;
+    vec3 viewDirWorld = hit ? normalize(pos - camPos) : rayDirection((pixel / fullResolution) * 2.0 - 1.0);
     vec3 viewDirPlanet = normalize(worldToPlanet * viewDirWorld);
     float surfaceDistance = viewData.x;
     float distanceLod = computeDistanceLod(surfaceDistance);
-    float jitter = interleavedGradientNoise(gl_FragCoord.xy + timeSeconds);
+    float jitter = interleavedGradientNoise(pixel + noiseSeed);
     float cappedDistance = min(surfaceDistance, cloudDrawDistance);
     if (cappedDistance <= 0.0) {
         FragColor = vec4(0.0, 0.0, 0.0, 1.0);
@@ -101,7 +101,7 @@ void main() {
     bool hitSurface = hit;
     float litTransmittance = 1.0;
     if (level >= 6) {
-        litTransmittance = hitSurface ? mix(1.0, atmosphereTransmittance, 0.75) : atmosphereTransmittance;
+        litTransmittance = atmosphereTransmittance;
     }
 
     float cloudBlend = (level >= 8) ? cloudTransmittance : 1.0;
@@ -109,13 +109,20 @@ void main() {
     vec3 composite = surface * litTransmittance * cloudBlend;
 
     if (level >= 7) {
-        float surfaceHaze = hitSurface ? 0.55 : 1.0;
-        composite += atmosphere * surfaceHaze * cloudBlend;
+        composite += atmosphere * cloudBlend;
     }
 
     if (level >= 9) {
         composite += clouds;
     }
 
-    FragColor = vec4(composite, 1.0);
+    // Output is premultiplied: alpha is how much of whatever lies behind this
+    // body (space or farther bodies) is hidden by its surface, air and clouds.
+    float coverage = 1.0;
+    if (!hitSurface) {
+        float behindAtmosphere = (level >= 7) ? atmosphereTransmittance : 1.0;
+        coverage = 1.0 - behindAtmosphere * cloudBlend;
+    }
+
+    FragColor = vec4(composite, clamp(coverage, 0.0, 1.0));
 }
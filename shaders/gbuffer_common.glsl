@@ -0,0 +1,502 @@
+// Shared by gbuffer.frag and gbuffer.comp; included after their outputs.
+
+// Camera + Lighting
+uniform vec3 camPos;
+uniform vec3 camForward;
+uniform vec3 camRight;
+uniform vec3 camUp;
+uniform vec3 sunDir;
+uniform float sunPower;
+uniform float aspect;
+uniform float tanHalfFov;
+
+// Planet Parameters
+uniform float planetRadius;
+uniform float atmosphereRadius;
+uniform float heightScale;
+uniform float maxRayDistance;
+uniform float seaLevel;
+uniform int planetMaxSteps;
+// Over-relaxation factor for sphere tracing; 1 takes exactly the safe step.
+uniform float planetStepScale;
+uniform float planetMinStepFactor;
+// Lipschitz constant of planetSDF (rendering/terrain.py); planetSDF divided
+// by it never oversteps the surface.
+uniform float terrainLipschitz;
+uniform vec2 resolution;
+// Offset of this viewport inside the full image (tile origin plus sub-pixel
+// jitter) and the full image size; zero and resolution for normal frames.
+uniform vec2 pixelOffset;
+uniform vec2 fullResolution;
+uniform mat3 planetToWorld;
+uniform mat3 worldToPlanet;
+// Offsets the per-pixel march jitter; progressive rendering changes it every
+// sample so the jitter averages out.
+uniform float noiseSeed;
+
+// Water Parameters
+uniform vec3 waterColor;
+uniform float cloudCoverage;
+
+// Helpers
+float hash(vec3 p) {
+    p = fract(p * 0.3183099 + vec3(0.1));
+    p *= 17.0;
+    return fract(p.x * p.y * p.z * (p.x + p.y + p.z));
+}
+
+float noise(vec3 p) {
+    vec3 i = floor(p);
+    vec3 f = fract(p);
+    float n000 = hash(i + vec3(0,0,0));
+    float n001 = hash(i + vec3(0,0,1));
+    float n010 = hash(i + vec3(0,1,0));
+    float n011 = hash(i + vec3(0,1,1));
+    float n100 = hash(i + vec3(1,0,0));
+    float n101 = hash(i + vec3(1,0,1));
+    float n110 = hash(i + vec3(1,1,0));
+    float n111 = hash(i + vec3(1,1,1));
+    vec3 u = f*f*(3.0 - 2.0*f);
+    return mix(
+        mix(mix(n000, n100, u.x), mix(n010, n110, u.x), u.y),
+        mix(mix(n001, n101, u.x), mix(n011, n111, u.x), u.y),
+        u.z
+    );
+}
+
+const int FBM_OCTAVES = 5;
+
+// fbm with a fractional octave count. Octaves past the count are replaced by
+// their mean and the last one fades in, so dropping detail neither shifts the
+// average nor pops.
+float fbm(vec3 p, float octaves) {
+    float v = 0.0;
+    float a = 0.5;
+    for (int i = 0; i < FBM_OCTAVES; i++) {
+        float weight = clamp(octaves - float(i), 0.0, 1.0);
+        if (weight <= 0.0) {
+            // Mean of the skipped octaves: 0.5 * (a + a/2 + ...).
+            v += a - exp2(-float(FBM_OCTAVES + 1));
+            break;
+        }
+        v += a * mix(0.5, noise(p), weight);
+        p *= 2.0;
+        a *= 0.5;
+    }
+    return v;
+}
+
+// Ray-cone width of one pixel per unit of distance; set in main().
+float pixelSpread = 0.0;
+
+// Width of the surface patch a pixel covers at p, distance t along rd.
+// Grazing rays stretch it along the surface; the square root takes the
+// geometric mean of the two axes, as an isotropic filter has to.
+float surfaceFootprint(vec3 p, vec3 rd, float t) {
+    float cosine = abs(dot(rd, p)) * inversesqrt(dot(p, p));
+    return max(t, 0.0) * pixelSpread * inversesqrt(max(cosine, 0.05));
+}
+
+// Octaves an fbm of the given base frequency (cells per planet radius) can
+// resolve when its lattice cells must stay at least two footprints wide, the
+// Nyquist limit. lod is -log2(footprint / planetRadius), shared by all the
+// fbm calls at one point so each only costs an add.
+float terrainLod(float footprint) {
+    return -log2(max(footprint / planetRadius, 1e-12));
+}
+
+float fbmOctaves(float lod, float frequency) {
+    return clamp(lod - log2(frequency), 1.0, float(FBM_OCTAVES));
+}
+
+float cloudCoverageField(vec3 dir) {
+    float octaves = float(FBM_OCTAVES);
+    float bands = fbm(dir * 3.1 + vec3(1.7, -2.2, 0.5), octaves);
+    float streaks = fbm(dir * 7.2 + vec3(-4.1, 2.6, 3.3), octaves);
+    float puffs = fbm(dir * 12.5 + vec3(5.1, -1.9, 3.6), octaves);
+    float coverage = bands * 0.55 + streaks * 0.35 + puffs * 0.25;
+    float coverageControl = clamp(cloudCoverage / 1.5, 0.0, 1.0);
+    float coverageGain = mix(0.85, 1.85, coverageControl);
+    float coverageBias = mix(-0.1, 0.32, coverageControl);
+    float adjusted = clamp(coverage * coverageGain + coverageBias, 0.0, 1.0);
+    float start = mix(0.44, 0.18, coverageControl);
+    float end = mix(0.82, 0.68, coverageControl);
+    return clamp(smoothstep(start, end, adjusted), 0.0, 1.0);
+}
+
+// Terrain Height and SDF
+// footprint limits the octaves to what a pixel can resolve; 0 gives the
+// full-detail surface that surface_info.comp evaluates.
+float terrainHeight(vec3 p, float footprint) {
+    vec3 scaledP = p / planetRadius;
+
+    float warpFreq = 1.15;
+    float warpAmp = 0.06;
+
+    float lod = terrainLod(footprint);
+    float warpOctaves = fbmOctaves(lod, warpFreq);
+    vec3 warp = vec3(
+        fbm(scaledP * warpFreq + vec3(11.7), warpOctaves),
+        fbm(scaledP * warpFreq + vec3(3.9, 17.2, 5.1), warpOctaves),
+        fbm(scaledP * warpFreq - vec3(7.5), warpOctaves)
+    );
+
+    vec3 warpedP = scaledP * 8.0 + (warp - 0.5) * 2.0 * warpAmp;
+
+    float base = fbm(warpedP, fbmOctaves(lod, 8.0));
+    float detail = fbm(warpedP * 2.5, fbmOctaves(lod, 20.0)) * 0.35;
+
+    float normalized = base * 0.62 + detail * 0.38;
+    // Bias the terrain downward so a portion of the surface sits below sea level,
+    // revealing oceans instead of an all-land sphere.
+    return (normalized - 0.42) * heightScale;
+}
+
+float planetSDF(vec3 p, float footprint) {
+    float r = length(p);
+    float h = terrainHeight(p, footprint);
+    return r - (planetRadius + h);
+}
+
+vec3 rayDirection(vec2 uv) {
+    uv.x *= aspect;
+    uv *= tanHalfFov;
+    return normalize(camForward + uv.x * camRight + uv.y * camUp);
+}
+
+float interleavedGradientNoise(vec2 pixel) {
+    float f = dot(pixel, vec2(0.06711056, 0.00583715));
+    return fract(52.9829189 * fract(f));
+}
+
+float computeLodFactor(vec3 ro, vec3 rd) {
+    float altitude = max(length(ro) - planetRadius, 0.0);
+    float distanceLod = log2(1.0 + altitude / max(planetRadius, 0.0001));
+    float horizonAlign = pow(1.0 - abs(dot(normalize(ro), rd)), 2.2);
+    return clamp(mix(distanceLod, distanceLod + horizonAlign * 0.5, 0.65), 0.0, 1.0);
+}
+
+const int PLANET_REFINE_STEPS = 3;
+
+// Locate the crossing between a point above the surface (tNear, dNear > 0)
+// and one below it (tFar, dFar <= 0) with safeguarded secant steps.
+float refineCrossing(vec3 ro, vec3 rd, float tNear, float dNear, float tFar, float dFar) {
+    for (int i = 0; i < PLANET_REFINE_STEPS; i++) {
+        float span = tFar - tNear;
+        float tMid = tNear + span * clamp(dNear / max(dNear - dFar, 1e-6), 0.1, 0.9);
+        vec3 p = ro + rd * tMid;
+        float d = planetSDF(p, surfaceFootprint(p, rd, tMid));
+        if (d > 0.0) {
+            tNear = tMid;
+            dNear = d;
+        } else {
+            tFar = tMid;
+            dFar = d;
+        }
+    }
+    return tNear + (tFar - tNear) * clamp(dNear / max(dNear - dFar, 1e-6), 0.0, 1.0);
+}
+
+// Sphere-tracing state of one ray. Kept in a struct so the compute path can
+// store it between the rounds of its work queue.
+const int MARCH_RUNNING = 0;
+const int MARCH_CROSSED = 1;
+const int MARCH_MISSED = 2;
+
+struct PlanetMarch {
+    float t;
+    float d;
+    float tPrev;
+    float dPrev;
+    float prevRadius;
+    float stepLength;
+    float omega;
+    float minStepLength;
+    float tMax;
+    int step;
+    int stepBudget;
+    int status;
+};
+
+PlanetMarch beginMarch(float lodFactor, float jitter, float tMin, float tMax) {
+    PlanetMarch m;
+    int stepBudget = int(mix(float(planetMaxSteps), float(planetMaxSteps) * 0.55, lodFactor));
+    m.stepBudget = max(stepBudget, 1);
+
+    float minStep = mix(planetMinStepFactor * 0.65, planetMinStepFactor * 1.5, lodFactor);
+    float eps = max(heightScale * 0.01, planetRadius * 0.0001);
+    m.minStepLength = eps * minStep;
+    m.omega = clamp(planetStepScale, 0.1, 1.95);
+
+    m.t = tMin + eps * jitter;
+    m.d = 0.0;
+    m.tPrev = m.t;
+    m.dPrev = 0.0;
+    m.prevRadius = 0.0;
+    m.stepLength = 0.0;
+    m.tMax = tMax;
+    m.step = 0;
+    m.status = MARCH_RUNNING;
+    return m;
+}
+
+// Take up to maxSteps steps of the march, stopping early once the ray
+// crosses the surface, leaves its segment or runs out of budget.
+void advanceMarch(inout PlanetMarch m, vec3 ro, vec3 rd, int maxSteps) {
+    float invLipschitz = 1.0 / max(terrainLipschitz, 1.0);
+    for (int i = 0; i < maxSteps; i++) {
+        if (m.step >= m.stepBudget) {
+            m.status = MARCH_MISSED;
+            return;
+        }
+        m.step++;
+        vec3 p = ro + rd * m.t;
+        m.d = planetSDF(p, surfaceFootprint(p, rd, m.t));
+        float radius = abs(m.d) * invLipschitz;
+
+        // An over-relaxed step is only safe while the bounding spheres of
+        // consecutive samples overlap; otherwise surface may hide in the gap,
+        // so go back and continue with plain sphere tracing.
+        if (m.omega > 1.0 && m.step > 1 && radius + m.prevRadius < m.stepLength) {
+            m.omega = 1.0;
+            m.stepLength = max(m.prevRadius, m.minStepLength);
+            m.t = m.tPrev + m.stepLength;
+            continue;
+        }
+
+        if (m.d < 0.0) {
+            m.status = MARCH_CROSSED;
+            return;
+        }
+
+        m.tPrev = m.t;
+        m.dPrev = m.d;
+        m.prevRadius = radius;
+        // Near the surface the floor makes the march step through it rather
+        // than creep up on it; the crossing is refined afterwards.
+        m.stepLength = max(radius * m.omega, m.minStepLength);
+        m.t += m.stepLength;
+        if (m.t > m.tMax) {
+            m.status = MARCH_MISSED;
+            return;
+        }
+    }
+}
+
+// Rays that stopped without crossing miss; so do any still running.
+bool finishMarch(PlanetMarch m, vec3 ro, vec3 rd, out vec3 pos, out float t) {
+    t = m.t;
+    pos = vec3(0.0);
+    if (m.status != MARCH_CROSSED) {
+        return false;
+    }
+
+    // Refine outside the loop so rays still marching don't wait on it. A
+    // march that starts below the surface has no bracket and hits as is.
+    if (m.dPrev > 0.0) {
+        t = refineCrossing(ro, rd, m.tPrev, m.dPrev, m.t, m.d);
+    }
+    pos = ro + rd * t;
+    return true;
+}
+
+bool marchPlanet(vec3 ro, vec3 rd, float lodFactor, float jitter, float tMin, float tMax, out vec3 pos, out float t) {
+    PlanetMarch m = beginMarch(lodFactor, jitter, tMin, tMax);
+    advanceMarch(m, ro, rd, 1024);
+    return finishMarch(m, ro, rd, pos, t);
+}
+
+vec3 computeNormal(vec3 p, float d0, float footprint) {
+    float eps = max(planetRadius * 0.0005, heightScale * 0.03);
+    float dx = planetSDF(p + vec3(eps,0,0), footprint) - d0;
+    float dy = planetSDF(p + vec3(0,eps,0), footprint) - d0;
+    float dz = planetSDF(p + vec3(0,0,eps), footprint) - d0;
+    return normalize(vec3(dx, dy, dz));
+}
+
+bool intersectSphere(vec3 ro, vec3 rd, float R, out float t0, out float t1) {
+    float b = dot(ro, rd);
+    float c = dot(ro, ro) - R*R;
+    float h = b*b - c;
+    if (h < 0.0) return false;
+    h = sqrt(h);
+    t0 = -b - h;
+    t1 = -b + h;
+    return true;
+}
+
+vec3 landColor(vec3 p, vec3 normal, float h, float footprint) {
+    vec3 ocean = vec3(0.026, 0.16, 0.32);
+    vec3 coast = vec3(0.82, 0.75, 0.6);
+    vec3 landLow = vec3(0.18, 0.42, 0.2);
+    vec3 landHigh = vec3(0.36, 0.34, 0.22);
+    vec3 landRock = vec3(0.38, 0.36, 0.33);
+    vec3 mountain = vec3(0.55, 0.56, 0.6);
+    vec3 snow = vec3(0.92, 0.95, 0.98);
+
+    float seaLevelHeight = seaLevel;
+    float heightAboveSea = h - seaLevelHeight;
+    float normalizedHeight = heightAboveSea / max(heightScale, 0.0001);
+    normalizedHeight = normalizedHeight * 5;
+
+    // Keep the coastline as a relatively thin band so inland regions pick up the
+    // intended greens and browns instead of the sandy coastline tint.
+    float coastBlend = smoothstep(-0.06, 0.01, normalizedHeight);
+    float landBlend = smoothstep(0.02, 0.32, normalizedHeight);
+    float mountainBlend = smoothstep(0.35, 0.62, normalizedHeight);
+    float snowBlend = smoothstep(0.65, 0.9, normalizedHeight);
+
+    float heightNorm = clamp(normalizedHeight, 0.0, 1.0);
+    float slope = 1.0 - clamp(dot(normalize(p), normal), 0.0, 1.0);
+    float slopeRock = smoothstep(0.28, 0.7, slope);
+    float colorNoise = fbm(normalize(p) * 12.0 + vec3(3.7, 1.3, 6.2), fbmOctaves(terrainLod(footprint), 12.0));
+    float heightMix = clamp(heightNorm * 1.2 + colorNoise * 0.25, 0.0, 1.0);
+
+    vec3 variedLand = mix(landLow, landHigh, heightMix);
+    variedLand = mix(variedLand, landRock, slopeRock * 0.65);
+
+    vec3 color = mix(ocean, coast, coastBlend);
+    color = mix(color, variedLand, landBlend);
+    color = mix(color, mountain, mountainBlend);
+    color = mix(color, snow, snowBlend);
+    return color;
+}
+
+// Camera ray through a pixel of the full image, in planet space.
+void primaryRay(vec2 pixel, out vec3 ro, out vec3 rd) {
+    vec2 uv = (pixel / fullResolution) * 2.0 - 1.0;
+    ro = worldToPlanet * camPos;
+    rd = worldToPlanet * rayDirection(uv);
+}
+
+// Where a ray enters and leaves the atmosphere and the water sphere, and
+// the part of it the terrain march has to cover.
+struct RaySegments {
+    bool hitsAtmosphere;
+    float tAtm0;
+    float tAtm1;
+    bool hitWaterSphere;
+    float tWater0;
+    float tWater1;
+    float marchStart;
+    float marchEnd;
+};
+
+RaySegments traceSegments(vec3 ro, vec3 rd) {
+    RaySegments s;
+    s.tAtm0 = 0.0;
+    s.tAtm1 = 0.0;
+    s.hitsAtmosphere = intersectSphere(ro, rd, atmosphereRadius, s.tAtm0, s.tAtm1);
+
+    float tPlanet0 = 0.0;
+    float tPlanet1 = 0.0;
+    bool hitsPlanetShell = intersectSphere(ro, rd, planetRadius, tPlanet0, tPlanet1);
+
+    float waterRadius = planetRadius + seaLevel;
+    s.tWater0 = 0.0;
+    s.tWater1 = 0.0;
+    s.hitWaterSphere = intersectSphere(ro, rd, waterRadius, s.tWater0, s.tWater1) && s.tWater1 > 0.0;
+    if (s.hitWaterSphere && s.tWater0 < 0.0) s.tWater0 = 0.0;
+
+    s.marchStart = 0.0;
+    s.marchEnd = maxRayDistance;
+
+    if (s.hitsAtmosphere && s.tAtm1 > 0.0) {
+        s.marchStart = max(s.tAtm0, 0.0);
+        s.marchEnd = min(s.tAtm1, maxRayDistance);
+    } else if (length(ro) > atmosphereRadius && (!s.hitsAtmosphere || s.tAtm1 <= 0.0)) {
+        s.marchStart = maxRayDistance;
+        s.marchEnd = maxRayDistance;
+    }
+
+    float shellPadding = max(heightScale * 1.2, planetRadius * 0.001);
+
+    if (hitsPlanetShell && tPlanet1 > 0.0) {
+        float entry = max(tPlanet0, 0.0);
+        s.marchStart = max(s.marchStart, max(entry - shellPadding, 0.0));
+        s.marchEnd = min(s.marchEnd, tPlanet1 + shellPadding);
+    }
+
+    if (s.hitWaterSphere) {
+        s.marchStart = max(s.marchStart, max(s.tWater0 - shellPadding, 0.0));
+        s.marchEnd = min(s.marchEnd, s.tWater1 + shellPadding);
+    }
+    return s;
+}
+
+// Everything the G-buffer stores for a ray, given the march result.
+void shadeGBuffer(
+    vec3 ro,
+    vec3 rd,
+    RaySegments s,
+    bool hit,
+    vec3 posPlanet,
+    float t,
+    out vec4 positionHeight,
+    out vec4 normalFlags,
+    out vec4 material,
+    out vec4 viewData
+) {
+    float tTerrain = hit ? t : 1e9;
+    float hitFootprint = hit ? surfaceFootprint(posPlanet, rd, t) : 0.0;
+    float heightValue = hit ? terrainHeight(posPlanet, hitFootprint) : -1.0;
+
+    vec3 baseColor = vec3(0.05, 0.07, 0.1);
+    float waterFlag = -1.0;
+    vec3 normalPlanet = normalize(rd);
+
+    if (hit) {
+        float d0 = planetSDF(posPlanet, hitFootprint);
+        normalPlanet = computeNormal(posPlanet, d0, hitFootprint);
+        baseColor = landColor(posPlanet, normalPlanet, heightValue, hitFootprint);
+        waterFlag = 0.0;
+    }
+
+    bool waterCoversTerrain = s.hitWaterSphere && (s.tWater0 < tTerrain) && heightValue <= seaLevel;
+    if (waterCoversTerrain) {
+        vec3 waterSurfacePos = ro + rd * s.tWater0;
+        posPlanet = waterSurfacePos;
+        normalPlanet = normalize(waterSurfacePos);
+        // Preserve the underlying terrain color so the lighting pass can
+        // treat the water as a transparent volume hovering above it.
+        waterFlag = 1.0;
+    } else if (!hit) {
+        posPlanet = ro + rd * s.marchEnd;
+    }
+
+    float cloudMask = 0.0;
+
+    // Only accumulate cloud noise when the view ray actually passes through the
+    // atmosphere (or hits the surface). Otherwise distant space renders pick up
+    // stray gray cloud patterns.
+    bool throughAtmosphere = hit || (s.hitsAtmosphere && s.tAtm1 > 0.0);
+    if (throughAtmosphere) {
+        vec3 coverageSample = hit ? posPlanet : (ro + rd * min(maxRayDistance, max(s.tAtm1, 0.0)));
+        cloudMask = cloudCoverageField(normalize(coverageSample));
+    }
+
+    vec3 posWorld = planetToWorld * posPlanet;
+    vec3 normal = normalize(planetToWorld * normalPlanet);
+
+    float viewDistance = length(posWorld - camPos);
+
+    float waterPath = 0.0;
+    if (s.hitWaterSphere) {
+        float waterExit = min(s.tWater1, viewDistance);
+        if (waterExit > s.tWater0) {
+            waterPath = waterExit - s.tWater0;
+        }
+    }
+
+    float atmEntry = 0.0;
+    float atmExit = 0.0;
+    if (throughAtmosphere) {
+        atmEntry = max(s.tAtm0, 0.0);
+        atmExit = min(s.tAtm1, maxRayDistance);
+    }
+
+    positionHeight = vec4(posWorld, heightValue);
+    normalFlags = vec4(normal, waterFlag);
+    material = vec4(baseColor, cloudMask);
+    viewData = vec4(viewDistance, atmEntry, atmExit, waterPath);
+}
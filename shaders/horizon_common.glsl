@@ -0,0 +1,16 @@
+// Shared by horizon_maps.comp and lighting.frag, see rendering/horizon_maps.py.
+
+// Azimuths stored per texel, spaced evenly from east through north: the
+// first four in the first map, the rest in the second.
+const int HORIZON_AZIMUTHS = 8;
+const float HORIZON_TAU = 6.28318530718;
+
+// East and north tangents at unit direction up in the planet's frame, whose
+// y axis is the pole. At the poles east falls back to the x axis.
+void horizonFrame(vec3 up, out vec3 east, out vec3 north) {
+    vec3 pole = vec3(0.0, 1.0, 0.0);
+    vec3 side = cross(pole, up);
+    float len = length(side);
+    east = len > 1e-5 ? side / len : vec3(1.0, 0.0, 0.0);
+    north = cross(up, east);
+}
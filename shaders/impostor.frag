@@ -0,0 +1,84 @@
+#version 410 core
+
+// Analytic stand-in for bodies that cover only a handful of pixels: a lit
+// sphere with a thin atmospheric rim, written premultiplied like composite.
+
+out vec4 FragColor;
+
+in vec2 TexCoord;
+
+uniform vec3 camPos;
+uniform vec3 camForward;
+uniform vec3 camRight;
+uniform vec3 camUp;
+uniform vec3 sunDir;
+uniform float sunPower;
+uniform float aspect;
+uniform float tanHalfFov;
+uniform vec2 pixelOffset;
+uniform vec2 fullResolution;
+
+uniform float planetRadius;
+uniform float atmosphereRadius;
+uniform vec3 waterColor;
+uniform float oceanFraction;
+
+vec3 rayDirection(vec2 uv) {
+    uv.x *= aspect;
+    uv *= tanHalfFov;
+    return normalize(camForward + uv.x * camRight + uv.y * camUp);
+}
+
+bool intersectSphere(vec3 ro, vec3 rd, float R, out float t0, out float t1) {
+    float b = dot(ro, rd);
+    float c = dot(ro, ro) - R*R;
+    float h = b*b - c;
+    if (h < 0.0) return false;
+    h = sqrt(h);
+    t0 = -b - h;
+    t1 = -b + h;
+    return true;
+}
+
+void main() {
+    vec2 uv = ((gl_FragCoord.xy + pixelOffset) / fullResolution) * 2.0 - 1.0;
+    vec3 ro = camPos;
+    vec3 rd = rayDirection(uv);
+    vec3 lightDir = normalize(sunDir);
+    float sunIntensity = max(sunPower, 0.0);
+
+    float tAtm0 = 0.0;
+    float tAtm1 = 0.0;
+    if (!intersectSphere(ro, rd, atmosphereRadius, tAtm0, tAtm1) || tAtm1 <= 0.0) {
+        FragColor = vec4(0.0);
+        return;
+    }
+
+    float tPlanet0 = 0.0;
+    float tPlanet1 = 0.0;
+    bool hit = intersectSphere(ro, rd, planetRadius, tPlanet0, tPlanet1) && tPlanet0 > 0.0;
+
+    float pathEnd = hit ? tPlanet0 : tAtm1;
+    float pathLength = max(pathEnd - max(tAtm0, 0.0), 0.0);
+    float atmThickness = max(atmosphereRadius - planetRadius, 0.001);
+    float maxChord = 2.0 * sqrt(max(atmosphereRadius * atmosphereRadius - planetRadius * planetRadius, 0.0)) + 0.001;
+    float airDensity = clamp(pathLength / maxChord, 0.0, 1.0) * clamp(atmThickness / (planetRadius * 0.02), 0.0, 1.0);
+
+    vec3 midPoint = ro + rd * (max(tAtm0, 0.0) + pathLength * 0.5);
+    float airLit = smoothstep(-0.1, 0.2, dot(normalize(midPoint), lightDir));
+    vec3 air = vec3(0.26, 0.48, 0.70) * airDensity * airLit * sunIntensity * 0.6;
+
+    vec3 color = air;
+    float coverage = 1.0 - exp(-airDensity * 2.0);
+    if (hit) {
+        vec3 normal = normalize(ro + rd * tPlanet0);
+        // Brighter than the raw terrain albedo to match the full lighting pass,
+        // which adds sky fill and specular on top of the diffuse term.
+        vec3 albedo = mix(vec3(0.5, 0.48, 0.42), waterColor, clamp(oceanFraction, 0.0, 1.0));
+        float diffuse = max(dot(normal, lightDir), 0.0);
+        color += albedo * diffuse * sunIntensity * 2.0 * (1.0 - airDensity * 0.5);
+        coverage = 1.0;
+    }
+
+    FragColor = vec4(color, coverage);
+}
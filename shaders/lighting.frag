@@ -17,6 +17,17 @@ uniform float seaLevel;
 uniform vec3 waterColor;
 uniform float waterAbsorption;
 uniform float waterScattering;
+uniform mat3 worldToPlanet;
+// Horizon angles of the terrain, see rendering/horizon_maps.py.
+uniform samplerCube horizonMapA;
+uniform samplerCube horizonMapB;
+
+#include "horizon_common.glsl"
+
+// Half width, in radians, of the band over which the sun fades behind the
+// horizon. Much wider than the sun itself: the maps are filtered over a
+// texel of terrain, and the wider band hides that.
+const float HORIZON_PENUMBRA = 0.035;
 
 vec3 decodePosition(vec2 uv) {
     return texture(gPositionHeight, uv).xyz;
@@ -61,6 +72,38 @@ float computeShadow(vec3 pos, vec3 normal) {
     return clamp(ndl * 0.5 + 0.5, 0.0, 1.0) * horizon;
 }
 
+// Soft terrain shadow (x) and horizon-based ambient occlusion (y) at pos,
+// from the horizon angles baked for the terrain under it.
+vec2 computeTerrainOcclusion(vec3 pos, vec3 lightDir) {
+    vec3 up = normalize(worldToPlanet * pos);
+    vec3 sun = worldToPlanet * lightDir;
+    vec3 east, north;
+    horizonFrame(up, east, north);
+
+    vec4 first = texture(horizonMapA, up);
+    vec4 second = texture(horizonMapB, up);
+    float horizon[HORIZON_AZIMUTHS] = float[](
+        first.x, first.y, first.z, first.w, second.x, second.y, second.z, second.w
+    );
+
+    // Cosine-weighted sky visible over a horizon at elevation h is cos^2(h)
+    // of each azimuth slice.
+    float occlusion = 0.0;
+    for (int i = 0; i < HORIZON_AZIMUTHS; ++i) {
+        float s = sin(max(horizon[i], 0.0));
+        occlusion += s * s;
+    }
+    float ambientVisibility = 1.0 - occlusion / float(HORIZON_AZIMUTHS);
+
+    float azimuth = atan(dot(sun, north), dot(sun, east)) / HORIZON_TAU * float(HORIZON_AZIMUTHS);
+    azimuth = mod(azimuth + float(HORIZON_AZIMUTHS), float(HORIZON_AZIMUTHS));
+    int index = int(azimuth) % HORIZON_AZIMUTHS;
+    float sunHorizon = mix(horizon[index], horizon[(index + 1) % HORIZON_AZIMUTHS], fract(azimuth));
+    float sunElevation = asin(clamp(dot(sun, up), -1.0, 1.0));
+    float sunVisibility = smoothstep(sunHorizon - HORIZON_PENUMBRA, sunHorizon + HORIZON_PENUMBRA, sunElevation);
+    return vec2(sunVisibility, ambientVisibility);
+}
+
 vec3 shadeWater(
     vec3 pos,
     vec3 normal,
@@ -90,7 +133,9 @@ vec3 shadeWater(
     vec3 inScattering = waterColor * (1.0 - absorption) * (0.25 + scatterAmount * sunFacing) * (sunColor * shadow + ambientLight);
 
     float bedDarken = smoothstep(0.0, 80.0, depth);
-    vec3 transmitted = floorColor * absorption * mix(1.0, 0.25, bedDarken);
+    // The sea floor is lit like land before the water attenuates it.
+    vec3 floorLight = sunColor * shadow + ambientLight;
+    vec3 transmitted = floorColor * floorLight * absorption * mix(1.0, 0.25, bedDarken);
     vec3 reflected = mix(waterColor, sunColor, 0.25) * (0.35 + 0.65 * ndl * shadow);
 
     float fresnel = 0.02 + pow(1.0 - viewFacing, 5.0);
@@ -140,7 +185,9 @@ void main() {
     vec3 directLight = effectiveSunColor * (wrapNdl * horizonBlend + softHalo * 0.5);
     vec3 ambient = ambientLight * (ambientStrength + softHalo * 0.25);
 
-    float shadow = hit ? computeShadow(pos, normal) : 0.0;
+    vec2 terrainOcclusion = hit ? computeTerrainOcclusion(pos, lightDir) : vec2(1.0);
+    ambient *= terrainOcclusion.y;
+    float shadow = hit ? computeShadow(pos, normal) * terrainOcclusion.x : 0.0;
 
     float distToPos = viewData.x;
     vec3 toPos = pos - camPos;
@@ -0,0 +1,115 @@
+#version 410 core
+
+// Blends a jittered frame into the history reprojected along the velocity
+// buffer. The history is first clipped to the colour range of the 3x3
+// neighbourhood in the new frame, which keeps disocclusions and lighting
+// changes from ghosting.
+
+out vec4 FragColor;
+
+in vec2 TexCoord;
+
+uniform sampler2D frameTex;
+uniform sampler2D historyTex;
+uniform sampler2D velocityTex;
+
+// Weight of the new frame; 1 discards the history.
+uniform float currentWeight;
+
+// How many standard deviations around the neighbourhood mean the history
+// may stray; lower clips harder and lets less noise through.
+const float VARIANCE_CLIP = 1.25;
+
+// Weight of the new frame where the history is read halfway between texels.
+// Each such read blurs it a little, and the blur compounds frame after
+// frame, so a moving view keeps less of it.
+const float RESAMPLE_WEIGHT = 0.25;
+
+vec3 toYCoCg(vec3 c) {
+    return vec3(dot(c, vec3(0.25, 0.5, 0.25)), dot(c, vec3(0.5, 0.0, -0.5)), dot(c, vec3(-0.25, 0.5, -0.25)));
+}
+
+vec3 fromYCoCg(vec3 c) {
+    return vec3(c.x + c.y - c.z, c.x + c.z, c.x - c.y - c.z);
+}
+
+vec3 frameColor(ivec2 texel, ivec2 size) {
+    // Clamp as the display would so bright outliers don't dominate.
+    texel = clamp(texel, ivec2(0), size - 1);
+    return toYCoCg(clamp(texelFetch(frameTex, texel, 0).rgb, 0.0, 1.0));
+}
+
+// Catmull-Rom filtered history at a pixel position, from five bilinear taps
+// with the corner taps left out. Plain bilinear would blur the history a
+// little more with every reprojection.
+vec3 sampleHistory(vec2 position, vec2 size) {
+    vec2 center = floor(position - 0.5) + 0.5;
+    vec2 f = position - center;
+    vec2 w0 = f * (-0.5 + f * (1.0 - 0.5 * f));
+    vec2 w1 = 1.0 + f * f * (-2.5 + 1.5 * f);
+    vec2 w2 = f * (0.5 + f * (2.0 - 1.5 * f));
+    vec2 w3 = f * f * (-0.5 + 0.5 * f);
+    vec2 w12 = w1 + w2;
+    vec2 p0 = (center - 1.0) / size;
+    vec2 p3 = (center + 2.0) / size;
+    vec2 p12 = (center + w2 / w12) / size;
+
+    vec3 color = texture(historyTex, vec2(p12.x, p0.y)).rgb * (w12.x * w0.y);
+    color += texture(historyTex, vec2(p0.x, p12.y)).rgb * (w0.x * w12.y);
+    color += texture(historyTex, p12).rgb * (w12.x * w12.y);
+    color += texture(historyTex, vec2(p3.x, p12.y)).rgb * (w3.x * w12.y);
+    color += texture(historyTex, vec2(p12.x, p3.y)).rgb * (w12.x * w3.y);
+    float total = w12.x * w0.y + w0.x * w12.y + w12.x * w12.y + w3.x * w12.y + w12.x * w3.y;
+    return clamp(color / total, 0.0, 1.0);
+}
+
+// Pulls color towards the centre of the box until it lies inside.
+vec3 clipToBox(vec3 color, vec3 boxMin, vec3 boxMax) {
+    vec3 center = 0.5 * (boxMin + boxMax);
+    vec3 extent = 0.5 * (boxMax - boxMin) + 1e-4;
+    vec3 offset = color - center;
+    vec3 units = abs(offset / extent);
+    float largest = max(units.x, max(units.y, units.z));
+    return largest > 1.0 ? center + offset / largest : color;
+}
+
+void main() {
+    ivec2 size = textureSize(frameTex, 0);
+    ivec2 texel = ivec2(gl_FragCoord.xy);
+    vec3 current = frameColor(texel, size);
+
+    if (currentWeight >= 1.0) {
+        FragColor = vec4(fromYCoCg(current), 1.0);
+        return;
+    }
+
+    vec3 boxMin = current;
+    vec3 boxMax = current;
+    vec3 sum = vec3(0.0);
+    vec3 sumSquares = vec3(0.0);
+    for (int y = -1; y <= 1; ++y) {
+        for (int x = -1; x <= 1; ++x) {
+            vec3 c = frameColor(texel + ivec2(x, y), size);
+            boxMin = min(boxMin, c);
+            boxMax = max(boxMax, c);
+            sum += c;
+            sumSquares += c * c;
+        }
+    }
+    vec3 mean = sum / 9.0;
+    vec3 deviation = sqrt(max(sumSquares / 9.0 - mean * mean, 0.0));
+    boxMin = max(boxMin, mean - VARIANCE_CLIP * deviation);
+    boxMax = min(boxMax, mean + VARIANCE_CLIP * deviation);
+
+    vec2 previous = gl_FragCoord.xy - texelFetch(velocityTex, texel, 0).xy;
+    vec3 result = current;
+    if (all(greaterThanEqual(previous, vec2(0.0))) && all(lessThan(previous, vec2(size)))) {
+        vec3 history = clipToBox(toYCoCg(sampleHistory(previous, vec2(size))), boxMin, boxMax);
+        vec2 f = fract(previous - 0.5);
+        float resampling = 4.0 * max(f.x * (1.0 - f.x), f.y * (1.0 - f.y));
+        float weight = mix(currentWeight, max(currentWeight, RESAMPLE_WEIGHT), resampling);
+        result = mix(history, current, weight);
+    }
+
+    FragColor = vec4(clamp(fromYCoCg(result), 0.0, 1.0), 1.0);
+}
@@ -0,0 +1,70 @@
+#version 410 core
+
+// Screen-space motion of what each pixel shows since the previous frame, in
+// pixels of the full image: where it is now minus where it was, both without
+// the sub-pixel jitter. Surface hits go through the planet frame, so changes
+// of planetToWorld move them too; everything else is treated as infinitely
+// far away and only follows the camera's orientation.
+
+layout (location = 0) out vec2 velocity;
+
+in vec2 TexCoord;
+
+uniform sampler2D gNormalFlags;
+uniform sampler2D gViewData;
+
+uniform vec3 camPos;
+uniform vec3 camForward;
+uniform vec3 camRight;
+uniform vec3 camUp;
+uniform vec2 pixelOffset;
+uniform vec2 fullResolution;
+uniform float aspect;
+uniform float tanHalfFov;
+uniform mat3 worldToPlanet;
+
+uniform vec3 previousCamPos;
+uniform vec3 previousCamForward;
+uniform vec3 previousCamRight;
+uniform vec3 previousCamUp;
+uniform float previousTanHalfFov;
+uniform mat3 previousPlanetToWorld;
+
+// Set while filling the space between bodies, where the G-buffer is stale.
+uniform int skyOnly;
+
+vec3 rayDirection(vec2 uv) {
+    uv.x *= aspect;
+    uv *= tanHalfFov;
+    return normalize(camForward + uv.x * camRight + uv.y * camUp);
+}
+
+vec2 previousPixel(vec3 direction) {
+    vec3 view = vec3(
+        dot(direction, previousCamRight), dot(direction, previousCamUp), dot(direction, previousCamForward)
+    );
+    if (view.z <= 1e-6) {
+        // Behind the previous camera; the resolve treats it as off-screen.
+        return vec2(-1e4);
+    }
+    vec2 uv = view.xy / (view.z * previousTanHalfFov);
+    uv.x /= aspect;
+    return (uv * 0.5 + 0.5) * fullResolution;
+}
+
+void main() {
+    vec2 pixel = gl_FragCoord.xy + pixelOffset;
+    vec3 rd = rayDirection((pixel / fullResolution) * 2.0 - 1.0);
+
+    vec3 previousDirection = rd;
+    if (skyOnly == 0) {
+        ivec2 texel = ivec2(gl_FragCoord.xy);
+        if (texelFetch(gNormalFlags, texel, 0).w >= 0.0) {
+            float viewDistance = texelFetch(gViewData, texel, 0).x;
+            vec3 posPlanet = worldToPlanet * (camPos + rd * viewDistance);
+            previousDirection = previousPlanetToWorld * posPlanet - previousCamPos;
+        }
+    }
+
+    velocity = pixel - previousPixel(previousDirection);
+}
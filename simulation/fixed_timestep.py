@@ -0,0 +1,367 @@
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from gl_utils.camera import FPSCamera, WORLD_UP
+from gl_utils.vecmath import Vec3
+from rendering.constants import PlanetParameters
+from simulation.terrain_tiles import TerrainTileCache
+from utils.time import CalendarState, PlanetCalendar
+
+
+# The simulation runs at a fixed rate independent of the render cost. Frames
+# that take longer than MAX_FRAME_TIME are clamped so a long stall (window drag,
+# breakpoint) does not replay seconds of physics in one burst, and the substep
+# cap keeps a slow frame from spiralling into ever more work.
+SIMULATION_RATE = 120.0
+MAX_SUBSTEPS = 15
+MAX_FRAME_TIME = 0.25
+GRAVITY_ACCELERATION = 35.0
+
+
+def compute_adaptive_speed(position, base_speed, planet_radius):
+    distance = math.hypot(*position)
+    distance_ratio = distance / planet_radius
+    adaptive_factor = min(max(0.15 + distance_ratio * 0.85, 0.15), 4.0)
+    return base_speed * adaptive_factor
+
+
+@dataclass
+class MovementInput:
+    """Held movement keys sampled once per rendered frame."""
+
+    forward: bool = False
+    backward: bool = False
+    left: bool = False
+    right: bool = False
+    roll_left: bool = False
+    roll_right: bool = False
+    fast: bool = False
+    enabled: bool = True
+
+
+@dataclass
+class SimulationState:
+    position: np.ndarray
+    elapsed_seconds: float
+
+
+@dataclass
+class RenderState:
+    position: np.ndarray
+    front: np.ndarray
+    right: np.ndarray
+    up: np.ndarray
+    calendar_state: CalendarState
+
+
+class FixedTimestepSimulation:
+    def __init__(
+        self,
+        camera: FPSCamera,
+        calendar: PlanetCalendar,
+        renderer,
+        parameters: PlanetParameters,
+        base_speed: float,
+        rate: float = SIMULATION_RATE,
+        max_substeps: int = MAX_SUBSTEPS,
+        terrain_tiles: Optional[TerrainTileCache] = None,
+    ):
+        self.camera = camera
+        self.calendar = calendar
+        self.renderer = renderer
+        self.parameters = parameters
+        self.base_speed = base_speed
+        self.step_dt = 1.0 / rate
+        self.max_substeps = max_substeps
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.time_speed = parameters.time_speed
+        self.gravity_enabled = False
+        self.gravity_acceleration = GRAVITY_ACCELERATION
+        self.min_ground_clearance = 0.0
+        self.calendar_state = calendar.current_state()
+        self.surface_info = None
+        self.player_height = 0.0
+        self.in_atmosphere = False
+        # CPU terrain around the camera; steps check their whole path against
+        # it, so fast flight cannot pass through a ridge between two steps.
+        self.terrain_tiles = terrain_tiles if terrain_tiles is not None else TerrainTileCache()
+        self.swept_collisions = 0
+        self._step_velocity = np.zeros(3, dtype=np.float32)
+        # Scratch vectors for the per-step movement math.
+        self._normal = Vec3()
+        self._tangent_forward = Vec3()
+        self._tangent_right = Vec3()
+        self._move_dir = Vec3()
+        self._position = Vec3()
+        self._velocity = Vec3()
+        self._contact = Vec3()
+        self._remaining = Vec3()
+        self._step_start = np.zeros(3, dtype=np.float32)
+        self._render_position = np.zeros(3, dtype=np.float32)
+        self._spin_delta = np.zeros((3, 3), dtype=np.float32)
+        self._rotated = np.zeros(3, dtype=np.float32)
+        self._contact_position = np.zeros(3, dtype=np.float32)
+        # Surface lookups fill these dicts in place; surface_info is the first.
+        self._surface_info = None
+        self._contact_info = None
+
+        renderer.prepare_frame_state(self.calendar_state)
+        self._prev_world_to_planet = renderer.world_to_planet
+        self.previous = self._capture_state()
+        self.current = self._capture_state()
+
+    def _capture_state(self) -> SimulationState:
+        return SimulationState(
+            position=self.camera.position.copy(),
+            elapsed_seconds=self.calendar.elapsed_seconds,
+        )
+
+    def _store_state(self, state: SimulationState) -> SimulationState:
+        state.position[...] = self.camera.position
+        state.elapsed_seconds = self.calendar.elapsed_seconds
+        return state
+
+    def _query_surface(self):
+        # Always the CPU tiles, never query_surface_info: which of the two
+        # answered would depend on how far the tile workers got, and replays
+        # must see the same ground as the recording.
+        self._surface_info = self.terrain_tiles.surface_info(
+            self.camera.position, self.renderer.world_to_planet, self.min_ground_clearance, out=self._surface_info
+        )
+        return self._surface_info
+
+    def _sweep_to_ground(self, start: np.ndarray):
+        """Stop the camera where its path from start meets the terrain and
+        slide the rest of the way along the slope there.
+
+        Only the approach is swept: the slide follows the ground like a step
+        that starts on it, with _clamp_to_ground() lifting whatever ends up
+        below the clearance.
+        """
+
+        world_to_planet = self.renderer.world_to_planet
+        clearance = self.min_ground_clearance
+        end = self.camera.position
+        clear = self.terrain_tiles.sweep(start, end, world_to_planet, clearance)
+        if clear is None:
+            return
+        self.swept_collisions += 1
+        remaining = self._remaining.load(end)
+        contact = self._contact.load(start)
+        remaining.add_scaled(contact, -1.0)
+        contact.add_scaled(remaining, clear)
+        remaining.scale(1.0 - clear)
+        self._contact_info = self.terrain_tiles.surface_info(
+            contact.store(self._contact_position), world_to_planet, clearance, out=self._contact_info
+        )
+        normal = self._normal.load(self._contact_info["terrain_normal"])
+        into_slope = remaining.dot(normal)
+        if into_slope < 0.0:
+            remaining.add_scaled(normal, -into_slope)
+        contact.add_scaled(remaining, 1.0).store(self.camera.position)
+
+    def _update_in_atmosphere(self):
+        self.in_atmosphere = math.hypot(*self.camera.position) <= self.parameters.atmosphere_radius
+
+    def _align_camera(self):
+        camera = self.camera
+        if self.gravity_enabled and self.in_atmosphere:
+            camera.enable_reference_alignment(True)
+            if self.surface_info is not None:
+                camera.set_reference_up(self.surface_info["normal"])
+            else:
+                camera.set_reference_up(WORLD_UP)
+        else:
+            camera.enable_reference_alignment(False)
+        camera.update_vectors()
+
+    def _clamp_to_ground(self):
+        surface_info = self.surface_info
+        if surface_info is None or surface_info["altitude"] >= self.min_ground_clearance:
+            return False
+        np.multiply(surface_info["normal"], surface_info["clamped_radius"], out=self.camera.position, casting="unsafe")
+        return True
+
+    def advance(self, frame_dt: float, movement: MovementInput) -> int:
+        """Run as many fixed substeps as the elapsed frame time covers."""
+
+        self.accumulator += min(max(frame_dt, 0.0), MAX_FRAME_TIME)
+        steps = 0
+        while self.accumulator >= self.step_dt and steps < self.max_substeps:
+            # The two states swap roles rather than a new one being made.
+            self.previous, self.current = self.current, self.previous
+            self._step(self.step_dt, movement)
+            self._store_state(self.current)
+            self.accumulator -= self.step_dt
+            steps += 1
+
+        if steps == self.max_substeps:
+            # Drop the backlog instead of carrying it into the next frame.
+            self.accumulator = min(self.accumulator, self.step_dt)
+        self.alpha = min(self.accumulator / self.step_dt, 1.0)
+        return steps
+
+    def _step(self, dt: float, movement: MovementInput):
+        camera = self.camera
+        self.calendar_state = self.calendar.advance(dt, self.time_speed)
+        self.renderer.prepare_frame_state(self.calendar_state)
+        self.terrain_tiles.update(self.parameters, camera.position, self._step_velocity, self.renderer.world_to_planet)
+        # The renderer hands out the same matrices while the orientation
+        # holds, which is the usual case; only a change needs the delta.
+        spin_delta = None
+        if self.renderer.world_to_planet is not self._prev_world_to_planet:
+            spin_delta = np.matmul(self.renderer.planet_to_world, self._prev_world_to_planet, out=self._spin_delta)
+
+        self.surface_info = self._query_surface()
+        self._update_in_atmosphere()
+        gravity_active = self.gravity_enabled and self.in_atmosphere
+        if gravity_active and spin_delta is not None:
+            rotated = self._rotated
+            np.matmul(spin_delta, camera.position, out=rotated)
+            camera.position[...] = rotated
+            np.matmul(spin_delta, camera.velocity, out=rotated)
+            camera.velocity[...] = rotated
+            self.surface_info = self._query_surface()
+        self._align_camera()
+
+        speed_multiplier = 10.0 if movement.fast else 1.0
+        camera.speed = (
+            compute_adaptive_speed(camera.position, self.base_speed, self.parameters.planet_radius)
+            * speed_multiplier
+        )
+
+        start = self._step_start
+        start[...] = camera.position
+        surface_info = self.surface_info
+        if movement.enabled:
+            if gravity_active and surface_info is not None:
+                surface_normal = self._normal.load(surface_info["normal"])
+                tangent_forward = self._tangent_forward.load(camera.front).project_out(surface_normal)
+                if tangent_forward.length() < 1e-5:
+                    tangent_forward.load(camera.right).project_out(surface_normal)
+                tangent_forward.normalize()
+                tangent_right = self._tangent_right.cross(tangent_forward, surface_normal).normalize()
+
+                move_dir = self._move_dir.set(0.0, 0.0, 0.0)
+                if movement.forward:
+                    move_dir.add_scaled(tangent_forward, 1.0)
+                if movement.backward:
+                    move_dir.add_scaled(tangent_forward, -1.0)
+                if movement.left:
+                    move_dir.add_scaled(tangent_right, -1.0)
+                if movement.right:
+                    move_dir.add_scaled(tangent_right, 1.0)
+
+                move_len = move_dir.length()
+                if move_len > 1e-6:
+                    position = self._position.load(camera.position)
+                    position.add_scaled(move_dir, camera.speed * dt / move_len).store(camera.position)
+            else:
+                if movement.forward:
+                    camera.process_movement("FORWARD", dt)
+                if movement.backward:
+                    camera.process_movement("BACKWARD", dt)
+                if movement.left:
+                    camera.process_movement("LEFT", dt)
+                if movement.right:
+                    camera.process_movement("RIGHT", dt)
+                if not self.gravity_enabled:
+                    if movement.roll_left:
+                        camera.process_roll("LEFT", dt)
+                    if movement.roll_right:
+                        camera.process_roll("RIGHT", dt)
+
+        if gravity_active and surface_info is not None:
+            velocity = self._velocity.load(camera.velocity)
+            velocity.add_scaled(self._normal.load(surface_info["normal"]), -self.gravity_acceleration * dt)
+            velocity.store(camera.velocity)
+            self._position.load(camera.position).add_scaled(velocity, dt).store(camera.position)
+        else:
+            camera.velocity[...] = 0.0
+
+        self._sweep_to_ground(start)
+        np.subtract(camera.position, start, out=self._step_velocity)
+        self._step_velocity /= dt
+        self.surface_info = self._query_surface()
+        if self._clamp_to_ground() and self.gravity_enabled:
+            normal = self._normal.load(self.surface_info["normal"])
+            velocity = self._velocity.load(camera.velocity)
+            velocity.add_scaled(normal, -velocity.dot(normal)).store(camera.velocity)
+
+        surface_info = self.surface_info
+        self.player_height = max(surface_info["altitude"], 0.0) if surface_info is not None else 0.0
+        self._update_in_atmosphere()
+        self._align_camera()
+        self._prev_world_to_planet = self.renderer.world_to_planet
+
+    def render_state(self) -> RenderState:
+        """Blend the last two simulated states by the leftover accumulator time.
+
+        Orientation follows the live camera so mouse look, which is applied
+        once per rendered frame, never lags behind the display.
+        """
+
+        alpha = self.alpha
+        previous = self.previous
+        current = self.current
+        # Interpolated into one reused array; the state is only valid until
+        # the next call.
+        position = self._render_position
+        np.subtract(current.position, previous.position, out=position)
+        position *= alpha
+        position += previous.position
+
+        elapsed_delta = current.elapsed_seconds - previous.elapsed_seconds
+        if elapsed_delta < 0.0:
+            elapsed_delta += self.calendar.seconds_per_year
+        calendar_state = self.calendar.state_at(previous.elapsed_seconds + elapsed_delta * alpha)
+
+        camera = self.camera
+        return RenderState(
+            position=position,
+            front=camera.front,
+            right=camera.right,
+            up=camera.up,
+            calendar_state=calendar_state,
+        )
+
+    def _reset_interpolation(self):
+        self._store_state(self.current)
+        self._store_state(self.previous)
+
+    def toggle_gravity(self):
+        self.gravity_enabled = not self.gravity_enabled
+        camera = self.camera
+        if self.gravity_enabled and self.in_atmosphere and self.surface_info is not None:
+            camera.enable_reference_alignment(True)
+            camera.set_reference_up(self.surface_info["normal"])
+        else:
+            camera.enable_reference_alignment(False)
+        camera.update_vectors()
+
+    def _calendar_changed(self, calendar_state: CalendarState) -> CalendarState:
+        self.calendar_state = calendar_state
+        self.renderer.prepare_frame_state(calendar_state)
+        self._reset_interpolation()
+        return calendar_state
+
+    def set_calendar_time(self, day_index: int, hour: int, minute: int, second: int) -> CalendarState:
+        return self._calendar_changed(self.calendar.set_time(day_index, hour, minute, second))
+
+    def set_elapsed_seconds(self, elapsed_seconds: float) -> CalendarState:
+        self.calendar.elapsed_seconds = elapsed_seconds % self.calendar.seconds_per_year
+        return self._calendar_changed(self.calendar.current_state())
+
+    def update_parameters(self, parameters: PlanetParameters):
+        self.parameters = parameters
+        self.terrain_tiles.update(parameters, self.camera.position, self._step_velocity, self.renderer.world_to_planet)
+        self.surface_info = self._query_surface()
+        self._clamp_to_ground()
+        self._reset_interpolation()
+
+    def close(self):
+        self.terrain_tiles.close()
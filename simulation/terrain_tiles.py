@@ -0,0 +1,346 @@
+import math
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from gl_utils.vecmath import Vec3
+from rendering.terrain import surface_height
+
+
+# Tiles split latitude into TILE_ROWS bands, and each band into as many
+# longitude tiles as keep them about square; each holds TILE_CELLS x
+# TILE_CELLS cells. On the default planet a tile spans about 78 km and a
+# cell about 2.4 km.
+TILE_ROWS = 256
+TILE_CELLS = 32
+TILE_ANGLE = math.pi / TILE_ROWS
+CELL_ANGLE = TILE_ANGLE / TILE_CELLS
+ROW_COLUMNS = tuple(
+    max(round(2 * TILE_ROWS * math.cos((row + 0.5) * TILE_ANGLE - 0.5 * math.pi)), 1) for row in range(TILE_ROWS)
+)
+# Tiles on each side of the camera's tile kept ready at all times.
+TILE_RING = 1
+# How far ahead along the velocity tiles are requested, in seconds of travel.
+PREFETCH_SECONDS = 2.0
+MAX_PREFETCH_SAMPLES = 16
+MAX_TILES = 96
+TILE_WORKERS = 2
+MAX_SWEEP_SAMPLES = 256
+# Depth below the clearance a sample must reach to count as contact, so a
+# camera just clamped onto the ground is not stopped by float32 rounding.
+SWEEP_TOLERANCE = 0.01
+
+TileKey = Tuple[int, int]
+
+
+def _lat_lon(x: float, y: float, z: float) -> Tuple[float, float]:
+    return math.atan2(y, math.hypot(x, z)), math.atan2(z, x)
+
+
+def _shader_rows(world_to_planet: np.ndarray):
+    """Rows of the rotation the shaders apply as worldToPlanet.
+
+    PlanetRenderer uploads its matrices untransposed, so the shaders, and
+    with them the rendered terrain, use the transpose of world_to_planet.
+    """
+
+    return world_to_planet.T.tolist()
+
+
+def _transform(rows, out: Vec3, values) -> Vec3:
+    """out = matrix @ values for a 3x3 matrix given as nested lists."""
+
+    x, y, z = values.tolist() if isinstance(values, np.ndarray) else values
+    out.x = rows[0][0] * x + rows[0][1] * y + rows[0][2] * z
+    out.y = rows[1][0] * x + rows[1][1] * y + rows[1][2] * z
+    out.z = rows[2][0] * x + rows[2][1] * y + rows[2][2] * z
+    return out
+
+
+def _tile_coordinates(lat: float, lon: float) -> Tuple[TileKey, float, float]:
+    """Tile holding a direction and its cell coordinates within that tile."""
+
+    lat_cells = min(max((lat + 0.5 * math.pi) / CELL_ANGLE, 0.0), TILE_ROWS * TILE_CELLS)
+    row = min(int(lat_cells) // TILE_CELLS, TILE_ROWS - 1)
+    columns = ROW_COLUMNS[row]
+    lon_cells = ((lon + math.pi) / (2.0 * math.pi) * columns * TILE_CELLS) % (columns * TILE_CELLS)
+    column = min(int(lon_cells) // TILE_CELLS, columns - 1)
+    return (row, column), lat_cells - row * TILE_CELLS, lon_cells - column * TILE_CELLS
+
+
+def _tile_origin(key: TileKey) -> Tuple[float, float, float]:
+    """Latitude and longitude of a tile's first corner and its longitude step per cell."""
+
+    row, column = key
+    lon_cell_angle = 2.0 * math.pi / (ROW_COLUMNS[row] * TILE_CELLS)
+    return row * TILE_ANGLE - 0.5 * math.pi, column * TILE_CELLS * lon_cell_angle - math.pi, lon_cell_angle
+
+
+def build_tile(key: TileKey, planet_radius: float, height_scale: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Terrain heights and planet-frame normals at the (TILE_CELLS + 1)^2
+    grid corners of a tile, indexed [latitude, longitude]."""
+
+    lat0, lon0, lon_cell_angle = _tile_origin(key)
+    steps = np.arange(TILE_CELLS + 1)
+    lat, lon = np.meshgrid(lat0 + steps * CELL_ANGLE, lon0 + steps * lon_cell_angle, indexing="ij")
+    cos_lat = np.cos(lat)
+    directions = np.stack([cos_lat * np.cos(lon), np.sin(lat), cos_lat * np.sin(lon)], axis=-1).astype(np.float32)
+
+    heights = surface_height(directions, planet_radius, height_scale)
+
+    surface = directions * (planet_radius + heights)[..., None]
+    normals = np.cross(np.gradient(surface, axis=0), np.gradient(surface, axis=1))
+    lengths = np.linalg.norm(normals, axis=-1, keepdims=True)
+    # Longitude steps vanish at the poles; the radial direction stands in.
+    normals = np.where(lengths > 1e-6, normals / np.maximum(lengths, 1e-12), directions)
+    return heights, normals.astype(np.float32)
+
+
+class TerrainTileCache:
+    """CPU copies of the terrain around the camera for collision lookups.
+
+    The surface is cut into small latitude/longitude tiles of heights and
+    normals. update() keeps the tiles around the camera and along its
+    velocity requested from a thread pool and collects the finished ones.
+    Lookups are bilinear reads of a tile; one that is not resident yet is
+    waited for, or built on the calling thread if it was never requested.
+    Their results therefore never depend on how far the workers got, which
+    keeps recorded flights replaying identically; prefetching only keeps the
+    lookups from stalling. The least recently used tiles are dropped beyond
+    max_tiles, and rebuilding one gives the same values.
+
+    Heights are those of the rendered surface, which query_surface_info
+    solves for too. On the default planet the two differ by a median of
+    0.05 km and a 90th percentile of 0.3 km; rare outliers reach about 5%
+    of height_scale, where float rounding flips a noise hash on one side.
+    """
+
+    def __init__(self, workers: int = TILE_WORKERS, max_tiles: int = MAX_TILES):
+        self.max_tiles = max_tiles
+        self.tiles: "OrderedDict[TileKey, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self.planet_radius = 0.0
+        self.height_scale = 0.0
+        self.built_count = 0
+        # Lookups that had to wait for a tile, or build one themselves.
+        self.stall_count = 0
+        self._pending: Dict[TileKey, Future] = {}
+        # Lookups run every simulation step and stick to Python floats: a
+        # NumPy call on the main thread can hand the GIL to a worker that is
+        # building a tile and then wait to get it back.
+        self._position = Vec3()
+        self._velocity = Vec3()
+        self._point = Vec3()
+        self._normal = Vec3()
+        # Wanted tiles of the last update(), in order of urgency; a dict so
+        # it doubles as the set the pending requests are checked against.
+        self._wanted: Dict[TileKey, None] = {}
+        self._rows_source = None
+        self._rows = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="terrain-tiles")
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def clear(self):
+        # Tiles already being built finish in the background and are dropped.
+        for future in self._pending.values():
+            future.cancel()
+        self._pending = {}
+        self.tiles.clear()
+
+    def close(self):
+        self.clear()
+        self._executor.shutdown(wait=True)
+
+    def _set_terrain(self, planet_radius: float, height_scale: float):
+        if (planet_radius, height_scale) != (self.planet_radius, self.height_scale):
+            self.clear()
+            self.planet_radius = planet_radius
+            self.height_scale = height_scale
+
+    def _collect(self):
+        if not self._pending:
+            return
+        for key, future in list(self._pending.items()):
+            if future.done():
+                del self._pending[key]
+                self.tiles[key] = future.result()
+                self.built_count += 1
+
+    def _shader_rows(self, world_to_planet: np.ndarray):
+        # The renderer's matrices are read-only and handed out again while
+        # the tilt holds, so their rows only need converting once.
+        if world_to_planet is not self._rows_source or world_to_planet.flags.writeable:
+            self._rows = _shader_rows(world_to_planet)
+            self._rows_source = world_to_planet
+        return self._rows
+
+    def _wanted_keys(self, position: Vec3, velocity: Vec3) -> Dict[TileKey, None]:
+        """Tiles to keep ready, most urgent first: the camera's own, those
+        along the look-ahead and then the ring around the camera."""
+
+        keys = self._wanted
+        keys.clear()
+        if position.length() > self._max_surface_radius() + TILE_ANGLE * self.planet_radius:
+            return keys
+        lat, lon = _lat_lon(position.x, position.y, position.z)
+        keys[_tile_coordinates(lat, lon)[0]] = None
+
+        # Every tile the look-ahead segment crosses, at half-tile spacing; the
+        # segment is shortened to MAX_PREFETCH_SAMPLES of those at high speed.
+        spacing = 0.5 * TILE_ANGLE * self.planet_radius
+        speed = velocity.length()
+        samples = min(int(speed * PREFETCH_SECONDS / spacing), MAX_PREFETCH_SAMPLES)
+        point = self._point
+        for index in range(1, samples + 1):
+            point.copy_from(position).add_scaled(velocity, index * spacing / speed)
+            if point.length() <= self._max_surface_radius():
+                keys[_tile_coordinates(*_lat_lon(point.x, point.y, point.z))[0]] = None
+
+        for row_offset in range(-TILE_RING, TILE_RING + 1):
+            row_lat = lat + row_offset * TILE_ANGLE
+            if abs(row_lat) > 0.5 * math.pi:
+                continue
+            (row, column), _, _ = _tile_coordinates(row_lat, lon)
+            columns = ROW_COLUMNS[row]
+            for column_offset in range(-TILE_RING, TILE_RING + 1):
+                keys[row, (column + column_offset) % columns] = None
+        return keys
+
+    def _max_surface_radius(self) -> float:
+        return self.planet_radius + abs(self.height_scale)
+
+    def update(self, parameters, position, velocity, world_to_planet):
+        """Collect finished tiles and request the ones around position and
+        PREFETCH_SECONDS ahead along velocity (world space, per second)."""
+
+        self._set_terrain(float(parameters.planet_radius), float(parameters.height_scale))
+        self._collect()
+
+        rows = self._shader_rows(world_to_planet)
+        wanted = self._wanted_keys(
+            _transform(rows, self._position, position), _transform(rows, self._velocity, velocity)
+        )
+
+        # Drop queued tiles the camera has moved away from, so the workers
+        # never fall behind on ones it is about to need.
+        if self._pending:
+            for key, future in list(self._pending.items()):
+                if key not in wanted and future.cancel():
+                    del self._pending[key]
+        for key in wanted:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+            elif key not in self._pending:
+                self._pending[key] = self._executor.submit(build_tile, key, self.planet_radius, self.height_scale)
+
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+    def _tile(self, key: TileKey) -> Tuple[np.ndarray, np.ndarray]:
+        tile = self.tiles.get(key)
+        if tile is not None:
+            return tile
+        self.stall_count += 1
+        future = self._pending.pop(key, None)
+        if future is not None and not future.cancelled():
+            tile = future.result()
+        else:
+            tile = build_tile(key, self.planet_radius, self.height_scale)
+        self.tiles[key] = tile
+        self.built_count += 1
+        return tile
+
+    def _sample_planet(self, point: Vec3, normal: Optional[Vec3] = None) -> float:
+        """Terrain height below a planet-frame point; also the interpolated
+        planet-frame normal if asked."""
+
+        key, v, u = _tile_coordinates(*_lat_lon(point.x, point.y, point.z))
+        heights, normals = self._tile(key)
+        i = min(int(v), TILE_CELLS - 1)
+        j = min(int(u), TILE_CELLS - 1)
+        fv = v - i
+        fu = u - j
+        weights = ((1.0 - fv) * (1.0 - fu), (1.0 - fv) * fu, fv * (1.0 - fu), fv * fu)
+        corners = ((i, j), (i, j + 1), (i + 1, j), (i + 1, j + 1))
+        height = 0.0
+        for weight, corner in zip(weights, corners):
+            height += weight * float(heights[corner])
+        if normal is not None:
+            normal.set(0.0, 0.0, 0.0)
+            for weight, corner in zip(weights, corners):
+                nx, ny, nz = normals[corner].tolist()
+                normal.x += weight * nx
+                normal.y += weight * ny
+                normal.z += weight * nz
+            normal.normalize()
+        return height
+
+    def surface_info(self, position, world_to_planet, min_altitude_offset: float = 0.0, out: Optional[dict] = None):
+        """The dict query_surface_info returns for position, plus the
+        world-space terrain_normal.
+
+        out, a dict an earlier call returned, is filled in place instead,
+        arrays included.
+        """
+
+        rows = self._shader_rows(world_to_planet)
+        point = _transform(rows, self._point, position)
+        normal = self._normal
+        height = self._sample_planet(point, normal)
+        surface_radius = self.planet_radius + height
+        distance = point.length()
+        if out is None:
+            out = {"normal": np.zeros(3, dtype=np.float32), "terrain_normal": np.zeros(3, dtype=np.float32)}
+        up = out["normal"]
+        if distance > 0.0:
+            np.divide(position, np.float32(distance), out=up, casting="unsafe")
+        else:
+            up[...] = (0.0, 1.0, 0.0)
+        # Planet to world is the transpose.
+        terrain_normal = out["terrain_normal"]
+        terrain_normal[0] = rows[0][0] * normal.x + rows[1][0] * normal.y + rows[2][0] * normal.z
+        terrain_normal[1] = rows[0][1] * normal.x + rows[1][1] * normal.y + rows[2][1] * normal.z
+        terrain_normal[2] = rows[0][2] * normal.x + rows[1][2] * normal.y + rows[2][2] * normal.z
+        out["surface_radius"] = surface_radius
+        out["terrain_height"] = height
+        out["altitude"] = distance - surface_radius
+        out["clamped_radius"] = surface_radius + max(min_altitude_offset, 0.0)
+        return out
+
+    def sweep(self, start, end, world_to_planet, min_altitude_offset: float = 0.0) -> Optional[float]:
+        """Fraction of the way from start to end up to which the segment
+        stays min_altitude_offset over the terrain, if it drops below that.
+
+        Samples every half cell, so ridges narrower than the segment cannot
+        be stepped over; the fraction is that of the last sample in the
+        clear. Returns None if the segment stays clear or starts out below
+        the terrain; the caller then falls back to checking the end point
+        alone.
+        """
+
+        rows = self._shader_rows(world_to_planet)
+        origin = _transform(rows, self._position, start)
+        delta = _transform(rows, self._velocity, end)
+        delta.add_scaled(origin, -1.0)
+
+        # Skip segments that never come within reach of the highest terrain.
+        point = self._point
+        length2 = delta.dot(delta)
+        closest = 0.0 if length2 <= 0.0 else min(max(-origin.dot(delta) / length2, 0.0), 1.0)
+        if point.copy_from(origin).add_scaled(delta, closest).length() > self._max_surface_radius() + max(
+            min_altitude_offset, 0.0
+        ):
+            return None
+
+        spacing = 0.5 * CELL_ANGLE * self.planet_radius
+        samples = min(max(math.ceil(math.sqrt(length2) / spacing), 1), MAX_SWEEP_SAMPLES)
+        for index in range(samples + 1):
+            point.copy_from(origin).add_scaled(delta, index / samples)
+            height = self._sample_planet(point)
+            if point.length() - (self.planet_radius + height) < min_altitude_offset - SWEEP_TOLERANCE:
+                return (index - 1) / samples if index > 0 else None
+        return None
@@ -0,0 +1,191 @@
+import ctypes
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from OpenGL.GL import *
+import numpy as np
+
+from utils.image_io import IMAGE_FORMATS, write_image
+
+
+CAPTURE_DIR = Path(__file__).resolve().parent.parent / "captures"
+
+_FREE = 0
+_READING = 1
+_ENCODING = 2
+
+
+class _Slot:
+    __slots__ = ("pbo", "state", "fence", "future", "path")
+
+    def __init__(self, pbo):
+        self.pbo = pbo
+        self.state = _FREE
+        self.fence = None
+        self.future = None
+        self.path = None
+
+
+class FrameCapture:
+    """Screenshots and image sequences read back through a ring of PBOs.
+
+    capture() only queues a glReadPixels into a pixel pack buffer and a
+    fence. update() maps buffers whose fences have signalled and hands the
+    mapped memory straight to an encoder thread; the buffer is unmapped and
+    reused once its file is written. The render loop only blocks when every
+    slot is still busy, i.e. when encoding cannot keep up.
+    """
+
+    def __init__(self, ring_size: int = 4, workers: int = 2, output_dir: Path = CAPTURE_DIR):
+        self.ring_size = ring_size
+        self.output_dir = Path(output_dir)
+        self.image_format = "png"
+        self.width = 0
+        self.height = 0
+        self.recording = False
+        self.sequence_dir: Optional[Path] = None
+        self.sequence_frame = 0
+        self.screenshot_count = 0
+        self.saved_count = 0
+        self.stall_count = 0
+        self.last_saved: Optional[Path] = None
+        self.last_error: Optional[str] = None
+        self._screenshot_requested = False
+        self._slots: List[_Slot] = []
+        self._next_slot = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capture")
+
+    @property
+    def pending(self) -> int:
+        return sum(slot.state != _FREE for slot in self._slots)
+
+    def set_format(self, image_format: str):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.image_format = image_format
+
+    def request_screenshot(self):
+        self._screenshot_requested = True
+
+    def toggle_recording(self):
+        if self.recording:
+            self.recording = False
+            return
+        self.sequence_dir = self.output_dir / f"sequence_{time.strftime('%Y%m%d_%H%M%S')}"
+        self.sequence_frame = 0
+        self.recording = True
+
+    def capture(self, width: int, height: int):
+        """Queue a readback of the default framebuffer if one is wanted this frame."""
+
+        if not (self._screenshot_requested or self.recording):
+            return
+        if width <= 0 or height <= 0:
+            # Minimised window: nothing to read. A pending screenshot waits
+            # for the window to come back.
+            return
+        if (width, height) != (self.width, self.height):
+            self._allocate(width, height)
+
+        if self._screenshot_requested:
+            self.screenshot_count += 1
+            path = self.output_dir / f"screenshot_{time.strftime('%Y%m%d_%H%M%S')}_{self.screenshot_count:04d}"
+            self._screenshot_requested = False
+        else:
+            self.sequence_frame += 1
+            path = self.sequence_dir / f"frame_{self.sequence_frame:06d}"
+        path = path.with_suffix("." + self.image_format)
+
+        slot = self._slots[self._next_slot]
+        if slot.state != _FREE:
+            self.stall_count += 1
+            self._finish(slot, block=True)
+        self._next_slot = (self._next_slot + 1) % self.ring_size
+
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.pbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        slot.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        slot.path = path
+        slot.state = _READING
+
+    def update(self):
+        """Advance slots without blocking; call once per frame."""
+
+        for slot in self._slots:
+            if slot.state != _FREE:
+                self._finish(slot, block=False)
+
+    def flush(self):
+        for slot in self._slots:
+            if slot.state != _FREE:
+                self._finish(slot, block=True)
+
+    def close(self):
+        self.recording = False
+        self.flush()
+        self._release()
+        self._executor.shutdown(wait=True)
+
+    def _allocate(self, width: int, height: int):
+        self.flush()
+        self._release()
+        self.width = width
+        self.height = height
+        size = width * height * 4
+        for pbo in np.atleast_1d(glGenBuffers(self.ring_size)):
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, int(pbo))
+            glBufferData(GL_PIXEL_PACK_BUFFER, size, None, GL_STREAM_READ)
+            self._slots.append(_Slot(int(pbo)))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self._next_slot = 0
+
+    def _release(self):
+        if self._slots:
+            glDeleteBuffers(len(self._slots), [slot.pbo for slot in self._slots])
+        self._slots = []
+        self.width = self.height = 0
+
+    def _finish(self, slot: _Slot, block: bool):
+        if slot.state == _READING:
+            timeout = GL_TIMEOUT_IGNORED if block else 0
+            flags = GL_SYNC_FLUSH_COMMANDS_BIT if block else 0
+            result = glClientWaitSync(slot.fence, flags, timeout)
+            if result not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+                return
+            glDeleteSync(slot.fence)
+            slot.fence = None
+            self._start_encode(slot)
+
+        if slot.state == _ENCODING:
+            if not block and not slot.future.done():
+                return
+            error = slot.future.exception()
+            if error is not None:
+                self.last_error = f"{slot.path.name}: {error}"
+            else:
+                self.saved_count += 1
+                self.last_saved = slot.path
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.pbo)
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            slot.future = None
+            slot.path = None
+            slot.state = _FREE
+
+    def _start_encode(self, slot: _Slot):
+        size = self.width * self.height * 4
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.pbo)
+        address = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, size, GL_MAP_READ_BIT)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        # The array aliases the mapping; it stays valid until _finish() unmaps
+        # the buffer, which only happens after the encoder is done with it.
+        raw = (ctypes.c_ubyte * size).from_address(address)
+        pixels = np.frombuffer(raw, dtype=np.uint8).reshape(self.height, self.width, 4)
+        slot.path.parent.mkdir(parents=True, exist_ok=True)
+        slot.future = self._executor.submit(write_image, slot.path, pixels, True)
+        slot.state = _ENCODING
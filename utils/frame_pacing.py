@@ -0,0 +1,96 @@
+import time
+
+import glfw
+import numpy as np
+
+
+# Sleeping is only accurate to a millisecond or two on most schedulers, so
+# the pacer sleeps until this margin before the deadline and spins the rest.
+SPIN_MARGIN_NS = 2_000_000
+STUTTER_FACTOR = 1.5
+
+
+class FrameTimeHistory:
+    """Fixed-size ring buffer of frame times in seconds."""
+
+    def __init__(self, capacity: int = 512):
+        self.samples = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+
+    def push(self, frame_time: float):
+        self.samples[self.index] = frame_time
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def values(self) -> np.ndarray:
+        """Return the samples oldest-first."""
+
+        if self.count < self.capacity:
+            return self.samples[: self.count]
+        return np.roll(self.samples, -self.index)
+
+    def percentiles(self, percents=(50.0, 95.0, 99.0)) -> np.ndarray:
+        if self.count == 0:
+            return np.zeros(len(percents), dtype=np.float32)
+        return np.percentile(self.samples[: self.count], percents)
+
+    def average_fps(self) -> float:
+        if self.count == 0:
+            return 0.0
+        mean = float(np.mean(self.samples[: self.count]))
+        return 1.0 / mean if mean > 0.0 else 0.0
+
+    def stutter_count(self, factor: float = STUTTER_FACTOR) -> int:
+        """Count frames that took noticeably longer than the median frame."""
+
+        if self.count == 0:
+            return 0
+        samples = self.samples[: self.count]
+        return int(np.count_nonzero(samples > np.median(samples) * factor))
+
+
+class FramePacer:
+    """Frame rate control: vsync through the swap interval and an optional
+    target rate on top of it.
+
+    Vsync is on by default so an idle view waits for the display instead of
+    rendering flat out; turning it off with no target rate is an explicit
+    choice from the performance panel.
+    """
+
+    def __init__(self, target_fps: float = 0.0, vsync: bool = True):
+        self.target_fps = target_fps
+        self.vsync = vsync
+        self._deadline_ns = time.perf_counter_ns()
+
+    def apply_swap_interval(self):
+        # Requires the window's context to be current.
+        glfw.swap_interval(1 if self.vsync else 0)
+
+    def set_vsync(self, enabled: bool):
+        if enabled != self.vsync:
+            self.vsync = enabled
+            self.apply_swap_interval()
+
+    def wait(self):
+        """Block until the next frame slot when a target rate is set."""
+
+        now = time.perf_counter_ns()
+        if self.target_fps <= 0.0:
+            self._deadline_ns = now
+            return
+
+        period_ns = int(1e9 / self.target_fps)
+        self._deadline_ns += period_ns
+        if self._deadline_ns < now - period_ns:
+            # Fell more than a frame behind; resynchronise instead of bursting.
+            self._deadline_ns = now
+            return
+
+        remaining = self._deadline_ns - now
+        if remaining > SPIN_MARGIN_NS:
+            time.sleep((remaining - SPIN_MARGIN_NS) / 1e9)
+        while time.perf_counter_ns() < self._deadline_ns:
+            pass
@@ -0,0 +1,144 @@
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+
+IMAGE_FORMATS = ("png", "exr", "raw")
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def encode_png(pixels: np.ndarray, compression: int = 6) -> bytes:
+    """Encode top-down RGBA8 pixels (height, width, 4) as PNG."""
+
+    height, width, _ = pixels.shape
+    # Every scanline is prefixed with filter type 0 (none).
+    rows = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 0] = 0
+    rows[:, 1:] = pixels.reshape(height, width * 4)
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            _png_chunk(b"IHDR", header),
+            _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)),
+            _png_chunk(b"IEND", b""),
+        )
+    )
+
+
+class PngStreamWriter:
+    """Writes an RGBA8 PNG band by band so the full image never sits in memory."""
+
+    def __init__(self, path: Path, width: int, height: int, compression: int = 6):
+        self.path = Path(path)
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compression)
+        self._file = open(self.path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._file.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+
+    def write_rows(self, pixels: np.ndarray):
+        """Append top-down rows (rows, width, 4)."""
+
+        rows = np.empty((pixels.shape[0], self.width * 4 + 1), dtype=np.uint8)
+        rows[:, 0] = 0
+        rows[:, 1:] = pixels.reshape(pixels.shape[0], self.width * 4)
+        data = self._compressor.compress(rows.tobytes())
+        if data:
+            self._file.write(_png_chunk(b"IDAT", data))
+        self.rows_written += pixels.shape[0]
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.rows_written != self.height:
+            self._file.close()
+            raise ValueError(f"{self.path}: wrote {self.rows_written} of {self.height} rows")
+        self._file.write(_png_chunk(b"IDAT", self._compressor.flush()))
+        self._file.write(_png_chunk(b"IEND", b""))
+        self._file.close()
+
+    def abort(self):
+        """Close without finishing, e.g. when rendering failed part way."""
+
+        if not self._file.closed:
+            self._file.close()
+
+
+def _exr_attribute(name: str, type_name: str, data: bytes) -> bytes:
+    return name.encode() + b"\0" + type_name.encode() + b"\0" + struct.pack("<i", len(data)) + data
+
+
+def encode_exr(pixels: np.ndarray) -> bytes:
+    """Encode top-down RGBA pixels as an uncompressed half-float scanline EXR.
+
+    8-bit input is normalised to [0, 1]; float input is written as is.
+    """
+
+    height, width, _ = pixels.shape
+    if pixels.dtype == np.uint8:
+        values = pixels.astype(np.float16) / np.float16(255.0)
+    else:
+        values = pixels.astype(np.float16)
+
+    # Channels are stored alphabetically: A, B, G, R; pixel type 1 is HALF.
+    channel_names = ("A", "B", "G", "R")
+    channel_list = b"".join(
+        name.encode() + b"\0" + struct.pack("<iB3xii", 1, 0, 1, 1) for name in channel_names
+    ) + b"\0"
+    header = b"".join(
+        (
+            struct.pack("<ii", 20000630, 2),
+            _exr_attribute("channels", "chlist", channel_list),
+            _exr_attribute("compression", "compression", b"\0"),
+            _exr_attribute("dataWindow", "box2i", struct.pack("<iiii", 0, 0, width - 1, height - 1)),
+            _exr_attribute("displayWindow", "box2i", struct.pack("<iiii", 0, 0, width - 1, height - 1)),
+            _exr_attribute("lineOrder", "lineOrder", b"\0"),
+            _exr_attribute("pixelAspectRatio", "float", struct.pack("<f", 1.0)),
+            _exr_attribute("screenWindowCenter", "v2f", struct.pack("<ff", 0.0, 0.0)),
+            _exr_attribute("screenWindowWidth", "float", struct.pack("<f", 1.0)),
+            b"\0",
+        )
+    )
+
+    # Each scanline block: y, byte count, then one run of samples per channel.
+    line_bytes = width * 2 * len(channel_names)
+    planar = values[:, :, [3, 2, 1, 0]].transpose(0, 2, 1)
+    blocks = np.empty((height, 8 + line_bytes), dtype=np.uint8)
+    blocks[:, 0:4] = np.arange(height, dtype="<i4").view(np.uint8).reshape(height, 4)
+    blocks[:, 4:8] = np.frombuffer(struct.pack("<i", line_bytes), dtype=np.uint8)
+    blocks[:, 8:] = np.ascontiguousarray(planar, dtype="<f2").view(np.uint8).reshape(height, line_bytes)
+
+    table_start = len(header) + 8 * height
+    offsets = table_start + np.arange(height, dtype="<u8") * (8 + line_bytes)
+    return header + offsets.tobytes() + blocks.tobytes()
+
+
+def write_image(path: Path, pixels: np.ndarray, flip: bool = False) -> Path:
+    """Write pixels in the format named by the file suffix.
+
+    ``flip`` converts from OpenGL's bottom-up row order. ``.raw`` files are
+    NumPy arrays so their shape and dtype travel with them.
+    """
+
+    path = Path(path)
+    if flip:
+        pixels = pixels[::-1]
+    suffix = path.suffix.lower()
+    if suffix == ".png":
+        path.write_bytes(encode_png(pixels))
+    elif suffix == ".exr":
+        path.write_bytes(encode_exr(pixels))
+    elif suffix == ".raw":
+        with open(path, "wb") as f:
+            np.save(f, np.ascontiguousarray(pixels))
+    else:
+        raise ValueError(f"Unsupported image format: {path.suffix}")
+    return path
@@ -6,6 +6,9 @@ import numpy as np
 
 
 BOOKMARK_PATH = Path(__file__).resolve().parent.parent / "camera_bookmark.json"
+QUALITY_PROFILE_PATH = Path(__file__).resolve().parent.parent / "quality_profile.json"
+# Bump when the profile layout changes; older files are then ignored.
+QUALITY_PROFILE_VERSION = 1
 
 
 def load_camera_bookmark(path: Path = BOOKMARK_PATH) -> Optional[dict]:
@@ -54,3 +57,30 @@ def save_camera_bookmark(camera, path: Path = BOOKMARK_PATH) -> bool:
         return False
 
     return True
+
+
+def load_quality_profile(device: str, path: Path = QUALITY_PROFILE_PATH) -> Optional[dict]:
+    """Load a calibrated quality profile, ignoring one made on other hardware."""
+
+    if not path.exists():
+        return None
+
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != QUALITY_PROFILE_VERSION:
+        return None
+    if data.get("device") != device or not isinstance(data.get("tiers"), dict):
+        return None
+    return data
+
+
+def save_quality_profile(profile: dict, path: Path = QUALITY_PROFILE_PATH) -> bool:
+    try:
+        path.write_text(json.dumps(profile, indent=2))
+    except OSError:
+        return False
+
+    return True
@@ -0,0 +1,374 @@
+"""Export the planet's terrain, colour and cloud fields as a tiled dataset.
+
+Samples the NumPy ports of the shader fields over an equirectangular or
+cube-sphere grid with a process pool. Every layer is one raw file laid out
+tile by tile; the workers write straight into shared memory maps of those
+files, and index.json, written last, describes the layout so that
+PlanetDataset can open an export of any size at once and read only the
+tiles it touches.
+
+    python -m utils.planet_export OUT_DIR [--grid cube|equirect]
+        [--resolution 4096] [--tile-size 256] [--workers N]
+        [--parameters planet.json]
+
+Does not need OpenGL.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from rendering.constants import PlanetParameters, default_planet_parameters
+from rendering.planet_fields import cloud_coverage, land_color
+from rendering.terrain import surface_height
+
+
+DATASET_FORMAT = "yaws-planet-tiles"
+DATASET_VERSION = 1
+INDEX_NAME = "index.json"
+GRIDS = ("cube", "equirect")
+DEFAULT_TILE_SIZE = 256
+# Faces of the cube grid, in file order. A face pixel (x, y) has centre
+# s, t in [-1, 1] (x right, y down) and looks along the unnormalized
+# direction given in CUBE_FACE_AXES, in the planet's frame with y at the pole.
+CUBE_FACES = ("+x", "-x", "+y", "-y", "+z", "-z")
+CUBE_FACE_AXES = ("(1, -t, -s)", "(-1, -t, s)", "(s, 1, t)", "(s, -1, -t)", "(s, -t, 1)", "(-s, -t, -1)")
+# name: (dtype, channels, description). Heights are in km above the planet
+# radius; the 8-bit layers hold values in [0, 1] scaled to 255.
+LAYERS = {
+    "height": ("float32", 1, "terrain height in km relative to planet_radius"),
+    "water": ("uint8", 1, "255 where the terrain is below sea_level"),
+    "color": ("uint8", 3, "linear surface albedo"),
+    "cloud": ("uint8", 1, "static cloud coverage"),
+}
+
+
+@dataclass(frozen=True)
+class DatasetLayout:
+    """Grid and tiling of an export. Every layer file holds an array of
+    shape (faces, tiles_y, tiles_x, tile_size, tile_size, channels); tiles
+    past the right or bottom edge of a face are padded with zeros."""
+
+    grid: str
+    width: int
+    height: int
+    faces: int
+    tile_size: int
+
+    @property
+    def tiles_x(self) -> int:
+        return math.ceil(self.width / self.tile_size)
+
+    @property
+    def tiles_y(self) -> int:
+        return math.ceil(self.height / self.tile_size)
+
+    @property
+    def tile_count(self) -> int:
+        return self.faces * self.tiles_y * self.tiles_x
+
+    def layer_shape(self, layer: str) -> Tuple[int, ...]:
+        channels = LAYERS[layer][1]
+        return (self.faces, self.tiles_y, self.tiles_x, self.tile_size, self.tile_size, channels)
+
+
+def grid_layout(grid: str, resolution: int, tile_size: int = DEFAULT_TILE_SIZE) -> DatasetLayout:
+    """Layout for a grid: resolution is the width of the equirectangular
+    map (its height is half that) or the edge of each cube face."""
+
+    if grid not in GRIDS:
+        raise ValueError(f"Unknown grid {grid!r}, expected one of {', '.join(GRIDS)}")
+    if resolution < 2 or tile_size < 1:
+        raise ValueError("Resolution must be at least 2 and the tile size at least 1")
+    if grid == "cube":
+        return DatasetLayout(grid, resolution, resolution, len(CUBE_FACES), tile_size)
+    return DatasetLayout(grid, resolution, resolution // 2, 1, tile_size)
+
+
+def pixel_directions(layout: DatasetLayout, face: int, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Unit directions in the planet's frame through pixel coordinates x, y
+    of a face; integer coordinates are pixel corners, so + 0.5 is a centre.
+    Coordinates past the edge of the face continue smoothly."""
+
+    if layout.grid == "equirect":
+        lon = x / layout.width * (2.0 * math.pi) - math.pi
+        lat = math.pi * 0.5 - y / layout.height * math.pi
+        cos_lat = np.cos(lat)
+        directions = np.stack(np.broadcast_arrays(cos_lat * np.cos(lon), np.sin(lat), cos_lat * np.sin(lon)), axis=-1)
+    else:
+        s, t = np.broadcast_arrays(x / layout.width * 2.0 - 1.0, y / layout.height * 2.0 - 1.0)
+        one = np.ones_like(s)
+        directions = np.stack(
+            (
+                (one, -t, -s),
+                (-one, -t, s),
+                (s, one, t),
+                (s, -one, -t),
+                (s, -t, one),
+                (-s, -t, -one),
+            )[face],
+            axis=-1,
+        )
+    directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+    return directions.astype(np.float32)
+
+
+def _surface_normals(directions: np.ndarray, heights: np.ndarray, planet_radius: float) -> np.ndarray:
+    """Normals of the interior of a padded grid of surface points, from the
+    differences of each pixel's neighbours."""
+
+    points = directions * (planet_radius + heights)[..., None]
+    along_x = points[1:-1, 2:] - points[1:-1, :-2]
+    along_y = points[2:, 1:-1] - points[:-2, 1:-1]
+    normals = np.cross(along_x, along_y)
+    up = directions[1:-1, 1:-1]
+    normals *= np.where(np.sum(normals * up, axis=-1, keepdims=True) < 0.0, -1.0, 1.0).astype(np.float32)
+    length = np.linalg.norm(normals, axis=-1, keepdims=True)
+    # Neighbours collapse onto a point at the poles of the equirectangular grid.
+    return np.where(length > 1e-9, normals / np.maximum(length, 1e-9), up).astype(np.float32)
+
+
+def _to_unorm8(values: np.ndarray) -> np.ndarray:
+    return np.round(np.clip(values, 0.0, 1.0) * 255.0).astype(np.uint8)
+
+
+def sample_region(
+    layout: DatasetLayout, parameters: PlanetParameters, face: int, x0: int, y0: int, width: int, height: int
+) -> Dict[str, np.ndarray]:
+    """Every layer over a block of pixels, as arrays of shape
+    (height, width, channels) in the layer's dtype."""
+
+    # One pixel of padding on every side for the normals.
+    xs = np.arange(x0 - 1, x0 + width + 1, dtype=np.float64) + 0.5
+    ys = np.arange(y0 - 1, y0 + height + 1, dtype=np.float64) + 0.5
+    padded = pixel_directions(layout, face, xs[None, :], ys[:, None])
+    padded_heights = surface_height(padded, parameters.planet_radius, parameters.height_scale)
+    normals = _surface_normals(padded, padded_heights, parameters.planet_radius)
+
+    directions = padded[1:-1, 1:-1]
+    heights = padded_heights[1:-1, 1:-1]
+    color = land_color(directions, normals, heights, parameters.sea_level, parameters.height_scale)
+    return {
+        "height": heights[..., None].astype(np.float32),
+        "water": np.where(heights < parameters.sea_level, 255, 0).astype(np.uint8)[..., None],
+        "color": _to_unorm8(color),
+        "cloud": _to_unorm8(cloud_coverage(directions, parameters.cloud_coverage))[..., None],
+    }
+
+
+def _open_layers(directory: Path, layout: DatasetLayout, mode: str) -> Dict[str, np.memmap]:
+    return {
+        name: np.memmap(directory / f"{name}.raw", dtype=dtype, mode=mode, shape=layout.layer_shape(name))
+        for name, (dtype, _, _) in LAYERS.items()
+    }
+
+
+# Per-process export state, set up by _start_worker.
+_worker = {}
+
+
+def _start_worker(directory: str, layout: dict, parameters: dict):
+    layout = DatasetLayout(**layout)
+    _worker["layout"] = layout
+    _worker["parameters"] = PlanetParameters.from_dict(parameters)
+    # Shared maps of the layer files: every process writes its tiles into
+    # the same pages, so nothing is copied back to the parent.
+    _worker["layers"] = _open_layers(Path(directory), layout, "r+")
+
+
+def _export_tile(tile: Tuple[int, int, int]) -> int:
+    face, tile_y, tile_x = tile
+    layout = _worker["layout"]
+    x0 = tile_x * layout.tile_size
+    y0 = tile_y * layout.tile_size
+    width = min(layout.tile_size, layout.width - x0)
+    height = min(layout.tile_size, layout.height - y0)
+    values = sample_region(layout, _worker["parameters"], face, x0, y0, width, height)
+    for name, layer in _worker["layers"].items():
+        layer[face, tile_y, tile_x, :height, :width] = values[name]
+    return width * height
+
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+def export_planet(
+    directory,
+    parameters: PlanetParameters,
+    grid: str = "cube",
+    resolution: int = 4096,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    workers: Optional[int] = None,
+    progress=None,
+) -> DatasetLayout:
+    """Sample the planet into a dataset under directory, replacing any
+    export there. progress, if given, is called with the number of tiles
+    done and the total after each one."""
+
+    layout = grid_layout(grid, resolution, tile_size)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # Without an index a half-written export cannot be opened as a finished one.
+    index_path = directory / INDEX_NAME
+    if index_path.exists():
+        index_path.unlink()
+
+    for name, (dtype, _, _) in LAYERS.items():
+        path = directory / f"{name}.raw"
+        size = int(np.prod(layout.layer_shape(name))) * np.dtype(dtype).itemsize
+        # Truncating to zero first drops the old contents; the file is
+        # sparse until the workers fill it.
+        with open(path, "wb") as f:
+            f.truncate(size)
+
+    tiles = [
+        (face, tile_y, tile_x)
+        for face in range(layout.faces)
+        for tile_y in range(layout.tiles_y)
+        for tile_x in range(layout.tiles_x)
+    ]
+    workers = workers or default_workers()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_start_worker,
+        initargs=(str(directory), asdict(layout), parameters.to_dict()),
+    ) as executor:
+        chunk = max(1, min(16, len(tiles) // (workers * 8)))
+        for done, _ in enumerate(executor.map(_export_tile, tiles, chunksize=chunk), start=1):
+            if progress is not None:
+                progress(done, len(tiles))
+
+    for layer in _open_layers(directory, layout, "r+").values():
+        layer.flush()
+
+    index = {
+        "format": DATASET_FORMAT,
+        "version": DATASET_VERSION,
+        "layout": asdict(layout),
+        "tiles_x": layout.tiles_x,
+        "tiles_y": layout.tiles_y,
+        "face_order": list(CUBE_FACES) if grid == "cube" else ["equirect"],
+        "cube_face_axes": list(CUBE_FACE_AXES) if grid == "cube" else None,
+        "layers": {
+            name: {
+                "file": f"{name}.raw",
+                "dtype": dtype,
+                "channels": channels,
+                "shape": list(layout.layer_shape(name)),
+                "description": description,
+            }
+            for name, (dtype, channels, description) in LAYERS.items()
+        },
+        "parameters": parameters.to_dict(),
+    }
+    temp_path = index_path.with_suffix(".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+    os.replace(temp_path, index_path)
+    return layout
+
+
+class PlanetDataset:
+    """A finished export, opened read-only. Layers are memory-mapped, so
+    opening costs the same at any size and reads touch only the pages of
+    the tiles they ask for."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / INDEX_NAME, "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        if self.index.get("format") != DATASET_FORMAT or self.index.get("version") != DATASET_VERSION:
+            raise ValueError(f"{self.directory} is not a version {DATASET_VERSION} planet dataset")
+        self.layout = DatasetLayout(**self.index["layout"])
+        self.parameters = PlanetParameters.from_dict(self.index["parameters"])
+        self.layers = _open_layers(self.directory, self.layout, "r")
+
+    def tile(self, layer: str, face: int, tile_x: int, tile_y: int) -> np.ndarray:
+        """View of one tile, of shape (rows, columns, channels) without the
+        padding of edge tiles."""
+
+        size = self.layout.tile_size
+        width = min(size, self.layout.width - tile_x * size)
+        height = min(size, self.layout.height - tile_y * size)
+        return self.layers[layer][face, tile_y, tile_x, :height, :width]
+
+    def read(self, layer: str, face: int, x0: int, y0: int, width: int, height: int) -> np.ndarray:
+        """Copy of a block of pixels of shape (height, width, channels),
+        gathered from the tiles that overlap it."""
+
+        if x0 < 0 or y0 < 0 or x0 + width > self.layout.width or y0 + height > self.layout.height:
+            raise ValueError("Region lies outside the face")
+        size = self.layout.tile_size
+        out = np.empty((height, width, LAYERS[layer][1]), dtype=LAYERS[layer][0])
+        for tile_y in range(y0 // size, (y0 + height - 1) // size + 1):
+            for tile_x in range(x0 // size, (x0 + width - 1) // size + 1):
+                left = max(x0, tile_x * size)
+                right = min(x0 + width, (tile_x + 1) * size)
+                top = max(y0, tile_y * size)
+                bottom = min(y0 + height, (tile_y + 1) * size)
+                out[top - y0:bottom - y0, left - x0:right - x0] = self.layers[layer][
+                    face, tile_y, tile_x, top - tile_y * size:bottom - tile_y * size, left - tile_x * size:right - tile_x * size
+                ]
+        return out
+
+
+def _print_progress(started: float):
+    def report(done: int, total: int):
+        if done == total or done % max(1, total // 100) == 0:
+            elapsed = time.perf_counter() - started
+            remaining = elapsed / done * (total - done)
+            print(f"\r{done}/{total} tiles, {elapsed:.0f} s, about {remaining:.0f} s left ", end="", flush=True)
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", type=Path, help="dataset directory")
+    parser.add_argument("--grid", choices=GRIDS, default="cube")
+    parser.add_argument(
+        "--resolution", type=int, default=4096, help="equirectangular width or cube face edge, in pixels"
+    )
+    parser.add_argument("--tile-size", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--parameters", type=Path, help="JSON of planet parameters; defaults otherwise")
+    args = parser.parse_args(argv)
+
+    if args.parameters is not None:
+        with open(args.parameters, "r", encoding="utf-8") as f:
+            parameters = PlanetParameters.from_dict(json.load(f))
+        parameters.scale_with_planet_radius()
+    else:
+        parameters = default_planet_parameters()
+
+    started = time.perf_counter()
+    layout = export_planet(
+        args.output,
+        parameters,
+        grid=args.grid,
+        resolution=args.resolution,
+        tile_size=args.tile_size,
+        workers=args.workers,
+        progress=_print_progress(started),
+    )
+    elapsed = time.perf_counter() - started
+    pixels = layout.faces * layout.width * layout.height
+    print(
+        f"\n{layout.faces} x {layout.width}x{layout.height} {layout.grid} in {layout.tile_count} tiles, "
+        f"{elapsed:.1f} s ({pixels / elapsed / 1e6:.2f} Mpixel/s) with {args.workers} workers"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
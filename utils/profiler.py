@@ -0,0 +1,152 @@
+import json
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start", "depth", "session")
+
+    def __init__(self, profiler: "FrameProfiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        profiler = self.profiler
+        # Toggling the profiler resets the depth; a span opened before that
+        # must not unwind the new count.
+        self.session = profiler._session
+        self.depth = profiler._depth
+        profiler._depth += 1
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        profiler = self.profiler
+        if self.session != profiler._session:
+            return False
+        profiler._depth -= 1
+        profiler.events.append((profiler.frame_index, self.name, self.start, end - self.start, self.depth))
+        return False
+
+
+class FrameProfiler:
+    """Scoped CPU profiler for frame phases.
+
+    Spans nest and are kept in a bounded ring buffer. While disabled, span()
+    hands back a shared no-op context manager so instrumented code pays only
+    for the call itself.
+    """
+
+    def __init__(self, capacity: int = 65536):
+        self.enabled = False
+        self.events = deque(maxlen=capacity)
+        self.frame_starts = deque(maxlen=1024)
+        self.frame_index = 0
+        self._depth = 0
+        self._session = 0
+        self._capture: Optional[Tuple[int, int, Path]] = None
+        self.last_export: Optional[Path] = None
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def set_enabled(self, enabled: bool):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        self._depth = 0
+        self._session += 1
+        if not enabled:
+            self._capture = None
+
+    def begin_frame(self):
+        self.frame_index += 1
+        if self.enabled:
+            self.frame_starts.append((self.frame_index, time.perf_counter_ns()))
+        if self._capture is not None:
+            first_frame, frame_count, path = self._capture
+            if self.frame_index >= first_frame + frame_count:
+                self.export_chrome_trace(path, first_frame, first_frame + frame_count)
+                self._capture = None
+
+    def request_capture(self, frame_count: int, path: Path):
+        """Export the next frame_count frames as a Chrome trace once they finish."""
+
+        self.set_enabled(True)
+        self._capture = (self.frame_index + 1, frame_count, Path(path))
+
+    @property
+    def capturing(self) -> bool:
+        return self._capture is not None
+
+    def phase_averages(self, frame_window: int = 60) -> List[Tuple[str, int, float]]:
+        """Average milliseconds per frame for each phase over recent frames.
+
+        Returns (name, depth, ms) in the order the phases first appear.
+        """
+
+        first_frame = self.frame_index - frame_window
+        frame_starts = dict(self.frame_starts)
+        totals: Dict[Tuple[str, int], float] = {}
+        order: Dict[Tuple[str, int], int] = {}
+        frames = set()
+        for frame, name, start, duration, depth in reversed(self.events):
+            if frame >= self.frame_index:
+                continue
+            if frame < first_frame:
+                break
+            key = (name, depth)
+            totals[key] = totals.get(key, 0.0) + duration
+            offset = start - frame_starts.get(frame, start)
+            order[key] = min(order.get(key, offset), offset)
+            frames.add(frame)
+
+        if not frames:
+            return []
+        scale = 1e-6 / len(frames)
+        keys = sorted(totals, key=lambda key: (order[key], key[1]))
+        return [(name, depth, totals[(name, depth)] * scale) for name, depth in keys]
+
+    def export_chrome_trace(self, path: Path, first_frame: int, end_frame: int) -> Path:
+        """Write frames [first_frame, end_frame) as Chrome trace-event JSON."""
+
+        trace_events = []
+        for frame, name, start, duration, _depth in self.events:
+            if first_frame <= frame < end_frame:
+                trace_events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": start / 1000.0,
+                        "dur": duration / 1000.0,
+                        "pid": 0,
+                        "tid": 0,
+                        "args": {"frame": frame},
+                    }
+                )
+        path = Path(path)
+        path.write_text(json.dumps({"traceEvents": trace_events, "displayTimeUnit": "ms"}))
+        self.last_export = path
+        return path
+
+
+# Shared instance so the main loop and renderer record into the same timeline.
+profiler = FrameProfiler()
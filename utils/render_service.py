@@ -0,0 +1,629 @@
+"""Local HTTP service that renders planet views on request.
+
+Keeps one hidden GL context with the renderer's programs compiled, so tools
+that need a view (map previews, bookmark thumbnails, parameter comparisons)
+don't each open a window and compile shaders.
+
+    python -m utils.render_service [--port 8765] [--cache-mb 256]
+        [--max-batch 16] [--batch-window-ms 10]
+
+POST /render takes a JSON request and answers with a PNG:
+
+    {
+      "camera": {"position": [0, 0, 10193.6], "yaw": -90, "pitch": 0, "roll": 0, "fov": 70},
+      "time": {"day": 100, "hour": 12, "minute": 0, "second": 0},
+      "parameters": {"cloud_coverage": 0.6},
+      "size": [320, 180],
+      "debug_level": 9
+    }
+
+The camera is either a camera bookmark as above or {"position", "front",
+"up", "fov"}. Parameters override the defaults by name; the radii derived
+from the percentages follow them as in the window. Every field but the
+camera position is optional. The X-Cache response header says whether the
+image came from the cache ("hit"), joined an identical render already
+queued ("shared") or was rendered ("miss"). Malformed requests get a 400,
+renders that fail a 500 and renders that take longer than RENDER_TIMEOUT a
+503. GET /metrics returns the counters and latency percentiles as JSON.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from typing import Dict, List, Optional, Tuple
+
+import glfw
+from OpenGL.GL import *
+import numpy as np
+
+from gl_utils.buffers import create_color_fbo, create_fullscreen_quad, delete_color_fbo
+from gl_utils.camera import FPSCamera
+from rendering.constants import PlanetParameters, default_planet_parameters
+from rendering.factory import create_renderer
+from utils.image_io import encode_png
+from utils.time import PlanetCalendar
+
+
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_BATCH = 16
+# How long the render thread waits for more requests after the first one of
+# a batch; tools tend to ask for several views at once.
+DEFAULT_BATCH_WINDOW = 0.010
+MAX_IMAGE_SIZE = 4096
+MAX_REQUEST_BYTES = 64 * 1024
+# Output targets kept allocated, one per image size.
+MAX_RESIDENT_TARGETS = 4
+# Latency samples the percentiles are taken over.
+LATENCY_WINDOW = 1024
+# Decimals of the camera directions that count towards the cache key.
+KEY_DECIMALS = 6
+# Seconds an HTTP handler waits for its image before answering 503.
+RENDER_TIMEOUT = 30.0
+
+
+@dataclass
+class RenderRequest:
+    """A view to render, with the camera resolved to vectors so that equal
+    views get equal cache keys however they were described."""
+
+    parameters: PlanetParameters
+    position: np.ndarray
+    front: np.ndarray
+    right: np.ndarray
+    up: np.ndarray
+    fov_degrees: float
+    elapsed_seconds: float
+    width: int
+    height: int
+    debug_level: int = 9
+
+    def parameters_key(self) -> str:
+        return _digest(self.parameters.to_dict())
+
+    def key(self) -> str:
+        """Hash of everything the image depends on."""
+
+        # Directions built from angles carry rounding noise, and -0.0 would
+        # hash apart from 0.0.
+        directions = [
+            np.round(vector.astype(np.float64), KEY_DECIMALS) + 0.0 for vector in (self.front, self.right, self.up)
+        ]
+        return _digest(
+            {
+                "parameters": self.parameters.to_dict(),
+                "camera": [[float(v) for v in vector] for vector in [self.position, *directions]],
+                "fov": float(np.float32(self.fov_degrees)),
+                "time": self.elapsed_seconds,
+                "size": [self.width, self.height],
+                "debug_level": self.debug_level,
+            }
+        )
+
+
+def _digest(data) -> str:
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _vector(data, name: str) -> np.ndarray:
+    value = np.asarray(data.get(name), dtype=np.float32)
+    if value.shape != (3,) or not np.all(np.isfinite(value)):
+        raise ValueError(f"camera.{name} must be three finite numbers")
+    return value
+
+
+def _normalize(vector: np.ndarray, name: str) -> np.ndarray:
+    length = float(np.linalg.norm(vector))
+    if length < 1e-6:
+        raise ValueError(f"camera.{name} must not be zero")
+    return (vector / length).astype(np.float32)
+
+
+def _number(name: str, value) -> float:
+    # JSON booleans are ints to Python, and 1e400 decodes to inf.
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return float(value)
+
+
+def _int_field(name: str, value) -> int:
+    number = _number(name, value)
+    if not number.is_integer():
+        raise ValueError(f"{name} must be an integer")
+    return int(number)
+
+
+def _parameter_overrides(overrides: dict) -> dict:
+    """Check overrides against the type of the default fields; vectors need
+    three finite components, radii, scales and step counts must be positive."""
+
+    defaults = PlanetParameters().to_dict()
+    unknown = set(overrides) - set(defaults)
+    if unknown:
+        raise ValueError(f"unknown parameters: {', '.join(sorted(unknown))}")
+    checked = {}
+    for name, value in overrides.items():
+        field_name = f"parameters.{name}"
+        default = defaults[name]
+        if isinstance(default, list):
+            if not isinstance(value, list) or len(value) != len(default):
+                raise ValueError(f"{field_name} must be {len(default)} finite numbers")
+            checked[name] = [_number(field_name, v) for v in value]
+            continue
+        value = _int_field(field_name, value) if isinstance(default, int) else _number(field_name, value)
+        if name.endswith(("_radius", "_scale", "_steps")) and value <= 0:
+            raise ValueError(f"{field_name} must be positive")
+        checked[name] = value
+    return checked
+
+
+def _camera_vectors(camera: dict):
+    position = _vector(camera, "position")
+    if "front" in camera:
+        front = _normalize(_vector(camera, "front"), "front")
+        right = _normalize(np.cross(front, _vector(camera, "up")), "up")
+        up = np.cross(right, front).astype(np.float32)
+        return position, front, right, up
+
+    # A camera bookmark; the window applies those without reference alignment.
+    view = FPSCamera(position, yaw=float(camera.get("yaw", -90.0)), pitch=float(camera.get("pitch", 0.0)))
+    view.enable_reference_alignment(False)
+    view.roll = float(camera.get("roll", 0.0))
+    view.update_vectors()
+    return position, view.front.copy(), view.right.copy(), view.up.copy()
+
+
+_TIME_DEFAULTS = (("day", 100), ("hour", 12), ("minute", 0), ("second", 0))
+
+
+def parse_request(data: dict) -> RenderRequest:
+    """Validate a decoded JSON request; raises ValueError naming the field
+    at fault."""
+
+    if not isinstance(data, dict):
+        raise ValueError("request must be a JSON object")
+    camera = data.get("camera")
+    if not isinstance(camera, dict):
+        raise ValueError("camera is required")
+    position, front, right, up = _camera_vectors(camera)
+    fov_degrees = float(camera.get("fov", 70.0))
+    if not 1.0 <= fov_degrees <= 170.0:
+        raise ValueError("camera.fov must be between 1 and 170 degrees")
+
+    when = data.get("time", {})
+    if not isinstance(when, dict):
+        raise ValueError("time must be a JSON object")
+    calendar_state = PlanetCalendar().set_time(
+        *(_int_field(f"time.{name}", when.get(name, default)) for name, default in _TIME_DEFAULTS)
+    )
+
+    overrides = data.get("parameters", {})
+    if not isinstance(overrides, dict):
+        raise ValueError("parameters must be a JSON object")
+    parameters = PlanetParameters.from_dict(
+        {**default_planet_parameters().to_dict(), **_parameter_overrides(overrides)}
+    )
+    parameters.scale_with_planet_radius()
+
+    size = data.get("size", [320, 180])
+    if not isinstance(size, list) or len(size) != 2:
+        raise ValueError("size must be [width, height]")
+    width, height = (_int_field("size", v) for v in size)
+    if not (1 <= width <= MAX_IMAGE_SIZE and 1 <= height <= MAX_IMAGE_SIZE):
+        raise ValueError(f"size must be between 1 and {MAX_IMAGE_SIZE} on each side")
+    debug_level = _int_field("debug_level", data.get("debug_level", 9))
+    if not 1 <= debug_level <= 9:
+        raise ValueError("debug_level must be between 1 and 9")
+
+    return RenderRequest(
+        parameters,
+        position,
+        front,
+        right,
+        up,
+        fov_degrees,
+        calendar_state.elapsed_seconds,
+        width,
+        height,
+        debug_level,
+    )
+
+
+class ResultCache:
+    """Encoded images by request key, least recently used evicted first once
+    their total size passes max_bytes."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= len(previous)
+        self._entries[key] = data
+        self.total_bytes += len(data)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.evictions += 1
+
+
+class ServiceMetrics:
+    """Counters and recent latencies; read through snapshot()."""
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.errors = 0
+        self.renders = 0
+        self.batches = 0
+        self.parameter_switches = 0
+        self.latency_ms = {"hit": deque(maxlen=LATENCY_WINDOW), "miss": deque(maxlen=LATENCY_WINDOW)}
+        self.render_ms = deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self, cache: ResultCache, queued: int) -> dict:
+        def percentiles(samples):
+            if not samples:
+                return None
+            values = np.fromiter(samples, dtype=np.float64)
+            return {f"p{q}": round(float(np.percentile(values, q)), 3) for q in (50, 95, 99)}
+
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "shared": self.shared,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / self.requests if self.requests else 0.0,
+            "renders": self.renders,
+            "batches": self.batches,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "parameter_switches": self.parameter_switches,
+            "queued": queued,
+            "cache_entries": len(cache),
+            "cache_bytes": cache.total_bytes,
+            "cache_evictions": cache.evictions,
+            "latency_ms": {name: percentiles(samples) for name, samples in self.latency_ms.items()},
+            "render_ms": percentiles(self.render_ms),
+        }
+
+
+@dataclass
+class _Job:
+    request: RenderRequest
+    key: str
+    future: Future
+
+
+class RenderService:
+    """Renders queued requests on the thread that owns the GL context.
+
+    submit() may be called from any thread. Requests already in the cache
+    are answered at once, and a request identical to one still queued
+    shares its future. Everything else waits for run(), which takes the
+    queue in batches: a batch's jobs are grouped by parameter set and image
+    size, so the renderer's parameters and lookup tables and the output
+    target change once per group, not once per view. PNG encoding runs on
+    a small pool so the GL thread can go on to the next view.
+    """
+
+    def __init__(
+        self,
+        renderer,
+        cache_bytes: int = DEFAULT_CACHE_BYTES,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        encoders: int = 2,
+    ):
+        self.renderer = renderer
+        self.cache = ResultCache(cache_bytes)
+        self.metrics = ServiceMetrics()
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._queue: "Queue[Optional[_Job]]" = Queue()
+        self._pending: Dict[str, Future] = {}
+        self._targets: "OrderedDict[Tuple[int, int], dict]" = OrderedDict()
+        self._parameters_key: Optional[str] = None
+        self._encoder = ThreadPoolExecutor(max_workers=encoders, thread_name_prefix="render-service")
+
+    def submit(self, request: RenderRequest) -> Tuple[Future, str]:
+        """Future of the PNG for request, and how it is being served."""
+
+        key = request.key()
+        with self._lock:
+            self.metrics.requests += 1
+            data = self.cache.get(key)
+            if data is not None:
+                self.metrics.hits += 1
+                future = Future()
+                future.set_result(data)
+                return future, "hit"
+            future = self._pending.get(key)
+            if future is not None:
+                self.metrics.shared += 1
+                return future, "shared"
+            self.metrics.misses += 1
+            future = self._pending[key] = Future()
+        self._queue.put(_Job(request, key, future))
+        return future, "miss"
+
+    def record_latency(self, source: str, milliseconds: float):
+        with self._lock:
+            self.metrics.latency_ms["hit" if source == "hit" else "miss"].append(milliseconds)
+
+    def record_error(self):
+        with self._lock:
+            self.metrics.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return self.metrics.snapshot(self.cache, self._queue.qsize())
+
+    def stop(self):
+        self._queue.put(None)
+
+    def _next_batch(self) -> Optional[List[_Job]]:
+        first = self._queue.get()
+        if first is None:
+            return None
+        jobs = [first]
+        deadline = time.perf_counter() + self.batch_window
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0.0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            if job is None:
+                self._queue.put(None)
+                break
+            jobs.append(job)
+        return jobs
+
+    def _groups(self, jobs: List[_Job]) -> List[List[_Job]]:
+        groups: "OrderedDict[tuple, List[_Job]]" = OrderedDict()
+        for job in jobs:
+            request = job.request
+            groups.setdefault((request.parameters_key(), request.width, request.height), []).append(job)
+        # Start with the parameters already set, sparing one switch.
+        return sorted(groups.values(), key=lambda group: group[0].request.parameters_key() != self._parameters_key)
+
+    def _target(self, width: int, height: int) -> dict:
+        target = self._targets.get((width, height))
+        if target is not None:
+            self._targets.move_to_end((width, height))
+            return target
+        if len(self._targets) >= MAX_RESIDENT_TARGETS:
+            _, oldest = self._targets.popitem(last=False)
+            delete_color_fbo(oldest)
+        target = self._targets[(width, height)] = create_color_fbo(width, height)
+        return target
+
+    def _render(self, request: RenderRequest) -> np.ndarray:
+        renderer = self.renderer
+        parameters_key = request.parameters_key()
+        if parameters_key != self._parameters_key:
+            renderer.update_parameters(request.parameters)
+            self._parameters_key = parameters_key
+            self.metrics.parameter_switches += 1
+        calendar_state = PlanetCalendar().state_at(request.elapsed_seconds)
+        renderer.prepare_frame_state(calendar_state)
+        target = self._target(request.width, request.height)
+        renderer.render(
+            request.position,
+            request.front,
+            request.right,
+            request.up,
+            request.fov_degrees,
+            request.width,
+            request.height,
+            request.debug_level,
+            calendar_state,
+            output_fbo=target["fbo"],
+        )
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, target["fbo"])
+        data = glReadPixels(0, 0, request.width, request.height, GL_RGBA, GL_FLOAT)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        renderer.state.reset_bindings()
+        pixels = np.frombuffer(data, dtype=np.float32).reshape(request.height, request.width, 4)
+        # Clamped and rounded like render_poster, then flipped to top-down.
+        return np.rint(np.clip(pixels[::-1], 0.0, 1.0) * 255.0).astype(np.uint8)
+
+    def _finish(self, job: _Job, pixels: np.ndarray):
+        try:
+            data = encode_png(pixels)
+        except Exception as exc:
+            with self._lock:
+                self._pending.pop(job.key, None)
+            job.future.set_exception(exc)
+            return
+        with self._lock:
+            self.cache.put(job.key, data)
+            self._pending.pop(job.key, None)
+        job.future.set_result(data)
+
+    def _fail(self, job: _Job, exc: Exception):
+        with self._lock:
+            self._pending.pop(job.key, None)
+        job.future.set_exception(exc)
+
+    def run(self):
+        """Serve batches on the calling thread, which must own the renderer's
+        GL context, until stop() is called."""
+
+        try:
+            while True:
+                jobs = self._next_batch()
+                if jobs is None:
+                    break
+                with self._lock:
+                    self.metrics.batches += 1
+                    self.metrics.batch_sizes.append(len(jobs))
+                for group in self._groups(jobs):
+                    for job in group:
+                        start = time.perf_counter()
+                        try:
+                            pixels = self._render(job.request)
+                        except Exception as exc:
+                            self._fail(job, exc)
+                            continue
+                        with self._lock:
+                            self.metrics.renders += 1
+                            self.metrics.render_ms.append((time.perf_counter() - start) * 1000.0)
+                        self._encoder.submit(self._finish, job, pixels)
+        finally:
+            self._encoder.shutdown(wait=True)
+            self.release()
+
+    def release(self):
+        for target in self._targets.values():
+            delete_color_fbo(target)
+        self._targets.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: RenderService
+
+    def _send(self, status: int, content_type: str, body: bytes, headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict):
+        self._send(status, "application/json", json.dumps(data, indent=2).encode())
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, self.service.snapshot())
+        else:
+            self._send_json(404, {"error": f"no such resource: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/render":
+            self._send_json(404, {"error": f"no such resource: {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_REQUEST_BYTES:
+                raise ValueError("request body too large")
+            request = parse_request(json.loads(self.rfile.read(length) or b"null"))
+        except (ValueError, TypeError) as exc:
+            self.service.record_error()
+            self._send_json(400, {"error": str(exc)})
+            return
+
+        future, source = self.service.submit(request)
+        try:
+            data = future.result(timeout=RENDER_TIMEOUT)
+        except FutureTimeoutError:
+            self.service.record_error()
+            self._send_json(503, {"error": f"render did not finish within {RENDER_TIMEOUT:g} s"})
+            return
+        except Exception as exc:
+            self.service.record_error()
+            self._send_json(500, {"error": f"render failed: {exc}"})
+            return
+        self.service.record_latency(source, (time.perf_counter() - start) * 1000.0)
+        self._send(200, "image/png", data, {"X-Cache": source})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Tools send bursts of requests; the default backlog of 5 makes the
+    # rest of a burst retry their connections a second later.
+    request_queue_size = 64
+
+
+def serve(service: RenderService, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Start answering HTTP requests for service on a background thread;
+    rendering still needs service.run() on the GL thread."""
+
+    handler = type("RenderServiceHandler", (_Handler,), {"service": service})
+    server = _Server((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="render-service-http", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on; keep it local")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--cache-mb", type=float, default=DEFAULT_CACHE_BYTES / (1024 * 1024))
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--batch-window-ms", type=float, default=DEFAULT_BATCH_WINDOW * 1000.0)
+    args = parser.parse_args(argv)
+
+    if not glfw.init():
+        raise RuntimeError("Failed to initialize GLFW")
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 4)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL_TRUE)
+    glfw.window_hint(glfw.VISIBLE, glfw.FALSE)
+    window = glfw.create_window(64, 64, "Render service", None, None)
+    if not window:
+        glfw.terminate()
+        raise RuntimeError("Failed to create window")
+    glfw.make_context_current(window)
+    try:
+        glBindVertexArray(create_fullscreen_quad())
+        service = RenderService(
+            create_renderer(),
+            cache_bytes=int(args.cache_mb * 1024 * 1024),
+            max_batch=max(args.max_batch, 1),
+            batch_window=max(args.batch_window_ms, 0.0) / 1000.0,
+        )
+        server = serve(service, args.host, args.port)
+        print(f"{glGetString(GL_RENDERER).decode(errors='replace')}, listening on http://{args.host}:{args.port}")
+        try:
+            service.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+    finally:
+        glfw.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
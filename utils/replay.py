@@ -0,0 +1,256 @@
+import json
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import glfw
+import numpy as np
+
+from rendering.constants import PlanetParameters
+
+
+# Binary layout (little endian):
+#   header : MAGIC, u32 version, session struct, u32 length + parameters JSON
+#   frames : frame struct, u8 event count, then per event u8 type, u32 length
+#            and the payload
+# Every value the main loop reads from glfw or the UI panels is stored, so a
+# replay reproduces the camera path and renderer state exactly.
+MAGIC = b"YAWSREC1"
+FORMAT_VERSION = 1
+_VERSION = struct.Struct("<I")
+_SESSION = struct.Struct("<3f4ddBiHHf")
+_FRAME = struct.Struct("<dddIBHHfff")
+_EVENT = struct.Struct("<BI")
+_COUNT = struct.Struct("<B")
+_LENGTH = struct.Struct("<I")
+_CALENDAR = struct.Struct("<4i")
+
+RECORDED_KEYS = (
+    glfw.KEY_W,
+    glfw.KEY_S,
+    glfw.KEY_A,
+    glfw.KEY_D,
+    glfw.KEY_Q,
+    glfw.KEY_E,
+    glfw.KEY_LEFT_SHIFT,
+    glfw.KEY_SPACE,
+    glfw.KEY_G,
+    glfw.KEY_ESCAPE,
+    glfw.KEY_1,
+    glfw.KEY_2,
+    glfw.KEY_3,
+    glfw.KEY_4,
+    glfw.KEY_5,
+    glfw.KEY_6,
+    glfw.KEY_7,
+    glfw.KEY_8,
+    glfw.KEY_9,
+)
+_KEY_BITS = {key: 1 << index for index, key in enumerate(RECORDED_KEYS)}
+
+FLAG_CAPTURE_MOUSE = 1
+FLAG_CAPTURE_KEYBOARD = 2
+
+EVENT_SET_CALENDAR = 1
+EVENT_UPDATE_PARAMETERS = 2
+EVENT_TOGGLE_GRAVITY = 3
+
+
+@dataclass
+class SessionState:
+    """Initial conditions a replay has to restore before the first frame."""
+
+    camera_position: np.ndarray
+    yaw: float
+    pitch: float
+    roll: float
+    fov_degrees: float
+    elapsed_seconds: float
+    gravity_enabled: bool
+    debug_level: int
+    framebuffer_size: Tuple[int, int]
+    min_ground_clearance: float
+    parameters: PlanetParameters
+
+
+@dataclass
+class FrameInput:
+    dt: float
+    cursor_x: float = 0.0
+    cursor_y: float = 0.0
+    keys: int = 0
+    flags: int = 0
+    framebuffer_size: Tuple[int, int] = (0, 0)
+    time_speed: float = 0.0
+    min_ground_clearance: float = 0.0
+    fov_degrees: float = 70.0
+    events: List[Tuple[int, object]] = field(default_factory=list)
+
+    def key_down(self, key) -> bool:
+        return bool(self.keys & _KEY_BITS.get(key, 0))
+
+    @property
+    def want_capture_mouse(self) -> bool:
+        return bool(self.flags & FLAG_CAPTURE_MOUSE)
+
+    @property
+    def want_capture_keyboard(self) -> bool:
+        return bool(self.flags & FLAG_CAPTURE_KEYBOARD)
+
+
+def poll_frame_input(window, dt: float, io) -> FrameInput:
+    keys = 0
+    for key, bit in _KEY_BITS.items():
+        if glfw.get_key(window, key) == glfw.PRESS:
+            keys |= bit
+    flags = 0
+    if io.want_capture_mouse:
+        flags |= FLAG_CAPTURE_MOUSE
+    if io.want_capture_keyboard:
+        flags |= FLAG_CAPTURE_KEYBOARD
+    cursor_x, cursor_y = glfw.get_cursor_pos(window)
+    return FrameInput(
+        dt=dt,
+        cursor_x=cursor_x,
+        cursor_y=cursor_y,
+        keys=keys,
+        flags=flags,
+        framebuffer_size=tuple(glfw.get_framebuffer_size(window)),
+    )
+
+
+def _encode_event(event_type: int, payload) -> bytes:
+    if event_type == EVENT_SET_CALENDAR:
+        return _CALENDAR.pack(*payload)
+    if event_type == EVENT_UPDATE_PARAMETERS:
+        return json.dumps(payload.to_dict()).encode("utf-8")
+    return b""
+
+
+def _decode_event(event_type: int, data: bytes):
+    if event_type == EVENT_SET_CALENDAR:
+        return _CALENDAR.unpack(data)
+    if event_type == EVENT_UPDATE_PARAMETERS:
+        return PlanetParameters.from_dict(json.loads(data.decode("utf-8")))
+    return None
+
+
+class InputRecorder:
+    def __init__(self, path: Path, session: SessionState):
+        self.path = Path(path)
+        self.frame_count = 0
+        self._file = open(self.path, "wb")
+        parameters = json.dumps(session.parameters.to_dict()).encode("utf-8")
+        self._file.write(MAGIC)
+        self._file.write(_VERSION.pack(FORMAT_VERSION))
+        self._file.write(
+            _SESSION.pack(
+                *[float(v) for v in session.camera_position],
+                session.yaw,
+                session.pitch,
+                session.roll,
+                session.fov_degrees,
+                session.elapsed_seconds,
+                int(session.gravity_enabled),
+                session.debug_level,
+                *session.framebuffer_size,
+                session.min_ground_clearance,
+            )
+        )
+        self._file.write(_LENGTH.pack(len(parameters)))
+        self._file.write(parameters)
+
+    def write_frame(self, frame: FrameInput):
+        self._file.write(
+            _FRAME.pack(
+                frame.dt,
+                frame.cursor_x,
+                frame.cursor_y,
+                frame.keys,
+                frame.flags,
+                *frame.framebuffer_size,
+                frame.time_speed,
+                frame.min_ground_clearance,
+                frame.fov_degrees,
+            )
+        )
+        self._file.write(_COUNT.pack(len(frame.events)))
+        for event_type, payload in frame.events:
+            data = _encode_event(event_type, payload)
+            self._file.write(_EVENT.pack(event_type, len(data)))
+            self._file.write(data)
+        self.frame_count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class InputReplay:
+    """Feeds a recorded session back one frame at a time."""
+
+    def __init__(self, path: Path, fixed_dt: Optional[float] = None):
+        self.path = Path(path)
+        self.fixed_dt = fixed_dt
+        self.frame_index = 0
+        self._data = self.path.read_bytes()
+        if self._data[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not an input recording")
+        offset = len(MAGIC)
+        (version,) = _VERSION.unpack_from(self._data, offset)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording version {version}")
+        offset += _VERSION.size
+
+        values = _SESSION.unpack_from(self._data, offset)
+        offset += _SESSION.size
+        (length,) = _LENGTH.unpack_from(self._data, offset)
+        offset += _LENGTH.size
+        parameters = PlanetParameters.from_dict(json.loads(self._data[offset:offset + length]))
+        offset += length
+
+        self.session = SessionState(
+            camera_position=np.array(values[0:3], dtype=np.float32),
+            yaw=values[3],
+            pitch=values[4],
+            roll=values[5],
+            fov_degrees=values[6],
+            elapsed_seconds=values[7],
+            gravity_enabled=bool(values[8]),
+            debug_level=values[9],
+            framebuffer_size=(values[10], values[11]),
+            min_ground_clearance=values[12],
+            parameters=parameters,
+        )
+        self._offset = offset
+
+    def next_frame(self) -> Optional[FrameInput]:
+        data = self._data
+        if self._offset + _FRAME.size > len(data):
+            return None
+
+        values = _FRAME.unpack_from(data, self._offset)
+        self._offset += _FRAME.size
+        (count,) = _COUNT.unpack_from(data, self._offset)
+        self._offset += _COUNT.size
+        events = []
+        for _ in range(count):
+            event_type, length = _EVENT.unpack_from(data, self._offset)
+            self._offset += _EVENT.size
+            events.append((event_type, _decode_event(event_type, data[self._offset:self._offset + length])))
+            self._offset += length
+
+        self.frame_index += 1
+        return FrameInput(
+            dt=values[0] if self.fixed_dt is None else self.fixed_dt,
+            cursor_x=values[1],
+            cursor_y=values[2],
+            keys=values[3],
+            flags=values[4],
+            framebuffer_size=(values[5], values[6]),
+            time_speed=values[7],
+            min_ground_clearance=values[8],
+            fov_degrees=values[9],
+            events=events,
+        )
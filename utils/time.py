@@ -1,3 +1,4 @@
+import math
 import time
 from dataclasses import dataclass
 
@@ -5,12 +6,14 @@ import numpy as np
 
 
 class DeltaTimer:
+    # perf_counter_ns is monotonic and high resolution, unlike time.time(),
+    # which is coarse on some platforms and jumps with clock adjustments.
     def __init__(self):
-        self.last = time.time()
+        self.last = time.perf_counter_ns()
 
     def get_delta(self):
-        now = time.time()
-        dt = now - self.last
+        now = time.perf_counter_ns()
+        dt = (now - self.last) * 1e-9
         self.last = now
         return dt
 
@@ -50,7 +53,10 @@ class PlanetCalendar:
         return self._state_from_elapsed()
 
     def _state_from_elapsed(self) -> CalendarState:
-        total_seconds = self.elapsed_seconds
+        return self.state_at(self.elapsed_seconds)
+
+    def state_at(self, elapsed_seconds: float) -> CalendarState:
+        total_seconds = elapsed_seconds % self.seconds_per_year
         day_index = int(total_seconds // self.seconds_per_day)
         seconds_into_day = total_seconds - day_index * self.seconds_per_day
         hour = int(seconds_into_day // 3600)
@@ -72,24 +78,22 @@ class PlanetCalendar:
         return self._state_from_elapsed()
 
 
-def compute_sun_direction(day_fraction: float, year_fraction: float, tilt_degrees: float) -> np.ndarray:
-    """Compute a normalized sun direction based on time-of-day and season."""
-
-    declination = np.deg2rad(tilt_degrees) * np.sin(2.0 * np.pi * year_fraction)
-    hour_angle = 2.0 * np.pi * (day_fraction - 0.5)
-    cos_decl = np.cos(declination)
+def compute_sun_direction(
+    day_fraction: float, year_fraction: float, tilt_degrees: float, out: np.ndarray = None
+) -> np.ndarray:
+    """Compute a normalized sun direction based on time-of-day and season.
 
-    sun_dir = np.array(
-        [
-            cos_decl * np.cos(hour_angle),
-            np.sin(declination),
-            cos_decl * np.sin(hour_angle),
-        ],
-        dtype=np.float32,
-    )
+    Writes into ``out`` when given, so the per-frame call allocates nothing.
+    """
 
-    norm = np.linalg.norm(sun_dir)
-    if norm > 1e-6:
-        sun_dir /= norm
+    declination = math.radians(tilt_degrees) * math.sin(2.0 * math.pi * year_fraction)
+    hour_angle = 2.0 * math.pi * (day_fraction - 0.5)
+    cos_decl = math.cos(declination)
 
-    return sun_dir
+    # Already unit length: cos^2(decl) (cos^2 + sin^2)(hour) + sin^2(decl).
+    if out is None:
+        out = np.empty(3, dtype=np.float32)
+    out[0] = cos_decl * math.cos(hour_angle)
+    out[1] = math.sin(declination)
+    out[2] = cos_decl * math.sin(hour_angle)
+    return out